@@ -0,0 +1,358 @@
+import argparse
+import functools
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from lib.services.ph import orion_star
+from lib.services.pump import norgren
+from lib.services.titration import forward, gran, results
+from lib.utils import regression
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Microbenchmarks #####
+
+Times the numeric and protocol hot paths one function at a time, so
+changes to them are measured rather than guessed:
+
+    python -m lib.benchmarks.micro                       # every kernel
+    python -m lib.benchmarks.micro --filter regression   # by name
+    python -m lib.benchmarks.micro --record              # add to history
+
+Each kernel is called a few times to warm up, then the number of calls per
+repeat is calibrated (doubling, like timeit's autorange) until one repeat
+takes at least MIN_REPEAT_TIME, and REPEATS repeats are timed with the
+garbage collector off. The median time per call is the figure to compare;
+min and interquartile range show how stable it was.
+
+Results print as a table and can be written as JSON (--output). With
+--record they are also appended to a JSON lines history (one run per
+line, with the host, versions and git commit), and each kernel is compared
+with the last recorded run of the same host.
+"""
+
+REPEATS = 7
+MIN_REPEAT_TIME = 0.05
+WARMUP_CALLS = 3
+
+HISTORY_FILEPATH = os.path.join(os.path.dirname(__file__), "baselines",
+                                "micro.jsonl")
+
+REGRESSION_SIZES = [10, 100, 1000, 10**4, 10**5, 10**6]
+GRAN_FIT_SIZES = [10, 100, 1000]
+FORWARD_SIZES = [1, 1000, 10**6]
+
+PUMP_RESPONSE = b"/0`48000"
+METER_RESPONSE = (b'GETMEAS         \r\n\r\n\rA215 pH,X51250,3.04,ABCDE,'
+                  b'12/07/23 09:30:40,---,CH-1,pH,4.61,pH,111.2, mV,25.0,C,'
+                  b'89.1,%,M100,#1\n\r\r>')
+
+
+def make_titration(n_steps: int) -> gran.ModifiedGranTitration:
+    """Builds a titration with the given number of steps, going down from
+    pH 3.8 in equal steps like the second titration.
+
+    Args:
+        n_steps (int): number of steps after the initial reading.
+
+    Returns:
+        ModifiedGranTitration: the titration.
+    """
+    phs = np.concatenate(([8.0], np.linspace(3.8, 3.0, n_steps)))
+    emfs = (7 - phs) * 59.16
+    volumes = np.concatenate(([0.0], 0.0021 + np.arange(n_steps) * 1e-5))
+    return gran.ModifiedGranTitration.from_arrays(
+        100.0, 35.0, 0.1, 25.0, phs, emfs, volumes, cumulative=True
+    )
+
+
+def time_kernel(func: Callable[[], object], repeats: int = REPEATS,
+                  min_repeat_time: float = MIN_REPEAT_TIME,
+                  warmup_calls: int = WARMUP_CALLS) -> dict:
+    """Times a function, see the notes above.
+
+    Args:
+        func (Callable): function taking no arguments.
+        repeats (int): number of timed repeats.
+        min_repeat_time (float): shortest time (in seconds) of a repeat.
+        warmup_calls (int): untimed calls before calibrating.
+
+    Returns:
+        dict: median_s, min_s and iqr_s per call, loops per repeat and
+            repeats.
+    """
+    for _ in range(warmup_calls):
+        func()
+
+    def run(loops: int) -> float:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        return time.perf_counter() - started
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        loops = 1
+        while run(loops) < min_repeat_time:
+            loops *= 2
+        times = [run(loops) / loops for _ in range(repeats)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    quartiles = statistics.quantiles(times, n=4) if repeats > 1 else [0, 0, 0]
+    return {"median_s": statistics.median(times), "min_s": min(times),
+            "iqr_s": quartiles[2] - quartiles[0], "loops": loops,
+            "repeats": repeats}
+
+
+def build_required_acid_vol() -> Callable[[], object]:
+    """Dose estimate of one step.
+    """
+    titration = make_titration(5)
+    return lambda: titration.calc_required_acid_vol(3.3)
+
+
+def build_constant(name: str) -> Callable[[], object]:
+    """One of the equilibrium constants, e.g. K1.
+    """
+    titration = make_titration(5)
+    return getattr(titration, f"calc_{name}")
+
+
+def build_gran_fit(n: int) -> Callable[[], object]:
+    """Final fit of a titration with n steps in the Gran region.
+    """
+    titration = make_titration(n)
+    return titration.gran_polynomial_fit
+
+
+def build_regression(n: int) -> Callable[[], object]:
+    """Linear regression of n noisy points.
+    """
+    rng = np.random.default_rng(0)
+    x = np.linspace(0.002, 0.0025, n)
+    y = 0.1 * x - 0.0002 + rng.normal(0.0, 1e-7, n)
+    return lambda: regression.linear_regression(x, y)
+
+
+def build_forward(n: int) -> Callable[[], object]:
+    """pH of n points of the forward model: curves of 1000 volumes over
+    samples of different salinity and alkalinity, or a single point.
+    """
+    n_samples, n_volumes = max(n // 1000, 1), min(n, 1000)
+    rng = np.random.default_rng(0)
+    constants = forward.equilibrium_constants(
+        rng.uniform(30.0, 38.0, n_samples), 25.0
+    )
+    alkalinity = rng.uniform(2000e-6, 2400e-6, n_samples)
+    volumes = np.linspace(0.0, 0.003, n_volumes)
+    return lambda: forward.forward_ph(volumes, alkalinity, sample_mass=100.0,
+                                      acid_conc=0.1, **constants)
+
+
+def build_pump_response() -> Callable[[], object]:
+    """Parsing of a pump position response.
+    """
+    pump = norgren.VersaPumpV6()
+    return lambda: pump._check_response(PUMP_RESPONSE)
+
+
+def build_meter_response() -> Callable[[], object]:
+    """Parsing of a meter measurement response.
+    """
+    meter = orion_star.OrionStarA215()
+    return lambda: meter._check_response(METER_RESPONSE)
+
+
+def build_write_rows() -> Callable[[], object]:
+    """Formatting of the csv rows of a 20 step titration.
+    """
+    titration = make_titration(20)
+    return lambda: results._write_rows(io.StringIO(), titration, 2250.123)
+
+
+def build_finalize() -> Callable[[], object]:
+    """The write path of the UI's write_data: the result file of a 20 step
+    titration written, fsynced and moved over the journal.
+    """
+    titration = make_titration(20)
+    filepath = os.path.join(tempfile.mkdtemp(prefix="openalk-bench-"),
+                            "result.csv")
+    return lambda: results.StepJournal(filepath).finalize(titration,
+                                                          2250.123)
+
+
+# name -> function building the callable to time
+KERNELS: Dict[str, Callable[[], Callable[[], object]]] = {
+    "gran.calc_required_acid_vol": build_required_acid_vol,
+    **{f"gran.calc_{name}": functools.partial(build_constant, name)
+       for name in ["K1", "K2", "KW", "KB"]},
+    **{f"gran.gran_polynomial_fit[n={n}]": functools.partial(build_gran_fit, n)
+       for n in GRAN_FIT_SIZES},
+    **{f"regression.linear_regression[n={n}]":
+       functools.partial(build_regression, n) for n in REGRESSION_SIZES},
+    **{f"forward.forward_ph[n={n}]": functools.partial(build_forward, n)
+       for n in FORWARD_SIZES},
+    "norgren._check_response": build_pump_response,
+    "orion_star._check_response": build_meter_response,
+    "results.write_rows[n=20]": build_write_rows,
+    "results.finalize[n=20]": build_finalize,
+}
+
+
+def run_kernels(pattern: Optional[str] = None, **timing) -> Dict[str, dict]:
+    """Times every kernel whose name matches the pattern.
+
+    Args:
+        pattern (str): optional regular expression searched in the names.
+        **timing: passed to time_kernel.
+
+    Returns:
+        dict: kernel name -> timing, see time_kernel.
+    """
+    timings = {}
+    for name, build in KERNELS.items():
+        if pattern and not re.search(pattern, name):
+            continue
+        timings[name] = time_kernel(build(), **timing)
+    return timings
+
+
+def describe_host() -> dict:
+    """Describes where the benchmarks ran, so runs of different hosts
+    aren't compared.
+
+    Args:
+        None.
+
+    Returns:
+        dict: host, python, numpy, git commit and time of the run.
+    """
+    commit = None
+    head = os.path.join(os.path.dirname(__file__), "..", "..", ".git")
+    try:
+        commit = subprocess.run(
+            ["git", "--git-dir", head, "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return {"host": platform.node(), "machine": platform.machine(),
+            "python": platform.python_version(), "numpy": np.__version__,
+            "commit": commit, "time": time.time()}
+
+
+def last_run(history_path: str, host: str) -> Optional[dict]:
+    """Finds the last recorded run of a host.
+
+    Args:
+        history_path (str): location of the JSON lines history.
+        host (str): host name.
+
+    Returns:
+        dict: the run, or None if the host has none.
+    """
+    if not os.path.exists(history_path):
+        return None
+    found = None
+    with open(history_path) as f:
+        for line in f:
+            try:
+                run = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if run["meta"]["host"] == host:
+                found = run
+    return found
+
+
+def format_timings(timings: Dict[str, dict],
+                     previous: Optional[Dict[str, dict]] = None) -> str:
+    """Lays out timings as a text table, with the change from a previous
+    run if given.
+
+    Args:
+        timings (dict): output of run_kernels.
+        previous (dict): optional, timings of an earlier run.
+
+    Returns:
+        str: one line per kernel.
+    """
+    previous = previous or {}
+    lines = [f"{'kernel':<42}{'median':>12}{'min':>12}{'iqr':>10}"
+             f"{'change':>9}"]
+    for name, t in timings.items():
+        change = ""
+        if name in previous:
+            ratio = t["median_s"] / previous[name]["median_s"] - 1
+            change = f"{ratio:+.0%}"
+        lines.append(
+            f"{name:<42}{t['median_s'] * 1e6:>10.2f}us"
+            f"{t['min_s'] * 1e6:>10.2f}us{t['iqr_s'] * 1e6:>8.2f}us"
+            f"{change:>9}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point, see above.
+
+    Args:
+        argv (list): arguments; defaults to the command line.
+
+    Returns:
+        int: exit status.
+    """
+    parser = argparse.ArgumentParser(description="Hot path microbenchmarks")
+    parser.add_argument("--filter", default=None,
+                        help="Regular expression selecting kernels by name.")
+    parser.add_argument("--output", default=None,
+                        help="Write the results to this JSON file.")
+    parser.add_argument("--record", action="store_true",
+                        help="Append the results to the history.")
+    parser.add_argument("--history", default=HISTORY_FILEPATH,
+                        help="JSON lines history file.")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--min-repeat-time", type=float,
+                        default=MIN_REPEAT_TIME)
+    args = parser.parse_args(argv)
+
+    # The fit logs at debug level; keep handlers out of the timings
+    logging.disable(logging.CRITICAL)
+    try:
+        timings = run_kernels(args.filter, repeats=args.repeats,
+                              min_repeat_time=args.min_repeat_time)
+    finally:
+        logging.disable(logging.NOTSET)
+    run = {"meta": describe_host(), "kernels": timings}
+
+    previous = last_run(args.history, run["meta"]["host"])
+    print(format_timings(timings, previous and previous["kernels"]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+    if args.record:
+        with open(args.history, "a") as f:
+            f.write(json.dumps(run) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
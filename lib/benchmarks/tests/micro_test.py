@@ -0,0 +1,49 @@
+# Write unit tests for the microbenchmarks here
+# Tests MUST start with `test_` for pytest to find them
+
+import json
+
+from lib.benchmarks import micro
+
+
+def test_loops_are_calibrated_to_the_repeat_time() -> None:
+    """Test that fast functions are called enough times per repeat for
+    the repeat to reach the minimum time.
+    """
+    calls = []
+    timing = micro.time_kernel(lambda: calls.append(1), repeats=3,
+                               min_repeat_time=0.001, warmup_calls=2)
+
+    assert timing["loops"] > 1
+    assert timing["repeats"] == 3
+    assert timing["min_s"] <= timing["median_s"]
+    assert len(calls) >= 2 + 3 * timing["loops"]
+
+def test_every_kernel_builds() -> None:
+    """Test that each kernel can be built and called once.
+    """
+    for name, build in micro.KERNELS.items():
+        if "1000000" in name:
+            continue
+        build()()
+
+def test_runs_are_recorded_and_compared(tmp_path, capsys) -> None:
+    """Test that runs are written as JSON, appended to the history, and
+    compared with the last run of the same host.
+    """
+    output = tmp_path / "micro.json"
+    history = tmp_path / "history.jsonl"
+    args = ["--filter", "_check_response", "--repeats", "2",
+            "--min-repeat-time", "0.001", "--history", str(history),
+            "--record"]
+
+    micro.main(args + ["--output", str(output)])
+    run = json.loads(output.read_text())
+    assert set(run["kernels"]) == {"norgren._check_response",
+                                   "orion_star._check_response"}
+    assert run["meta"]["host"]
+
+    capsys.readouterr()
+    micro.main(args)
+    assert "%" in capsys.readouterr().out
+    assert len(history.read_text().splitlines()) == 2
@@ -0,0 +1,35 @@
+# Write unit tests for the throughput benchmark here
+# Tests MUST start with `test_` for pytest to find them
+
+from lib.benchmarks import throughput
+
+
+def test_case_reports_every_metric() -> None:
+    """Test that a case runs to completion and reports each metric.
+    """
+    result = throughput.run_case(35.0, 2300.0, 0.002)
+    assert set(result) == set(throughput.PROCEDURE_METRICS
+                              + throughput.RESOURCE_METRICS)
+    assert result["sim_wall_s"] > 60
+    assert result["steps"] >= 10
+    assert result["serial_transactions"] > result["steps"]
+
+def test_compare_flags_regressions() -> None:
+    """Test that procedure metrics are checked per case, and resources on
+    the mean only when asked for, each with its own tolerance.
+    """
+    base = {"sim_wall_s": 300.0, "serial_transactions": 60, "steps": 10,
+            "ta_error": 10.0, "cpu_s": 0.004, "peak_kb": 12.0}
+    baseline = {"a": base, "b": base}
+
+    same = {"a": dict(base), "b": dict(base, cpu_s=0.005)}
+    assert throughput.compare(same, baseline) == []
+
+    slower = {"a": dict(base, sim_wall_s=330.0), "b": dict(base, cpu_s=0.02)}
+    assert len(throughput.compare(slower, baseline)) == 1
+    regressions = throughput.compare(slower, baseline, check_resources=True)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("a: sim_wall_s")
+    assert regressions[1].startswith("mean cpu_s")
+
+    assert throughput.compare({"a": base}, baseline) == ["b: case missing"]
@@ -0,0 +1,343 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from lib.services.titration import routine, simulation
+from lib.utils import clocks
+
+logger = logging.getLogger(__name__)
+
+"""
+##### End-to-end throughput benchmark #####
+
+Runs complete titrations, with the real drivers and routine, against
+simulated devices on a virtual clock (see titration/simulation.py), over a
+matrix of salinity, alkalinity and pH reading noise. For each case it
+reports:
+
+sim_wall_s            simulated time taken by the sample, i.e. what
+                      limits samples/hour on real hardware
+serial_transactions   pump and meter transactions per sample
+steps                 titration steps per sample
+ta_error              |estimated - true| total alkalinity (umol/kg)
+cpu_s                 CPU time of the host per sample (best of REPEATS)
+peak_kb               peak memory allocated during the sample
+
+The first four only change when the procedure changes, so they are
+compared with the baseline at a tight tolerance. CPU time and memory depend
+on the host the baseline was recorded on, so they are only compared (as
+means over the matrix, with a loose tolerance) when asked for, against a
+baseline recorded on the same host:
+
+    python -m lib.benchmarks.throughput                 # run and print
+    python -m lib.benchmarks.throughput --check         # fail on regression
+    python -m lib.benchmarks.throughput --check --check-resources
+    python -m lib.benchmarks.throughput --update-baseline
+"""
+
+SALINITIES = [30.0, 35.0, 38.0]
+ALKALINITIES = [2000.0, 2150.0, 2300.0]
+PH_NOISES = [0.0, 0.002, 0.005]
+
+# Time (in seconds) the simulated meter takes per reading
+STABILIZE_TIME = 20.0
+
+# Runs of each case the CPU time is the best of
+REPEATS = 5
+
+BASELINE_FILEPATH = os.path.join(os.path.dirname(__file__), "baselines",
+                                 "throughput.json")
+
+# Metrics checked per case, and metrics checked as totals over the matrix
+PROCEDURE_METRICS = ["sim_wall_s", "serial_transactions", "steps",
+                     "ta_error"]
+RESOURCE_METRICS = ["cpu_s", "peak_kb"]
+
+DEFAULT_TOLERANCE = 0.02
+DEFAULT_RESOURCE_TOLERANCE = 0.5
+
+# Absolute slack (in umol/kg) on the TA error, so a tiny error can't fail
+# the check by doubling
+TA_ERROR_SLACK = 0.5
+
+
+def case_name(salinity: float, alkalinity: float, ph_noise: float) -> str:
+    """Builds the name of a benchmark case, e.g. S35-TA2300-N0.002.
+
+    Args:
+        salinity (float): salinity (in PSU) of the sample.
+        alkalinity (float): total alkalinity (in umol/kg) of the sample.
+        ph_noise (float): standard deviation of the pH reading noise.
+
+    Returns:
+        str: the case name.
+    """
+    return f"S{salinity:g}-TA{alkalinity:g}-N{ph_noise:g}"
+
+
+def run_sample(salinity: float, alkalinity: float, ph_noise: float,
+                 seed: int = 0) -> dict:
+    """Runs one simulated titration in virtual time.
+
+    Args:
+        salinity (float): salinity (in PSU) of the sample.
+        alkalinity (float): total alkalinity (in umol/kg) of the sample.
+        ph_noise (float): standard deviation of the pH reading noise.
+        seed (int): seed of the reading noise.
+
+    Returns:
+        dict: sim_wall_s, serial_transactions, steps and ta_error of the
+            sample.
+    """
+    clock = clocks.VirtualClock()
+    sample = simulation.SimulatedSample(alkalinity, salinity,
+                                        ph_noise=ph_noise, seed=seed)
+    pump, meter = simulation.simulated_devices(clock, sample,
+                                               stabilize_time=STABILIZE_TIME)
+    titration_routine = routine.TitrationRoutine(
+        pump, meter, sample.sample_mass, sample.salinity, sample.acid_conc,
+        clock=clock
+    )
+    clock.run(titration_routine.run())
+
+    total_alkalinity, _, _ = titration_routine.result
+    return {
+        "sim_wall_s": clock.monotonic(),
+        "serial_transactions": (pump.serial_port.transactions
+                                + meter.serial_port.transactions),
+        "steps": int(titration_routine.titration.ph_array.size - 1),
+        "ta_error": abs(total_alkalinity - alkalinity),
+    }
+
+
+def run_case(salinity: float, alkalinity: float, ph_noise: float,
+               seed: int = 0) -> dict:
+    """Runs one case of the matrix and measures its host resources too.
+
+    Args:
+        salinity (float): salinity (in PSU) of the sample.
+        alkalinity (float): total alkalinity (in umol/kg) of the sample.
+        ph_noise (float): standard deviation of the pH reading noise.
+        seed (int): seed of the reading noise.
+
+    Returns:
+        dict: every metric listed above.
+    """
+    cpu_times = []
+    for _ in range(REPEATS):
+        started = time.process_time()
+        result = run_sample(salinity, alkalinity, ph_noise, seed)
+        cpu_times.append(time.process_time() - started)
+
+    # Memory is traced on a run of its own, since tracing slows it down
+    tracemalloc.start()
+    try:
+        run_sample(salinity, alkalinity, ph_noise, seed)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result.update(cpu_s=min(cpu_times), peak_kb=peak / 1024)
+    return result
+
+
+def run_matrix() -> Dict[str, dict]:
+    """Runs every case of the matrix.
+
+    Args:
+        None.
+
+    Returns:
+        dict: case name -> metrics, see run_case.
+    """
+    results = {}
+    cases = itertools.product(SALINITIES, ALKALINITIES, PH_NOISES)
+    for seed, (salinity, alkalinity, ph_noise) in enumerate(cases):
+        name = case_name(salinity, alkalinity, ph_noise)
+        results[name] = run_case(salinity, alkalinity, ph_noise, seed)
+    return results
+
+
+def summarize(results: Dict[str, dict]) -> dict:
+    """Totals and means over the matrix.
+
+    Args:
+        results (dict): output of run_matrix.
+
+    Returns:
+        dict: samples_per_hour (simulated), and the mean of every metric
+            per sample.
+    """
+    n = len(results)
+    summary = {name: sum(r[name] for r in results.values()) / n
+               for name in PROCEDURE_METRICS + RESOURCE_METRICS}
+    summary["samples_per_hour"] = 3600 / summary["sim_wall_s"]
+    return summary
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict],
+              tolerance: float = DEFAULT_TOLERANCE,
+              resource_tolerance: float = DEFAULT_RESOURCE_TOLERANCE,
+              check_resources: bool = False) -> List[str]:
+    """Finds the metrics that got worse than the baseline by more than the
+    tolerance; for every metric, higher is worse.
+
+    Args:
+        results (dict): output of run_matrix.
+        baseline (dict): an earlier output of run_matrix.
+        tolerance (float): allowed relative increase of the procedure
+            metrics of each case.
+        resource_tolerance (float): allowed relative increase of the mean
+            CPU time and memory over the matrix.
+        check_resources (bool): if True, CPU time and memory are compared
+            too; only meaningful with a baseline from the same host.
+            Defaults to False.
+
+    Returns:
+        list: one message per regression, empty if there are none.
+    """
+    regressions = []
+    for name, base in sorted(baseline.items()):
+        if name not in results:
+            regressions.append(f"{name}: case missing")
+            continue
+        for metric in PROCEDURE_METRICS:
+            limit = base[metric] * (1 + tolerance)
+            if metric == "ta_error":
+                limit += TA_ERROR_SLACK
+            if results[name][metric] > limit:
+                regressions.append(
+                    f"{name}: {metric} {results[name][metric]:.4g} > "
+                    f"{base[metric]:.4g} (+{tolerance:.0%})"
+                )
+
+    common = [name for name in baseline if name in results]
+    if not check_resources or not common:
+        return regressions
+    current = summarize({name: results[name] for name in common})
+    previous = summarize({name: baseline[name] for name in common})
+    for metric in RESOURCE_METRICS:
+        if current[metric] > previous[metric] * (1 + resource_tolerance):
+            regressions.append(
+                f"mean {metric} {current[metric]:.4g} > "
+                f"{previous[metric]:.4g} (+{resource_tolerance:.0%})"
+            )
+    return regressions
+
+
+def format_results(results: Dict[str, dict]) -> str:
+    """Lays out the results as a text table.
+
+    Args:
+        results (dict): output of run_matrix.
+
+    Returns:
+        str: one line per case, and one with the means.
+    """
+    lines = [f"{'case':<22}{'sim min':>9}{'serial':>8}{'steps':>7}"
+             f"{'TA err':>8}{'cpu ms':>9}{'peak kB':>9}"]
+    rows = list(results.items()) + [("mean", summarize(results))]
+    for name, r in rows:
+        lines.append(
+            f"{name:<22}{r['sim_wall_s'] / 60:>9.2f}"
+            f"{r['serial_transactions']:>8.0f}{r['steps']:>7.0f}"
+            f"{r['ta_error']:>8.2f}{r['cpu_s'] * 1000:>9.2f}"
+            f"{r['peak_kb']:>9.0f}"
+        )
+    summary = summarize(results)
+    lines.append(f"Simulated throughput: {summary['samples_per_hour']:.2f} "
+                 f"samples/hour")
+    return "\n".join(lines)
+
+
+def load_results(filepath: str) -> Dict[str, dict]:
+    """Reads results written by save_results.
+
+    Args:
+        filepath (str): location of the JSON file.
+
+    Returns:
+        dict: case name -> metrics.
+    """
+    with open(filepath) as f:
+        return json.load(f)["cases"]
+
+
+def save_results(filepath: str, results: Dict[str, dict]) -> None:
+    """Writes results, with their summary, to a JSON file.
+
+    Args:
+        filepath (str): location of the JSON file.
+        results (dict): output of run_matrix.
+
+    Returns:
+        None.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    with open(filepath, "w") as f:
+        json.dump({"summary": summarize(results), "cases": results}, f,
+                  indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point, see above.
+
+    Args:
+        argv (list): arguments; defaults to the command line.
+
+    Returns:
+        int: exit status, 1 if --check found a regression.
+    """
+    parser = argparse.ArgumentParser(
+        description="End-to-end titration throughput on simulated devices"
+    )
+    parser.add_argument("--check", action="store_true",
+                        help="Compare with the baseline and fail on "
+                             "regressions.")
+    parser.add_argument("--baseline", default=BASELINE_FILEPATH,
+                        help="Baseline JSON file.")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Write the results as the new baseline.")
+    parser.add_argument("--output", default=None,
+                        help="Also write the results to this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed relative increase of the procedure "
+                             "metrics of each case.")
+    parser.add_argument("--check-resources", action="store_true",
+                        help="With --check, also compare the mean CPU time "
+                             "and memory; use a baseline from this host.")
+    parser.add_argument("--resource-tolerance", type=float,
+                        default=DEFAULT_RESOURCE_TOLERANCE,
+                        help="Allowed relative increase of the mean CPU "
+                             "time and memory.")
+    args = parser.parse_args(argv)
+
+    results = run_matrix()
+    print(format_results(results))
+
+    if args.output:
+        save_results(args.output, results)
+    if args.update_baseline:
+        save_results(args.baseline, results)
+        print(f"Baseline written to {args.baseline}")
+    if args.check:
+        regressions = compare(results, load_results(args.baseline),
+                              args.tolerance, args.resource_tolerance,
+                              args.check_resources)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
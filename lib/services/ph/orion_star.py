@@ -1,7 +1,9 @@
 import serial
 import logging
+from typing import Iterator, List
 
 from lib.services.ph.ph_interface import pHInterface
+from lib.utils import clocks, metrics, serial_recorder
 
 logger = logging.getLogger(__name__)
 
@@ -16,8 +18,106 @@ Commands given in the form of "<OPCODE> <OPERAND>\r".
 Example pH channel response:
 b'GETMEAS         \r\n\r\n\rA215 pH,X51250,3.04,ABCDE,12/07/23
   09:30:40,---,CH-1,pH,4.61,pH,111.2, mV,25.0,C,89.1,%,M100,#1\n\r\r>'
+
+##### Streaming #####
+
+Instead of answering GETMEAS, the meter can export a reading every few
+seconds (or less) by itself. start_streaming turns its timed export on and
+stop_streaming turns it off again; in between, each exported frame is the
+data line of the response above, ending with "\n". Frames are read off the
+port as they arrive and split by a FrameParser, which keeps a partial frame
+until the rest of it comes in and skips anything that isn't a reading
+(prompts, command echoes, noise). Every reading is stamped with the host
+time it was read:
+
+    ph_meter.start_streaming(interval=0.5)
+    for reading in ph_meter.stream_measurements():
+        print(reading["time"], reading["pH"], reading["mV"])
+
+The meter echoes each SETEXPORT command before its prompt; a response
+without the prompt, or with an error in it, raises a ValueError and leaves
+the streaming state as it was.
+
+While streaming, get_measurement returns the next frame to arrive, so a
+routine polling the meter gets a fresh reading without the GETMEAS round
+trip. Both it and stream_measurements raise an IndexError when no frame
+arrives within the read timeout. Export Data and DataLog must be off again before the meter is used
+request-response; stop_streaming takes care of the former.
 """
 
+# Commands turning the timed export on, every {interval} seconds, and off
+STREAM_START_COMMAND = "SETEXPORT TIMED {interval:g}"
+STREAM_STOP_COMMAND = "SETEXPORT OFF"
+
+# Words in a configuration command's response meaning the meter refused it
+CONFIG_ERROR_WORDS = ("ERROR", "INVALID")
+
+# Frames longer than this (in bytes) without a "\n" are dropped as noise
+MAX_FRAME_BYTES = 512
+
+
+def parse_channel_values(line: str) -> dict:
+    """Takes the measurements from the data line of a reading.
+
+    Args:
+        line (str): data line, see above.
+
+    Returns:
+        dict: {"pH": (str), "mV": (str), "temp": (str)}
+
+    Raises:
+        IndexError: if the line doesn't hold channel values.
+    """
+    # Split the line and take just the channel values
+    channel_values_raw = line.split('---')[1]
+
+    # Split the channel values and take pH, mV, and temp
+    channel_values_list = channel_values_raw.split(',')
+    return {"pH": channel_values_list[3], "mV": channel_values_list[5],
+                "temp": channel_values_list[7]}
+
+
+class FrameParser:
+    """Splits the meter's exported output into readings, see above.
+
+    Args:
+        None.
+
+    Returns:
+        None.
+    """
+    def __init__(self) -> None:
+        self.buffer = b""
+
+    def feed(self, data: bytes) -> List[dict]:
+        """Adds bytes read off the port and parses the frames they
+        complete.
+
+        Args:
+            data (bytes): bytes read off the port.
+
+        Returns:
+            list: {"pH": (str), "mV": (str), "temp": (str)} of every
+                complete frame, in order.
+        """
+        *lines, self.buffer = (self.buffer + data).split(b"\n")
+        if len(self.buffer) > MAX_FRAME_BYTES:
+            logger.warning("Dropping %d bytes of meter output without a "
+                           "frame end.", len(self.buffer))
+            self.buffer = b""
+
+        readings = []
+        for line in lines:
+            try:
+                readings.append(parse_channel_values(
+                    line.decode("ascii").strip()
+                ))
+            except (IndexError, UnicodeDecodeError):
+                if line.strip(b"\r> "):
+                    logger.debug("Skipping meter output: %s", line)
+        return readings
+
+
 class OrionStarA215(pHInterface):
     """Serial interface for Orion Star A215 pH meters.
 
@@ -30,22 +130,32 @@ class OrionStarA215(pHInterface):
         serial_timeout (int): timeout (in seconds) after which the serial
             port will be closed if no message is received. Defaults to 600.
             The default of 600 is important for the current functionality,
-            so be careful not to change it.
+            so be careful not to change it. While streaming, reads time out
+            after a few export intervals instead.
+        clock (Clock): clock used to time transactions. Defaults to real
+            time.
 
     Returns:
         None.
     """
     def __init__(self, serial_port_loc: str = '/dev/ttyACM0',
-                    baud_rate: int = 9600, serial_timeout: int = 600) -> None:
+                    baud_rate: int = 9600, serial_timeout: int = 600,
+                    clock: clocks.Clock = clocks.REAL_CLOCK) -> None:
         super().__init__()
 
         self.serial_port_loc = serial_port_loc
         self.baud_rate = baud_rate
         self.serial_timeout = serial_timeout
+        self.clock = clock
 
         # Meter protocol uses > as the end-of-response character
         self.end_response_char = b'\r>'
 
+        # Whether the timed export is on, and the parser of its frames
+        self.streaming = False
+        self.stream_interval = None
+        self.frame_parser = FrameParser()
+
     def open_serial_port(self, port: str = None) -> bool:
         """Opens serial communication to the pH meter.
 
@@ -78,17 +188,144 @@ class OrionStarA215(pHInterface):
 
     def get_measurement(self) -> dict:
         """Polls the meter for measurements of pH, emf, and temperature.
+        While streaming, waits for the next exported frame instead.
 
         Args:
             None.
 
         Returns:
-            dict: {"pH": (str), "mV": (str), "temp": (str)}
+            dict: {"pH": (str), "mV": (str), "temp": (str)}, and the host
+                time ("time": (float)) of a streamed reading.
+
+        Raises:
+            IndexError: if no frame arrives while streaming.
         """
+        if self.streaming:
+            return self.get_streamed_measurement()
+
         cmd = "GETMEAS"
         res_dict = self._send_meter_command(cmd)
         return res_dict
 
+    def start_streaming(self, interval: float = 1.0) -> None:
+        """Turns the meter's timed export on, see above.
+
+        Args:
+            interval (float): time (in seconds) between exported readings.
+                Defaults to 1.
+
+        Returns:
+            None.
+
+        Raises:
+            ValueError: if the interval isn't positive, or the meter
+                doesn't accept the command.
+        """
+        if interval <= 0:
+            raise ValueError(f"Invalid export interval {interval}.")
+
+        self._send_config_command(STREAM_START_COMMAND.format(
+            interval=interval
+        ))
+        self.serial_port.timeout = 3 * interval
+        self.frame_parser = FrameParser()
+        self.stream_interval = interval
+        self.streaming = True
+        logger.info(f"pH meter streaming every {interval} s")
+
+    def stop_streaming(self) -> None:
+        """Turns the meter's timed export off and drops any frames still
+        waiting on the port.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+
+        Raises:
+            ValueError: if the meter doesn't accept the command; it is
+                still streaming then.
+        """
+        self._send_config_command(STREAM_STOP_COMMAND)
+        self.serial_port.timeout = self.serial_timeout
+        self.serial_port.reset_input_buffer()
+        self.streaming = False
+        logger.info("pH meter streaming stopped")
+
+    def read_stream(self, block: bool = True) -> List[dict]:
+        """Reads what has arrived on the port and parses it into readings.
+
+        Args:
+            block (bool): if True, waits (up to the port's timeout) for at
+                least a byte when nothing has arrived. Defaults to True.
+
+        Returns:
+            list: {"pH": (str), "mV": (str), "temp": (str), "time":
+                (float)} of every frame completed, in order.
+        """
+        waiting = self.serial_port.in_waiting
+        if not waiting and not block:
+            return []
+
+        data = self.serial_port.read(max(waiting, 1))
+        received = self.clock.time()
+        readings = self.frame_parser.feed(data)
+        for reading in readings:
+            reading["time"] = received
+        return readings
+
+    def stream_measurements(self) -> Iterator[dict]:
+        """Yields the streamed readings as they arrive, until streaming is
+        stopped.
+
+        Args:
+            None.
+
+        Yields:
+            dict: {"pH": (str), "mV": (str), "temp": (str), "time": (float)}
+
+        Returns:
+            None.
+
+        Raises:
+            IndexError: if no frame arrives within the port's timeout.
+        """
+        waiting_since = self.clock.monotonic()
+        while self.streaming:
+            readings = self.read_stream()
+            if readings:
+                yield from readings
+                waiting_since = self.clock.monotonic()
+            elif (self.clock.monotonic() - waiting_since
+                    >= self.serial_port.timeout):
+                logger.error("No reading streamed from meter.")
+                raise IndexError("No reading streamed from meter.")
+
+    def get_streamed_measurement(self) -> dict:
+        """Drops the frames already waiting and returns the next one.
+
+        Args:
+            None.
+
+        Returns:
+            dict: {"pH": (str), "mV": (str), "temp": (str), "time": (float)}
+
+        Raises:
+            IndexError: if no frame arrives within the port's timeout.
+        """
+        while self.serial_port.in_waiting:
+            self.read_stream(block=False)
+
+        started = self.clock.monotonic()
+        while True:
+            readings = self.read_stream()
+            if readings:
+                return readings[-1]
+            if self.clock.monotonic() - started >= self.serial_port.timeout:
+                logger.error("No reading streamed from meter.")
+                raise IndexError("No reading streamed from meter.")
+
     def _build_serial_command(self, cmd: str) -> bytes:
         """Uses Thermo-specific formatting and converts to bytes.
 
@@ -100,6 +337,50 @@ class OrionStarA215(pHInterface):
         """
         return f"{cmd}\r".encode("ascii")
 
+    def _send_config_command(self, cmd: str) -> bytes:
+        """Sends a command that doesn't return a reading and waits for the
+        meter's prompt.
+
+        Args:
+            cmd (str): the command to be encoded, e.g. "SETEXPORT OFF".
+
+        Returns:
+            bytes: the response, up to and including the prompt.
+
+        Raises:
+            ValueError: if the response has no prompt or reports an error.
+        """
+        serial_cmd = self._build_serial_command(cmd)
+        kind = cmd.split()[0]
+        started = self.clock.monotonic()
+        self.serial_port.write(serial_cmd)
+        written = self.clock.monotonic()
+
+        res_bytes = self.serial_port.read_until(
+                        expected=self.end_response_char
+                    )
+        finished = self.clock.monotonic()
+
+        timed_out = not res_bytes.endswith(self.end_response_char)
+        metrics.observe_serial(type(self).__name__, self.serial_port_loc,
+                               kind, finished - started, timed_out)
+
+        try:
+            res_dict = self._check_config_response(res_bytes)
+        except (ValueError, UnicodeDecodeError) as e:
+            logger.error(f"Meter did not accept {cmd}: {e}")
+            serial_recorder.record_transaction(
+                type(self).__name__, self.serial_port_loc, kind, serial_cmd,
+                res_bytes, started, written, finished, timed_out, None,
+                f"{type(e).__name__}: {e}"
+            )
+            raise ValueError(f"Meter did not accept {cmd}: {e}") from e
+        serial_recorder.record_transaction(
+            type(self).__name__, self.serial_port_loc, kind, serial_cmd,
+            res_bytes, started, written, finished, timed_out, res_dict
+        )
+        return res_bytes
+
     def _send_meter_command(self, cmd: str) -> dict:
         """Sends an encoded serial command and returns the decoded response.
 
@@ -110,12 +391,58 @@ class OrionStarA215(pHInterface):
             dict: {"pH": (str), "mV": (str), "temp": (str)}
         """
         serial_cmd = self._build_serial_command(cmd)
+        started = self.clock.monotonic()
         self.serial_port.write(serial_cmd)
+        written = self.clock.monotonic()
 
         res_bytes = self.serial_port.read_until(
                         expected=self.end_response_char
                     )
-        return self._check_response(res_bytes)
+        finished = self.clock.monotonic()
+
+        timed_out = not res_bytes.endswith(self.end_response_char)
+        metrics.observe_serial(type(self).__name__, self.serial_port_loc,
+                               cmd, finished - started, timed_out)
+
+        if not serial_recorder.recording_enabled():
+            return self._check_response(res_bytes)
+
+        try:
+            res_dict = self._check_response(res_bytes)
+        except (ValueError, IndexError, UnicodeDecodeError) as e:
+            serial_recorder.record_transaction(
+                type(self).__name__, self.serial_port_loc, cmd, serial_cmd,
+                res_bytes, started, written, finished, timed_out, None,
+                f"{type(e).__name__}: {e}"
+            )
+            raise
+        serial_recorder.record_transaction(
+            type(self).__name__, self.serial_port_loc, cmd, serial_cmd,
+            res_bytes, started, written, finished, timed_out, res_dict
+        )
+        return res_dict
+
+    def _check_config_response(self, res: bytes) -> dict:
+        """Helper function to check the response to a configuration
+        command.
+
+        Args:
+            res (bytes): encoded response coming from the pH meter, e.g.
+                b'SETEXPORT OFF\r\n\r>'.
+
+        Returns:
+            dict: {"msg": (str)}, the response without the prompt.
+
+        Raises:
+            ValueError: if the response has no prompt or reports an error.
+        """
+        if not res.endswith(self.end_response_char):
+            raise ValueError(f"No prompt in response {res!r}")
+
+        msg = res[:-len(self.end_response_char)].decode("ascii").strip()
+        if any(word in msg.upper() for word in CONFIG_ERROR_WORDS):
+            raise ValueError(f"Error in response {msg!r}")
+        return {"msg": msg}
 
     def _check_response(self, res: bytes) -> dict:
         """Helper function to parse data from serial messages.
@@ -130,14 +457,8 @@ class OrionStarA215(pHInterface):
         # Decode the response and strip leading newlines
         res_decoded = res.decode("ascii").rstrip().splitlines()[3]
 
-        # Split the response and take just the channel values
         try:
-            channel_values_raw = res_decoded.split('---')[1]
+            return parse_channel_values(res_decoded)
         except IndexError as e:
             logger.error(f"Invalid response from meter: {res_decoded}, Error: {e}")
             raise
-
-        # Split the channel values and take pH, mV, and temp
-        channel_values_list = channel_values_raw.split(',')
-        return {"pH": channel_values_list[3], "mV": channel_values_list[5],
-                    "temp": channel_values_list[7]}
@@ -14,3 +14,18 @@ class pHInterface:
         ***Override this method in the child class***
         """
         raise NotImplementedError("Use derived pH meter implementation class!")
+
+    def start_streaming(self, interval: float = 1.0) -> None:
+        """Starts the meter exporting readings by itself, every interval
+        seconds.
+
+        ***Override this method in the child class***
+        """
+        raise NotImplementedError("Use derived pH meter implementation class!")
+
+    def stop_streaming(self) -> None:
+        """Stops the meter exporting readings.
+
+        ***Override this method in the child class***
+        """
+        raise NotImplementedError("Use derived pH meter implementation class!")
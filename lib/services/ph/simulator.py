@@ -0,0 +1,214 @@
+import datetime
+import logging
+import re
+from typing import Callable, Optional, Tuple
+
+from lib.utils import clocks
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Simulated Orion Star A215 #####
+
+Stands in for the serial port of an OrionStarA215 and answers GETMEAS like
+the meter would (see orion_star.py for the format), so the real driver can
+be run without hardware:
+
+    meter = orion_star.OrionStarA215(clock=clock)
+    meter.serial_port = SimulatedMeterPort(clock, sample.measure)
+
+The reading comes from the measure callable, which returns pH, emf (in mV)
+and temperature (in C). Like the real meter, a reading takes a while to
+stabilize; that time passes on the given clock, as does the transfer time
+of every byte at the baud rate.
+
+The timed export is simulated too: once it is turned on, a frame is sent
+every interval, a byte at a time at the baud rate, so a read can end in
+the middle of a frame. A frame is measured when the first read after its
+time comes in.
+"""
+
+FRAME_TEMPLATE = ("A215 pH,X51250,3.04,ABCDE,{stamp},---,CH-1,pH,{ph:.3f},pH,"
+                  "{emf:.1f}, mV,{temp:.1f},C,89.1,%,M100,#1\n\r")
+
+
+class SimulatedMeterPort:
+    """Serial port answering like an OrionStarA215, see above.
+
+    Args:
+        clock (Clock): clock the simulated time passes on.
+        measure (Callable): returns the current pH, emf (in mV) and
+            temperature (in C) of the sample.
+        stabilize_time (float): time (in seconds) a reading takes.
+            Defaults to 20.
+        baud_rate (int): baudrate used for the transfer time of each byte.
+
+    Returns:
+        None.
+    """
+    def __init__(self, clock: clocks.Clock,
+                    measure: Callable[[], Tuple[float, float, float]],
+                    stabilize_time: float = 20.0,
+                    baud_rate: int = 9600) -> None:
+        self.clock = clock
+        self.measure = measure
+        self.stabilize_time = stabilize_time
+        self.baud_rate = baud_rate
+        self.transactions = 0
+        self._command = b""
+
+        # pyserial's read timeout (in seconds), set by the driver
+        self.timeout = None
+
+        # Export interval (in seconds) while the export is on, time of the
+        # next frame, and the frame bytes sent with their arrival times
+        self.export_interval = None
+        self._next_frame = None
+        self._outgoing = []
+
+    def _transfer(self, data: bytes) -> None:
+        """Lets the transfer time of some bytes pass, at 10 bits a byte.
+
+        Args:
+            data (bytes): the bytes sent or received.
+
+        Returns:
+            None.
+        """
+        self.clock.sleep(len(data) * 10 / self.baud_rate)
+
+    def write(self, data: bytes) -> int:
+        """Takes a command; GETMEAS and the export commands are answered.
+
+        Args:
+            data (bytes): encoded command, e.g. b'GETMEAS\\r'.
+
+        Returns:
+            int: number of bytes written.
+        """
+        self._transfer(data)
+        self.transactions += 1
+        self._command = data.strip()
+        return len(data)
+
+    def _frame(self) -> bytes:
+        """Takes a reading and formats it like the meter does.
+
+        Args:
+            None.
+
+        Returns:
+            bytes: the data line of the reading.
+        """
+        ph, emf, temp = self.measure()
+        stamp = datetime.datetime.fromtimestamp(
+            self.clock.time(), datetime.timezone.utc
+        ).strftime("%m/%d/%y %H:%M:%S")
+        return FRAME_TEMPLATE.format(
+            stamp=stamp, ph=ph, emf=emf, temp=temp
+        ).encode("ascii")
+
+    def _export(self) -> None:
+        """Sends the frames due by now, if the export is on.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        now = self.clock.monotonic()
+        byte_time = 10 / self.baud_rate
+        while self.export_interval and self._next_frame <= now:
+            frame = self._frame()
+            self._outgoing.extend(
+                (self._next_frame + (i + 1) * byte_time, frame[i:i + 1])
+                for i in range(len(frame))
+            )
+            self._next_frame += self.export_interval
+
+    @property
+    def in_waiting(self) -> int:
+        """Number of bytes that have arrived and not been read.
+        """
+        self._export()
+        now = self.clock.monotonic()
+        return sum(1 for arrival, _ in self._outgoing if arrival <= now)
+
+    def read(self, size: int = 1) -> bytes:
+        """Reads up to size bytes that have arrived, waiting up to the
+        timeout for the first one.
+
+        Args:
+            size (int): most bytes to read.
+
+        Returns:
+            bytes: the bytes read, empty on a timeout.
+        """
+        waiting = self.in_waiting
+        if not waiting:
+            first = self._next_arrival()
+            wait = (self.timeout if first is None
+                    else first - self.clock.monotonic())
+            if self.timeout is not None and wait > self.timeout:
+                wait = self.timeout
+            self.clock.sleep(max(wait or 0.0, 0.0))
+            waiting = self.in_waiting
+
+        taken = self._outgoing[:min(size, waiting)]
+        del self._outgoing[:len(taken)]
+        return b"".join(byte for _, byte in taken)
+
+    def _next_arrival(self) -> Optional[float]:
+        """Finds when the next byte will arrive.
+
+        Args:
+            None.
+
+        Returns:
+            float: arrival time of the next byte, or None if the export is
+                off and nothing is on its way.
+        """
+        if self._outgoing:
+            return self._outgoing[0][0]
+        if self.export_interval:
+            return self._next_frame + 10 / self.baud_rate
+        return None
+
+    def reset_input_buffer(self) -> None:
+        """Drops every byte sent so far.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        self._outgoing = []
+
+    def read_until(self, expected: bytes = b"\n") -> bytes:
+        """Takes the reading asked for by the last command and returns it.
+
+        Args:
+            expected (bytes): terminator; the response always ends with
+                the meter's prompt.
+
+        Returns:
+            bytes: the response.
+        """
+        command, self._command = self._command, b""
+        start = re.fullmatch(rb"SETEXPORT TIMED ([\d.]+)", command)
+        if start or command == b"SETEXPORT OFF":
+            self.export_interval = float(start.group(1)) if start else None
+            self._next_frame = self.clock.monotonic()
+            response = command + b"\r\n\r>"
+            self._transfer(response)
+            return response
+        if command != b"GETMEAS":
+            return b""
+
+        self.clock.sleep(self.stabilize_time)
+        response = (b"GETMEAS         \r\n\r\n\r" + self._frame()
+                    + b"\r>")
+        self._transfer(response)
+        return response
@@ -17,3 +17,13 @@ def test_get_measurement_not_implemented() -> None:
     interface = pHInterface()
     with pytest.raises(NotImplementedError):
         interface.get_measurement()
+
+def test_streaming_not_implemented() -> None:
+    """Test to make sure the streaming methods fail if not overridden by
+    a subclass.
+    """
+    interface = pHInterface()
+    with pytest.raises(NotImplementedError):
+        interface.start_streaming(interval=1.0)
+    with pytest.raises(NotImplementedError):
+        interface.stop_streaming()
@@ -5,6 +5,7 @@ import pytest
 from unittest.mock import Mock, patch
 
 from lib.services.ph import orion_star
+from lib.utils import clocks
 
 # Important note on testing techniques:
 # 
@@ -116,4 +117,138 @@ def test_check_response_failure_random_A215() -> None:
     """
     with pytest.raises(IndexError):
         ph_meter = orion_star.OrionStarA215()
-        res = ph_meter._check_response(RANDOM_RES)
\ No newline at end of file
+        res = ph_meter._check_response(RANDOM_RES)
+DUMMY_FRAME = b'A215 pH,X51250,3.04,ABCDE,12/07/23 09:30:40,---,CH-1,pH,4.61,\
+pH,111.2, mV,25.0,C,89.1,%,M100,#1\n\r'
+
+def test_frame_parser_partial_frames_A215() -> None:
+    """Test that frames split across reads, and surrounded by prompts
+    and noise, are parsed once complete.
+    """
+    parser = orion_star.FrameParser()
+    stream = b'SETEXPORT OFF\r\n\r>' + DUMMY_FRAME + b'a;sld4\n' + DUMMY_FRAME
+
+    readings = []
+    for i in range(0, len(stream), 7):
+        readings += parser.feed(stream[i:i + 7])
+    assert readings == [{"pH": "4.61", "mV": "111.2", "temp": "25.0"}] * 2
+    assert parser.buffer == b'\r'
+
+    assert parser.feed(b'x' * (orion_star.MAX_FRAME_BYTES + 1)) == []
+    assert parser.buffer == b''
+
+def test_start_stop_streaming_A215() -> None:
+    """Test that streaming turns the timed export on and off, and sets the
+    read timeout for it.
+    """
+    ph_meter = orion_star.OrionStarA215()
+    ph_meter.serial_port = Mock()
+    ph_meter.serial_port.write = Mock(return_value=True)
+    ph_meter.serial_port.read_until = Mock(return_value=b'\r>')
+
+    with pytest.raises(ValueError):
+        ph_meter.start_streaming(interval=0)
+
+    ph_meter.start_streaming(interval=0.5)
+    ph_meter.serial_port.write.assert_called_with(b"SETEXPORT TIMED 0.5\r")
+    assert ph_meter.streaming
+    assert ph_meter.serial_port.timeout == 1.5
+
+    ph_meter.stop_streaming()
+    ph_meter.serial_port.write.assert_called_with(b"SETEXPORT OFF\r")
+    ph_meter.serial_port.reset_input_buffer.assert_called_once()
+    assert not ph_meter.streaming
+    assert ph_meter.serial_port.timeout == 600
+
+@pytest.mark.parametrize("response", [
+    b'',
+    b'SETEXPORT TIMED 0.5\r\nInvalid command\r\n\r>',
+    b'SETEXPORT TIMED 0.5\r\nERROR 2\r\n\r>',
+])
+def test_start_streaming_refused_A215(response: bytes) -> None:
+    """Test that streaming isn't turned on when the meter answers without
+    its prompt or with an error.
+    """
+    ph_meter = orion_star.OrionStarA215()
+    ph_meter.serial_port = Mock()
+    ph_meter.serial_port.timeout = 600
+    ph_meter.serial_port.read_until = Mock(return_value=response)
+
+    with pytest.raises(ValueError):
+        ph_meter.start_streaming(interval=0.5)
+    assert not ph_meter.streaming
+    assert ph_meter.serial_port.timeout == 600
+
+def test_stop_streaming_refused_A215() -> None:
+    """Test that streaming stays on, with its read timeout, when the meter
+    doesn't accept the command to stop.
+    """
+    ph_meter = orion_star.OrionStarA215()
+    ph_meter.serial_port = Mock()
+    ph_meter.serial_port.read_until = Mock(return_value=b'\r>')
+    ph_meter.start_streaming(interval=0.5)
+
+    ph_meter.serial_port.read_until = Mock(
+        return_value=b'SETEXPORT OFF\r\nERROR 2\r\n\r>'
+    )
+    with pytest.raises(ValueError):
+        ph_meter.stop_streaming()
+    assert ph_meter.streaming
+    assert ph_meter.serial_port.timeout == 1.5
+    ph_meter.serial_port.reset_input_buffer.assert_not_called()
+
+def test_stream_measurements_timeout_A215() -> None:
+    """Test that streamed readings are yielded as they arrive, and that
+    the stream fails once no frame arrives within the read timeout.
+    """
+    clock = clocks.VirtualClock()
+    ph_meter = orion_star.OrionStarA215(clock=clock)
+    ph_meter.streaming = True
+    ph_meter.serial_port = Mock()
+    ph_meter.serial_port.timeout = 1.5
+    ph_meter.serial_port.in_waiting = 0
+    reads = [DUMMY_FRAME, DUMMY_FRAME]
+
+    def read(size: int) -> bytes:
+        """Helper returning the next chunk, or nothing after the read
+        timeout.
+        """
+        if reads:
+            return reads.pop(0)
+        clock.advance(ph_meter.serial_port.timeout)
+        return b''
+
+    ph_meter.serial_port.read = Mock(side_effect=read)
+    stream = ph_meter.stream_measurements()
+    assert next(stream)["pH"] == "4.61"
+    assert next(stream)["pH"] == "4.61"
+    with pytest.raises(IndexError):
+        next(stream)
+
+def test_get_measurement_streaming_A215() -> None:
+    """Test that while streaming, get_measurement skips the frames already
+    waiting and returns the next one with its host time, and fails if none
+    arrives.
+    """
+    ph_meter = orion_star.OrionStarA215()
+    ph_meter.streaming = True
+    ph_meter.serial_port = Mock()
+    ph_meter.serial_port.timeout = 1.5
+    stale = DUMMY_FRAME.replace(b'4.61', b'4.70')
+    ph_meter.serial_port.in_waiting = len(stale)
+    reads = [stale, DUMMY_FRAME[:20], DUMMY_FRAME[20:]]
+
+    def read(size: int) -> bytes:
+        """Helper returning the next chunk and emptying the port.
+        """
+        ph_meter.serial_port.in_waiting = 0
+        return reads.pop(0)
+
+    ph_meter.serial_port.read = Mock(side_effect=read)
+    res = ph_meter.get_measurement()
+    assert res["pH"] == "4.61"
+    assert isinstance(res["time"], float)
+
+    ph_meter.serial_port.read = Mock(return_value=b'')
+    with pytest.raises(IndexError):
+        ph_meter.get_measurement()
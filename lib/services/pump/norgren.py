@@ -1,9 +1,10 @@
-import time
+import re
 import serial
 import logging
 from enum import Enum, unique
 
 from lib.services.pump.pump_interface import PumpInterface
+from lib.utils import clocks, metrics, serial_recorder
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +23,7 @@ Commands (all require an "R" after the command to run)
 "AnR" will command an absolute move to n steps from the valve
 "DnR" will dispense n steps toward the valve
 "PnR" will aspirate n steps away from the valve
+"VnR" sets the top speed of the following moves to n steps per second
 
 "IR" switches valve to input position (port A -> syringe)
 "OR" switches valve to output position (syringe -> port B)
@@ -59,17 +61,24 @@ class VersaPumpV6(PumpInterface):
             since this is the pump's default setting.
         serial_timeout (int): timeout (in seconds) after which the serial
             port will be closed if no message is received. Defaults to 2.
+        clock (Clock): clock used to wait between busy checks and to time
+            transactions. Defaults to real time.
 
     Returns:
         None.
     """
     def __init__(self, serial_port_loc: str = '/dev/ttyUSB0',
-                    baud_rate: int = 9600, serial_timeout: int = 2) -> None:
+                    baud_rate: int = 9600, serial_timeout: int = 2,
+                    clock: clocks.Clock = clocks.REAL_CLOCK) -> None:
         super().__init__()
 
         self.serial_port_loc = serial_port_loc
         self.baud_rate = baud_rate
         self.serial_timeout = serial_timeout
+        self.clock = clock
+
+        # Interval (in seconds) between busy checks while waiting on a move
+        self.poll_interval = 0.25
 
         # Pump protocol uses FF hex as end-of-packet character
         self.end_packet_char = b'\xff'
@@ -95,6 +104,14 @@ class VersaPumpV6(PumpInterface):
         self.liters_per_step = (self.syringe_size_liters_calib /
                                     self.syringe_position_max)
 
+        # Valid top speeds (in steps/second) of the plunger; the fastest is
+        # the speed after initialization
+        self.plunger_speed_max = 6000
+        self.plunger_speed_range = range(1, self.plunger_speed_max + 1)
+
+        # Top speed last sent to the pump; the pump can't be asked for it
+        self.plunger_speed = self.plunger_speed_max
+
     def open_serial_port(self, port: str = None) -> bool:
         """Opens serial communication to the pump.
 
@@ -140,6 +157,7 @@ class VersaPumpV6(PumpInterface):
         """
         cmd = "W4R"
         res_dict = self._send_pump_command(cmd)
+        self.plunger_speed = self.plunger_speed_max
         return res_dict
 
     def check_module_ready(self) -> bool:
@@ -254,7 +272,7 @@ class VersaPumpV6(PumpInterface):
             set = self.set_valve_state(state=ValveStates.INPUT)
 
         while not self.check_module_ready():
-            time.sleep(0.25)
+            self.clock.sleep(self.poll_interval)
 
         cmd = f"A{self.syringe_position_max}R"
         res_dict = self._send_pump_command(cmd)
@@ -274,7 +292,7 @@ class VersaPumpV6(PumpInterface):
             set = self.set_valve_state(state=ValveStates.OUTPUT)
 
         while not self.check_module_ready():
-            time.sleep(0.25)
+            self.clock.sleep(self.poll_interval)
 
         cmd = f"A{self.syringe_position_min}R"
         res_dict = self._send_pump_command(cmd)
@@ -294,12 +312,12 @@ class VersaPumpV6(PumpInterface):
             fill_res_dict = self.fill()
             last_res = fill_res_dict
             while not self.check_module_ready():
-                time.sleep(0.25)
+                self.clock.sleep(self.poll_interval)
 
             empty_res_dict = self.empty()
             last_res = empty_res_dict
             while not self.check_module_ready():
-                time.sleep(0.25)
+                self.clock.sleep(self.poll_interval)
         return last_res
 
     def liters_to_steps(self, volume: float) -> int:
@@ -336,7 +354,7 @@ class VersaPumpV6(PumpInterface):
             set = self.set_valve_state(state=ValveStates.INPUT)
 
         while not self.check_module_ready():
-            time.sleep(0.25)
+            self.clock.sleep(self.poll_interval)
 
         cmd = f"P{steps}R"
         res_dict = self._send_pump_command(cmd)
@@ -365,12 +383,30 @@ class VersaPumpV6(PumpInterface):
             set = self.set_valve_state(state=ValveStates.OUTPUT)
 
         while not self.check_module_ready():
-            time.sleep(0.25)
+            self.clock.sleep(self.poll_interval)
 
         cmd = f"D{steps}R"
         res_dict = self._send_pump_command(cmd)
         return res_dict
 
+    def set_plunger_speed(self, steps_per_second: int) -> dict:
+        """Sets the top speed of the plunger for the following moves, e.g.
+        to dispense slowly.
+
+        Args:
+            steps_per_second (int): the requested speed (in steps/second).
+
+        Returns:
+            dict: {"host_ready": (bool), "module_ready": (bool), "msg": (str)}
+        """
+        if not steps_per_second in self.plunger_speed_range:
+            raise ValueError(f"Invalid speed {steps_per_second}.")
+
+        cmd = f"V{steps_per_second}R"
+        res_dict = self._send_pump_command(cmd)
+        self.plunger_speed = steps_per_second
+        return res_dict
+
     def _build_serial_command(self, cmd: str) -> bytes:
         """Uses Norgren-specific formatting and converts to bytes.
 
@@ -392,11 +428,38 @@ class VersaPumpV6(PumpInterface):
             dict: {"host_ready": (bool), "module_ready": (bool), "msg": (str)}
         """
         serial_cmd = self._build_serial_command(cmd)
+        started = self.clock.monotonic()
         self.serial_port.write(serial_cmd)
+        written = self.clock.monotonic()
 
         res_bytes = self.serial_port.read_until(expected=self.end_packet_char)
+        finished = self.clock.monotonic()
         res_bytes_cleaned = res_bytes.split(self.end_response_char)[0]
-        return self._check_response(res_bytes_cleaned)
+
+        # Moves, aspirate/dispense and speeds are grouped regardless of
+        # their operand
+        kind = re.sub(r"(?<=[ADPV])\d+", "n", cmd)
+        timed_out = not res_bytes.endswith(self.end_packet_char)
+        metrics.observe_serial(type(self).__name__, self.serial_port_loc,
+                               kind, finished - started, timed_out)
+
+        if not serial_recorder.recording_enabled():
+            return self._check_response(res_bytes_cleaned)
+
+        try:
+            res_dict = self._check_response(res_bytes_cleaned)
+        except (ValueError, IndexError, UnicodeDecodeError) as e:
+            serial_recorder.record_transaction(
+                type(self).__name__, self.serial_port_loc, kind, serial_cmd,
+                res_bytes, started, written, finished, timed_out, None,
+                f"{type(e).__name__}: {e}"
+            )
+            raise
+        serial_recorder.record_transaction(
+            type(self).__name__, self.serial_port_loc, kind, serial_cmd,
+            res_bytes, started, written, finished, timed_out, res_dict
+        )
+        return res_dict
 
     def _check_response(self, res: bytes) -> dict:
         """Helper function to parse data from serial messages.
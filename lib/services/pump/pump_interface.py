@@ -9,6 +9,8 @@ class PumpInterface:
         self.serial_port_loc = None
         self.wash_cycles = None
         self.liters_per_step = None
+        self.plunger_speed_max = None
+        self.plunger_speed = None
 
     def initialize_pump(self):
         """Send an initialize command to the pump.
@@ -68,3 +70,8 @@ class PumpInterface:
         """Dispense solution from syringe through the output port.
         """
         raise NotImplementedError("Use derived pump implementation class!")
+
+    def set_plunger_speed(self, steps_per_second):
+        """Set the speed of the plunger's following moves.
+        """
+        raise NotImplementedError("Use derived pump implementation class!")
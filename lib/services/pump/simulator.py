@@ -0,0 +1,217 @@
+import logging
+import re
+from typing import Callable, Optional
+
+from lib.utils import clocks
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Simulated Versa Pump V6 #####
+
+Stands in for the serial port of a VersaPumpV6 and answers its commands
+like the pump would (see norgren.py for the protocol), so the real driver
+can be run without hardware:
+
+    pump = norgren.VersaPumpV6(clock=clock)
+    pump.serial_port = SimulatedPumpPort(clock, on_dispense=sample.add_acid)
+
+Moves take time on the given clock, at the plunger speed (set with V),
+and the module reports busy until they are done; the position reported
+while a move is under way is where the plunger is at that moment. Every
+byte written and read costs its transfer time at the baud rate, plus the
+pump's response latency. Liquid pushed out through the output valve is
+reported to on_dispense, in liters, as the plunger moves: whenever the
+pump is sent a command, or update is called, e.g. right before the sample
+is measured.
+"""
+
+# Pump response framing
+RESPONSE_END = b"\x03\r\n\xff"
+
+# Status bytes: ready, busy, invalid command, invalid operand
+READY = "`"
+BUSY = "@"
+INVALID_COMMAND = "B"
+INVALID_OPERAND = "C"
+
+VALVE_CODES = {"I": 1, "B": 2, "O": 3}
+
+# Fastest plunger speed (in steps/second), which the pump starts at
+MAX_SPEED = 6000
+
+
+class SimulatedPumpPort:
+    """Serial port answering like a VersaPumpV6, see above.
+
+    Args:
+        clock (Clock): clock the simulated time passes on.
+        on_dispense (Callable): optional, called with the volume (in
+            liters) of every dispense through the output valve.
+        steps_per_second (float): plunger speed until the pump is sent
+            another. Defaults to 6000, i.e. a full stroke in 8 seconds.
+        latency (float): time (in seconds) the pump takes to answer.
+        baud_rate (int): baudrate used for the transfer time of each byte.
+        syringe_liters (float): volume of a full stroke.
+        max_steps (int): steps of a full stroke.
+
+    Returns:
+        None.
+    """
+    def __init__(self, clock: clocks.Clock,
+                    on_dispense: Optional[Callable[[float], None]] = None,
+                    steps_per_second: float = MAX_SPEED,
+                    latency: float = 0.005,
+                    baud_rate: int = 9600, syringe_liters: float = 0.002478,
+                    max_steps: int = 48000) -> None:
+        self.clock = clock
+        self.on_dispense = on_dispense
+        self.steps_per_second = steps_per_second
+        self.latency = latency
+        self.baud_rate = baud_rate
+        self.liters_per_step = syringe_liters / max_steps
+        self.max_steps = max_steps
+
+        self.position = 0
+        self.valve = VALVE_CODES["I"]
+        self.busy_until = 0.0
+
+        # Current move: start and end position, and when it starts (after
+        # any valve turn); dispensing if it goes out through the output
+        self._move_from = 0
+        self._move_to = 0
+        self._move_start = 0.0
+        self._move_speed = steps_per_second
+        self._dispensing = False
+        self.transactions = 0
+        self._response = b""
+
+    def _transfer(self, data: bytes) -> None:
+        """Lets the transfer time of some bytes pass, at 10 bits a byte.
+
+        Args:
+            data (bytes): the bytes sent or received.
+
+        Returns:
+            None.
+        """
+        self.clock.sleep(len(data) * 10 / self.baud_rate)
+
+    def write(self, data: bytes) -> int:
+        """Takes a command and prepares the response.
+
+        Args:
+            data (bytes): encoded command, e.g. b'/1D1937R\\r'.
+
+        Returns:
+            int: number of bytes written.
+        """
+        self._transfer(data)
+        self.transactions += 1
+        status, msg = self.execute(data.decode("ascii").strip()[2:])
+        self._response = f"/0{status}{msg}".encode("ascii") + RESPONSE_END
+        return len(data)
+
+    def read_until(self, expected: bytes = b"\n") -> bytes:
+        """Returns the response to the last command.
+
+        Args:
+            expected (bytes): terminator; the response always ends with
+                the pump's end-of-packet character.
+
+        Returns:
+            bytes: the response.
+        """
+        self.clock.sleep(self.latency)
+        response, self._response = self._response, b""
+        self._transfer(response)
+        return response
+
+    def execute(self, cmd: str) -> tuple:
+        """Runs one command.
+
+        Args:
+            cmd (str): command without the address, e.g. "D1937R".
+
+        Returns:
+            tuple: status byte and response message.
+        """
+        self.update()
+        busy = self.clock.monotonic() < self.busy_until
+        if cmd == "":
+            return (BUSY if busy else READY), ""
+        if cmd == "?":
+            return (BUSY if busy else READY), str(self.position)
+        if cmd == "?8":
+            return (BUSY if busy else READY), str(self.valve)
+
+        match = re.fullmatch(r"([ADPIOBWV])(\d*)R", cmd)
+        if not match:
+            return INVALID_COMMAND, ""
+        if busy:
+            # The real pump ignores commands sent while it is moving
+            return BUSY, ""
+
+        op, operand = match.group(1), match.group(2)
+        if op in VALVE_CODES:
+            self.valve = VALVE_CODES[op]
+            self._move(0, 0.2)
+            return READY, ""
+        if op == "W":
+            self.steps_per_second = MAX_SPEED
+            self._move(-self.position)
+            return READY, ""
+
+        steps = int(operand or 0)
+        if op == "V":
+            if not 1 <= steps <= MAX_SPEED:
+                return INVALID_OPERAND, ""
+            self.steps_per_second = steps
+            return READY, ""
+
+        target = {"A": steps, "P": self.position + steps,
+                  "D": self.position - steps}[op]
+        if not 0 <= target <= self.max_steps:
+            return INVALID_OPERAND, ""
+
+        self._move(target - self.position)
+        return READY, ""
+
+    def update(self) -> None:
+        """Brings the plunger to where the current move has taken it by
+        now, reporting the liquid pushed out on the way.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        elapsed = self.clock.monotonic() - self._move_start
+        travel = abs(self._move_to - self._move_from)
+        done = min(int(max(elapsed, 0.0) * self._move_speed), travel)
+        direction = 1 if self._move_to >= self._move_from else -1
+        position = self._move_from + direction * done
+
+        if self._dispensing and self.on_dispense and position < self.position:
+            self.on_dispense((self.position - position) * self.liters_per_step)
+        self.position = position
+
+    def _move(self, steps: int, extra: float = 0.0) -> None:
+        """Starts moving the plunger and marks the pump busy for as long as
+        it takes.
+
+        Args:
+            steps (int): signed number of steps to move.
+            extra (float): additional busy time (in seconds), e.g. for a
+                valve turn.
+
+        Returns:
+            None.
+        """
+        self._move_from = self.position
+        self._move_to = self.position + steps
+        self._move_start = self.clock.monotonic() + extra
+        self._move_speed = self.steps_per_second
+        self._dispensing = steps < 0 and self.valve == VALVE_CODES["O"]
+        self.busy_until = self._move_start + abs(steps) / self._move_speed
@@ -11,6 +11,8 @@ def test_init_base_interface() -> None:
     assert hasattr(interface, 'serial_port_loc')
     assert hasattr(interface, 'wash_cycles')
     assert hasattr(interface, 'liters_per_step')
+    assert hasattr(interface, 'plunger_speed_max')
+    assert hasattr(interface, 'plunger_speed')
 
 def test_initialize_pump_not_implemented() -> None:
     """Test to make sure the initialize_pump method fails if not 
@@ -99,3 +101,11 @@ def test_dispense_not_implemented() -> None:
     interface = PumpInterface()
     with pytest.raises(NotImplementedError):
         interface.dispense(volume=0.0015)
+
+def test_set_plunger_speed_not_implemented() -> None:
+    """Test to make sure the set_plunger_speed method fails if not
+    overridden by a subclass.
+    """
+    interface = PumpInterface()
+    with pytest.raises(NotImplementedError):
+        interface.set_plunger_speed(steps_per_second=100)
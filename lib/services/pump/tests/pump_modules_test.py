@@ -335,6 +335,30 @@ def test_dispense_failure_norgren() -> None:
         pump = norgren.VersaPumpV6()
         res = pump.dispense(volume=0.5)
 
+def test_set_plunger_speed_success_norgren() -> None:
+    """Test that the set_plunger_speed method sends the speed command and
+    returns the proper data object.
+    """
+    pump = norgren.VersaPumpV6()
+    pump.serial_port = Mock()
+    pump.serial_port.write = Mock(return_value=True)
+    pump.serial_port.read_until = Mock(return_value=DUMMY_RES_POS)
+
+    res = pump.set_plunger_speed(steps_per_second=20)
+    pump.serial_port.write.assert_called_once_with(b"/1V20R\r")
+    assert res == {"host_ready": True, "module_ready": True, "msg": "48000"}
+    assert pump.plunger_speed == 20
+
+def test_set_plunger_speed_failure_norgren() -> None:
+    """Test that the set_plunger_speed method fails as expected given
+    an invalid speed.
+    """
+    pump = norgren.VersaPumpV6()
+    with pytest.raises(ValueError):
+        pump.set_plunger_speed(steps_per_second=0)
+    with pytest.raises(ValueError):
+        pump.set_plunger_speed(steps_per_second=6001)
+
 def test_build_serial_command_norgren() -> None:
     """Test proper formatting of serial commands to meet the pump's
     specifications.
@@ -0,0 +1,290 @@
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum, auto
+from typing import Dict, List, Optional, Tuple
+
+import serial
+from serial.tools import list_ports
+
+from lib.services.ph import orion_star
+from lib.services.pump import norgren
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Automatic device discovery #####
+
+Every serial port on the host is probed at the same time, each on its own
+thread. A port is asked for the syringe position in the Kloehn protocol
+("/1?\\r", answered with e.g. b'/0`24000\\xff') and for a measurement in the
+Thermo protocol ("GETMEAS\\r", answered with a csv line ending in '\\r>').
+A correct probe returns as soon as the terminator arrives, so only a wrong
+guess costs a full probe timeout. Ports that look like USB CDC-ACM devices
+(how the A215 enumerates) are asked the meter question first, everything
+else the pump question first, so a whole rig normally comes up in about
+one probe timeout regardless of how many devices it has.
+
+Probing never moves the syringe; pumps are only initialized once they are
+connected.
+"""
+
+# Time (in seconds) to wait for each probe response
+PROBE_TIMEOUT = 0.5
+
+# The pump and meter both default to 9600 baud
+PROBE_BAUD_RATE = 9600
+
+
+class DeviceTypes(Enum):
+    """Enum values for the kinds of device a port can be identified as.
+    """
+    PUMP = auto()
+    PH_METER = auto()
+    UNKNOWN = auto()
+
+
+def port_sort_key(port: str) -> tuple:
+    """Gives a key sorting port locations by their numbers as numbers, so
+    /dev/ttyUSB2 comes before /dev/ttyUSB10.
+
+    Args:
+        port (str): port location on the host.
+
+    Returns:
+        tuple: the text and numbers of the location, in turn.
+    """
+    # Splitting on the numbers leaves them at the odd positions
+    parts = re.split(r"(\d+)", port)
+    return tuple(int(part) if i % 2 else part
+                 for i, part in enumerate(parts))
+
+
+def list_candidate_ports() -> List[str]:
+    """Lists the serial ports present on the host.
+
+    Args:
+        None.
+
+    Returns:
+        list: port locations, e.g. ['/dev/ttyACM0', '/dev/ttyUSB0'].
+    """
+    return sorted((port.device for port in list_ports.comports()),
+                  key=port_sort_key)
+
+
+def probe_port(port: str, timeout: float = PROBE_TIMEOUT) -> DeviceTypes:
+    """Identifies the device on a serial port.
+
+    Args:
+        port (str): port location on the host.
+        timeout (float): time (in seconds) to wait for each probe response.
+            Defaults to PROBE_TIMEOUT.
+
+    Returns:
+        DeviceTypes: the kind of device found on the port.
+    """
+    try:
+        serial_port = serial.Serial(
+            port = port,
+            baudrate = PROBE_BAUD_RATE,
+            bytesize = serial.EIGHTBITS,
+            parity = serial.PARITY_NONE,
+            stopbits = serial.STOPBITS_ONE,
+            timeout = timeout
+        )
+    except serial.SerialException as e:
+        logger.info(f"Could not open {port} for probing: {e}")
+        return DeviceTypes.UNKNOWN
+
+    probes = [_probe_pump, _probe_meter]
+    if "ACM" in port:
+        probes.reverse()
+
+    try:
+        for probe in probes:
+            device_type = probe(serial_port)
+            if device_type != DeviceTypes.UNKNOWN:
+                logger.info(f"Found {device_type.name} on {port}")
+                return device_type
+    except serial.SerialException as e:
+        logger.info(f"Probing {port} failed with error: {e}")
+    finally:
+        serial_port.close()
+
+    return DeviceTypes.UNKNOWN
+
+
+def _probe_pump(serial_port: serial.Serial) -> DeviceTypes:
+    """Sends a syringe position query and checks for a Kloehn response.
+
+    Args:
+        serial_port (serial.Serial): open port to probe.
+
+    Returns:
+        DeviceTypes: PUMP if the response is valid, UNKNOWN otherwise.
+    """
+    pump = norgren.VersaPumpV6()
+    serial_port.reset_input_buffer()
+    serial_port.write(pump._build_serial_command("?"))
+
+    res_bytes = serial_port.read_until(expected=pump.end_packet_char)
+    res_bytes_cleaned = res_bytes.split(pump.end_response_char)[0]
+    try:
+        pump._check_response(res_bytes_cleaned)
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return DeviceTypes.UNKNOWN
+    return DeviceTypes.PUMP
+
+
+def _probe_meter(serial_port: serial.Serial) -> DeviceTypes:
+    """Sends a measurement request and checks for a Thermo response.
+
+    Args:
+        serial_port (serial.Serial): open port to probe.
+
+    Returns:
+        DeviceTypes: PH_METER if the response is valid, UNKNOWN otherwise.
+    """
+    ph_meter = orion_star.OrionStarA215()
+    serial_port.reset_input_buffer()
+    serial_port.write(ph_meter._build_serial_command("GETMEAS"))
+
+    res_bytes = serial_port.read_until(expected=ph_meter.end_response_char)
+    try:
+        ph_meter._check_response(res_bytes)
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return DeviceTypes.UNKNOWN
+    return DeviceTypes.PH_METER
+
+
+def discover_devices(ports: Optional[List[str]] = None,
+                       timeout: float = PROBE_TIMEOUT) -> Dict[str, DeviceTypes]:
+    """Probes every port concurrently and identifies the devices on them.
+
+    Args:
+        ports (list): port locations to probe. Defaults to every serial
+            port on the host.
+        timeout (float): time (in seconds) to wait for each probe response.
+            Defaults to PROBE_TIMEOUT.
+
+    Returns:
+        dict: port location -> DeviceTypes, for every probed port.
+    """
+    if ports is None:
+        ports = list_candidate_ports()
+    if not ports:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=len(ports),
+                            thread_name_prefix="probe") as pool:
+        device_types = pool.map(lambda port: probe_port(port, timeout), ports)
+        return dict(zip(ports, device_types))
+
+
+def connect_pump(pump: norgren.VersaPumpV6, port: str,
+                   initialize: bool = True) -> bool:
+    """Opens and initializes a pump.
+
+    Args:
+        pump (VersaPumpV6): pump to connect.
+        port (str): port location on the host.
+        initialize (bool): if False, the pump is only opened; used when
+            resuming a run, since initializing zeroes the syringe.
+            Defaults to True.
+
+    Returns:
+        bool: True if the pump is connected and initialized, False otherwise.
+    """
+    if not pump.open_serial_port(port=port):
+        return False
+    if not initialize:
+        return True
+
+    pump_init = pump.initialize_pump()
+    if not pump_init['host_ready']:
+        logger.error(f"Pump initialization failed on {port}.")
+        return False
+    return True
+
+
+def connect_meter(ph_meter: orion_star.OrionStarA215, port: str) -> bool:
+    """Opens a pH meter.
+
+    Args:
+        ph_meter (OrionStarA215): meter to connect.
+        port (str): port location on the host.
+
+    Returns:
+        bool: True if the meter is connected, False otherwise.
+    """
+    return ph_meter.open_serial_port(port=port)
+
+
+def connect_devices(pumps: Dict[str, norgren.VersaPumpV6],
+                      ph_meters: Dict[str, orion_star.OrionStarA215],
+                      initialize_pumps: bool = True) -> Dict[str, bool]:
+    """Connects any number of pumps and meters concurrently.
+
+    Args:
+        pumps (dict): port location -> pump to connect on that port.
+        ph_meters (dict): port location -> meter to connect on that port.
+        initialize_pumps (bool): see connect_pump. Defaults to True.
+
+    Returns:
+        dict: port location -> True if the connection was successful.
+    """
+    def connect(pump: norgren.VersaPumpV6, port: str) -> bool:
+        return connect_pump(pump, port, initialize=initialize_pumps)
+
+    jobs = [(port, connect, pump) for port, pump in pumps.items()]
+    jobs += [(port, connect_meter, meter) for port, meter in ph_meters.items()]
+    if not jobs:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=len(jobs),
+                            thread_name_prefix="connect") as pool:
+        futures = {port: pool.submit(func, device, port)
+                   for port, func, device in jobs}
+        return {port: future.result() for port, future in futures.items()}
+
+
+def discover_and_connect(ports: Optional[List[str]] = None,
+                            timeout: float = PROBE_TIMEOUT
+                            ) -> List[Tuple[norgren.VersaPumpV6,
+                                            orion_star.OrionStarA215]]:
+    """Finds every pump and meter on the host, connects them all in
+    parallel, and pairs them up by port order.
+
+    The n-th pump (sorted by port location) is paired with the n-th meter,
+    which matches the order the ports are enumerated in when each station's
+    devices are plugged in together; check the pairing on new rigs.
+
+    Args:
+        ports (list): port locations to probe. Defaults to every serial
+            port on the host.
+        timeout (float): time (in seconds) to wait for each probe response.
+            Defaults to PROBE_TIMEOUT.
+
+    Returns:
+        list: (pump, meter) pairs of connected devices.
+    """
+    found = discover_devices(ports, timeout)
+
+    ports = sorted(found, key=port_sort_key)
+    pumps = {port: norgren.VersaPumpV6() for port in ports
+             if found[port] == DeviceTypes.PUMP}
+    ph_meters = {port: orion_star.OrionStarA215() for port in ports
+                 if found[port] == DeviceTypes.PH_METER}
+
+    connected = connect_devices(pumps, ph_meters)
+
+    pumps = [pump for port, pump in pumps.items() if connected[port]]
+    ph_meters = [meter for port, meter in ph_meters.items() if connected[port]]
+
+    if len(pumps) != len(ph_meters):
+        logger.warning(
+            f"Found {len(pumps)} pumps but {len(ph_meters)} pH meters, "
+            f"unpaired devices are left out."
+        )
+    return list(zip(pumps, ph_meters))
@@ -0,0 +1,597 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from lib.services.ph import orion_star
+from lib.services.ph.ph_interface import pHInterface
+from lib.services.pump import norgren
+from lib.services.pump.pump_interface import PumpInterface
+from lib.services.station import discovery
+from lib.services.station.scheduler import ScheduledTask, Scheduler
+from lib.services.station.states import SystemStates
+from lib.services.titration import (protocol, recovery, results, routine,
+                                    store, timing)
+from lib.utils import log_pipeline, metrics
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Station configuration file #####
+
+A JSON list with one entry per titrator, e.g.:
+
+[
+    {"name": "station-1", "pump_port": "/dev/ttyUSB0",
+     "meter_port": "/dev/ttyACM0"},
+    {"name": "station-2", "pump_port": "/dev/ttyUSB1",
+     "meter_port": "/dev/ttyACM1", "protocol": "profiles/fast.json"}
+]
+
+The optional protocol is a profile (see titration/protocol.py) the
+station's titrations follow instead of the default protocol.
+"""
+
+
+class Station:
+    """One titrator, i.e. a pump and pH meter pair, with its own log file
+    and stream of results.
+
+    Args:
+        name (str): unique name of the station, used for its log and
+            result file locations.
+        pump (PumpInterface): pump of the station.
+        ph_meter (pHInterface): pH meter of the station.
+        log_dir (str): directory for the station's log file. Defaults to
+            logs, same as the main application log.
+        results_dir (str): directory under which a sub-directory for the
+            station's result files is created. Defaults to results.
+        store (ResultStore): optional, store every finished titration is
+            added to; set by StationManager.add_station if not given.
+        titration_protocol (TitrationProtocol): targets, step and Gran
+            cutoff of the station's titrations. Defaults to the standard
+            protocol.
+
+    Returns:
+        None.
+    """
+    def __init__(self, name: str, pump: PumpInterface, ph_meter: pHInterface,
+                    log_dir: str = "logs", results_dir: str = "results",
+                    store: Optional[store.ResultStore] = None,
+                    titration_protocol: protocol.TitrationProtocol = (
+                        protocol.DEFAULT_PROTOCOL)) -> None:
+        self.name = name
+        self.pump = pump
+        self.ph_meter = ph_meter
+        self.store = store
+        self.protocol = titration_protocol
+
+        self.results_dir = os.path.join(results_dir, name)
+
+        self.log = logging.getLogger(f"{__name__}.{name}")
+        self._log_handler = None
+        self.attach_log_file(log_dir)
+
+        # Every finished (or failed) titration is put here as a dict, see
+        # handle_routine_done for the keys
+        self.results = queue.Queue()
+        self._result_callbacks: List[Callable[[dict], None]] = []
+
+        self.routine = None
+        self.task = None
+        self._system_state = SystemStates.DISCONNECTED
+        metrics.SYSTEM_STATE.track(name, lambda: self._system_state)
+
+        # Time (in seconds) spent connecting, charged to the next run
+        self.connect_time = timing.ConnectTime()
+
+    @property
+    def state(self) -> SystemStates:
+        """Current state of the station.
+        """
+        return self._system_state
+
+    def attach_log_file(self, log_dir: str) -> None:
+        """Sends this station's log messages to a file of its own, in
+        addition to the main application log. The file is written by the
+        logging listener (see log_pipeline.py), not the dosing threads.
+
+        Args:
+            log_dir (str): directory for the log file.
+
+        Returns:
+            None.
+        """
+        if not os.path.isdir(log_dir):
+            return
+
+        log_filepath = os.path.join(
+            log_dir, f"{self.name}_{results.default_filename()}.log"
+        )
+        self._log_handler = log_pipeline.add_logger_file(self.log.name,
+                                                         log_filepath)
+
+    def subscribe(self, callback: Callable[[dict], None]) -> None:
+        """Registers a function to be called with each new result.
+
+        Callbacks run on a scheduler worker thread, so UI code must hand
+        the result over to its own thread.
+
+        Args:
+            callback (Callable): function taking the result dict.
+
+        Returns:
+            None.
+        """
+        self._result_callbacks.append(callback)
+
+    def connect(self, pump_port: str, meter_port: str,
+                   initialize_pump: bool = True) -> bool:
+        """Opens serial connections to the station's pump and pH meter.
+
+        Args:
+            pump_port (str): location of the pump's serial port.
+            meter_port (str): location of the pH meter's serial port.
+            initialize_pump (bool): if False, the pump is not initialized
+                (which would zero the syringe), so an interrupted run can be
+                resumed. Defaults to True.
+
+        Returns:
+            bool: True if all connections are successful, False otherwise.
+        """
+        self._system_state = SystemStates.DISCONNECTED
+
+        connect_started = time.monotonic()
+        connected = discovery.connect_devices(
+            pumps={pump_port: self.pump}, ph_meters={meter_port: self.ph_meter},
+            initialize_pumps=initialize_pump
+        )
+        self.connect_time.record(time.monotonic() - connect_started)
+
+        if not connected[pump_port]:
+            self.log.error("Pump connection failed.")
+            return False
+
+        if not connected[meter_port]:
+            self.log.error("pH meter serial connection failed.")
+            return False
+
+        self._system_state = SystemStates.READY
+        self.log.info("Device connection successful.")
+        return True
+
+    def mark_connected(self) -> None:
+        """Marks the station as ready when its devices were connected
+        elsewhere, e.g. by discovery.discover_and_connect.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        self._system_state = SystemStates.READY
+        self.log.info("Device connection successful.")
+
+    def start(self, scheduler: Scheduler, sample_mass: float, salinity: float,
+                 acid_conc: float,
+                 on_status: Optional[Callable[[str], None]] = None,
+                 on_step: Optional[Callable] = None) -> ScheduledTask:
+        """Starts a titration on the shared scheduler.
+
+        Args:
+            scheduler (Scheduler): scheduler to run the routine on.
+            sample_mass (float): mass (in grams) of the sample.
+            salinity (float): salinity (in PSU) of the sample.
+            acid_conc (float): concentration (in moles/l) of the titrant.
+            on_status (Callable): optional, see TitrationRoutine.
+            on_step (Callable): optional, see TitrationRoutine.
+
+        Returns:
+            ScheduledTask: handle for the running routine.
+        """
+        self.check_ready()
+
+        os.makedirs(self.results_dir, exist_ok=True)
+        filepath = os.path.join(self.results_dir,
+                                results.default_filename() + ".csv")
+
+        self.routine = routine.TitrationRoutine(
+            self.pump, self.ph_meter, sample_mass, salinity, acid_conc,
+            on_status=on_status, on_step=on_step, log=self.log,
+            journal=results.StepJournal(filepath),
+            checkpoint=recovery.Checkpoint(filepath),
+            timer=self.connect_time.new_timer(self.name), station=self.name,
+            titration_protocol=self.protocol
+        )
+        return self.launch(scheduler)
+
+    def find_interrupted_run(self) -> Optional[str]:
+        """Looks for the checkpoint of a run interrupted on this station.
+
+        Args:
+            None.
+
+        Returns:
+            str: location of the most recent checkpoint, or None.
+        """
+        if not os.path.isdir(self.results_dir):
+            return None
+        paths = recovery.find_interrupted_runs(self.results_dir)
+        return paths[0] if paths else None
+
+    def discard_interrupted_runs(self, keep: Optional[str] = None) -> None:
+        """Removes the checkpoints of the runs interrupted on this station,
+        so they aren't offered again. Only the most recent run can be
+        resumed, since the syringe has moved on from the others.
+
+        Args:
+            keep (str): optional, location of a checkpoint to leave, e.g.
+                the one being resumed.
+
+        Returns:
+            None.
+        """
+        if not os.path.isdir(self.results_dir):
+            return
+        for path in recovery.find_interrupted_runs(self.results_dir):
+            if path != keep:
+                self.log.info("Discarding checkpoint %s", path)
+                os.remove(path)
+
+    def resume(self, scheduler: Scheduler, checkpoint_path: str,
+                  on_status: Optional[Callable[[str], None]] = None,
+                  on_step: Optional[Callable] = None) -> ScheduledTask:
+        """Continues an interrupted titration from its checkpoint. The
+        station must have been connected without initializing the pump.
+
+        Args:
+            scheduler (Scheduler): scheduler to run the routine on.
+            checkpoint_path (str): location of the checkpoint.
+            on_status (Callable): optional, see TitrationRoutine.
+            on_step (Callable): optional, see TitrationRoutine.
+
+        Returns:
+            ScheduledTask: handle for the running routine.
+        """
+        self.check_ready()
+
+        state = recovery.load_checkpoint(checkpoint_path)
+        self.routine = routine.TitrationRoutine.resume(
+            self.pump, self.ph_meter, state,
+            on_status=on_status, on_step=on_step, log=self.log,
+            journal=results.StepJournal(state["filepath"]),
+            checkpoint=recovery.Checkpoint(state["filepath"]),
+            timer=self.connect_time.new_timer(self.name), station=self.name,
+            titration_protocol=self.protocol
+        )
+        return self.launch(scheduler)
+
+    def check_ready(self) -> None:
+        """Raises an error unless the station can start a titration.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if not self._system_state == SystemStates.READY:
+            raise RuntimeError(
+                f"Station {self.name} is not ready ({self._system_state.name})"
+            )
+
+    def launch(self, scheduler: Scheduler) -> ScheduledTask:
+        """Submits the station's routine to the scheduler.
+
+        Args:
+            scheduler (Scheduler): scheduler to run the routine on.
+
+        Returns:
+            ScheduledTask: handle for the running routine.
+        """
+        self._system_state = SystemStates.RUNNING
+        self.task = scheduler.submit(self.name, self.routine.run(),
+                                       on_done=self.handle_routine_done)
+        return self.task
+
+    def stop(self) -> None:
+        """Gives the signal to stop the running titration before its next step.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if not self._system_state == SystemStates.RUNNING:
+            return
+
+        self.routine.stop()
+        self._system_state = SystemStates.STOPPING
+
+    def handle_routine_done(self, task: ScheduledTask) -> None:
+        """Writes the data of a finished titration and publishes the result.
+
+        Args:
+            task (ScheduledTask): the finished scheduler task.
+
+        Returns:
+            None.
+        """
+        result = {
+            "station": self.name,
+            "total_alkalinity": None,
+            "gamma": None,
+            "rsq": None,
+            "filepath": None,
+            "stopped": self.routine.stopped,
+            "error": str(task.error) if task.error else None,
+            "max_lateness_s": task.max_lateness,
+            "timings": None,
+        }
+
+        try:
+            if self.routine.result:
+                total_alkalinity, gamma, rsq = self.routine.result
+                with self.routine.timer.span("write"):
+                    filepath = self.routine.journal.finalize(
+                        self.routine.titration, total_alkalinity
+                    )
+                timings = self.routine.timer.summary()
+                self.log.info(f"Timing: {timing.format_summary(timings)}")
+                result.update(total_alkalinity=total_alkalinity, gamma=gamma,
+                              rsq=rsq, filepath=filepath, timings=timings)
+                if self.store:
+                    self.store.add_run(
+                        self.routine.titration, total_alkalinity, gamma=gamma,
+                        rsq=rsq, station=self.name,
+                        started_at=self.routine.started_at, filepath=filepath,
+                        timings=timings, protocol=self.protocol.to_dict()
+                    )
+            elif self.routine.titration is not None:
+                self.log.info(
+                    f"Partial data kept in {self.routine.journal.journal_path}"
+                )
+        except (OSError, ValueError, sqlite3.Error) as e:
+            self.log.error(f"Writing titration data failed with error: {e}")
+            result["error"] = str(e)
+        finally:
+            self._system_state = SystemStates.READY
+
+        self.results.put(result)
+        for callback in self._result_callbacks:
+            callback(result)
+
+    def close(self) -> None:
+        """Detaches the station's log file and stops reporting its state.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        metrics.SYSTEM_STATE.untrack(self.name)
+        if self._log_handler:
+            log_pipeline.remove_logger_file(self.log.name, self._log_handler)
+            self._log_handler = None
+
+
+class StationManager:
+    """Holds any number of stations and runs their titrations concurrently
+    on one shared scheduler.
+
+    Args:
+        scheduler (Scheduler): optional scheduler to use; by default one
+            is created with a worker per station (and a few spare).
+        store (ResultStore): optional, result store shared by every
+            station.
+
+    Returns:
+        None.
+    """
+    def __init__(self, scheduler: Optional[Scheduler] = None,
+                    store: Optional[store.ResultStore] = None) -> None:
+        self.stations: Dict[str, Station] = {}
+        self.scheduler = scheduler
+        self.store = store
+
+    def add_station(self, station: Station) -> None:
+        """Adds a station to the manager.
+
+        Args:
+            station (Station): the station to add; names must be unique.
+
+        Returns:
+            None.
+        """
+        if station.name in self.stations:
+            raise ValueError(f"Duplicate station name {station.name}.")
+        if station.store is None:
+            station.store = self.store
+        self.stations[station.name] = station
+
+    def get_scheduler(self) -> Scheduler:
+        """Returns the shared scheduler, starting it if needed.
+
+        Args:
+            None.
+
+        Returns:
+            Scheduler: the running scheduler.
+        """
+        if self.scheduler is None:
+            self.scheduler = Scheduler(max_workers=len(self.stations) + 4)
+        self.scheduler.start()
+        return self.scheduler
+
+    def start(self, name: str, sample_mass: float, salinity: float,
+                 acid_conc: float, **kwargs) -> ScheduledTask:
+        """Starts a titration on one station.
+
+        Args:
+            name (str): name of the station.
+            sample_mass (float): mass (in grams) of the sample.
+            salinity (float): salinity (in PSU) of the sample.
+            acid_conc (float): concentration (in moles/l) of the titrant.
+            **kwargs: callbacks passed through to Station.start.
+
+        Returns:
+            ScheduledTask: handle for the running routine.
+        """
+        return self.stations[name].start(
+            self.get_scheduler(), sample_mass, salinity, acid_conc, **kwargs
+        )
+
+    def resume(self, name: str, checkpoint_path: str,
+                  **kwargs) -> ScheduledTask:
+        """Continues an interrupted titration on one station.
+
+        Args:
+            name (str): name of the station.
+            checkpoint_path (str): location of the checkpoint.
+            **kwargs: callbacks passed through to Station.resume.
+
+        Returns:
+            ScheduledTask: handle for the running routine.
+        """
+        return self.stations[name].resume(
+            self.get_scheduler(), checkpoint_path, **kwargs
+        )
+
+    def stop(self, name: str) -> None:
+        """Stops the titration running on one station.
+
+        Args:
+            name (str): name of the station.
+
+        Returns:
+            None.
+        """
+        self.stations[name].stop()
+
+    def stop_all(self) -> None:
+        """Stops the titrations running on every station.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        for station in self.stations.values():
+            station.stop()
+
+    def shutdown(self) -> None:
+        """Stops the scheduler, closes every station's log file, and closes
+        the result store.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if self.scheduler:
+            self.scheduler.shutdown()
+        for station in self.stations.values():
+            station.close()
+        if self.store:
+            self.store.close()
+
+
+def load_station_config(filepath: str) -> List[dict]:
+    """Reads a station configuration file, see the example above.
+
+    Args:
+        filepath (str): location of the JSON configuration file.
+
+    Returns:
+        list: one dict per station with name, pump_port and meter_port,
+            and protocol if given.
+    """
+    with open(filepath) as f:
+        config = json.load(f)
+
+    for entry in config:
+        for key in ("name", "pump_port", "meter_port"):
+            if key not in entry:
+                raise ValueError(f"Station entry {entry} is missing {key}.")
+    return config
+
+
+def open_default_store(results_dir: str = "results") -> store.ResultStore:
+    """Opens the result store shared by the stations, in the root of the
+    stations' results directory.
+
+    Args:
+        results_dir (str): results directory. Defaults to results.
+
+    Returns:
+        ResultStore: the opened store.
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    return store.ResultStore(
+        os.path.join(results_dir, store.DEFAULT_STORE_FILENAME)
+    )
+
+
+def build_manager_from_discovery(
+        timeout: float = discovery.PROBE_TIMEOUT,
+        titration_protocol: protocol.TitrationProtocol = (
+            protocol.DEFAULT_PROTOCOL)
+        ) -> Tuple[StationManager, Dict[str, tuple]]:
+    """Creates a manager with one station for every pump/meter pair found
+    on the host, with all devices already connected.
+
+    Args:
+        timeout (float): time (in seconds) to wait for each probe response.
+        titration_protocol (TitrationProtocol): protocol of every station.
+            Defaults to the standard protocol.
+
+    Returns:
+        tuple containing:
+         - StationManager: manager holding the connected stations.
+         - dict: station name -> (pump port, meter port).
+    """
+    manager = StationManager(store=open_default_store())
+    ports = {}
+    for i, (pump, ph_meter) in enumerate(discovery.discover_and_connect(
+                                                        timeout=timeout)):
+        station = Station(f"station-{i + 1}", pump, ph_meter,
+                          titration_protocol=titration_protocol)
+        station.mark_connected()
+        manager.add_station(station)
+        ports[station.name] = (pump.serial_port_loc, ph_meter.serial_port_loc)
+    return manager, ports
+
+
+def build_manager(config: List[dict],
+                    titration_protocol: protocol.TitrationProtocol = (
+                        protocol.DEFAULT_PROTOCOL)) -> StationManager:
+    """Creates a manager with a VersaPumpV6/OrionStarA215 station for each
+    entry of a station configuration.
+
+    Args:
+        config (list): station configuration, see load_station_config.
+        titration_protocol (TitrationProtocol): protocol of the stations
+            whose entry doesn't name a profile. Defaults to the standard
+            protocol.
+
+    Returns:
+        StationManager: manager holding the (not yet connected) stations.
+    """
+    manager = StationManager(store=open_default_store())
+    for entry in config:
+        station_protocol = titration_protocol
+        if "protocol" in entry:
+            station_protocol = protocol.load_protocol(entry["protocol"])
+        manager.add_station(Station(
+            entry["name"], norgren.VersaPumpV6(), orion_star.OrionStarA215(),
+            titration_protocol=station_protocol
+        ))
+    return manager
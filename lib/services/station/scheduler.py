@@ -0,0 +1,240 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Generator, Optional
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Shared scheduler for generator-based routines #####
+
+Each task is a generator that yields the time (in seconds) it wants to wait
+before it is resumed, see lib/services/titration/routine.py. A single
+dispatcher thread keeps every pending wakeup in a heap ordered by deadline,
+and hands each task to a worker pool when its deadline comes up. Device I/O
+(which blocks on the serial port) only ever ties up a worker, never the
+dispatcher, so a slow meter on one station can't delay another station.
+
+Deadlines are absolute (time.monotonic()), and the lateness of each wakeup
+is tracked per task so that missed equilibration deadlines are visible.
+"""
+
+
+class ScheduledTask:
+    """Bookkeeping for one routine running on the scheduler.
+
+    Args:
+        name (str): display name of the task, e.g. the station name.
+        steps (Generator): the routine's generator.
+        on_done (Callable): optional, called with the task once the
+            generator is exhausted or has raised.
+
+    Returns:
+        None.
+    """
+    def __init__(self, name: str, steps: Generator[float, None, None],
+                    on_done: Optional[Callable] = None) -> None:
+        self.name = name
+        self.steps = steps
+        self.on_done = on_done
+
+        self.done = threading.Event()
+        self.error = None
+
+        self.wakeups = 0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+
+    def record_lateness(self, lateness: float) -> None:
+        """Keeps track of how far past its deadline the task was resumed.
+
+        Args:
+            lateness (float): time (in seconds) past the deadline.
+
+        Returns:
+            None.
+        """
+        self.wakeups += 1
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until the task has finished.
+
+        Args:
+            timeout (float): optional maximum time (in seconds) to wait.
+
+        Returns:
+            bool: True if the task finished, False on timeout.
+        """
+        return self.done.wait(timeout)
+
+
+class Scheduler:
+    """Runs many generator-based routines concurrently on shared threads.
+
+    Args:
+        max_workers (int): size of the worker pool used to advance tasks.
+            This should be at least the number of tasks expected to block
+            on device I/O at the same time, i.e. the number of stations.
+            Defaults to 16.
+
+    Returns:
+        None.
+    """
+    def __init__(self, max_workers: int = 16) -> None:
+        self.max_workers = max_workers
+
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._pool = None
+
+    def start(self) -> None:
+        """Starts the dispatcher thread and the worker pool.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if self._running:
+            return
+
+        self._running = True
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                          thread_name_prefix="scheduler")
+        self._thread = threading.Thread(target=self._dispatch,
+                                          name="scheduler-dispatch",
+                                          daemon=True)
+        self._thread.start()
+
+    def shutdown(self) -> None:
+        """Stops the dispatcher and waits for running steps to complete.
+
+        Pending tasks are dropped without being resumed.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        if self._thread:
+            self._thread.join()
+        if self._pool:
+            self._pool.shutdown(wait=True)
+
+    def submit(self, name: str, steps: Generator[float, None, None],
+                  on_done: Optional[Callable] = None) -> ScheduledTask:
+        """Adds a routine to the scheduler, to be started immediately.
+
+        Args:
+            name (str): display name of the task.
+            steps (Generator): the routine's generator.
+            on_done (Callable): optional, called with the task once it has
+                finished or failed.
+
+        Returns:
+            ScheduledTask: handle for the submitted routine.
+        """
+        task = ScheduledTask(name, steps, on_done)
+        self._push(time.monotonic(), task)
+        return task
+
+    def _push(self, deadline: float, task: ScheduledTask) -> None:
+        """Queues a wakeup for a task and nudges the dispatcher.
+
+        Args:
+            deadline (float): time.monotonic() value at which to resume.
+            task (ScheduledTask): task to resume.
+
+        Returns:
+            None.
+        """
+        with self._condition:
+            heapq.heappush(self._heap, (deadline, next(self._counter), task))
+            self._condition.notify()
+
+    def _dispatch(self) -> None:
+        """Dispatcher loop, hands tasks to the pool as their deadlines pass.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        while True:
+            with self._condition:
+                while self._running:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+
+                    timeout = self._heap[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+
+                if not self._running:
+                    return
+
+                deadline, _, task = heapq.heappop(self._heap)
+
+            self._pool.submit(self._advance, task, deadline)
+
+    def _advance(self, task: ScheduledTask, deadline: float) -> None:
+        """Runs a task up to its next wait, then re-queues it.
+
+        Args:
+            task (ScheduledTask): task to resume.
+            deadline (float): the deadline the task was waiting for.
+
+        Returns:
+            None.
+        """
+        task.record_lateness(max(0.0, time.monotonic() - deadline))
+
+        try:
+            delay = next(task.steps)
+        except StopIteration:
+            self._finish(task)
+            return
+        except Exception as e:
+            logger.exception(f"Task {task.name} failed with error: {e}")
+            task.error = e
+            self._finish(task)
+            return
+
+        self._push(time.monotonic() + delay, task)
+
+    def _finish(self, task: ScheduledTask) -> None:
+        """Marks a task as finished and runs its callback.
+
+        Args:
+            task (ScheduledTask): the finished task.
+
+        Returns:
+            None.
+        """
+        logger.info(
+            f"Task {task.name} finished after {task.wakeups} wakeups, "
+            f"max lateness {task.max_lateness:.3f} s"
+        )
+        if task.on_done:
+            try:
+                task.on_done(task)
+            except Exception as e:
+                logger.exception(f"Callback for {task.name} failed: {e}")
+        task.done.set()
@@ -0,0 +1,11 @@
+from enum import Enum, auto
+
+
+class SystemStates(Enum):
+    """Enum values to be used with the _system_state attributes of the UI
+    and of each station.
+    """
+    DISCONNECTED = auto()
+    READY = auto()
+    RUNNING = auto()
+    STOPPING = auto()
@@ -0,0 +1,128 @@
+# Write unit tests for device discovery here
+# Tests MUST start with `test_` for pytest to find them
+
+import time
+from unittest.mock import Mock, patch
+
+from lib.services.station import discovery
+
+# Discovery opens serial.Serial itself, so these tests patch it with a
+# factory returning fake ports. A fake port answers its own protocol
+# immediately, and only times out (by sleeping) on the wrong one, the way
+# the real devices behave.
+
+PUMP_RES = b'/0`48000\x03\xff'
+METER_RES = b'GETMEAS         \r\n\r\n\rA215 pH,X51250,3.04,ABCDE,12/07/23\
+    09:30:40,---,CH-1,pH,4.61,pH,111.2, mV,25.0,C,89.1,%,M100,#1\n\r\r>'
+
+TIMEOUT = 0.2
+
+
+class FakePort:
+    """Stand-in for serial.Serial on a port with a known device.
+    """
+    def __init__(self, device: str, timeout: float) -> None:
+        self.device = device
+        self.timeout = timeout
+        self.last_cmd = b''
+
+    def reset_input_buffer(self) -> None:
+        pass
+
+    def write(self, cmd: bytes) -> int:
+        self.last_cmd = cmd
+        return len(cmd)
+
+    def read_until(self, expected: bytes) -> bytes:
+        if self.device == "pump" and self.last_cmd.startswith(b'/1'):
+            return PUMP_RES
+        if self.device == "meter" and self.last_cmd == b'GETMEAS\r':
+            return METER_RES
+        time.sleep(self.timeout)
+        return b''
+
+    def close(self) -> None:
+        pass
+
+
+def fake_serial(devices: dict):
+    """Helper to build a serial.Serial replacement for the given ports.
+    """
+    return lambda port, timeout, **kwargs: FakePort(devices[port], timeout)
+
+def test_probe_identifies_devices() -> None:
+    """Test that each kind of device is identified by its own protocol.
+    """
+    devices = {"/dev/ttyUSB0": "pump", "/dev/ttyACM0": "meter",
+               "/dev/ttyS0": "other"}
+    with patch("serial.Serial", fake_serial(devices)):
+        assert (discovery.probe_port("/dev/ttyUSB0", TIMEOUT)
+                == discovery.DeviceTypes.PUMP)
+        assert (discovery.probe_port("/dev/ttyACM0", TIMEOUT)
+                == discovery.DeviceTypes.PH_METER)
+        assert (discovery.probe_port("/dev/ttyS0", TIMEOUT)
+                == discovery.DeviceTypes.UNKNOWN)
+
+def test_unopenable_port_is_unknown() -> None:
+    """Test that a port which can't be opened is reported as unknown.
+    """
+    assert (discovery.probe_port("/dev", TIMEOUT)
+            == discovery.DeviceTypes.UNKNOWN)
+
+def test_discovery_runs_in_parallel() -> None:
+    """Test that probing many ports takes about one probe timeout rather
+    than the sum of all of them.
+    """
+    devices = {}
+    for i in range(8):
+        devices[f"/dev/ttyUSB{i}"] = "pump"
+        devices[f"/dev/ttyACM{i}"] = "meter"
+
+    with patch("serial.Serial", fake_serial(devices)):
+        started = time.monotonic()
+        found = discovery.discover_devices(list(devices), TIMEOUT)
+        elapsed = time.monotonic() - started
+
+    assert sum(t == discovery.DeviceTypes.PUMP for t in found.values()) == 8
+    assert sum(t == discovery.DeviceTypes.PH_METER for t in found.values()) == 8
+    assert elapsed < 2 * TIMEOUT
+
+def test_connect_devices_in_parallel() -> None:
+    """Test that pumps and meters are connected concurrently and the
+    outcome is reported per port.
+    """
+    def slow_open(port):
+        time.sleep(TIMEOUT)
+        return True
+
+    pumps = {}
+    for i in range(4):
+        pump = Mock()
+        pump.open_serial_port = Mock(side_effect=slow_open)
+        pump.initialize_pump = Mock(return_value={"host_ready": i != 0})
+        pumps[f"/dev/ttyUSB{i}"] = pump
+
+    meter = Mock()
+    meter.open_serial_port = Mock(side_effect=slow_open)
+
+    started = time.monotonic()
+    connected = discovery.connect_devices(pumps, {"/dev/ttyACM0": meter})
+    elapsed = time.monotonic() - started
+
+    assert connected["/dev/ttyUSB0"] is False
+    assert all(connected[f"/dev/ttyUSB{i}"] for i in range(1, 4))
+    assert connected["/dev/ttyACM0"] is True
+    assert elapsed < 3 * TIMEOUT
+
+def test_ports_sorted_by_number() -> None:
+    """Test that ports are paired in numeric order, so the tenth pump
+    isn't paired with the third meter.
+    """
+    ports = [f"/dev/ttyUSB{i}" for i in range(12)]
+    ports += [f"/dev/ttyACM{i}" for i in range(12)]
+    ordered = sorted(ports, key=discovery.port_sort_key)
+    assert ordered[:3] == ["/dev/ttyACM0", "/dev/ttyACM1", "/dev/ttyACM2"]
+    assert ordered[11] == "/dev/ttyACM11"
+    assert ordered[-1] == "/dev/ttyUSB11"
+    assert sorted(["COM10", "COM9"], key=discovery.port_sort_key) == \
+        ["COM9", "COM10"]
@@ -0,0 +1,126 @@
+# Write unit tests for station management here
+# Tests MUST start with `test_` for pytest to find them
+
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from lib.services.station import manager
+from lib.services.titration import protocol, routine
+
+PH_READINGS = [8.0, 3.75, 3.65, 3.55, 3.45, 3.35, 3.25, 3.15, 3.05, 2.95]
+
+
+def make_station(name: str, tmp_path) -> manager.Station:
+    """Helper to build a station with mocked, connected devices.
+    """
+    pump = Mock()
+    pump.open_serial_port = Mock(return_value=True)
+    pump.initialize_pump = Mock(return_value={"host_ready": True})
+    pump.get_syringe_position = Mock(return_value=48000)
+    pump.liters_to_steps = Mock(side_effect=lambda v: int(v / 5.1625e-8))
+
+    meter = Mock()
+    meter.open_serial_port = Mock(return_value=True)
+    meter.get_measurement = Mock(side_effect=[
+        {"pH": str(ph), "mV": str(round((7 - ph) * 59.16, 1)), "temp": "25.0"}
+        for ph in PH_READINGS
+    ])
+
+    station = manager.Station(name, pump, meter, log_dir=str(tmp_path),
+                              results_dir=str(tmp_path / "results"))
+    assert station.connect("/dev/ttyUSB0", "/dev/ttyACM0")
+    return station
+
+def test_stations_run_concurrently(tmp_path, monkeypatch) -> None:
+    """Test that several stations run their titrations at once, each
+    writing its own results and log file.
+    """
+    monkeypatch.setattr(routine.TitrationRoutine, "dose_wait", 0.01)
+    monkeypatch.setattr(routine.TitrationRoutine, "equilibration_wait", 0)
+
+    station_manager = manager.StationManager()
+    for i in range(4):
+        station_manager.add_station(make_station(f"station-{i}", tmp_path))
+
+    tasks = [station_manager.start(name, 100.0, 35.0, 0.1)
+             for name in station_manager.stations]
+    for task in tasks:
+        assert task.wait(timeout=10)
+    station_manager.shutdown()
+
+    for station in station_manager.stations.values():
+        result = station.results.get_nowait()
+        assert result["error"] is None
+        assert result["total_alkalinity"] > 0
+        assert (tmp_path / "results" / station.name).is_dir()
+        assert station.state == manager.SystemStates.READY
+
+    assert len(list(tmp_path.glob("station-*.log"))) == 4
+
+def test_duplicate_station_rejected(tmp_path) -> None:
+    """Test that station names must be unique.
+    """
+    station_manager = manager.StationManager()
+    station_manager.add_station(make_station("a", tmp_path))
+    with pytest.raises(ValueError):
+        station_manager.add_station(make_station("a", tmp_path))
+
+def test_start_requires_ready_station(tmp_path) -> None:
+    """Test that a station which isn't connected can't be started.
+    """
+    station = manager.Station("a", Mock(), Mock(), log_dir=str(tmp_path))
+    with pytest.raises(RuntimeError):
+        station.start(Mock(), 100.0, 35.0, 0.1)
+
+def test_load_station_config(tmp_path) -> None:
+    """Test that a station configuration file is read and validated.
+    """
+    config = [{"name": "a", "pump_port": "/dev/ttyUSB0",
+               "meter_port": "/dev/ttyACM0"}]
+    filepath = tmp_path / "stations.json"
+    filepath.write_text(json.dumps(config))
+    assert manager.load_station_config(str(filepath)) == config
+
+    filepath.write_text(json.dumps([{"name": "a"}]))
+    with pytest.raises(ValueError):
+        manager.load_station_config(str(filepath))
+
+def test_build_manager_station_protocols(tmp_path, monkeypatch) -> None:
+    """Test that stations follow the protocol profile of their entry, and
+    the given protocol otherwise.
+    """
+    monkeypatch.chdir(tmp_path)
+    fast = protocol.TitrationProtocol(4.0, 3.1, 0.2, 3.7)
+    protocol.save_protocol("fast.json", fast)
+    coarse = protocol.TitrationProtocol(ph_step=0.15)
+
+    config = [{"name": "a", "pump_port": "/dev/ttyUSB0",
+               "meter_port": "/dev/ttyACM0", "protocol": "fast.json"},
+              {"name": "b", "pump_port": "/dev/ttyUSB1",
+               "meter_port": "/dev/ttyACM1"}]
+    station_manager = manager.build_manager(config, coarse)
+    try:
+        assert station_manager.stations["a"].protocol == fast
+        assert station_manager.stations["b"].protocol == coarse
+    finally:
+        station_manager.shutdown()
+
+def test_discard_interrupted_runs(tmp_path) -> None:
+    """Test that declining a resume removes every checkpoint of the
+    station, and accepting one keeps only that one.
+    """
+    station = make_station("station-1", tmp_path)
+    results_dir = tmp_path / "results" / "station-1"
+    results_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(3):
+        (results_dir / f"run-{i}.csv.checkpoint").write_text("{}")
+
+    newest = station.find_interrupted_run()
+    station.discard_interrupted_runs(keep=newest)
+    assert station.find_interrupted_run() == newest
+    assert len(list(results_dir.glob("*.checkpoint"))) == 1
+
+    station.discard_interrupted_runs()
+    assert station.find_interrupted_run() is None
@@ -0,0 +1,72 @@
+# Write unit tests for the shared scheduler here
+# Tests MUST start with `test_` for pytest to find them
+
+import time
+
+from lib.services.station.scheduler import Scheduler
+
+
+def sleeper(delays: list, log: list, name: str):
+    """Helper routine that records when it is resumed.
+    """
+    for delay in delays:
+        log.append((name, time.monotonic()))
+        yield delay
+
+def test_tasks_run_concurrently() -> None:
+    """Test that waits of different tasks overlap rather than add up.
+    """
+    scheduler = Scheduler(max_workers=4)
+    scheduler.start()
+
+    log = []
+    started = time.monotonic()
+    tasks = [scheduler.submit(f"t{i}", sleeper([0.1, 0.1], log, f"t{i}"))
+             for i in range(4)]
+    for task in tasks:
+        assert task.wait(timeout=5)
+    elapsed = time.monotonic() - started
+    scheduler.shutdown()
+
+    assert len(log) == 8
+    # Sequential execution would take 0.8 s
+    assert elapsed < 0.6
+
+def test_blocking_task_does_not_delay_others() -> None:
+    """Test that a task blocking inside a step (e.g. on serial I/O) does
+    not hold up the deadlines of other tasks.
+    """
+    scheduler = Scheduler(max_workers=4)
+    scheduler.start()
+
+    def blocker():
+        time.sleep(0.5)
+        yield 0
+
+    slow = scheduler.submit("slow", blocker())
+    fast = scheduler.submit("fast", sleeper([0.05] * 4, [], "fast"))
+
+    assert fast.wait(timeout=5)
+    assert not slow.done.is_set()
+    assert fast.max_lateness < 0.1
+    assert slow.wait(timeout=5)
+    scheduler.shutdown()
+
+def test_task_error_is_recorded() -> None:
+    """Test that an exception in a routine finishes its task with the
+    error attached and calls the done callback.
+    """
+    scheduler = Scheduler(max_workers=2)
+    scheduler.start()
+
+    def failing():
+        yield 0
+        raise ValueError("bad response")
+
+    done = []
+    task = scheduler.submit("failing", failing(), on_done=done.append)
+    assert task.wait(timeout=5)
+    scheduler.shutdown()
+
+    assert isinstance(task.error, ValueError)
+    assert done == [task]
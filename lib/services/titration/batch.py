@@ -0,0 +1,422 @@
+import csv
+import logging
+import os
+import sqlite3
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Generator, List, Optional, Tuple
+
+from lib.services.ph.ph_interface import pHInterface
+from lib.services.pump.pump_interface import PumpInterface
+from lib.services.titration import recovery, results, routine, store
+from lib.utils import clocks
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Sample manifest #####
+
+A csv file with a header row and one sample per row, run in file order:
+
+sample_id,sample_mass_g,salinity,acid_conc_M
+CRM-205,100.12,33.4,0.1
+STN4-10m,99.87,34.9,0.1
+
+##### Pipelining between samples #####
+
+As soon as the last step of a sample has been measured, its analysis and
+data writing are handed to a background thread, and the pump immediately
+starts washing and refilling the syringe for the next sample. The wash
+empties into the vessel of the sample that just finished, so the next
+sample must only be presented once its titration starts (i.e. when
+on_sample_start is called).
+"""
+
+MANIFEST_HEADER = ["sample_id", "sample_mass_g", "salinity", "acid_conc_M"]
+
+
+class Sample:
+    """Parameters of one queued sample.
+
+    Args:
+        sample_id (str): identifier of the sample, used in result filenames.
+        sample_mass (float): mass (in grams) of the sample.
+        salinity (float): salinity (in PSU) of the sample.
+        acid_conc (float): concentration (in moles/l) of the acid titrant.
+
+    Returns:
+        None.
+    """
+    def __init__(self, sample_id: str, sample_mass: float, salinity: float,
+                    acid_conc: float) -> None:
+        self.sample_id = sample_id
+        self.sample_mass = sample_mass
+        self.salinity = salinity
+        self.acid_conc = acid_conc
+
+    def __repr__(self) -> str:
+        return (f"Sample({self.sample_id!r}, {self.sample_mass}, "
+                f"{self.salinity}, {self.acid_conc})")
+
+
+def load_manifest(filepath: str) -> List[Sample]:
+    """Reads a sample manifest, see the example above.
+
+    Args:
+        filepath (str): location of the csv manifest.
+
+    Returns:
+        list: the samples, in file order.
+    """
+    samples = []
+    with open(filepath, newline="") as f:
+        reader = csv.DictReader(f)
+        missing = set(MANIFEST_HEADER) - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Manifest is missing columns: {sorted(missing)}")
+
+        for row in reader:
+            samples.append(Sample(
+                row["sample_id"].strip(), float(row["sample_mass_g"]),
+                float(row["salinity"]), float(row["acid_conc_M"])
+            ))
+    return samples
+
+
+class SampleQueue:
+    """Runs queued samples back-to-back on one pump/pH meter pair.
+
+    Like TitrationRoutine, the queue is run by iterating over the generator
+    returned by run(), so it can be driven by the UI or a scheduler. A
+    sample that fails (e.g. on a bad serial response) is recorded as failed
+    and the batch moves on to the next one.
+
+    Args:
+        pump (PumpInterface): connected pump used to dose the acid.
+        ph_meter (pHInterface): connected meter used to take readings.
+        results_dir (str): directory for the result files. Defaults to the
+            current working directory, same as single runs.
+        wash (bool): if True, the syringe is washed before being refilled
+            between samples. Defaults to True.
+        on_sample_start (Callable): optional, called with the sample and
+            its routine when its titration starts.
+        on_sample_done (Callable): optional, called with the per-sample
+            record (see get_records) once its data has been written.
+        store (ResultStore): optional, store every finished sample is
+            added to.
+        clock (Clock): clock of the devices, used to time the samples and
+            passed to every routine. Defaults to real time.
+        **routine_kwargs: callbacks passed through to every TitrationRoutine.
+
+    Returns:
+        None.
+    """
+    def __init__(self, pump: PumpInterface, ph_meter: pHInterface,
+                    results_dir: str = ".", wash: bool = True,
+                    on_sample_start: Optional[Callable] = None,
+                    on_sample_done: Optional[Callable[[dict], None]] = None,
+                    store: Optional[store.ResultStore] = None,
+                    clock: clocks.Clock = clocks.REAL_CLOCK,
+                    **routine_kwargs) -> None:
+        self.pump = pump
+        self.ph_meter = ph_meter
+        self.results_dir = results_dir
+        self.wash = wash
+
+        self.on_sample_start = on_sample_start
+        self.on_sample_done = on_sample_done
+        self.store = store
+        self.clock = clock
+        self.routine_kwargs = routine_kwargs
+
+        self.pending = deque()
+        self.records: List[dict] = []
+        self.routine = None
+
+        self._stop_queue = False
+        self._started_at = None
+        self._finished_at = None
+
+    def add(self, sample: Sample) -> None:
+        """Adds a sample to the end of the queue.
+
+        Args:
+            sample (Sample): the sample to add.
+
+        Returns:
+            None.
+        """
+        self.pending.append(sample)
+
+    def extend(self, samples: List[Sample]) -> None:
+        """Adds several samples to the end of the queue.
+
+        Args:
+            samples (list): the samples to add, in order.
+
+        Returns:
+            None.
+        """
+        self.pending.extend(samples)
+
+    def stop(self) -> None:
+        """Stops the current sample before its next step, and the batch
+        after it.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        self._stop_queue = True
+        if self.routine:
+            self.routine.stop()
+
+    def run(self) -> Generator[float, None, None]:
+        """Runs every queued sample in order, including samples added while
+        the batch is running.
+
+        Args:
+            None.
+
+        Yields:
+            float: time (in seconds) to wait before resuming the queue.
+
+        Returns:
+            None.
+        """
+        self._started_at = self.clock.monotonic()
+        prefilled = False
+
+        with ThreadPoolExecutor(max_workers=1,
+                                thread_name_prefix="batch-writer") as pool:
+            while self.pending and not self._stop_queue:
+                sample = self.pending.popleft()
+                record = self._new_record(sample)
+
+                filepath = os.path.join(
+                    self.results_dir,
+                    f"{results.default_filename()}_{sample.sample_id}.csv"
+                )
+                self.routine = routine.TitrationRoutine(
+                    self.pump, self.ph_meter, sample.sample_mass,
+                    sample.salinity, sample.acid_conc, prefilled=prefilled,
+                    defer_analysis=True,
+                    journal=results.StepJournal(filepath),
+                    checkpoint=recovery.Checkpoint(filepath),
+                    clock=self.clock, **self.routine_kwargs
+                )
+                if self.on_sample_start:
+                    self.on_sample_start(sample, self.routine)
+
+                try:
+                    yield from self.routine.run()
+                except Exception as e:
+                    logger.exception(f"Sample {sample.sample_id} failed: {e}")
+                    # A failed run isn't offered for resuming, which could
+                    # dose on a bad reading; its journal keeps the data
+                    self.routine.checkpoint.clear()
+                    self._close_record(record, status="failed", error=str(e))
+                    prefilled = False
+                    continue
+
+                if self.routine.stopped:
+                    self._close_record(record, status="stopped")
+                    break
+
+                # The analysis and file writing of this sample overlap with
+                # the syringe prep for the next one. The sample's time ends
+                # with its last measurement, not with the writing.
+                pending_write = (
+                    pool.submit(self._finalize, self.routine, sample),
+                    record, self.clock.monotonic()
+                )
+
+                if self.pending and not self._stop_queue:
+                    try:
+                        yield from self.prepare_syringe()
+                        prefilled = True
+                    except Exception as e:
+                        logger.exception(f"Syringe prep failed: {e}")
+                        prefilled = False
+
+                self._collect(pending_write)
+
+        self.routine = None
+        self._finished_at = self.clock.monotonic()
+        logger.info(f"Batch finished: {self.get_throughput()}")
+
+    def prepare_syringe(self) -> Generator[float, None, None]:
+        """Washes (optionally) and refills the syringe without blocking the
+        caller while the pump moves.
+
+        Args:
+            None.
+
+        Yields:
+            float: time (in seconds) to wait before checking the pump again.
+
+        Returns:
+            None.
+        """
+        cycles = self.pump.wash_cycles if self.wash else 0
+        for _ in range(cycles):
+            self.pump.fill()
+            yield from self.routine.wait_for_pump()
+            self.pump.empty()
+            yield from self.routine.wait_for_pump()
+
+        self.pump.fill()
+        yield from self.routine.wait_for_pump()
+
+    def get_records(self) -> List[dict]:
+        """Returns the per-sample records of the batch so far.
+
+        Each record holds sample_id, status (running, done, failed or
+        stopped), started_at and finished_at (clock.monotonic() values),
+        duration_s, total_alkalinity, filepath and error.
+
+        Args:
+            None.
+
+        Returns:
+            list: one dict per sample that has been started.
+        """
+        return self.records
+
+    def get_throughput(self) -> dict:
+        """Summarizes the throughput of the batch so far.
+
+        Args:
+            None.
+
+        Returns:
+            dict: {"completed": (int), "failed": (int), "elapsed_s": (float),
+                "samples_per_hour": (float), "mean_sample_s": (float)}
+        """
+        done = [r for r in self.records if r["status"] == "done"]
+        failed = [r for r in self.records if r["status"] == "failed"]
+
+        elapsed = 0.0
+        if self._started_at is not None:
+            end = self._finished_at
+            if end is None:
+                end = self.clock.monotonic()
+            elapsed = end - self._started_at
+
+        samples_per_hour = len(done) / elapsed * 3600 if elapsed > 0 else 0.0
+        mean_sample = (sum(r["duration_s"] for r in done) / len(done)
+                       if done else 0.0)
+
+        return {"completed": len(done), "failed": len(failed),
+                "elapsed_s": elapsed, "samples_per_hour": samples_per_hour,
+                "mean_sample_s": mean_sample}
+
+    def _new_record(self, sample: Sample) -> dict:
+        """Starts the record of a sample.
+
+        Args:
+            sample (Sample): the sample being started.
+
+        Returns:
+            dict: the new record, see get_records.
+        """
+        record = {"sample_id": sample.sample_id, "status": "running",
+                  "started_at": self.clock.monotonic(), "finished_at": None,
+                  "duration_s": None, "total_alkalinity": None,
+                  "filepath": None, "error": None}
+        self.records.append(record)
+        return record
+
+    def _close_record(self, record: dict, status: str,
+                         error: Optional[str] = None,
+                         finished_at: Optional[float] = None) -> None:
+        """Completes the record of a sample.
+
+        Args:
+            record (dict): the record to complete.
+            status (str): final status of the sample.
+            error (str): optional error message.
+            finished_at (float): optional clock.monotonic() value at which
+                the sample finished. Defaults to now.
+
+        Returns:
+            None.
+        """
+        record["status"] = status
+        record["error"] = error
+        if finished_at is None:
+            finished_at = self.clock.monotonic()
+        record["finished_at"] = finished_at
+        record["duration_s"] = record["finished_at"] - record["started_at"]
+        logger.info(
+            f"Sample {record['sample_id']} {status} after "
+            f"{record['duration_s']:.1f} s"
+        )
+        if self.on_sample_done:
+            self.on_sample_done(record)
+
+    def _finalize(self, titration_routine: routine.TitrationRoutine,
+                     sample: Sample) -> Tuple[float, str]:
+        """Runs the calculations and writes the data of a finished sample.
+        Called on the background writer thread.
+
+        Args:
+            titration_routine (TitrationRoutine): the sample's routine.
+            sample (Sample): the finished sample.
+
+        Returns:
+            tuple containing:
+             - float: estimated total alkalinity.
+             - str: location of the result file.
+        """
+        total_alkalinity, gamma, rsq = titration_routine.finish_titration()
+
+        with titration_routine.timer.span("write"):
+            filepath = titration_routine.journal.finalize(
+                titration_routine.titration, total_alkalinity
+            )
+
+        if self.store:
+            try:
+                self.store.add_run(
+                    titration_routine.titration, total_alkalinity,
+                    gamma=gamma, rsq=rsq, sample_id=sample.sample_id,
+                    started_at=titration_routine.started_at,
+                    filepath=filepath,
+                    timings=titration_routine.timer.summary(),
+                    protocol=titration_routine.protocol.to_dict()
+                )
+            except (ValueError, sqlite3.Error) as e:
+                logger.error(f"Storing sample {sample.sample_id} failed "
+                             f"with error: {e}")
+        return total_alkalinity, filepath
+
+    def _collect(self, pending_write: Optional[Tuple[Future, dict,
+                                                      float]]) -> None:
+        """Waits for a background finalize job, if any, and completes the
+        sample's record on the caller's thread.
+
+        Args:
+            pending_write (tuple): the job, the sample's record, and the
+                clock.monotonic() value of its last measurement.
+
+        Returns:
+            None.
+        """
+        if pending_write is None:
+            return
+
+        future, record, finished_at = pending_write
+        try:
+            total_alkalinity, filepath = future.result()
+        except Exception as e:
+            logger.exception(f"Sample {record['sample_id']} failed: {e}")
+            self._close_record(record, status="failed", error=str(e),
+                               finished_at=finished_at)
+            return
+
+        record["total_alkalinity"] = total_alkalinity
+        record["filepath"] = filepath
+        self._close_record(record, status="done", finished_at=finished_at)
@@ -0,0 +1,203 @@
+import logging
+from typing import Generator, List, Tuple
+
+from lib.services.titration import routine
+from lib.services.titration.routine import TitrationPhases
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Continuous-dosing titration #####
+
+TitrationRoutine doses, waits and measures at every step of the second
+titration, so most of a run is spent waiting on the electrode.
+ContinuousTitrationRoutine runs the initial titration the same way, then
+does the second titration in one slow dispense: the plunger speed is set
+so the acid needed to get below the second target goes in over
+dispense_time seconds, and the meter is read over and over while it does.
+
+The syringe position is queried right before and right after each reading,
+and the volume of the reading is interpolated between the two at the time
+the reading was taken, i.e. reading_lag seconds before the meter answered,
+or before it came in if the meter stamps its readings with a time (as
+streamed readings are).
+Every reading is kept in readings as a (time, volume, emf, pH) tuple, with
+the time from the routine's clock and the total volume dosed, and is also
+added to the titration as a step, so the curve is fitted at the end like a
+stepwise one (see finish_titration and GranAnalysis).
+
+The meter should be in its continuous read mode, so it answers with the
+current reading rather than waiting for it to settle, or streaming (see
+orion_star.py), which also saves the GETMEAS round trip. The readings lag
+the acid by the electrode's response time, so the dispense should be slow
+compared to it; the emf analysis doesn't mind the readings being closer
+together than the meter's pH resolution. A stop request takes effect once
+the dispense is over. However the dispense ends, the plunger is set back to
+the speed it had before once it has stopped.
+
+Usage:
+    routine = ContinuousTitrationRoutine(pump, ph_meter, 100.0, 35.0, 0.1,
+                                         dispense_time=120.0)
+    clock.run(routine.run())
+"""
+
+
+class ContinuousTitrationRoutine(routine.TitrationRoutine):
+    """Runs the second titration as one slow dispense, see above.
+
+    Args:
+        *args: TitrationRoutine arguments.
+        dispense_time (float): time (in seconds) the second titration's
+            acid takes to go in. Defaults to 120.
+        reading_lag (float): time (in seconds) between the meter taking a
+            reading and answering with it. Defaults to 0.
+        **kwargs: other TitrationRoutine arguments.
+
+    Returns:
+        None.
+    """
+    # pH below the second target the dispense aims for, so the run ends
+    # past it even if the estimate of the required acid is a little short
+    ph_overshoot = 0.05
+
+    # Interval (in seconds) between the end of a reading and the next one
+    reading_interval = 0.0
+
+    def __init__(self, *args, dispense_time: float = 120.0,
+                    reading_lag: float = 0.0, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if dispense_time <= 0:
+            raise ValueError(f"Invalid dispense time {dispense_time}.")
+        self.dispense_time = dispense_time
+        self.reading_lag = reading_lag
+        self.readings: List[Tuple[float, float, float, float]] = []
+
+    def auto_titration(self) -> Generator[float, None, None]:
+        """Dispenses the acid of the second titration slowly, reading the
+        meter until the dispense is over.
+
+        Args:
+            None.
+
+        Yields:
+            float: time (in seconds) to wait before resuming the routine.
+
+        Returns:
+            None.
+        """
+        self.phase = TitrationPhases.AUTO
+
+        last_ph = self.titration.get_last_ph()
+        if last_ph <= self.protocol.second_ph_target:
+            self.log.info("Titration finished.")
+            self.log.info("Final pH: %s", last_ph)
+            return
+
+        with self.timer.span("compute"):
+            volume = self.titration.calc_required_acid_vol(
+                self.protocol.second_ph_target - self.ph_overshoot
+            )
+
+        yield from self.make_room(volume)
+        # The plunger speed is only taken while the pump is idle
+        yield from self.wait_for_pump()
+
+        steps = self.pump.liters_to_steps(volume)
+        speed = min(max(round(steps / self.dispense_time), 1),
+                    self.pump.plunger_speed_max)
+
+        with self.timer.span("dose"):
+            self.log.info("Dispensing: %s uL over %s s",
+                          round(volume * 1e6, 2), steps / speed)
+            start = self.pump.get_syringe_position()
+            start_volume = self.titration.get_last_volume()
+            previous_speed = self.pump.plunger_speed
+            self.pump.set_plunger_speed(speed)
+
+        try:
+            with self.timer.span("dose"):
+                self.pump.dispense(volume)
+                self.set_status("Dosing continuously...")
+
+            yield from self.read_during_dispense(start, start_volume)
+        finally:
+            self.restore_plunger_speed(previous_speed)
+
+        self.sync_syringe_position()
+        self.set_status("Titration in progress")
+        self.log.info("Titration finished with %d readings.",
+                      len(self.readings))
+        self.log.info("Final pH: %s", self.titration.get_last_ph())
+
+    def restore_plunger_speed(self, speed: int) -> None:
+        """Sets the plunger back to its speed before the dispense. If the
+        dispense was cut short the plunger may still be moving, and the
+        pump only takes the speed while idle, so this blocks until it
+        stops; the routine is over by then, so there is nothing to yield
+        to.
+
+        Args:
+            speed (int): speed (in steps/second) to set.
+
+        Returns:
+            None.
+        """
+        while not self.pump.check_module_ready():
+            self.clock.sleep(self.pump_poll_interval)
+        self.pump.set_plunger_speed(speed)
+
+    def read_during_dispense(self, start: int, start_volume: float
+                               ) -> Generator[float, None, None]:
+        """Reads the meter until the dispense is over, recording every
+        reading as a step at the volume interpolated from the syringe
+        positions around it. The last reading is taken after the plunger
+        has stopped.
+
+        Args:
+            start (int): syringe position (in steps) the dispense started
+                from.
+            start_volume (float): total volume (in liters) dosed before
+                the dispense.
+
+        Yields:
+            float: time (in seconds) to wait before the next reading.
+
+        Returns:
+            None.
+        """
+        liters_per_step = self.pump.liters_per_step
+        dispensed = False
+        while not dispensed:
+            dispensed = self.pump.check_module_ready()
+
+            before = self.pump.get_syringe_position()
+            t_before = self.clock.monotonic()
+            reading = self.get_phmeter_reading()
+            t_after = self.clock.monotonic()
+            wall_after = self.clock.time()
+            after = self.pump.get_syringe_position()
+            pH, emf = float(reading["pH"]), float(reading["mV"])
+
+            # A streamed reading may have come in before the meter call
+            # returned it
+            t_received = t_after
+            if "time" in reading:
+                t_received -= max(wall_after - reading["time"], 0.0)
+
+            # The plunger moves at a constant speed, so the position is
+            # linear in time between the two queries
+            t_reading = max(t_received - self.reading_lag, t_before)
+            fraction = ((t_reading - t_before) / (t_after - t_before)
+                        if t_after > t_before else 1.0)
+            position = before + (after - before) * fraction
+            volume = start_volume + (start - position) * liters_per_step
+
+            self.readings.append(
+                (wall_after - (t_after - t_reading), volume, emf, pH)
+            )
+            self.log.debug("Volume: %s L, pH: %s, emf: %s", volume, pH, emf)
+            self.record_step(pH, emf, volume - self.titration.get_last_volume())
+            self.report_step()
+
+            if not dispensed:
+                yield self.reading_interval
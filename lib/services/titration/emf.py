@@ -0,0 +1,248 @@
+import logging
+from typing import Optional, Tuple
+
+import numpy as np
+
+from lib.services.titration import forward, gran
+from lib.utils import diagnostics, regression
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Emf-based Gran analysis #####
+
+gran_polynomial_fit works from the pH the meter reports, which it rounds
+to two decimals and derives from its own stored calibration. The emf is
+read to 0.1 mV, i.e. about 0.002 pH, and doesn't depend on the meter's
+calibration, so this analysis works from the emf alone. The electrode
+follows
+
+    E = E0 - s * pH,
+
+with E0 and the Nernst slope s estimated from the run itself:
+
+1. For a trial alkalinity, the forward model (see forward.py) predicts the
+   pH of every step in the Gran region. E0 and s are then the linear
+   regression of the emf on those pH, and the alkalinity is the one with
+   the smallest emf residual. The residual is minimized on a grid that is
+   refined ZOOMS times around the best point.
+2. With E0 and s, [H+] = 10^((E - E0) / s) at every step, and the modified
+   Gran function
+
+       y = (m + V) * ([H+] - KW / [H+]) - carbonate - borate
+
+   i.e. the acid in excess of what the carbonate, borate and water systems
+   still hold, is linear in V, with slope C and root Veq. Its linear fit
+   gives the alkalinity, gamma and R-squared, like gran_polynomial_fit.
+
+Only the steps in the Gran region are used: there the carbonate is
+nearly all CO2, so the model doesn't depend on the DIC it assumes, which
+the steps above would. The region is still chosen by the pH reported,
+which the rounding doesn't matter for. At least three steps are needed,
+for E0, s and the alkalinity (two with s fixed, see below):
+
+    total_alkalinity, gamma, rsq = emf_gran_fit(titration)
+
+The Gran region covers less than a pH unit, so a run's own slope is less
+certain than its E0. For noisy or short runs, the slope can be fixed
+instead, e.g. to the Nernst slope at the sample's temperature, leaving
+only E0 to estimate:
+
+    nernst = NERNST_MV_PER_K * titration.temp_K
+    total_alkalinity, gamma, rsq = emf_gran_fit(titration, slope=nernst)
+"""
+
+# Nernst slope (in mV per pH unit) per kelvin, i.e. 1000 * R * ln(10) / F
+NERNST_MV_PER_K = 0.198416
+
+# Alkalinity grid of each refinement, and number of refinements; each one
+# narrows the grid to 4 of its points
+GRID_POINTS = 64
+ZOOMS = 6
+
+# Estimated slopes further than this (as a fraction) from the Nernst slope
+# are logged as suspect
+SLOPE_TOLERANCE = 0.05
+
+
+def calc_H_from_emf(emfs: np.ndarray, e0: float, slope: float) -> np.ndarray:
+    """Calculates the hydrogen ion concentration from the emf.
+
+    Args:
+        emfs (np.ndarray): emf (in mV) of each step.
+        e0 (float): standard potential (in mV) of the electrode.
+        slope (float): slope (in mV per pH unit) of the electrode.
+
+    Returns:
+        np.ndarray: hydrogen ion concentration at each step.
+    """
+    return np.power(10, (np.asarray(emfs) - e0) / slope)
+
+
+def model_emf_fit(titration: gran.ModifiedGranTitration,
+                    volumes: np.ndarray, emfs: np.ndarray,
+                    total_alkalinity: np.ndarray,
+                    slope: Optional[float] = None) -> Tuple[np.ndarray,
+                                                            np.ndarray,
+                                                            np.ndarray]:
+    """Fits E0 and the slope to the emf for trial alkalinities, see step 1
+    above.
+
+    Args:
+        titration (ModifiedGranTitration): titration holding the sample's
+            constants.
+        volumes (np.ndarray): total volume (in liters) at each step.
+        emfs (np.ndarray): emf (in mV) at each step.
+        total_alkalinity (np.ndarray): trial alkalinities (in mol/kg).
+        slope (float): optional, slope (in mV per pH unit) to use instead
+            of fitting it.
+
+    Returns:
+        tuple containing:
+         - np.ndarray: E0 (in mV) for each trial alkalinity.
+         - np.ndarray: slope (in mV per pH unit) for each.
+         - np.ndarray: sum of squared emf residuals for each.
+    """
+    phs = forward.forward_ph(
+        volumes, total_alkalinity, titration.DIC,
+        titration.BT, titration.K1, titration.K2, titration.KB,
+        titration.KW, titration.sample_mass_kg * 1000,
+        titration.acid_conc_M
+    )
+    ph_centered = phs - phs.mean(axis=1, keepdims=True)
+    emf_centered = emfs - emfs.mean()
+
+    if slope is None:
+        slopes = -(ph_centered @ emf_centered) / np.sum(ph_centered**2,
+                                                        axis=1)
+    else:
+        slopes = np.full(phs.shape[0], float(slope))
+    e0s = emfs.mean() + slopes * phs.mean(axis=1)
+    residuals = emf_centered + slopes[:, np.newaxis] * ph_centered
+    return e0s, slopes, np.sum(residuals**2, axis=1)
+
+
+def estimate_electrode(titration: gran.ModifiedGranTitration,
+                         ph_cutoff: float = gran.GRAN_PH_CUTOFF,
+                         slope: Optional[float] = None
+                         ) -> Tuple[float, float]:
+    """Estimates E0 and the slope of the electrode from the steps in the
+    Gran region, see step 1 above.
+
+    Args:
+        titration (ModifiedGranTitration): the titration.
+        ph_cutoff (float): highest pH to include. Defaults to
+            GRAN_PH_CUTOFF.
+        slope (float): optional, slope (in mV per pH unit) to use instead
+            of estimating it.
+
+    Returns:
+        tuple containing:
+         - float: E0 (in mV).
+         - float: slope (in mV per pH unit).
+
+    Raises:
+        ValueError: if there are fewer than three steps in the Gran region,
+            or two with the slope given.
+    """
+    gran_region = titration.ph_array <= ph_cutoff
+    volumes = titration.volume_array[gran_region].astype(float)
+    emfs = titration.emf_array[gran_region].astype(float)
+    needed = 3 if slope is None else 2
+    if volumes.size < needed:
+        raise ValueError(f"Emf analysis needs at least {needed} steps under "
+                         f"pH {ph_cutoff}, not {volumes.size}.")
+
+    # Every step in the region is past the equivalence point
+    highest = volumes.min() * titration.acid_conc_M / titration.sample_mass_kg
+    low, high = 0.5 * highest, highest
+    for _ in range(ZOOMS):
+        grid = np.linspace(low, high, GRID_POINTS)
+        e0s, slopes, sse = model_emf_fit(titration, volumes, emfs, grid,
+                                         slope)
+        best = int(np.argmin(sse))
+        low = grid[max(best - 2, 0)]
+        high = grid[min(best + 2, GRID_POINTS - 1)]
+
+    e0, fitted_slope = float(e0s[best]), float(slopes[best])
+    nernst = NERNST_MV_PER_K * titration.temp_K
+    logger.debug("E0: %s mV, slope: %s mV/pH (Nernst %s)", e0, fitted_slope,
+                 nernst)
+    if slope is None and abs(fitted_slope / nernst - 1) > SLOPE_TOLERANCE:
+        logger.warning("Electrode slope %.2f mV/pH is far from the Nernst "
+                       "slope %.2f; check the electrode.", fitted_slope, nernst)
+    return e0, fitted_slope
+
+
+def calc_modified_ygran(titration: gran.ModifiedGranTitration,
+                          H: np.ndarray, volumes: np.ndarray) -> np.ndarray:
+    """Calculates the modified Gran function, see step 2 above.
+
+    Args:
+        titration (ModifiedGranTitration): titration holding the sample's
+            constants.
+        H (np.ndarray): hydrogen ion concentration at each step.
+        volumes (np.ndarray): total volume (in liters) at each step.
+
+    Returns:
+        np.ndarray: moles of acid in excess at each step.
+    """
+    # With no alkalinity, the charge balance leaves the acid added less
+    # the excess acid
+    no_alkalinity = forward.charge_balance(
+        H, volumes, 0.0, titration.DIC, titration.BT, titration.K1,
+        titration.K2, titration.KB, titration.KW,
+        titration.sample_mass_kg * 1000, titration.acid_conc_M
+    )
+    return titration.acid_conc_M * volumes - no_alkalinity
+
+
+def emf_gran_fit(titration: gran.ModifiedGranTitration,
+                   ph_cutoff: float = gran.GRAN_PH_CUTOFF,
+                   slope: Optional[float] = None
+                   ) -> Tuple[float, float, float]:
+    """Fits the equivalence volume from the emf, see above.
+
+    Args:
+        titration (ModifiedGranTitration): the titration.
+        ph_cutoff (float): highest pH of the steps used in the fit.
+            Defaults to GRAN_PH_CUTOFF.
+        slope (float): optional, electrode slope (in mV per pH unit) to
+            use instead of estimating it from the run.
+
+    Returns:
+        tuple containing:
+         - total_alkalinity (float): estimated total alkalinity (in umol/kg).
+         - gamma (float): quality of fit metric.
+         - rsq (float): R-squared of the fit.
+
+    Raises:
+        ValueError: if there are fewer than three steps in the Gran region,
+            or two with the slope given.
+    """
+    e0, slope = estimate_electrode(titration, ph_cutoff, slope)
+
+    gran_region = titration.ph_array <= ph_cutoff
+    volumes = titration.volume_array[gran_region].astype(float)
+    H = calc_H_from_emf(titration.emf_array[gran_region], e0, slope)
+    ygran = calc_modified_ygran(titration, H, volumes)
+
+    gran_slope, intercept, _, y_model, rsq = regression.linear_regression(
+                                                                volumes, ygran)
+    gamma = gran_slope / titration.acid_conc_M
+    Veq = -1 * intercept / gran_slope
+    total_alkalinity = (Veq * titration.acid_conc_M
+                        / titration.sample_mass_kg * 1e6)
+    logger.debug("Gamma: %s, Veq: %s, TA: %s", gamma, Veq, total_alkalinity)
+
+    if diagnostics.fit_dump_enabled():
+        diagnostics.dump_fit(
+            "emf_gran_fit", ph_cutoff=ph_cutoff, volumes=volumes, ygran=ygran,
+            residuals=ygran - y_model.ravel(), e0=e0, electrode_slope=slope,
+            slope=gran_slope, intercept=intercept, rsq=rsq, gamma=gamma,
+            Veq=Veq, total_alkalinity=total_alkalinity,
+            sample_mass_kg=titration.sample_mass_kg,
+            acid_conc_M=titration.acid_conc_M
+        )
+
+    return total_alkalinity, gamma, rsq
@@ -0,0 +1,240 @@
+import logging
+from typing import Dict
+
+import numpy as np
+
+from lib.services.titration import gran
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Forward titration model #####
+
+ModifiedGranTitration works from pH to dose; this module goes the other
+way, predicting the pH after a given volume of acid has been added. The
+pH follows from the charge balance of the sample (carbonate, borate and
+water systems, with dilution by the acid):
+
+    m * TA - C * V = m * DIC * (K1*H + 2*K1*K2) / (H^2 + K1*H + K1*K2)
+                     + m * BT * KB / (KB + H)
+                     + (m + V) * (KW / H - H)
+
+with m the sample mass (in kg), V the acid volume (in liters, taken as
+kg), C the acid concentration, and H = [H+]. The right hand side only
+decreases as H goes up, so there is exactly one root, which is found for
+every point at once by a vectorized Newton iteration on H. Since H spans
+many decades, the steps are taken on ln(H). Each point keeps a bracket
+around its root, and a Newton step that would leave it is replaced by a
+bisection of the bracket, so every point converges, including near the
+equivalence point where plain Newton overshoots.
+
+Sample parameters are arrays of one value per sample (or scalars), and
+volumes are either one array shared by every sample or one row per
+sample:
+
+    constants = equilibrium_constants(salinity=[33.0, 35.0], temp=25.0)
+    phs = forward_ph(volumes, [2200e-6, 2300e-6], sample_mass=100.0,
+                     acid_conc=0.1, **constants)    # shape (2, n_volumes)
+"""
+
+# Bracket of H (in mol/kg) every root is searched in, i.e. pH 14 to -1
+H_MIN = 1e-14
+H_MAX = 10.0
+
+DEFAULT_TOLERANCE = 1e-10
+DEFAULT_MAX_ITER = 100
+
+
+def equilibrium_constants(salinity, temp) -> Dict[str, np.ndarray]:
+    """Evaluates the constants and salinity-based estimates used by
+    ModifiedGranTitration for arrays of samples.
+
+    The formulas of ModifiedGranTitration are plain numpy expressions of
+    salinity and temperature, so they are evaluated on arrays by building
+    one titration with array arguments.
+
+    Args:
+        salinity (array_like): salinity (in PSU) of each sample.
+        temp (array_like): temperature (in C) of each sample.
+
+    Returns:
+        dict: k1, k2, kb, kw, bt and dic (in mol/kg), as arrays broadcast
+            over the samples.
+    """
+    salinity, temp = np.broadcast_arrays(np.asarray(salinity, dtype=float),
+                                         np.asarray(temp, dtype=float))
+    titration = gran.ModifiedGranTitration(100.0, salinity, 0.1, temp, 8.0,
+                                           0.0)
+    return {"k1": titration.K1, "k2": titration.K2, "kb": titration.KB,
+            "kw": titration.KW, "bt": titration.BT, "dic": titration.DIC}
+
+
+def charge_balance(H: np.ndarray, volumes, total_alkalinity, dic, bt,
+                     k1, k2, kb, kw, sample_mass, acid_conc) -> np.ndarray:
+    """Evaluates the charge balance above.
+
+    Args:
+        H (array_like): hydrogen ion concentration (in mol/kg).
+        volumes, total_alkalinity, dic, bt, k1, k2, kb, kw, sample_mass,
+            acid_conc: see forward_ph; they broadcast against H.
+
+    Returns:
+        np.ndarray: moles of alkalinity left over; positive when H is below
+            the sample's actual concentration.
+    """
+    value, _ = _balance(np.asarray(H, dtype=float),
+                        *_coefficients(volumes, total_alkalinity, dic, bt,
+                                       k1, k2, kb, kw, sample_mass,
+                                       acid_conc))
+    return value
+
+
+def _coefficients(volumes, total_alkalinity, dic, bt, k1, k2, kb, kw,
+                    sample_mass, acid_conc) -> list:
+    """Folds the parameters of forward_ph into the coefficients of the
+    charge balance, which don't change while solving.
+
+    Args:
+        See forward_ph.
+
+    Returns:
+        list: carbonate and borate (in moles), k1, k1 * k2, kb, kw, total
+            mass (in kg) and net alkalinity (in moles) of each point.
+    """
+    (volumes, total_alkalinity, dic, bt, k1, k2, kb, kw, sample_mass,
+     acid_conc) = (np.asarray(p, dtype=float) for p in
+                   (volumes, total_alkalinity, dic, bt, k1, k2, kb, kw,
+                    sample_mass, acid_conc))
+    sample_mass_kg = sample_mass / 1000
+    return [sample_mass_kg * dic, sample_mass_kg * bt, k1, k1 * k2, kb, kw,
+            sample_mass_kg + volumes,
+            sample_mass_kg * total_alkalinity - acid_conc * volumes]
+
+
+def _balance(H: np.ndarray, carbonate, borate, k1, k1k2, kb, kw, total_kg,
+               net) -> tuple:
+    """Evaluates the charge balance and its derivative in ln(H).
+
+    Args:
+        H (np.ndarray): hydrogen ion concentration (in mol/kg).
+        carbonate, borate, k1, k1k2, kb, kw, total_kg, net: see
+            _coefficients.
+
+    Returns:
+        tuple containing:
+         - np.ndarray: moles of alkalinity left over.
+         - np.ndarray: derivative with respect to ln(H), always negative.
+    """
+    denom = H * (H + k1) + k1k2
+    numer = k1 * H + 2 * k1k2
+    kb_H = kb + H
+    water = kw / H
+    value = (carbonate * numer / denom + borate * kb / kb_H
+             + total_kg * (water - H) - net)
+    slope = -H * (carbonate * k1 * (H * (H + 4 * k1k2 / k1) + k1k2)
+                  / (denom * denom)
+                  + borate * kb / (kb_H * kb_H)
+                  + total_kg * (water / H + 1))
+    return value, slope
+
+
+def _initial_guess(carbonate, k1, k1k2, total_kg, net) -> np.ndarray:
+    """Estimates H from the carbonate system alone before the equivalence
+    point, and from the excess acid past it.
+
+    Args:
+        carbonate, k1, k1k2, total_kg, net: see _coefficients.
+
+    Returns:
+        np.ndarray: estimated hydrogen ion concentration (in mol/kg).
+    """
+    # Carbonate alkalinity left, as a fraction of DIC, solved for H:
+    # f * H^2 + (f - 1) * K1 * H + (f - 2) * K1 * K2 = 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        f = net / carbonate
+        b = (f - 1) * k1
+        root = (-b + np.sqrt(b * b - 4 * f * (f - 2) * k1k2)) / (2 * f)
+    H = np.where((f > 0) & (f < 2) & (root > 0), root, 1e-8)
+    H = np.maximum(H, -net / total_kg)
+    return np.clip(H, H_MIN * 10, H_MAX / 10)
+
+
+def forward_ph(volumes, total_alkalinity, dic, bt, k1, k2, kb, kw,
+                 sample_mass, acid_conc,
+                 tolerance: float = DEFAULT_TOLERANCE,
+                 max_iter: int = DEFAULT_MAX_ITER) -> np.ndarray:
+    """Predicts the pH of samples after given volumes of acid, see above.
+
+    Every sample parameter is a scalar or an array with one value per
+    sample; concentrations are in mol/kg, as returned by
+    equilibrium_constants.
+
+    Args:
+        volumes (array_like): total acid volume (in liters) added; either
+            shared by every sample (shape (n_volumes,)) or one row per
+            sample (shape (n_samples, n_volumes)).
+        total_alkalinity (array_like): total alkalinity (in mol/kg).
+        dic (array_like): dissolved inorganic carbon (in mol/kg).
+        bt (array_like): total borate (in mol/kg).
+        k1, k2, kb, kw (array_like): equilibrium constants (in mol/kg).
+        sample_mass (array_like): sample mass (in grams).
+        acid_conc (array_like): acid concentration (in moles/l).
+        tolerance (float): change of ln(H), i.e. relative change of H, at
+            which a point has converged.
+        max_iter (int): most iterations before giving up.
+
+    Returns:
+        np.ndarray: pH of every (sample, volume) pair, shape (n_samples,
+            n_volumes), or (n_volumes,) if every parameter is a scalar.
+
+    Raises:
+        ValueError: if some points have not converged after max_iter
+            iterations.
+    """
+    # Sample parameters become columns, so they broadcast along volumes
+    params = [np.asarray(p, dtype=float)[..., np.newaxis] for p in
+              (total_alkalinity, dic, bt, k1, k2, kb, kw, sample_mass,
+               acid_conc)]
+    volumes = np.asarray(volumes, dtype=float)
+    coefficients = [c.ravel() for c in
+                    np.broadcast_arrays(*_coefficients(volumes, *params))]
+
+    x = np.log(_initial_guess(*(coefficients[i] for i in (0, 2, 3, 6, 7))))
+    lo = np.full(x.size, np.log(H_MIN))
+    hi = np.full(x.size, np.log(H_MAX))
+
+    # Points are dropped from the working arrays as they converge, so a
+    # few slow ones don't cost a pass over every point
+    log_H = np.empty_like(x)
+    index = np.arange(x.size)
+
+    for _ in range(max_iter):
+        H = np.exp(x)
+        value, slope = _balance(H, *coefficients)
+
+        # The balance decreases in H, so a positive value means the root
+        # is above H
+        below = value > 0
+        lo = np.where(below, x, lo)
+        hi = np.where(below, hi, x)
+
+        newton = x - value / slope
+        x_next = np.where((newton >= lo) & (newton <= hi), newton,
+                          (lo + hi) / 2)
+
+        unconverged = np.abs(x_next - x) > tolerance
+        if not unconverged.all():
+            done = ~unconverged
+            log_H[index[done]] = x_next[done]
+            index, x_next, lo, hi = (a[unconverged]
+                                     for a in (index, x_next, lo, hi))
+            coefficients = [c[unconverged] for c in coefficients]
+        x = x_next
+        if not index.size:
+            break
+    else:
+        raise ValueError(f"Forward model did not converge for "
+                         f"{index.size} points.")
+
+    shape = np.broadcast_shapes(volumes.shape, *(p.shape for p in params))
+    return (log_H / -np.log(10)).reshape(shape)
@@ -3,10 +3,14 @@ from typing import Tuple
 
 import numpy as np
 
-from lib.utils import regression
+from lib.utils import diagnostics, regression
 
 logger = logging.getLogger(__name__)
 
+# Highest pH of the steps used in the Gran fit; below it practically all
+# carbonate alkalinity has been titrated
+GRAN_PH_CUTOFF = 3.8
+
 class ModifiedGranTitration:
     """Utility class for calculating parameters of a modified gran titration.
 
@@ -41,6 +45,68 @@ class ModifiedGranTitration:
         self.BT = self.calc_BT()
         self.DIC = self.calc_DIC()
 
+    @classmethod
+    def from_arrays(cls, sample_mass: float, salinity: float,
+                      acid_conc: float, temp: float, phs: np.ndarray,
+                      emfs: np.ndarray, volumes: np.ndarray,
+                      cumulative: bool = False) -> "ModifiedGranTitration":
+        """Builds a titration from the readings of every step at once,
+        instead of one add_step_data call per step.
+
+        The pH and emf arrays (and the volume array if cumulative) are used
+        as they are, without a copy, when they are already 1-D float64
+        arrays, so they must not be modified afterwards.
+
+        Args:
+            sample_mass (float): mass (in grams) of the sample.
+            salinity (float): salinity (in PSU) of the sample.
+            acid_conc (float): concentration (in moles/l) of the acid titrant.
+            temp (float): temperature (in C) of the sample.
+            phs (np.ndarray): pH at each step, starting with the initial
+                reading.
+            emfs (np.ndarray): emf (in mV) at each step, starting with the
+                initial reading.
+            volumes (np.ndarray): volume (in liters) added during each step,
+                with 0 for the initial reading; or, if cumulative, the total
+                volume added at each step.
+            cumulative (bool): whether volumes are totals rather than
+                increments. Defaults to False.
+
+        Returns:
+            ModifiedGranTitration: titration holding every step.
+
+        Raises:
+            ValueError: if the arrays are not 1-D and of the same length,
+                hold non-finite values, the volume ever decreases, or an
+                increment is given for the initial reading.
+        """
+        phs = np.asarray(phs, dtype=np.float64)
+        emfs = np.asarray(emfs, dtype=np.float64)
+        volumes = np.asarray(volumes, dtype=np.float64)
+
+        if (phs.ndim != 1 or phs.size == 0 or emfs.shape != phs.shape
+                or volumes.shape != phs.shape):
+            raise ValueError("pH, emf and volume arrays must be 1-D, non-empty "
+                             "and of the same length.")
+        if not np.isfinite(np.concatenate((phs, emfs, volumes))).all():
+            raise ValueError("pH, emf and volume arrays must be finite.")
+
+        # Acid is only added after the initial reading; a non-zero first
+        # increment means the steps are shifted by one
+        if not cumulative and volumes[0] != 0:
+            raise ValueError("Volume added before the initial reading must be "
+                             "0.")
+
+        increments = np.diff(volumes, prepend=0.0) if cumulative else volumes
+        if (increments < 0).any():
+            raise ValueError("Volume added can't be negative.")
+
+        titration = cls(sample_mass, salinity, acid_conc, temp, phs[0], emfs[0])
+        titration.ph_array = phs
+        titration.emf_array = emfs
+        titration.volume_array = volumes if cumulative else np.cumsum(volumes)
+        return titration
+
     def get_last_volume(self) -> float:
         """Returns the volume reading from the most recent titration step.
 
@@ -375,12 +441,33 @@ class ModifiedGranTitration:
 
         return np.multiply(adj_volumes, H_conc_array)
 
-    def gran_polynomial_fit(self) -> Tuple[float, float, float]:
+    def get_gran_data(self, ph_cutoff: float = GRAN_PH_CUTOFF
+                         ) -> Tuple[np.ndarray, np.ndarray]:
+        """Selects the steps in the Gran region and calculates the Gran
+        function at each of them.
+
+        Args:
+            ph_cutoff (float): highest pH to include in the Gran region.
+                Defaults to GRAN_PH_CUTOFF.
+
+        Returns:
+            tuple containing:
+             - np.ndarray: total volume (in liters) at each Gran step.
+             - np.ndarray: Gran function (see calc_ygran) at each Gran step.
+        """
+        gran_region = self.ph_array <= ph_cutoff
+        volumes = self.volume_array[gran_region]
+        pHs = self.ph_array[gran_region]
+        return volumes, self.calc_ygran(pHs, volumes)
+
+    def gran_polynomial_fit(self, ph_cutoff: float = GRAN_PH_CUTOFF
+                               ) -> Tuple[float, float, float]:
         """Fits a polynomial of degree 1 from the acid volume data to the
         hydrogen ion molar concentration data.
 
         Args:
-            None.
+            ph_cutoff (float): highest pH to include in the fit. Defaults
+                to GRAN_PH_CUTOFF.
 
         Returns:
             tuple containing:
@@ -388,36 +475,39 @@ class ModifiedGranTitration:
              - gamma (float): quality of fit metric.
              - rsq (float): R-squared of the fit.
         """
-        # Take volumes of steps with ph under 3.8. Must be numpy arrays
-        volumes = self.volume_array[self.ph_array <= 3.8]
-        logger.info(f"Volume array: {volumes}")
-
-        # Take ph of steps with ph under 3.8. Must be numpy arrays
-        pHs = self.ph_array[self.ph_array <= 3.8]
-        logger.info(f"pH array: {pHs}")
-
-        ygran = self.calc_ygran(pHs, volumes)
-        logger.info(f"ygran: {ygran}")
+        # Take volumes and Gran function of steps with ph under the cutoff
+        volumes, ygran = self.get_gran_data(ph_cutoff)
+        logger.debug("Volume array: %s", diagnostics.Lazy(
+            lambda: np.array2string(volumes, precision=6)))
+        logger.debug("ygran: %s", diagnostics.Lazy(
+            lambda: np.array2string(ygran, precision=6)))
 
         slope, intercept, x_model, y_model, rsq = regression.linear_regression(
                                                                 volumes, ygran)
-        logger.info(f"Slope: {slope}, int: {intercept}")
-        logger.info(f"xModel: {x_model}, yModel: {y_model}")
-        logger.info(f"rsq: {rsq}")
+        logger.debug("Slope: %s, int: %s, rsq: %s", slope, intercept, rsq)
 
         gamma = slope / self.acid_conc_M
-        logger.info(f"Gamma: {gamma}")
 
         # Veq: HCO3/H2CO3 equivalence point volume, volume HCl needed to
         # drive all HCO3 into H2CO3
         Veq = -1 * intercept / slope
-        logger.info(f"Veq: {Veq}")
 
         # Hansson/Jagner 1973 lists this as moles alkalinity/kg seawater
         molIn = Veq * self.acid_conc_M
-        logger.info(f"molIn: {molIn}")
 
         total_alkalinity = molIn / self.sample_mass_kg * 1e6
-        logger.info(f"TA: {total_alkalinity}")
+        logger.debug("Gamma: %s, Veq: %s, molIn: %s, TA: %s", gamma, Veq,
+                     molIn, total_alkalinity)
+
+        # The residuals are only worth computing if someone will read them
+        if diagnostics.fit_dump_enabled():
+            diagnostics.dump_fit(
+                "gran_fit", ph_cutoff=ph_cutoff, volumes=volumes, ygran=ygran,
+                residuals=ygran - y_model.ravel(), slope=slope,
+                intercept=intercept, rsq=rsq, gamma=gamma, Veq=Veq,
+                total_alkalinity=total_alkalinity,
+                sample_mass_kg=self.sample_mass_kg,
+                acid_conc_M=self.acid_conc_M
+            )
 
         return total_alkalinity, gamma, rsq
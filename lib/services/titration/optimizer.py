@@ -0,0 +1,502 @@
+import argparse
+import concurrent.futures
+import datetime
+import logging
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from lib.services.titration import forward, gran, protocol
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Monte Carlo protocol optimizer #####
+
+Searches the parameters of the titration protocol (see protocol.py) for
+the one that finishes a sample in the least time while keeping the
+standard deviation of the total alkalinity error under a target.
+
+A protocol is scored by replaying the titration procedure of
+TitrationRoutine on thousands of simulated samples at once:
+- Samples are drawn over ranges of alkalinity and salinity, and their
+  actual DIC is off from the salinity-based estimate used for dosing.
+- Each dose is calculated like the routine does, from the last reading.
+- The dispensed volume has a random error and is rounded to pump steps.
+- The pH is read off the forward model (see forward.py), with a
+  calibration offset per sample and noise on every reading.
+- Once the second target is reached, the recorded readings under the Gran
+  cutoff are fitted per sample like gran_polynomial_fit does.
+The run time is the number of steps times the time of a step.
+
+The search is a random search over SEARCH_SPACE followed by rounds of
+sampling around the best protocol so far, with a shrinking spread. Every
+candidate of a round is evaluated on the same samples and noise, so they
+are compared on equal terms, and candidates are spread over a process
+pool. The best protocol is then evaluated again on fresh samples, and
+written as a profile the routine can load:
+
+    python -m lib.services.titration.optimizer --target-sd 3.0 \\
+        --output profiles/optimized.json
+    python run.py --protocol profiles/optimized.json
+"""
+
+# Range (low, high) searched for each protocol parameter
+SEARCH_SPACE = {
+    "first_ph_target": (3.5, 4.3),
+    "second_ph_target": (2.6, 3.4),
+    "ph_step": (0.05, 0.3),
+    "gran_ph_cutoff": (3.3, 4.0),
+}
+
+DEFAULT_TARGET_TA_SD = 3.0
+DEFAULT_SAMPLES = 2000
+DEFAULT_CANDIDATES = 64
+DEFAULT_ROUNDS = 4
+
+# Spread of the candidates around the best one, as a fraction of each
+# range, in the first refining round; it halves every round after
+INITIAL_SPREAD = 0.25
+
+# Liters per step of a VersaPumpV6, doses are rounded to it
+PUMP_LITERS_PER_STEP = 0.002478 / 48000
+
+
+class Conditions:
+    """Samples and sources of error the protocols are evaluated under.
+
+    Args:
+        alkalinity_range (tuple): range (in umol/kg) of sample alkalinity.
+        salinity_range (tuple): range (in PSU) of sample salinity.
+        temp (float): sample temperature (in C).
+        sample_mass (float): sample mass (in grams).
+        acid_conc (float): acid concentration (in moles/l).
+        dic_error (float): relative standard deviation of the actual DIC
+            from the salinity-based estimate.
+        ph_noise (float): standard deviation of the noise of each reading.
+        ph_offset (float): standard deviation of the calibration offset
+            of each sample's readings.
+        dose_error (float): relative standard deviation of each dispensed
+            volume.
+        step_time (float): time (in seconds) a step takes, i.e. dosing,
+            equilibration and a stable reading.
+        max_steps (int): steps after which a titration counts as failed.
+
+    Returns:
+        None.
+    """
+    def __init__(self, alkalinity_range: Tuple[float, float] = (2000.0,
+                                                                  2400.0),
+                    salinity_range: Tuple[float, float] = (30.0, 38.0),
+                    temp: float = 25.0, sample_mass: float = 100.0,
+                    acid_conc: float = 0.1, dic_error: float = 0.05,
+                    ph_noise: float = 0.002, ph_offset: float = 0.02,
+                    dose_error: float = 0.0005, step_time: float = 30.0,
+                    max_steps: int = 100) -> None:
+        self.alkalinity_range = tuple(alkalinity_range)
+        self.salinity_range = tuple(salinity_range)
+        self.temp = temp
+        self.sample_mass = sample_mass
+        self.acid_conc = acid_conc
+        self.dic_error = dic_error
+        self.ph_noise = ph_noise
+        self.ph_offset = ph_offset
+        self.dose_error = dose_error
+        self.step_time = step_time
+        self.max_steps = max_steps
+
+    def to_dict(self) -> dict:
+        """Lays out the conditions for the profile.
+
+        Args:
+            None.
+
+        Returns:
+            dict: argument name -> value.
+        """
+        return dict(vars(self))
+
+
+def required_doses(titration: gran.ModifiedGranTitration,
+                     ph_from: np.ndarray, ph_to: np.ndarray) -> np.ndarray:
+    """calc_required_acid_vol for arrays of samples and readings.
+
+    Args:
+        titration (ModifiedGranTitration): titration built with arrays of
+            salinity and temperature, one per sample.
+        ph_from (np.ndarray): last pH reading of each sample.
+        ph_to (np.ndarray): target pH of each sample.
+
+    Returns:
+        np.ndarray: estimated acid dose (in liters) of each sample.
+    """
+    H_from = titration.calc_H_concentration_array(ph_from)
+    H_to = titration.calc_H_concentration_array(ph_to)
+    carbonate_diff = (titration.calc_carbonate_alkalinity(ph_to)
+                      - titration.calc_carbonate_alkalinity(ph_from))
+    borate_diff = (titration.calc_borate_alkalinity(ph_to)
+                   - titration.calc_borate_alkalinity(ph_from))
+    return (titration.sample_mass_kg / titration.acid_conc_M
+            * (H_to - H_from - carbonate_diff - borate_diff
+               - titration.KW * (1 / H_to - 1 / H_from)))
+
+
+def gran_fits(titration: gran.ModifiedGranTitration, phs: np.ndarray,
+                volumes: np.ndarray, ph_cutoff: float) -> np.ndarray:
+    """gran_polynomial_fit for arrays of samples, giving the alkalinity
+    only.
+
+    Args:
+        titration (ModifiedGranTitration): titration built with arrays of
+            salinity and temperature, one per sample.
+        phs (np.ndarray): readings, one row per sample, NaN after the last.
+        volumes (np.ndarray): cumulative recorded volumes (in liters), like
+            phs.
+        ph_cutoff (float): highest pH included in the fit.
+
+    Returns:
+        np.ndarray: estimated total alkalinity (in umol/kg) of each sample,
+            NaN where fewer than two readings are under the cutoff.
+    """
+    # Same Gran function as calc_ygran, zeroed outside the region
+    in_region = phs <= ph_cutoff
+    x = np.where(in_region, volumes, 0.0)
+    y = np.where(in_region, titration.calc_ygran(phs, volumes), 0.0)
+
+    n = in_region.sum(axis=1)
+    sx, sy = x.sum(axis=1), y.sum(axis=1)
+    sxx, sxy = (x * x).sum(axis=1), (x * y).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+        intercept = (sy - slope * sx) / n
+        veq = -intercept / slope
+    total_alkalinity = (veq * titration.acid_conc_M / titration.sample_mass_kg
+                        * 1e6)
+    return np.where(n >= 2, total_alkalinity, np.nan)
+
+
+def simulate(titration_protocol: protocol.TitrationProtocol,
+               conditions: Conditions, n_samples: int,
+               seed: int = 0) -> Dict[str, np.ndarray]:
+    """Replays the titration procedure with a protocol on simulated
+    samples, see above.
+
+    Args:
+        titration_protocol (TitrationProtocol): the protocol.
+        conditions (Conditions): samples and errors simulated.
+        n_samples (int): number of samples.
+        seed (int): seed of the samples and errors.
+
+    Returns:
+        dict: per sample, ta_error (estimated - actual, in umol/kg, NaN if
+            the titration failed), steps and run_time_s.
+    """
+    rng = np.random.default_rng(seed)
+    c = conditions
+    alkalinity = rng.uniform(*c.alkalinity_range, n_samples)
+    salinity = rng.uniform(*c.salinity_range, n_samples)
+    offset = rng.normal(0.0, c.ph_offset, n_samples)
+
+    # Doses are calculated from the estimates the routine would use, while
+    # the pH follows the sample's actual DIC
+    titration = gran.ModifiedGranTitration(
+        c.sample_mass, salinity, c.acid_conc, np.full(n_samples, c.temp),
+        8.0, 0.0
+    )
+    constants = forward.equilibrium_constants(salinity, c.temp)
+    constants["dic"] = constants["dic"] * (
+        1 + rng.normal(0.0, c.dic_error, n_samples)
+    )
+
+    def read(samples: np.ndarray, volumes: np.ndarray) -> np.ndarray:
+        """Helper taking a reading of some of the samples.
+        """
+        sample_constants = {k: v[samples] for k, v in constants.items()}
+        ph = forward.forward_ph(volumes[:, np.newaxis],
+                                alkalinity[samples] * 1e-6,
+                                sample_mass=c.sample_mass,
+                                acid_conc=c.acid_conc, **sample_constants)
+        return (ph[:, 0] + offset[samples]
+                + rng.normal(0.0, c.ph_noise, samples.size))
+
+    p = titration_protocol
+    everyone = np.arange(n_samples)
+    dispensed = np.zeros(n_samples)
+    recorded = np.zeros(n_samples)
+    last_ph = read(everyone, dispensed)
+    phs = [last_ph.copy()]
+    volumes = [recorded.copy()]
+    steps = np.zeros(n_samples, dtype=int)
+    initial = np.ones(n_samples, dtype=bool)
+
+    for _ in range(c.max_steps):
+        # Same conditions as initial_titration and auto_titration
+        initial &= last_ph > p.first_ph_target
+        running = np.flatnonzero(initial | (last_ph > p.second_ph_target))
+        if not running.size:
+            break
+
+        targets = np.where(initial, p.first_ph_target - 0.01,
+                           last_ph - p.ph_step)
+        dose = np.maximum(required_doses(titration, last_ph, targets),
+                          0.0)[running]
+        actual = dose * (1 + rng.normal(0.0, c.dose_error, running.size))
+        actual = np.round(actual / PUMP_LITERS_PER_STEP) * PUMP_LITERS_PER_STEP
+
+        dispensed[running] += actual
+        recorded[running] += dose
+        last_ph[running] = read(running, dispensed[running])
+        steps[running] += 1
+
+        ph_row = np.full(n_samples, np.nan)
+        ph_row[running] = last_ph[running]
+        phs.append(ph_row)
+        volumes.append(np.where(np.isnan(ph_row), np.nan, recorded))
+
+    failed = initial | (last_ph > p.second_ph_target)
+    estimate = gran_fits(titration, np.column_stack(phs),
+                         np.column_stack(volumes), p.gran_ph_cutoff)
+    ta_error = np.where(failed, np.nan, estimate - alkalinity)
+    return {"ta_error": ta_error, "steps": steps,
+            "run_time_s": steps * c.step_time}
+
+
+def summarize(simulated: Dict[str, np.ndarray]) -> dict:
+    """Sums up the outcome of a simulation.
+
+    Args:
+        simulated (dict): output of simulate.
+
+    Returns:
+        dict: ta_sd and ta_bias (in umol/kg) of the titrations that
+            finished, failure_rate, mean_steps and mean_run_time_s.
+    """
+    errors = simulated["ta_error"]
+    finished = errors[np.isfinite(errors)]
+    return {
+        "ta_sd": float(np.std(finished)) if finished.size > 1 else np.inf,
+        "ta_bias": float(np.mean(finished)) if finished.size else np.nan,
+        "failure_rate": 1 - finished.size / errors.size,
+        "mean_steps": float(np.mean(simulated["steps"])),
+        "mean_run_time_s": float(np.mean(simulated["run_time_s"])),
+    }
+
+
+def evaluate(params: dict, conditions: Conditions, n_samples: int,
+               seed: int) -> dict:
+    """Simulates a protocol given as parameters; runs in the workers of
+    the process pool.
+
+    Args:
+        params (dict): protocol parameters, see TitrationProtocol.
+        conditions (Conditions): samples and errors simulated.
+        n_samples (int): number of samples.
+        seed (int): seed of the samples and errors.
+
+    Returns:
+        dict: the parameters and their summary, see summarize.
+    """
+    simulated = simulate(protocol.TitrationProtocol(**params), conditions,
+                         n_samples, seed)
+    return {"params": params, **summarize(simulated)}
+
+
+def is_better(result: dict, best: Optional[dict],
+                target_ta_sd: float) -> bool:
+    """Ranks evaluated protocols: those meeting the target, without failed
+    titrations, by run time, ahead of the others by TA standard deviation.
+
+    Args:
+        result (dict): output of evaluate.
+        best (dict): the best output so far, or None.
+        target_ta_sd (float): target TA standard deviation (in umol/kg).
+
+    Returns:
+        bool: True if result ranks above best.
+    """
+    if best is None:
+        return True
+
+    def key(r: dict) -> tuple:
+        feasible = r["ta_sd"] <= target_ta_sd and r["failure_rate"] == 0
+        if feasible:
+            return (0, r["mean_run_time_s"], r["ta_sd"])
+        return (1, r["failure_rate"], r["ta_sd"])
+
+    return key(result) < key(best)
+
+
+def propose(rng: np.random.Generator, n: int, center: Optional[dict] = None,
+              spread: float = 1.0) -> List[dict]:
+    """Draws valid protocol parameters from the search space, uniformly or
+    around a center.
+
+    Args:
+        rng (np.random.Generator): random generator.
+        n (int): number of candidates.
+        center (dict): optional, parameters the candidates are drawn
+            around; uniform over SEARCH_SPACE if not given.
+        spread (float): standard deviation around the center, as a
+            fraction of each range.
+
+    Returns:
+        list: parameter dicts, rounded to 0.005.
+    """
+    candidates = []
+    while len(candidates) < n:
+        params = {}
+        for name, (low, high) in SEARCH_SPACE.items():
+            if center is None:
+                value = rng.uniform(low, high)
+            else:
+                value = rng.normal(center[name], spread * (high - low))
+            params[name] = round(float(np.clip(value, low, high)) * 200) / 200
+        try:
+            protocol.TitrationProtocol(**params)
+        except ValueError:
+            continue
+        candidates.append(params)
+    return candidates
+
+
+def optimize(target_ta_sd: float = DEFAULT_TARGET_TA_SD,
+               conditions: Optional[Conditions] = None,
+               n_samples: int = DEFAULT_SAMPLES,
+               candidates: int = DEFAULT_CANDIDATES,
+               rounds: int = DEFAULT_ROUNDS, workers: Optional[int] = None,
+               seed: int = 0) -> Tuple[protocol.TitrationProtocol, dict]:
+    """Searches for the fastest protocol meeting the TA target, see above.
+
+    Args:
+        target_ta_sd (float): target TA standard deviation (in umol/kg).
+        conditions (Conditions): samples and errors simulated; defaults
+            to Conditions().
+        n_samples (int): simulated samples per candidate.
+        candidates (int): candidates per round.
+        rounds (int): rounds, the first being uniform over the space.
+        workers (int): processes evaluating candidates; defaults to the
+            number of CPUs, and 1 evaluates in this process.
+        seed (int): seed of the search and the samples.
+
+    Returns:
+        tuple containing:
+         - TitrationProtocol: the best protocol found.
+         - dict: how it was chosen, stored as the profile's optimization
+             section; its summary on fresh samples is under validation.
+    """
+    conditions = conditions or Conditions()
+    rng = np.random.default_rng(seed)
+
+    def run(batch: List[dict], batch_seed: int) -> List[dict]:
+        """Helper evaluating candidates, in the pool if there is one.
+        """
+        args = ([conditions] * len(batch), [n_samples] * len(batch),
+                [batch_seed] * len(batch))
+        if executor is None:
+            return list(map(evaluate, batch, *args))
+        return list(executor.map(evaluate, batch, *args))
+
+    executor = None
+    if workers != 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    try:
+        # The current protocol competes too, so the result is never worse
+        best = None
+        evaluated = 0
+        for round_index in range(rounds):
+            if round_index == 0:
+                batch = ([protocol.DEFAULT_PROTOCOL.to_dict()]
+                         + propose(rng, candidates - 1))
+            else:
+                spread = INITIAL_SPREAD / 2**(round_index - 1)
+                batch = propose(rng, candidates, best["params"], spread)
+
+            for result in run(batch, seed + round_index):
+                evaluated += 1
+                if is_better(result, best, target_ta_sd):
+                    best = result
+            logger.info(f"Round {round_index + 1}/{rounds}: best {best}")
+
+        validation = run([best["params"]], seed + rounds)[0]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if not (validation["ta_sd"] <= target_ta_sd
+            and validation["failure_rate"] == 0):
+        logger.warning(f"Best protocol misses the target on fresh samples: "
+                       f"{validation}")
+
+    optimization = {
+        "target_ta_sd": target_ta_sd,
+        "search": {k: v for k, v in best.items() if k != "params"},
+        "validation": {k: v for k, v in validation.items()
+                       if k != "params"},
+        "conditions": conditions.to_dict(),
+        "samples": n_samples, "candidates_evaluated": evaluated,
+        "seed": seed,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    return protocol.TitrationProtocol(**best["params"]), optimization
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point, see above.
+
+    Args:
+        argv (list): arguments; defaults to the command line.
+
+    Returns:
+        int: exit status, 1 if the best protocol misses the target.
+    """
+    parser = argparse.ArgumentParser(
+        description="Monte Carlo search of the titration protocol"
+    )
+    parser.add_argument("--output", required=True,
+                        help="Profile JSON file to write.")
+    parser.add_argument("--target-sd", type=float,
+                        default=DEFAULT_TARGET_TA_SD,
+                        help="Target TA standard deviation (umol/kg).")
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES,
+                        help="Simulated samples per candidate.")
+    parser.add_argument("--candidates", type=int,
+                        default=DEFAULT_CANDIDATES,
+                        help="Candidates per round.")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes; defaults to the CPU count.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ph-noise", type=float,
+                        default=Conditions().ph_noise,
+                        help="Standard deviation of each pH reading.")
+    parser.add_argument("--dose-error", type=float,
+                        default=Conditions().dose_error,
+                        help="Relative standard deviation of each dose.")
+    parser.add_argument("--step-time", type=float,
+                        default=Conditions().step_time,
+                        help="Time (in seconds) of a titration step.")
+    args = parser.parse_args(argv)
+
+    conditions = Conditions(ph_noise=args.ph_noise,
+                            dose_error=args.dose_error,
+                            step_time=args.step_time)
+    titration_protocol, optimization = optimize(
+        args.target_sd, conditions, args.samples, args.candidates,
+        args.rounds, args.workers, args.seed
+    )
+    protocol.save_protocol(args.output, titration_protocol, optimization)
+
+    validation = optimization["validation"]
+    print(f"{titration_protocol}")
+    print(f"TA sd {validation['ta_sd']:.2f} umol/kg, bias "
+          f"{validation['ta_bias']:+.2f} umol/kg, "
+          f"{validation['mean_steps']:.1f} steps, "
+          f"{validation['mean_run_time_s'] / 60:.1f} min per sample")
+    print(f"Profile written to {args.output}")
+    return 0 if (validation["ta_sd"] <= args.target_sd
+                 and validation["failure_rate"] == 0) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
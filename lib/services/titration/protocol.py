@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+from typing import Optional
+
+from lib.services.titration import gran
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Titration protocol profiles #####
+
+The few numbers that shape the procedure: the pH the first titration
+doses down to, the pH the second one stops at, the pH step between its
+readings, and the highest pH used in the Gran fit. TitrationRoutine takes
+a TitrationProtocol, and the defaults are the values the procedure has
+always used.
+
+A protocol is stored as a JSON profile, e.g. as written by the optimizer
+(see optimizer.py), which also records how it was chosen:
+
+{"protocol": {"first_ph_target": 3.8, "second_ph_target": 3.0,
+              "ph_step": 0.1, "gran_ph_cutoff": 3.8},
+ "optimization": {"target_ta_sd": 3.0, "validation": {"ta_sd": 2.96, ...}}}
+
+Only the protocol section is read back:
+
+    titration_protocol = load_protocol("profiles/fast.json")
+    routine = TitrationRoutine(pump, ph_meter, 100.0, 35.0, 0.1,
+                               titration_protocol=titration_protocol)
+"""
+
+FIRST_TITRATION_PH_TARGET = 3.8
+SECOND_TITRATION_PH_TARGET = 3.0
+PH_STEP = 0.1
+
+
+class TitrationProtocol:
+    """Parameters of the titration procedure, see above.
+
+    Args:
+        first_ph_target (float): pH the initial titration doses down to
+            before data collection starts. Defaults to 3.8.
+        second_ph_target (float): pH at which the second titration stops.
+            Defaults to 3.0.
+        ph_step (float): pH step between the readings of the second
+            titration. Defaults to 0.1.
+        gran_ph_cutoff (float): highest pH of the steps used in the Gran
+            fit. Defaults to GRAN_PH_CUTOFF.
+
+    Returns:
+        None.
+
+    Raises:
+        ValueError: if the parameters can't make a titration, e.g. the
+            second target isn't below the first.
+    """
+    def __init__(self, first_ph_target: float = FIRST_TITRATION_PH_TARGET,
+                    second_ph_target: float = SECOND_TITRATION_PH_TARGET,
+                    ph_step: float = PH_STEP,
+                    gran_ph_cutoff: float = gran.GRAN_PH_CUTOFF) -> None:
+        if not second_ph_target < first_ph_target:
+            raise ValueError(f"Second pH target {second_ph_target} must be "
+                             f"below the first, {first_ph_target}.")
+        if not ph_step > 0:
+            raise ValueError(f"pH step must be positive, not {ph_step}.")
+        if not gran_ph_cutoff > second_ph_target:
+            raise ValueError(f"Gran pH cutoff {gran_ph_cutoff} must be above "
+                             f"the second pH target, {second_ph_target}.")
+
+        self.first_ph_target = first_ph_target
+        self.second_ph_target = second_ph_target
+        self.ph_step = ph_step
+        self.gran_ph_cutoff = gran_ph_cutoff
+
+    def __repr__(self) -> str:
+        params = ", ".join(f"{k}={v}" for k, v in self.to_dict().items())
+        return f"TitrationProtocol({params})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, TitrationProtocol):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def to_dict(self) -> dict:
+        """Lays out the protocol as the protocol section of a profile.
+
+        Args:
+            None.
+
+        Returns:
+            dict: parameter name -> value.
+        """
+        return {"first_ph_target": self.first_ph_target,
+                "second_ph_target": self.second_ph_target,
+                "ph_step": self.ph_step,
+                "gran_ph_cutoff": self.gran_ph_cutoff}
+
+    @classmethod
+    def from_dict(cls, params: dict) -> "TitrationProtocol":
+        """Builds a protocol from the protocol section of a profile.
+
+        Args:
+            params (dict): parameter name -> value; missing parameters
+                take their default.
+
+        Returns:
+            TitrationProtocol: the protocol.
+
+        Raises:
+            ValueError: if a parameter is unknown or the parameters are
+                invalid.
+        """
+        unknown = set(params) - set(DEFAULT_PROTOCOL.to_dict())
+        if unknown:
+            raise ValueError(f"Unknown protocol parameters: "
+                             f"{', '.join(sorted(unknown))}.")
+        return cls(**{k: float(v) for k, v in params.items()})
+
+
+DEFAULT_PROTOCOL = TitrationProtocol()
+
+
+def load_protocol(filepath: str) -> TitrationProtocol:
+    """Reads the protocol of a profile, see the example above.
+
+    Args:
+        filepath (str): location of the JSON profile.
+
+    Returns:
+        TitrationProtocol: the protocol.
+
+    Raises:
+        ValueError: if the file has no valid protocol section.
+    """
+    with open(filepath) as f:
+        profile = json.load(f)
+
+    if "protocol" not in profile:
+        raise ValueError(f"Profile {filepath} has no protocol section.")
+    titration_protocol = TitrationProtocol.from_dict(profile["protocol"])
+    logger.info(f"Loaded {titration_protocol} from {filepath}")
+    return titration_protocol
+
+
+def save_protocol(filepath: str, titration_protocol: TitrationProtocol,
+                    optimization: Optional[dict] = None) -> None:
+    """Writes a protocol as a profile.
+
+    Args:
+        filepath (str): location of the JSON profile.
+        titration_protocol (TitrationProtocol): the protocol.
+        optimization (dict): optional, how the protocol was chosen; stored
+            alongside it for reference.
+
+    Returns:
+        None.
+    """
+    profile = {"protocol": titration_protocol.to_dict()}
+    if optimization is not None:
+        profile["optimization"] = optimization
+
+    directory = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(directory, exist_ok=True)
+    with open(filepath, "w") as f:
+        json.dump(profile, f, indent=2)
+        f.write("\n")
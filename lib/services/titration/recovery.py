@@ -0,0 +1,167 @@
+import glob
+import json
+import logging
+import os
+import time
+from typing import List, Optional
+
+from lib.services.titration import gran
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Checkpoints of running titrations #####
+
+A small JSON file is kept next to the result file of a running titration
+(same name, with .checkpoint added) and rewritten atomically twice per step:
+once right before the dose is dispensed, with the dose marked as pending and
+the syringe position from before it, and once the step has been measured.
+If the syringe is refilled while the dose equilibrates, it is rewritten a
+third time before the refill, with the dose marked as dispensed and the
+syringe position after it.
+It holds everything needed to rebuild the titration without touching the
+sample:
+
+{"version": 1, "filepath": "2024_05_01-09_30_40_AM.csv",
+ "saved_at": 1714555840.2, "phase": "AUTO",
+ "sample_mass": 100.0, "salinity": 35.0, "acid_conc": 0.1, "temp": 25.0,
+ "volumes": [0.0, 0.00183], "emfs": [-40.2, 145.3], "phs": [8.01, 3.77],
+ "syringe_steps": 12345, "pending_dose": null, "dose_dispensed": false,
+ "started_at": 1714555600.0}
+
+A checkpoint that is still on disk when the program starts belongs to a run
+that was interrupted. Resuming it re-reads the syringe position from the
+pump (the pump must not be initialized, which would zero the syringe). If a
+dose was pending, the plunger tells whether it went in: if it moved by the
+dose, the dose is measured rather than dispensed again, and if it didn't
+move, the dose is dispensed as the next step. A dose marked as dispensed is
+always measured, since the plunger may have been refilled since.
+
+The checkpoint is removed once the run finishes or is stopped; the step
+journal (see results.py) is left for the owner to finalize.
+"""
+
+CHECKPOINT_VERSION = 1
+
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+
+class Checkpoint:
+    """Writes the checkpoints of one titration, see the notes above.
+
+    Args:
+        filepath (str): location of the titration's result file.
+
+    Returns:
+        None.
+    """
+    def __init__(self, filepath: str) -> None:
+        self.filepath = filepath
+        self.path = filepath + CHECKPOINT_SUFFIX
+
+    def save(self, titration: gran.ModifiedGranTitration, phase: str,
+                syringe_steps: Optional[int],
+                pending_dose: Optional[float],
+                started_at: Optional[float] = None,
+                dose_dispensed: bool = False) -> None:
+        """Atomically replaces the checkpoint with the current state.
+
+        Args:
+            titration (ModifiedGranTitration): gran titration object.
+            phase (str): name of the routine's current phase.
+            syringe_steps (int): tracked syringe contents (in steps), from
+                before the pending dose if there is one and it isn't
+                dispensed yet.
+            pending_dose (float): volume (in liters) dispensed but not yet
+                measured, or None.
+            started_at (float): optional, unix time the run started, kept
+                so a resumed run is stored with its original start.
+            dose_dispensed (bool): whether the pending dose has gone in
+                completely. Defaults to False.
+
+        Returns:
+            None.
+        """
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "filepath": self.filepath,
+            "saved_at": time.time(),
+            "phase": phase,
+            "sample_mass": titration.sample_mass_kg * 1000,
+            "salinity": titration.salinity,
+            "acid_conc": titration.acid_conc_M,
+            "temp": titration.temp_C,
+            "volumes": titration.volume_array.tolist(),
+            "emfs": titration.emf_array.tolist(),
+            "phs": titration.ph_array.tolist(),
+            "syringe_steps": syringe_steps,
+            "pending_dose": pending_dose,
+            "dose_dispensed": dose_dispensed,
+            "started_at": started_at,
+        }
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def clear(self) -> None:
+        """Removes the checkpoint, if any.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def load_checkpoint(path: str) -> dict:
+    """Reads a checkpoint file.
+
+    Args:
+        path (str): location of the checkpoint.
+
+    Returns:
+        dict: the saved state, see the example above.
+    """
+    with open(path) as f:
+        state = json.load(f)
+
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version in {path}.")
+    return state
+
+
+def find_interrupted_runs(directory: str) -> List[str]:
+    """Lists the checkpoints left in a directory by interrupted runs.
+
+    Args:
+        directory (str): directory holding the result files.
+
+    Returns:
+        list: checkpoint locations, most recent first.
+    """
+    paths = glob.glob(os.path.join(glob.escape(directory),
+                                   "*" + CHECKPOINT_SUFFIX))
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def titration_from_state(state: dict) -> gran.ModifiedGranTitration:
+    """Rebuilds the titration held in a checkpoint.
+
+    Args:
+        state (dict): state read by load_checkpoint.
+
+    Returns:
+        ModifiedGranTitration: titration with every measured step.
+    """
+    return gran.ModifiedGranTitration.from_arrays(
+        state["sample_mass"], state["salinity"], state["acid_conc"],
+        state["temp"], state["phs"], state["emfs"], state["volumes"],
+        cumulative=True
+    )
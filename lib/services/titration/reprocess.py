@@ -0,0 +1,272 @@
+import argparse
+import csv
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from lib.services.titration import emf, gran, store
+from lib.utils import diagnostics
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Reprocessing archived runs #####
+
+Recomputes the total alkalinity of stored runs, e.g. after a change to the
+constants or to the fit. Runs are read from a result store in one query,
+split into chunks, and fitted in a pool of worker processes, one chunk per
+task, so each worker receives a few large messages rather than one per run.
+Each run is fitted with the Gran pH cutoff of the protocol it was measured
+with, or the default cutoff if none was stored.
+The results are written back to the store's reprocessed table in one
+transaction, with the difference to the TA stored at measurement time, and
+optionally to a csv report.
+
+Usage:
+    python -m lib.services.titration.reprocess results.sqlite3 \\
+        --engine gran --workers 8 --report reprocessed.csv
+"""
+
+REPORT_HEADER = ["run_id", "stored_total_alk_umol_kg", "total_alk_umol_kg",
+                 "diff_umol_kg", "gamma", "rsq", "error"]
+
+# Number of chunks handed to each worker; a few per worker keeps them all
+# busy until the end without adding much messaging
+CHUNKS_PER_WORKER = 4
+
+
+def fit_gran(titration: gran.ModifiedGranTitration,
+               ph_cutoff: float = gran.GRAN_PH_CUTOFF) -> Tuple[float, float,
+                                                                float]:
+    """Fit engine using the modified Gran fit of the titration itself.
+
+    Args:
+        titration (ModifiedGranTitration): gran titration object.
+        ph_cutoff (float): highest pH of the steps used in the fit.
+
+    Returns:
+        tuple containing:
+         - total_alkalinity (float): estimated total alkalinity.
+         - gamma (float): quality of fit metric.
+         - rsq (float): R-squared of the fit.
+    """
+    return titration.gran_polynomial_fit(ph_cutoff)
+
+
+def fit_gran_emf(titration: gran.ModifiedGranTitration,
+                   ph_cutoff: float = gran.GRAN_PH_CUTOFF
+                   ) -> Tuple[float, float, float]:
+    """Fit engine using the emf, with the electrode estimated from the run
+    (see emf.py), so it doesn't depend on the meter's calibration.
+
+    Args:
+        titration (ModifiedGranTitration): gran titration object.
+        ph_cutoff (float): highest pH of the steps used in the fit.
+
+    Returns:
+        tuple containing:
+         - total_alkalinity (float): estimated total alkalinity.
+         - gamma (float): quality of fit metric.
+         - rsq (float): R-squared of the fit.
+    """
+    return emf.emf_gran_fit(titration, ph_cutoff)
+
+
+# Fit engines available by name; each takes a titration and a Gran pH
+# cutoff and returns (total_alkalinity, gamma, rsq). Engines must be module-level functions so
+# worker processes can find them.
+ENGINES: Dict[str, Callable] = {
+    "gran": fit_gran,
+    "gran_emf": fit_gran_emf,
+}
+
+
+def build_titration(params: tuple, volumes: np.ndarray, emfs: np.ndarray,
+                      phs: np.ndarray) -> gran.ModifiedGranTitration:
+    """Builds a titration straight from stored arrays.
+
+    Args:
+        params (tuple): sample mass (in grams), salinity, acid
+            concentration (in moles/l) and initial temperature (in C).
+        volumes (np.ndarray): total volume (in liters) at each step.
+        emfs (np.ndarray): emf (in mV) at each step.
+        phs (np.ndarray): pH at each step.
+
+    Returns:
+        ModifiedGranTitration: titration holding every step.
+    """
+    sample_mass, salinity, acid_conc, temp = params
+    return gran.ModifiedGranTitration.from_arrays(
+        sample_mass, salinity, acid_conc, temp, phs, emfs, volumes,
+        cumulative=True
+    )
+
+
+def process_chunk(engine: str, chunk: List[tuple]) -> List[tuple]:
+    """Fits every run of a chunk. Runs in a worker process.
+
+    Args:
+        engine (str): name of the fit engine, see ENGINES.
+        chunk (list): (run_id, params, ph_cutoff, volumes, emfs, phs)
+            tuples, see build_titration.
+
+    Returns:
+        list: one (run_id, total_alkalinity, gamma, rsq, error) tuple per
+            run; the error is None, or the fit values are None.
+    """
+    fit = ENGINES[engine]
+    fitted = []
+    for run_id, params, ph_cutoff, volumes, emfs, phs in chunk:
+        diagnostics.set_dump_context(run_id=run_id, engine=engine)
+        try:
+            total_alkalinity, gamma, rsq = fit(
+                build_titration(params, volumes, emfs, phs), ph_cutoff
+            )
+            fitted.append((run_id, float(total_alkalinity), float(gamma),
+                           float(rsq), None))
+        except Exception as e:
+            fitted.append((run_id, None, None, None, f"{type(e).__name__}: {e}"))
+    return fitted
+
+
+def reprocess(result_store: store.ResultStore, engine: str = "gran",
+                 workers: Optional[int] = None,
+                 chunk_size: Optional[int] = None,
+                 fit_dump: Optional[str] = None,
+                 **filters) -> List[tuple]:
+    """Recomputes the TA of stored runs in parallel and writes the results
+    back to the store.
+
+    Args:
+        result_store (ResultStore): store holding the runs.
+        engine (str): name of the fit engine, see ENGINES. Defaults to gran.
+        workers (int): number of worker processes. Defaults to the number
+            of CPUs.
+        chunk_size (int): runs per task. Defaults to spreading the runs
+            over CHUNKS_PER_WORKER tasks per worker.
+        fit_dump (str): optional, JSON lines file every worker appends the
+            internals of its fits to, see diagnostics.py.
+        **filters: passed to ResultStore.query_runs to select runs.
+
+    Returns:
+        list: one (run_id, total_alk_umol_kg, gamma, rsq, diff_umol_kg,
+            error) tuple per run, as written to the store.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}, choose from "
+                         f"{sorted(ENGINES)}.")
+
+    runs = result_store.query_runs(**filters)
+    if runs.size == 0:
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    chunk_size = chunk_size or max(
+        1, math.ceil(runs.size / (workers * CHUNKS_PER_WORKER))
+    )
+
+    params = {
+        int(run["id"]): (float(run["sample_mass_g"]), float(run["salinity"]),
+                         float(run["acid_conc_M"]), float(run["temp_C"]))
+        for run in runs
+    }
+    stored_alk = dict(zip(runs["id"].tolist(),
+                          runs["total_alk_umol_kg"].tolist()))
+    cutoffs = {
+        run_id: run_protocol.get("gran_ph_cutoff", gran.GRAN_PH_CUTOFF)
+        for run_id, run_protocol in result_store.get_protocols(
+            list(params)).items()
+    }
+
+    chunks = [[]]
+    for run_id, volumes, emfs, phs in result_store.iter_steps(list(params)):
+        if len(chunks[-1]) == chunk_size:
+            chunks.append([])
+        chunks[-1].append((run_id, params[run_id],
+                           cutoffs.get(run_id, gran.GRAN_PH_CUTOFF), volumes,
+                           emfs, phs))
+
+    logger.info(f"Reprocessing {runs.size} runs with {engine} in "
+                f"{len(chunks)} chunks on {workers} workers")
+
+    rows = []
+    init_args = (fit_dump,) if fit_dump else ()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=diagnostics.enable_fit_dump if fit_dump else None,
+        initargs=init_args
+    ) as pool:
+        futures = [pool.submit(process_chunk, engine, chunk)
+                   for chunk in chunks]
+        for future in futures:
+            for run_id, total_alkalinity, gamma, rsq, error in future.result():
+                diff = (None if total_alkalinity is None
+                        else total_alkalinity - stored_alk[run_id])
+                rows.append((run_id, total_alkalinity, gamma, rsq, diff,
+                             error))
+
+    result_store.add_reprocessed(engine, rows)
+    return rows
+
+
+def write_report(filepath: str, result_store: store.ResultStore,
+                    rows: List[tuple]) -> None:
+    """Writes the per-run outcome of a reprocessing pass to a csv file.
+
+    Args:
+        filepath (str): location of the report.
+        result_store (ResultStore): store holding the runs.
+        rows (list): rows returned by reprocess.
+
+    Returns:
+        None.
+    """
+    runs = result_store.query_runs()
+    stored_alk = dict(zip(runs["id"].tolist(),
+                          runs["total_alk_umol_kg"].tolist()))
+
+    with open(filepath, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_HEADER)
+        for run_id, total_alkalinity, gamma, rsq, diff, error in rows:
+            writer.writerow([run_id, stored_alk[run_id], total_alkalinity,
+                             diff, gamma, rsq, error or ""])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute total alkalinity of stored runs"
+    )
+    parser.add_argument("store", help="result store (sqlite3 file)")
+    parser.add_argument("--engine", default="gran", choices=sorted(ENGINES))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--sample-id", default=None)
+    parser.add_argument("--station", default=None)
+    parser.add_argument("--report", default=None,
+                        help="optional csv file for the per-run diff")
+    parser.add_argument("--fit-dump", default=None,
+                        help="optional JSON lines file for the internals "
+                             "of every fit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    result_store = store.ResultStore(args.store)
+    rows = reprocess(result_store, args.engine, args.workers,
+                     args.chunk_size, fit_dump=args.fit_dump,
+                     sample_id=args.sample_id, station=args.station)
+    if args.report:
+        write_report(args.report, result_store, rows)
+    result_store.close()
+
+    diffs = np.array([row[4] for row in rows if row[4] is not None])
+    failed = sum(row[5] is not None for row in rows)
+    print(f"Reprocessed {len(rows)} runs, {failed} failed.")
+    if diffs.size:
+        print(f"TA difference (umol/kg): mean {diffs.mean():.3f}, "
+              f"max abs {np.abs(diffs).max():.3f}")
@@ -0,0 +1,267 @@
+import csv
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from lib.services.titration import gran
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Layout of the csv file written at the end of each titration #####
+
+The first row after the header holds the initial reading along with the
+sample parameters and the final result; every following row only holds
+the volume/emf/pH of one titration step.
+
+total_volume_added_L,emf_mV,pH,sample_mass_g,temp_C,salinity,acid_conc_M,total_alk_umol_kg
+0.0,-40.2,8.01,100.0,25.0,35.0,0.1,2267.604
+0.00183,145.3,3.77
+...
+
+##### Journaling #####
+
+While a titration runs, its steps are appended to a journal next to the
+result file (same name, with .partial added) as soon as they are measured.
+The journal has the same layout as the final file, except that the total
+alkalinity of the first row is left empty. Every row is flushed to the OS
+right away, which is enough to survive the program crashing; fsync calls,
+which are needed to survive a power loss, are batched to at most one every
+sync_interval seconds.
+
+When the titration finishes, the final file is written to a temporary file,
+fsynced, and moved over the result path in one atomic rename before the
+journal is removed, so the result path only ever holds a complete file.
+A run that is stopped or crashes leaves its journal behind, which can be
+read back with load_journal.
+"""
+
+CSV_HEADER = ["total_volume_added_L", "emf_mV", "pH", "sample_mass_g",
+              "temp_C", "salinity", "acid_conc_M", "total_alk_umol_kg"]
+
+
+def default_filename() -> str:
+    """Builds the timestamped name (without extension) used for result files.
+
+    Args:
+        None.
+
+    Returns:
+        str: filename, e.g. 2024_05_01-09_30_40_AM.
+    """
+    return datetime.now().strftime("%Y_%m_%d-%I_%M_%S_%p")
+
+
+def write_csv(filepath: str, titration: gran.ModifiedGranTitration,
+                total_alkalinity: float) -> None:
+    """Dumps the titration data to a csv file on the host.
+
+    Args:
+        filepath (str): location of the file to write.
+        titration (ModifiedGranTitration): gran titration object.
+        total_alkalinity (float): estimated total alkalinity value.
+
+    Returns:
+        None.
+    """
+    with open(filepath, "w") as f:
+        _write_rows(f, titration, total_alkalinity)
+
+    logger.info(f"Titration data written to {filepath}")
+
+
+def _first_row(titration: gran.ModifiedGranTitration,
+                 total_alkalinity: Optional[float]) -> list:
+    """Builds the row holding the initial reading and sample parameters.
+
+    Args:
+        titration (ModifiedGranTitration): gran titration object.
+        total_alkalinity (float): estimated total alkalinity value, or None
+            if it isn't known yet.
+
+    Returns:
+        list: the row values.
+    """
+    total_alk = "" if total_alkalinity is None else round(total_alkalinity, 3)
+    return [titration.volume_array[0], titration.emf_array[0],
+            titration.ph_array[0], titration.sample_mass_kg * 1000,
+            titration.temp_K - 273.15, titration.salinity,
+            titration.acid_conc_M, total_alk]
+
+
+def _write_rows(f, titration: gran.ModifiedGranTitration,
+                  total_alkalinity: Optional[float]) -> None:
+    """Writes the full csv layout to an open file.
+
+    Args:
+        f (file): file object opened for writing.
+        titration (ModifiedGranTitration): gran titration object.
+        total_alkalinity (float): estimated total alkalinity value, or None.
+
+    Returns:
+        None.
+    """
+    writer = csv.writer(f, delimiter=",")
+    writer.writerow(CSV_HEADER)
+    writer.writerow(_first_row(titration, total_alkalinity))
+
+    for vol,emf,ph in zip(titration.volume_array[1:],
+            titration.emf_array[1:], titration.ph_array[1:]):
+        rowarray = [vol, emf, ph]
+        writer.writerow(rowarray)
+
+
+class StepJournal:
+    """Append-only record of a running titration, see the notes above.
+
+    Args:
+        filepath (str): location of the final result file.
+        sync_interval (float): minimum time (in seconds) between fsync
+            calls while steps are appended. Defaults to 5.
+
+    Returns:
+        None.
+    """
+    def __init__(self, filepath: str, sync_interval: float = 5.0) -> None:
+        self.filepath = filepath
+        self.journal_path = filepath + ".partial"
+        self.sync_interval = sync_interval
+
+        self.finalized = False
+
+        self._file = None
+        self._writer = None
+        self._last_sync = 0.0
+
+    def open(self, titration: gran.ModifiedGranTitration) -> None:
+        """Starts the journal with the header, initial reading, and any
+        steps the titration already holds (e.g. when resuming a run).
+
+        Args:
+            titration (ModifiedGranTitration): gran titration object.
+
+        Returns:
+            None.
+        """
+        self._file = open(self.journal_path, "w")
+        _write_rows(self._file, titration, None)
+        self._writer = csv.writer(self._file, delimiter=",")
+        self.sync()
+        logger.info(f"Journaling titration data to {self.journal_path}")
+
+    def append(self, volume: float, emf: float, ph: float) -> None:
+        """Appends one step to the journal.
+
+        Args:
+            volume (float): total volume (in liters) added so far.
+            emf (float): emf (in mV) at the end of the step.
+            ph (float): pH at the end of the step.
+
+        Returns:
+            None.
+        """
+        self._writer.writerow([volume, emf, ph])
+        self._file.flush()
+
+        if time.monotonic() - self._last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self) -> None:
+        """Forces the journal to disk.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        """Syncs and closes the journal, leaving it on disk. Safe to call
+        more than once.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if self._file is None:
+            return
+        self.sync()
+        self._file.close()
+        self._file = None
+        self._writer = None
+
+    def finalize(self, titration: gran.ModifiedGranTitration,
+                    total_alkalinity: float) -> str:
+        """Atomically replaces the journal with the final result file.
+
+        Args:
+            titration (ModifiedGranTitration): gran titration object.
+            total_alkalinity (float): estimated total alkalinity value.
+
+        Returns:
+            str: location of the result file.
+        """
+        self.close()
+
+        tmp_path = self.filepath + ".tmp"
+        with open(tmp_path, "w") as f:
+            _write_rows(f, titration, total_alkalinity)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.filepath)
+
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.finalized = True
+
+        logger.info(f"Titration data written to {self.filepath}")
+        return self.filepath
+
+
+def load_journal(filepath: str) -> gran.ModifiedGranTitration:
+    """Rebuilds a titration from a journal (or a final result file).
+
+    Args:
+        filepath (str): location of the journal.
+
+    Returns:
+        ModifiedGranTitration: titration holding every step found in the
+            file; a partly written last row is ignored.
+    """
+    with open(filepath, newline="") as f:
+        rows = list(csv.reader(f))
+
+    if len(rows) < 2 or rows[0] != CSV_HEADER:
+        raise ValueError(f"{filepath} is not a titration journal.")
+
+    vol_init, emf_init, ph_init, mass, temp, salinity, acid_conc = (
+        float(x) for x in rows[1][:7]
+    )
+
+    steps = [(vol_init, emf_init, ph_init)]
+    for row in rows[2:]:
+        try:
+            volume, emf, ph = (float(x) for x in row)
+        except ValueError:
+            # A row cut short by a crash can only be the last one
+            logger.warning(f"Skipping incomplete row {row} in {filepath}")
+            break
+        steps.append((volume, emf, ph))
+
+    steps = np.array(steps)
+    return gran.ModifiedGranTitration.from_arrays(
+        mass, salinity, acid_conc, temp, steps[:, 2], steps[:, 1],
+        steps[:, 0], cumulative=True
+    )
@@ -0,0 +1,858 @@
+import logging
+from enum import Enum, auto
+from typing import Callable, Generator, Optional, Tuple
+
+from lib.services.ph.ph_interface import pHInterface
+from lib.services.pump.pump_interface import PumpInterface
+from lib.services.titration import (emf, gran, protocol, recovery,
+                                    results, spacing, timing)
+from lib.utils import clocks, metrics
+
+logger = logging.getLogger(__name__)
+
+"""
+##### The titration procedure is written as a generator #####
+
+Every time the routine needs to wait (for the syringe to fill, for acid to
+dispense, for the electrode to equilibrate) it yields the wait time in
+seconds instead of sleeping. Whoever drives the routine decides how to wait:
+the single-station UI schedules the next step with tk's after(), and the
+station manager hands it to a shared scheduler so that many stations can
+wait at the same time without holding a thread each.
+
+##### Steps are pipelined #####
+
+The syringe contents are tracked locally from the last position query, so
+checking whether a dose fits costs no serial traffic. As soon as a dose has
+been dispensed, the previous step is reported (plotted, logged) and the dose
+of the following step is estimated while the acid mixes in. If that dose
+won't fit in what's left, the syringe is refilled right away, during the
+equilibration and measurement of the current step, and the next step only
+waits for the pump if it's still moving. The initial fill likewise overlaps
+the initial measurement, and fills are waited on by polling the pump rather
+than for a fixed time.
+
+##### Protocol #####
+
+The pH targets, the pH step of the second titration and the Gran cutoff
+come from the routine's TitrationProtocol (see protocol.py), so a profile
+chosen by the optimizer can be run without code changes. Where the steps
+of the second titration land is up to its StepPolicy (see spacing.py),
+which steps down by the protocol's pH step by default, and
+ContinuousTitrationRoutine (see continuous.py) replaces them with one slow
+dispense, read throughout.
+
+The final Gran fit works from the pH the meter reports, or, with
+GranAnalysis.EMF, from the emf, with the electrode's E0 and slope
+estimated from the run itself (see emf.py).
+
+##### Timing #####
+
+The time spent filling, dosing, equilibrating, measuring, computing,
+plotting and writing is added up by the routine's PhaseTimer (see
+timing.py); the owner adds its own connect and final write time and stores
+timer.summary() with the result. Finished samples, their step counts and
+refills are also counted in the live metrics (see lib/utils/metrics.py).
+
+Usage:
+    routine = TitrationRoutine(pump, ph_meter, 100.0, 35.0, 0.1)
+    for delay in routine.run():
+        time.sleep(delay)
+    total_alkalinity, gamma, rsq = routine.result
+
+The routine reads the time from its clock (see lib/utils/clocks.py); with
+a VirtualClock and simulated devices it runs in virtual time:
+
+    clock.run(routine.run())
+"""
+
+
+class TitrationPhases(Enum):
+    """Enum values to track which part of the procedure a routine is in.
+    """
+    IDLE = auto()
+    MEASURING = auto()
+    FILLING = auto()
+    INITIAL = auto()
+    AUTO = auto()
+    FINISHED = auto()
+    STOPPED = auto()
+
+
+class GranAnalysis(Enum):
+    """Enum values to choose what the final Gran fit works from.
+    """
+    PH = auto()
+    EMF = auto()
+
+
+class TitrationRoutine:
+    """Runs the full titration procedure on one pump/pH meter pair.
+
+    Args:
+        pump (PumpInterface): connected pump used to dose the acid.
+        ph_meter (pHInterface): connected meter used to take readings.
+        sample_mass (float): mass (in grams) of the sample.
+        salinity (float): salinity (in PSU) of the sample.
+        acid_conc (float): concentration (in moles/l) of the acid titrant.
+        on_status (Callable): optional, called with a short status string
+            whenever the routine moves to a new stage of a step.
+        on_start (Callable): optional, called with the titration object
+            once the initial measurements have been taken.
+        on_step (Callable): optional, called with the titration object
+            after each step's data has been added.
+        log (logging.Logger): optional logger to use instead of the module
+            logger, e.g. to keep per-station log files.
+        prefilled (bool): if True, the syringe has already been filled
+            (e.g. during the previous sample of a batch) and the initial
+            fill is skipped. Defaults to False.
+        defer_analysis (bool): if True, the routine ends after the last
+            step without running the final calculations, so the owner can
+            call finish_titration itself (e.g. on another thread).
+            Defaults to False.
+        journal (StepJournal): optional, journal that every step is
+            appended to as soon as it is measured. The owner finalizes it
+            once the result is known.
+        checkpoint (Checkpoint): optional, checkpoint rewritten after every
+            dose and every measurement so the run can be resumed if the
+            program dies.
+        timer (PhaseTimer): optional, timer the phases of the run are
+            added to, e.g. one already holding the connect time. A new one
+            is created by default.
+        station (str): station label of the routine's metrics. Defaults
+            to the single-station label.
+        clock (Clock): clock the start time and phase timings are read
+            from; should be the devices' clock. Defaults to real time.
+        titration_protocol (TitrationProtocol): targets, step and Gran
+            cutoff of the procedure. Defaults to the standard protocol.
+        step_policy (StepPolicy): chooses the targets of the second
+            titration. Defaults to fixed steps of the protocol's pH step.
+        analysis (GranAnalysis): whether the final fit works from the pH
+            or the emf readings. Defaults to pH.
+
+    Returns:
+        None.
+    """
+    # Wait times (in seconds) between the stages of the procedure
+    dose_wait = 5
+    equilibration_wait = 1
+
+    # Interval (in seconds) between busy checks while waiting on the pump
+    pump_poll_interval = 0.25
+
+    # Factor applied to the estimated next dose when deciding whether to
+    # refill early, since the estimate assumes each step lands on target
+    refill_margin = 1.5
+
+    def __init__(self, pump: PumpInterface, ph_meter: pHInterface,
+                    sample_mass: float, salinity: float, acid_conc: float,
+                    on_status: Optional[Callable[[str], None]] = None,
+                    on_start: Optional[Callable] = None,
+                    on_step: Optional[Callable] = None,
+                    log: Optional[logging.Logger] = None,
+                    prefilled: bool = False,
+                    defer_analysis: bool = False,
+                    journal: Optional[results.StepJournal] = None,
+                    checkpoint: Optional[recovery.Checkpoint] = None,
+                    timer: Optional[timing.PhaseTimer] = None,
+                    station: str = metrics.DEFAULT_STATION,
+                    clock: clocks.Clock = clocks.REAL_CLOCK,
+                    titration_protocol: protocol.TitrationProtocol = (
+                        protocol.DEFAULT_PROTOCOL),
+                    step_policy: spacing.StepPolicy = spacing.FIXED_STEPS,
+                    analysis: GranAnalysis = GranAnalysis.PH) -> None:
+        self.pump = pump
+        self.ph_meter = ph_meter
+
+        self.sample_mass = sample_mass
+        self.salinity = salinity
+        self.acid_conc = acid_conc
+
+        self.on_status = on_status
+        self.on_start = on_start
+        self.on_step = on_step
+        self.log = log or logger
+        self.prefilled = prefilled
+        self.defer_analysis = defer_analysis
+        self.journal = journal
+        self.checkpoint = checkpoint
+        self.station = station
+        self.clock = clock
+        self.protocol = titration_protocol
+        self.step_policy = step_policy
+        self.analysis = analysis
+        self.timer = timer or timing.PhaseTimer(clock=clock.monotonic,
+                                                station=station)
+
+        self.titration = None
+        self.result = None
+        self.started_at = None
+        self.phase = TitrationPhases.IDLE
+
+        # Syringe contents (in steps) as of the last dispense, and whether
+        # a fill has been started that hasn't been waited on yet
+        self.available_steps = None
+        self.refill_pending = False
+        self.refill_count = 0
+        self.stalled_refill_count = 0
+
+        # Dose (in liters) dispensed but not measured yet, whether it has
+        # gone in completely, and whether the routine continues an
+        # interrupted run
+        self.pending_dose = None
+        self.dose_dispensed = False
+        self.resumed = False
+        self._saved_syringe_steps = None
+
+        self._step_unreported = False
+        self._stop_titration = False
+
+    def stop(self) -> None:
+        """Gives the signal to stop the routine before its next step.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        self._stop_titration = True
+        self.log.info("Stopping titration before next step...")
+
+    @classmethod
+    def resume(cls, pump: PumpInterface, ph_meter: pHInterface, state: dict,
+                  **kwargs) -> "TitrationRoutine":
+        """Creates a routine that continues an interrupted run from its
+        last checkpoint.
+
+        Args:
+            pump (PumpInterface): connected pump; it must not have been
+                initialized since the interruption.
+            ph_meter (pHInterface): connected meter.
+            state (dict): checkpoint state, see recovery.load_checkpoint.
+            **kwargs: other TitrationRoutine arguments (callbacks, journal,
+                checkpoint...).
+
+        Returns:
+            TitrationRoutine: the routine, ready to run.
+        """
+        titration_routine = cls(pump, ph_meter, state["sample_mass"],
+                                state["salinity"], state["acid_conc"],
+                                **kwargs)
+        titration_routine.titration = recovery.titration_from_state(state)
+        titration_routine.phase = TitrationPhases[state["phase"]]
+        titration_routine.pending_dose = state["pending_dose"]
+        # Checkpoints written before the flag was saved don't have it
+        titration_routine.dose_dispensed = state.get("dose_dispensed", False)
+        titration_routine.resumed = True
+        # Checkpoints written before the start time was saved don't have it
+        titration_routine.started_at = state.get("started_at")
+        titration_routine._saved_syringe_steps = state["syringe_steps"]
+        return titration_routine
+
+    @property
+    def stopped(self) -> bool:
+        """True if the routine ended because of a stop request.
+        """
+        return self.phase == TitrationPhases.STOPPED
+
+    def run(self) -> Generator[float, None, None]:
+        """Runs the whole procedure, from the initial measurement to the
+        final calculations.
+
+        Args:
+            None.
+
+        Yields:
+            float: time (in seconds) to wait before resuming the routine.
+
+        Returns:
+            None.
+        """
+        # A resumed run keeps the start time of the original run
+        if self.started_at is None:
+            self.started_at = self.clock.time()
+        self.timer.start()
+        try:
+            yield from self._run()
+        finally:
+            # Whether the routine finished, was stopped, or failed, every
+            # step measured so far is on disk
+            if self.journal:
+                self.journal.close()
+
+    def _run(self) -> Generator[float, None, None]:
+        """Body of run, see above.
+
+        Args:
+            None.
+
+        Yields:
+            float: time (in seconds) to wait before resuming the routine.
+
+        Returns:
+            None.
+        """
+        if self.resumed:
+            yield from self.resume_interrupted_step()
+        else:
+            yield from self.start_titration()
+
+        yield from self.initial_titration()
+        if self._stop_titration:
+            self.report_step()
+            self.cancel()
+            return
+
+        yield from self.auto_titration()
+        self.report_step()
+        if self.checkpoint:
+            self.checkpoint.clear()
+        if self._stop_titration:
+            self.cancel()
+            return
+
+        if not self.defer_analysis:
+            self.finish_titration()
+
+    def start_titration(self) -> Generator[float, None, None]:
+        """Takes the initial measurements and fills the syringe.
+
+        Args:
+            None.
+
+        Yields:
+            float: time (in seconds) to wait before resuming the routine.
+
+        Returns:
+            None.
+        """
+        self.phase = TitrationPhases.MEASURING
+
+        if self.prefilled:
+            self.log.info("Syringe already filled, skipping initial fill.")
+            self.sync_syringe_position()
+        else:
+            # The syringe fills while the electrode settles in the sample
+            self.log.info("Filling syringe...")
+            self.start_refill()
+
+        self.set_status("Waiting for pH measurement...")
+        with self.timer.span("equilibrate"):
+            yield self.equilibration_wait
+
+        ph_init, emf_init, temp_init = self.get_phmeter_measurements()
+
+        self.titration = gran.ModifiedGranTitration(
+            self.sample_mass, self.salinity, self.acid_conc,
+            temp_init, ph_init, emf_init
+        )
+        if self.journal:
+            with self.timer.span("write"):
+                self.journal.open(self.titration)
+        if self.on_start:
+            with self.timer.span("plot"):
+                self.on_start(self.titration)
+
+        self.set_status("Titration in progress")
+
+        if self.refill_pending:
+            self.phase = TitrationPhases.FILLING
+            yield from self.finish_refill()
+
+    def resume_interrupted_step(self) -> Generator[float, None, None]:
+        """Picks up an interrupted run where its checkpoint left off: the
+        syringe position is read back from the pump, and a dose that was
+        dispensed but never measured is measured now instead of being
+        dispensed again.
+
+        Args:
+            None.
+
+        Yields:
+            float: time (in seconds) to wait before resuming the routine.
+
+        Returns:
+            None.
+        """
+        self.log.info("Resuming titration after step %d...",
+                      self.titration.ph_array.size - 1)
+        self.set_status("Resuming titration...")
+
+        # The pump may still be finishing a refill or a dose started before
+        # the interruption
+        yield from self.wait_for_pump()
+        self.sync_syringe_position()
+        if self.available_steps != self._saved_syringe_steps:
+            self.log.info("Syringe at %d steps, checkpoint had %s.",
+                          self.available_steps, self._saved_syringe_steps)
+        if self.pending_dose is not None:
+            self.pending_dose = self.check_pending_dose()
+
+        if self.journal:
+            with self.timer.span("write"):
+                self.journal.open(self.titration)
+        if self.on_start:
+            with self.timer.span("plot"):
+                self.on_start(self.titration)
+
+        if self.pending_dose is not None:
+            self.log.info("Measuring the dose dispensed before the "
+                          "interruption...")
+            self.set_status("Waiting for pH measurement...")
+            with self.timer.span("equilibrate"):
+                yield self.equilibration_wait
+
+            pH, emf, _ = self.get_phmeter_measurements()
+            self.log.info("pH: %s, emf: %s", pH, emf)
+            self.record_step(pH, emf, self.pending_dose)
+
+        self.set_status("Titration in progress")
+
+    def check_pending_dose(self) -> Optional[float]:
+        """Works out from the plunger how much of the dose pending at the
+        interruption went in. The checkpoint holds the syringe position
+        from before the dose, so a plunger that hasn't moved means the
+        dose was never dispensed, and it is dosed again as the next step.
+        A dose the checkpoint marks as dispensed is measured whatever the
+        plunger says, since the syringe may have been refilled since.
+
+        Args:
+            None.
+
+        Returns:
+            float: the volume (in liters) dispensed, to be measured, or
+                None if nothing was.
+        """
+        if self.dose_dispensed:
+            return self.pending_dose
+
+        dose_steps = self.pump.liters_to_steps(self.pending_dose)
+        moved = self._saved_syringe_steps - self.available_steps
+
+        if moved == dose_steps:
+            return self.pending_dose
+        if moved <= 0:
+            self.log.info("Pending dose was not dispensed, dosing again.")
+            return None
+
+        # A move cut short, e.g. by a power loss, still put some acid in
+        self.log.warning("Only %d of %d steps of the pending dose were "
+                         "dispensed.", moved, dose_steps)
+        return self.pending_dose * min(moved / dose_steps, 1.0)
+
+    def initial_titration(self) -> Generator[float, None, None]:
+        """Runs the initial titration procedure from the starting pH to
+        the first target pH where data will be collected.
+
+        Args:
+            None.
+
+        Yields:
+            float: time (in seconds) to wait before resuming the routine.
+
+        Returns:
+            None.
+        """
+        self.phase = TitrationPhases.INITIAL
+
+        while not self._stop_titration:
+            # Check if last pH reading is below target, if so move to next step
+            first_ph_target = self.protocol.first_ph_target
+            if self.titration.get_last_ph() <= first_ph_target:
+                self.log.info(
+                    "Reached pH target. Moving to second titration step..."
+                )
+                return
+
+            # Shoot for slightly below target to make sure target is reached
+            stepwise_ph_target = first_ph_target - 0.01
+
+            yield from self.run_titration_step(stepwise_ph_target)
+
+    def auto_titration(self) -> Generator[float, None, None]:
+        """Runs the second titration, in smaller steps, to collect data
+        for the total alkalinity estimate.
+
+        Args:
+            None.
+
+        Yields:
+            float: time (in seconds) to wait before resuming the routine.
+
+        Returns:
+            None.
+        """
+        self.phase = TitrationPhases.AUTO
+
+        while not self._stop_titration:
+            last_ph = self.titration.get_last_ph()
+
+            # Check if last pH reading is below target, if so stop the
+            # routine so the calculations can be run
+            if last_ph <= self.protocol.second_ph_target:
+                self.log.info("Titration finished.")
+                self.log.info("Final pH: %s", last_ph)
+                return
+
+            # Collect data moving downward, in steps chosen by the policy
+            with self.timer.span("compute"):
+                stepwise_ph_target = self.step_policy.next_target(
+                    self.titration, self.protocol
+                )
+
+            yield from self.run_titration_step(stepwise_ph_target)
+
+    def run_titration_step(self,
+                              ph_target: float) -> Generator[float, None, None]:
+        """Handles the addition of acid and gathers measurements at
+        each individual titration step.
+
+        Args:
+            ph_target (float): desired pH at the end of the step.
+
+        Yields:
+            float: time (in seconds) to wait before resuming the routine.
+
+        Returns:
+            None.
+        """
+        titration = self.titration
+
+        # Get the volume of acid required to dose at the next step, in liters
+        with self.timer.span("compute"):
+            required_acid_vol_liters = titration.calc_required_acid_vol(
+                ph_target
+            )
+
+        required_acid_vol_ul = round(required_acid_vol_liters * 1e6, 2)
+
+        yield from self.make_room(required_acid_vol_liters)
+
+        # Dispense required volume of acid; the checkpoint is written first,
+        # with the syringe position before the dose, so a resume can tell
+        # from the plunger whether the dose went in
+        with self.timer.span("dose"):
+            self.log.info("Dispensing: %s uL", required_acid_vol_ul)
+            self.pending_dose = required_acid_vol_liters
+            self.save_checkpoint()
+            self.pump.dispense(required_acid_vol_liters)
+            self.available_steps -= self.pump.liters_to_steps(
+                required_acid_vol_liters
+            )
+            self.set_status("Dosing...")
+
+            # Everything that doesn't need the pump or meter is done while
+            # the acid goes in
+            self.report_step()
+            next_acid_vol_liters = self.estimate_next_dose(ph_target)
+            self.log.debug("Target pH: %s, syringe: %d steps, next dose: %s L",
+                           ph_target, self.available_steps,
+                           next_acid_vol_liters)
+
+            # Wait to dispense acid
+            yield self.dose_wait
+
+        if (next_acid_vol_liters is not None and not self.check_dose_fits(
+                next_acid_vol_liters * self.refill_margin)):
+            self.log.info("Next dose won't fit, re-filling during "
+                          "equilibration...")
+            self.set_status("Refilling syringe...")
+            # The refill moves the plunger back past where the dose left
+            # it, so the checkpoint has to say the dose is in before then
+            yield from self.wait_for_pump()
+            self.dose_dispensed = True
+            self.save_checkpoint()
+            self.start_refill()
+
+        self.set_status("Waiting for pH measurement...")
+        with self.timer.span("equilibrate"):
+            yield self.equilibration_wait
+
+        # Take pH, emf measurements -- this call is blocking
+        pH, emf, _ = self.get_phmeter_measurements()
+        self.log.info("pH: %s, emf: %s", pH, emf)
+
+        self.set_status("Titration in progress")
+
+        self.record_step(pH, emf, required_acid_vol_liters)
+
+    def record_step(self, pH: float, emf: float, volume: float) -> None:
+        """Adds a measured step to the titration, the journal, and the
+        checkpoint. The step is reported once the next dose is on its way
+        (or when the routine ends).
+
+        Args:
+            pH (float): the pH at the end of the step.
+            emf (float): the emf (in mV) at the end of the step.
+            volume (float): the volume (in liters) dosed during the step.
+
+        Returns:
+            None.
+        """
+        self.titration.add_step_data(pH, emf, volume)
+        if self.journal:
+            with self.timer.span("write"):
+                self.journal.append(self.titration.get_last_volume(), emf, pH)
+
+        self.pending_dose = None
+        self.dose_dispensed = False
+        self.save_checkpoint()
+        self._step_unreported = True
+
+    def save_checkpoint(self) -> None:
+        """Rewrites the checkpoint, if any, with the current state. A
+        failed write is logged but doesn't stop the run.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if not self.checkpoint:
+            return
+
+        try:
+            with self.timer.span("write"):
+                self.checkpoint.save(self.titration, self.phase.name,
+                                     self.available_steps, self.pending_dose,
+                                     self.started_at, self.dose_dispensed)
+        except OSError as e:
+            self.log.error("Writing checkpoint failed with error: %s", e)
+
+    def report_step(self) -> None:
+        """Passes the titration to the on_step callback if a step has been
+        added since the last report.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if not self._step_unreported:
+            return
+
+        self._step_unreported = False
+        if self.on_step:
+            with self.timer.span("plot"):
+                self.on_step(self.titration)
+
+    def estimate_next_dose(self, ph_target: float) -> Optional[float]:
+        """Estimates the dose of the step after the current one, assuming
+        the current step lands on its target and the next one aims at the
+        step policy's lookahead target.
+
+        Args:
+            ph_target (float): target pH of the current step.
+
+        Returns:
+            float: estimated dose (in liters), or None if the current step
+                should be the last one.
+        """
+        if ph_target <= self.protocol.second_ph_target:
+            return None
+
+        # Doses from the last reading add up, so the next dose is the
+        # difference between dosing to both targets
+        with self.timer.span("compute"):
+            next_target = self.step_policy.lookahead_target(ph_target,
+                                                            self.protocol)
+            return (self.titration.calc_required_acid_vol(next_target)
+                    - self.titration.calc_required_acid_vol(ph_target))
+
+    def make_room(self, volume: float) -> Generator[float, None, None]:
+        """Makes sure a dose is in the syringe before dispensing it,
+        finishing a started refill and refilling if it still doesn't fit.
+
+        Args:
+            volume (float): the volume (in liters) of the dose.
+
+        Yields:
+            float: time (in seconds) to wait before checking the pump again.
+
+        Returns:
+            None.
+        """
+        # A refill started during the last step normally finishes long
+        # before this point, so this rarely waits at all
+        if self.refill_pending:
+            yield from self.finish_refill()
+
+        if not self.check_dose_fits(volume):
+            self.log.info("Volume low, re-filling...")
+            self.stalled_refill_count += 1
+            metrics.STALLED_REFILLS.inc(station=self.station)
+            self.start_refill()
+            yield from self.finish_refill()
+
+    def check_dose_fits(self, volume: float) -> bool:
+        """Checks a dose against the tracked syringe contents, without
+        querying the pump.
+
+        Args:
+            volume (float): the volume (in liters) of the dose.
+
+        Returns:
+            bool: True if the volume is available, False otherwise.
+        """
+        if self.available_steps is None:
+            self.sync_syringe_position()
+        return self.available_steps > self.pump.liters_to_steps(volume)
+
+    def sync_syringe_position(self) -> None:
+        """Reads the syringe position from the pump into the tracked
+        syringe contents.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        self.available_steps = self.pump.get_syringe_position()
+
+    def start_refill(self) -> None:
+        """Starts filling the syringe without waiting for it to finish.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        with self.timer.span("fill"):
+            self.pump.fill()
+        self.refill_pending = True
+        self.refill_count += 1
+        metrics.REFILLS.inc(station=self.station)
+
+    def finish_refill(self) -> Generator[float, None, None]:
+        """Waits for a started fill to finish and re-reads the syringe
+        position.
+
+        Args:
+            None.
+
+        Yields:
+            float: time (in seconds) to wait before checking the pump again.
+
+        Returns:
+            None.
+        """
+        with self.timer.span("fill"):
+            yield from self.wait_for_pump()
+            self.sync_syringe_position()
+        self.refill_pending = False
+
+    def finish_titration(self) -> Tuple[float, float, float]:
+        """Runs the final calculations once the titration is finished.
+
+        Args:
+            None.
+
+        Returns:
+            tuple containing:
+             - total_alkalinity (float): estimated total alkalinity.
+             - gamma (float): quality of fit metric.
+             - rsq (float): R-squared of the fit.
+        """
+        with self.timer.span("compute"):
+            if self.analysis == GranAnalysis.EMF:
+                total_alkalinity, gamma, rsq = emf.emf_gran_fit(
+                    self.titration, self.protocol.gran_ph_cutoff
+                )
+            else:
+                total_alkalinity, gamma, rsq = (
+                    self.titration.gran_polynomial_fit(
+                        self.protocol.gran_ph_cutoff
+                    )
+                )
+        self.log.info("TA: %s, Gamma: %s, Rsq: %s", total_alkalinity, gamma,
+                      rsq)
+
+        self.result = (total_alkalinity, gamma, rsq)
+        self.phase = TitrationPhases.FINISHED
+        metrics.SAMPLES_COMPLETED.inc(station=self.station)
+        metrics.STEPS_PER_SAMPLE.observe(self.titration.ph_array.size - 1,
+                                         station=self.station)
+        return self.result
+
+    def cancel(self) -> None:
+        """Marks the routine as stopped after a stop request.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        self.log.info("Titration cancelled.")
+        self.phase = TitrationPhases.STOPPED
+        if self.checkpoint:
+            self.checkpoint.clear()
+
+    def wait_for_pump(self) -> Generator[float, None, None]:
+        """Waits until the pump reports that it is ready for another command.
+
+        Args:
+            None.
+
+        Yields:
+            float: time (in seconds) to wait before checking again.
+
+        Returns:
+            None.
+        """
+        while not self.pump.check_module_ready():
+            yield self.pump_poll_interval
+
+    def get_phmeter_reading(self) -> dict:
+        """Polls the pH meter for a reading, trying again once if it fails.
+
+        Args:
+            None.
+
+        Returns:
+            dict: the meter's reading, see pHInterface.get_measurement.
+        """
+        with self.timer.span("measure"):
+            try:
+                return self.ph_meter.get_measurement()
+            except IndexError:
+                self.log.info("pH measurement failed, trying again...")
+                return self.ph_meter.get_measurement()
+
+    def get_phmeter_measurements(self) -> Tuple[float, float, float]:
+        """Polls the pH meter for the current measurements of pH, emf,
+        and temperature.
+
+        Args:
+            None.
+
+        Returns:
+            tuple containing:
+             - float: pH value from the meter casted to float.
+             - float: emf value from the meter casted to float.
+             - float: temperature value from the meter casted to float.
+        """
+        meas = self.get_phmeter_reading()
+
+        ph_meas = meas["pH"]
+        emf_meas = meas["mV"]
+        temp_meas = meas["temp"]
+
+        return float(ph_meas), float(emf_meas), float(temp_meas)
+
+    def set_status(self, status: str) -> None:
+        """Reports a status update to the owner of the routine, if any.
+
+        Args:
+            status (str): short description of the current stage.
+
+        Returns:
+            None.
+        """
+        if self.on_status:
+            self.on_status(status)
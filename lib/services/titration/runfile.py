@@ -0,0 +1,373 @@
+import argparse
+import errno
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from typing import List, Optional
+
+import numpy as np
+
+from lib.services.titration import gran, store
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Binary run files #####
+
+A run file holds one titration in a form that can be read without any
+parsing of the data itself:
+
+offset 0   magic b"OALKRUN\\0"
+offset 8   format version, uint16 little-endian
+offset 10  length of the metadata header in bytes, uint32 little-endian
+offset 14  metadata header, utf-8 JSON, e.g.
+           {"n_steps": 12, "columns": ["volume_L", "emf_mV", "pH",
+            "temp_C", "time_s"], "sample_mass_g": 100.0, "salinity": 35.0,
+            "acid_conc_M": 0.1, "temp_C": 25.0, "total_alk_umol_kg": 2250.1,
+            "sample_id": "CRM-205", "started_at": 1714555840.0}
+           padded with spaces so the data starts on an 8-byte boundary
+data       one contiguous little-endian float64 column per entry of
+           "columns", each n_steps + 1 values long (the initial reading
+           comes first)
+
+Readers map the file into memory and hand out read-only numpy views of
+the columns, so opening a run costs one small JSON parse no matter how
+many steps it has. A file is only mapped once its columns are first used,
+since before python 3.13 every open map holds a file descriptor; QC over
+very large archives should still start from load_summary, which only reads
+the headers. Running out of file descriptors is raised rather than taken
+for an unreadable file, so a bulk load never silently leaves runs out.
+
+Unknown values (e.g. the step times of runs converted from csv files) are
+stored as NaN.
+
+Converting csv result files:
+
+    python -m lib.services.titration.runfile convert archive/ *.csv
+"""
+
+MAGIC = b"OALKRUN\0"
+FORMAT_VERSION = 1
+RUNFILE_EXTENSION = ".oalk"
+
+COLUMNS = ["volume_L", "emf_mV", "pH", "temp_C", "time_s"]
+
+PREAMBLE = struct.Struct("<8sHI")
+
+# Column data is always little-endian float64
+COLUMN_DTYPE = np.dtype("<f8")
+
+# Metadata fields returned by load_summary, with their numpy types
+SUMMARY_DTYPE = np.dtype([
+    ("started_at", "f8"), ("sample_mass_g", "f8"), ("salinity", "f8"),
+    ("acid_conc_M", "f8"), ("temp_C", "f8"), ("total_alk_umol_kg", "f8"),
+    ("n_steps", "i8"),
+])
+
+# Maps don't need to keep their own file descriptor where python allows it
+MMAP_KWARGS = {"trackfd": False} if sys.version_info >= (3, 13) else {}
+
+# Errors meaning the process or system is out of file descriptors, which
+# bulk loads raise instead of skipping the file
+FD_LIMIT_ERRNOS = (errno.EMFILE, errno.ENFILE)
+
+
+def write_run(filepath: str, columns: dict, metadata: dict) -> None:
+    """Writes a run file, replacing any existing file atomically.
+
+    Args:
+        filepath (str): location of the file to write.
+        columns (dict): column name -> 1-D array, for every name in COLUMNS;
+            all of the same length.
+        metadata (dict): JSON-serializable run metadata.
+
+    Returns:
+        None.
+    """
+    arrays = [np.ascontiguousarray(columns[name], dtype=COLUMN_DTYPE)
+              for name in COLUMNS]
+    n_values = arrays[0].size
+    if any(array.shape != (n_values,) for array in arrays):
+        raise ValueError("Every column must be 1-D and of the same length.")
+
+    header = dict(metadata, n_steps=n_values - 1, columns=COLUMNS)
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (-(PREAMBLE.size + len(header_bytes)) % 8)
+
+    tmp_path = filepath + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for array in arrays:
+            f.write(array.tobytes())
+    os.replace(tmp_path, filepath)
+
+
+def write_titration(filepath: str, titration: gran.ModifiedGranTitration,
+                      total_alkalinity: float,
+                      temps: Optional[np.ndarray] = None,
+                      times: Optional[np.ndarray] = None,
+                      **metadata) -> None:
+    """Writes a titration to a run file.
+
+    Args:
+        filepath (str): location of the file to write.
+        titration (ModifiedGranTitration): gran titration object.
+        total_alkalinity (float): estimated total alkalinity value.
+        temps (np.ndarray): optional, temperature (in C) at each step.
+            Defaults to the initial temperature throughout.
+        times (np.ndarray): optional, time (in seconds since the start)
+            of each step. Defaults to NaN throughout.
+        **metadata: extra JSON-serializable metadata, e.g. sample_id.
+
+    Returns:
+        None.
+    """
+    n_values = titration.ph_array.size
+    if temps is None:
+        temps = np.full(n_values, titration.temp_C)
+    if times is None:
+        times = np.full(n_values, np.nan)
+
+    columns = {"volume_L": titration.volume_array,
+               "emf_mV": titration.emf_array, "pH": titration.ph_array,
+               "temp_C": temps, "time_s": times}
+    metadata.update(sample_mass_g=titration.sample_mass_kg * 1000,
+                    salinity=titration.salinity,
+                    acid_conc_M=titration.acid_conc_M,
+                    temp_C=titration.temp_C,
+                    total_alk_umol_kg=total_alkalinity)
+    write_run(filepath, columns, metadata)
+
+
+class RunFile:
+    """Memory-mapped, read-only view of a run file.
+
+    Only the header is read when the run is opened; the file is mapped on
+    the first use of its columns. The column arrays are views into the
+    mapped file and stay valid for as long as they are referenced, even
+    after the RunFile itself is dropped.
+
+    Args:
+        filepath (str): location of the run file.
+
+    Returns:
+        None.
+    """
+    def __init__(self, filepath: str) -> None:
+        self.filepath = filepath
+        self._map = None
+        self._columns = None
+
+        with open(filepath, "rb") as f:
+            header_len = _check_preamble(f.read(PREAMBLE.size), filepath)
+            self.metadata = json.loads(f.read(header_len).decode("utf-8"))
+            size = os.fstat(f.fileno()).st_size
+
+        self._data_offset = PREAMBLE.size + header_len
+        n_values = self.metadata["n_steps"] + 1
+        column_bytes = n_values * COLUMN_DTYPE.itemsize
+        if size < self._data_offset + column_bytes * len(COLUMNS):
+            raise ValueError(f"{filepath} is truncated.")
+
+    @property
+    def columns(self) -> dict:
+        """Column name -> read-only view of the column in the mapped file.
+        The file is mapped on first use.
+        """
+        if self._columns is None:
+            with open(self.filepath, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0,
+                                      access=mmap.ACCESS_READ, **MMAP_KWARGS)
+
+            n_values = self.metadata["n_steps"] + 1
+            column_bytes = n_values * COLUMN_DTYPE.itemsize
+            self._columns = {
+                name: np.frombuffer(
+                    self._map, dtype=COLUMN_DTYPE, count=n_values,
+                    offset=self._data_offset + i * column_bytes
+                )
+                for i, name in enumerate(self.metadata["columns"])
+            }
+        return self._columns
+
+    @property
+    def volume(self) -> np.ndarray:
+        """Total volume (in liters) added at each step.
+        """
+        return self.columns["volume_L"]
+
+    @property
+    def emf(self) -> np.ndarray:
+        """Emf (in mV) at each step.
+        """
+        return self.columns["emf_mV"]
+
+    @property
+    def ph(self) -> np.ndarray:
+        """pH at each step.
+        """
+        return self.columns["pH"]
+
+    @property
+    def temp(self) -> np.ndarray:
+        """Temperature (in C) at each step.
+        """
+        return self.columns["temp_C"]
+
+    @property
+    def time(self) -> np.ndarray:
+        """Time (in seconds since the start) of each step.
+        """
+        return self.columns["time_s"]
+
+    def to_titration(self) -> gran.ModifiedGranTitration:
+        """Builds a titration from the run, sharing the mapped arrays.
+
+        Args:
+            None.
+
+        Returns:
+            ModifiedGranTitration: titration holding every step.
+        """
+        meta = self.metadata
+        return gran.ModifiedGranTitration.from_arrays(
+            meta["sample_mass_g"], meta["salinity"], meta["acid_conc_M"],
+            meta["temp_C"], self.ph, self.emf, self.volume, cumulative=True
+        )
+
+
+def _check_preamble(preamble: bytes, filepath: str) -> int:
+    """Validates the fixed-size start of a run file.
+
+    Args:
+        preamble (bytes): the first PREAMBLE.size bytes of the file.
+        filepath (str): location of the file, for error messages.
+
+    Returns:
+        int: length of the metadata header in bytes.
+    """
+    if len(preamble) < PREAMBLE.size:
+        raise ValueError(f"{filepath} is not a run file.")
+
+    magic, version, header_len = PREAMBLE.unpack(preamble)
+    if magic != MAGIC:
+        raise ValueError(f"{filepath} is not a run file.")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported run file version {version} in "
+                         f"{filepath}.")
+    return header_len
+
+
+def read_metadata(filepath: str) -> dict:
+    """Reads only the metadata header of a run file.
+
+    Args:
+        filepath (str): location of the run file.
+
+    Returns:
+        dict: the run metadata.
+    """
+    with open(filepath, "rb") as f:
+        header_len = _check_preamble(f.read(PREAMBLE.size), filepath)
+        return json.loads(f.read(header_len).decode("utf-8"))
+
+
+def load_summary(filepaths: List[str]) -> np.ndarray:
+    """Reads the metadata of many run files into one array, e.g. for QC
+    of a whole archive. Files that can't be read are logged and skipped.
+
+    Args:
+        filepaths (list): locations of the run files.
+
+    Returns:
+        np.ndarray: structured array with the fields of SUMMARY_DTYPE, one
+            entry per readable file. Missing values are NaN.
+
+    Raises:
+        OSError: if the process runs out of file descriptors.
+    """
+    def summaries():
+        for filepath in filepaths:
+            try:
+                meta = read_metadata(filepath)
+            except (OSError, ValueError) as e:
+                if isinstance(e, OSError) and e.errno in FD_LIMIT_ERRNOS:
+                    raise
+                logger.error(f"Skipping {filepath}: {e}")
+                continue
+            yield tuple(np.nan if meta.get(name) is None else meta[name]
+                        for name in SUMMARY_DTYPE.names)
+
+    return np.fromiter(summaries(), dtype=SUMMARY_DTYPE)
+
+
+def load_runs(filepaths: List[str]) -> List[RunFile]:
+    """Opens many run files; files that can't be read are logged and
+    skipped.
+
+    Args:
+        filepaths (list): locations of the run files.
+
+    Returns:
+        list: the opened runs, in the given order.
+
+    Raises:
+        OSError: if the process runs out of file descriptors.
+    """
+    runs = []
+    for filepath in filepaths:
+        try:
+            runs.append(RunFile(filepath))
+        except (OSError, ValueError, KeyError) as e:
+            if isinstance(e, OSError) and e.errno in FD_LIMIT_ERRNOS:
+                raise
+            logger.error(f"Skipping {filepath}: {e}")
+    return runs
+
+
+def convert_csv(csv_path: str, out_dir: str) -> str:
+    """Converts a csv result file (see results.write_csv) to a run file.
+
+    Args:
+        csv_path (str): location of the csv file.
+        out_dir (str): directory for the run file.
+
+    Returns:
+        str: location of the run file.
+    """
+    titration, total_alkalinity = store.read_csv(csv_path)
+    started_at, sample_id = store.parse_filename(csv_path)
+
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    filepath = os.path.join(out_dir, name + RUNFILE_EXTENSION)
+    write_titration(filepath, titration, total_alkalinity,
+                    sample_id=sample_id, started_at=started_at)
+    return filepath
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAlk run files")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = commands.add_parser(
+        "convert", help="Convert csv result files to run files."
+    )
+    convert_parser.add_argument("out_dir")
+    convert_parser.add_argument("files", nargs="+")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    converted = 0
+    for csv_path in args.files:
+        try:
+            convert_csv(csv_path, args.out_dir)
+            converted += 1
+        except (OSError, ValueError, IndexError) as e:
+            logger.error(f"Skipping {csv_path}: {e}")
+    print(f"Converted {converted} of {len(args.files)} files.")
@@ -0,0 +1,173 @@
+import logging
+from typing import Optional, Tuple
+
+import numpy as np
+
+from lib.services.ph import orion_star
+from lib.services.ph.simulator import SimulatedMeterPort
+from lib.services.pump import norgren
+from lib.services.pump.simulator import SimulatedPumpPort
+from lib.services.titration import forward
+from lib.services.titration.emf import NERNST_MV_PER_K
+from lib.utils import clocks
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Simulated titrations #####
+
+A SimulatedSample is a seawater sample of known total alkalinity that
+acid can be added to; its pH follows from the charge balance of the
+carbonate, borate and water systems (see forward.py), using the same
+equilibrium constants as ModifiedGranTitration. simulated_devices connects the real pump and
+meter drivers to simulated serial ports (see pump/simulator.py and
+ph/simulator.py) dosing into and measuring the sample, all on one clock.
+
+With a VirtualClock, a whole titration replays in a fraction of a second
+of real time and gives the same result every time for the same seed:
+
+    clock = clocks.VirtualClock()
+    sample = SimulatedSample(2300.0, 35.0)
+    pump, meter = simulated_devices(clock, sample)
+    titration_routine = routine.TitrationRoutine(
+        pump, meter, sample.sample_mass, sample.salinity, sample.acid_conc,
+        clock=clock
+    )
+    clock.run(titration_routine.run())
+"""
+
+class SimulatedSample:
+    """A sample of known composition that acid is added to.
+
+    Args:
+        total_alkalinity (float): total alkalinity (in umol/kg).
+        salinity (float): salinity (in PSU).
+        temp (float): temperature (in C). Defaults to 25.
+        sample_mass (float): mass (in grams). Defaults to 100.
+        acid_conc (float): concentration (in moles/l) of the acid titrant.
+            Defaults to 0.1.
+        dic (float): dissolved inorganic carbon (in umol/kg). Defaults to
+            the salinity-based estimate used by ModifiedGranTitration.
+        ph_noise (float): standard deviation of the noise added to each
+            pH reading. Defaults to 0.
+        e0 (float): standard potential (in mV) of the electrode.
+        seed (int): seed of the reading noise.
+
+    Returns:
+        None.
+    """
+    def __init__(self, total_alkalinity: float, salinity: float,
+                    temp: float = 25.0, sample_mass: float = 100.0,
+                    acid_conc: float = 0.1, dic: Optional[float] = None,
+                    ph_noise: float = 0.0, e0: float = 400.0,
+                    seed: int = 0) -> None:
+        self.total_alkalinity = total_alkalinity
+        self.salinity = salinity
+        self.temp = temp
+        self.sample_mass = sample_mass
+        self.acid_conc = acid_conc
+        self.ph_noise = ph_noise
+        self.e0 = e0
+        self.rng = np.random.default_rng(seed)
+
+        # Equilibrium constants and borate come from the same formulas the
+        # calculations use
+        constants = forward.equilibrium_constants(salinity, temp)
+        self.K1 = float(constants["k1"])
+        self.K2 = float(constants["k2"])
+        self.KW = float(constants["kw"])
+        self.KB = float(constants["kb"])
+        self.BT = float(constants["bt"])
+        self.DIC = float(constants["dic"]) if dic is None else dic * 1e-6
+
+        self.acid_added = 0.0
+
+    def add_acid(self, volume: float) -> None:
+        """Adds acid to the sample.
+
+        Args:
+            volume (float): volume (in liters) of acid added.
+
+        Returns:
+            None.
+        """
+        self.acid_added += volume
+
+    def ph_curve(self, volumes) -> np.ndarray:
+        """Predicts the pH of the sample after given volumes of acid,
+        regardless of the acid added so far.
+
+        Args:
+            volumes (array_like): total acid volumes (in liters).
+
+        Returns:
+            np.ndarray: pH after each volume, without noise.
+        """
+        return forward.forward_ph(
+            volumes, self.total_alkalinity * 1e-6, self.DIC, self.BT,
+            self.K1, self.K2, self.KB, self.KW, self.sample_mass,
+            self.acid_conc
+        )
+
+    def true_ph(self) -> float:
+        """Solves the charge balance for the pH at the acid added so far.
+
+        Args:
+            None.
+
+        Returns:
+            float: pH of the sample, without noise.
+        """
+        return float(self.ph_curve([self.acid_added])[0])
+
+    def measure(self) -> Tuple[float, float, float]:
+        """Takes a reading of the sample, as the meter would.
+
+        Args:
+            None.
+
+        Returns:
+            tuple containing:
+             - float: pH, with noise.
+             - float: emf (in mV).
+             - float: temperature (in C).
+        """
+        ph = self.true_ph()
+        if self.ph_noise:
+            ph += self.rng.normal(0.0, self.ph_noise)
+        emf = self.e0 - NERNST_MV_PER_K * (self.temp + 273.15) * ph
+        return ph, emf, self.temp
+
+
+def simulated_devices(clock: clocks.Clock, sample: SimulatedSample,
+                         stabilize_time: float = 20.0
+                         ) -> Tuple[norgren.VersaPumpV6,
+                                    orion_star.OrionStarA215]:
+    """Builds a pump and a meter, with their real drivers, connected to
+    simulated devices dosing into and measuring the given sample.
+
+    Args:
+        clock (Clock): clock the devices run on.
+        sample (SimulatedSample): the sample being titrated.
+        stabilize_time (float): time (in seconds) each pH reading takes.
+
+    Returns:
+        tuple containing:
+         - VersaPumpV6: the pump, with its syringe empty.
+         - OrionStarA215: the meter.
+    """
+    pump = norgren.VersaPumpV6(serial_port_loc="sim-pump", clock=clock)
+    pump_port = SimulatedPumpPort(clock, on_dispense=sample.add_acid)
+    pump.serial_port = pump_port
+
+    def measure() -> Tuple[float, float, float]:
+        """Measures the sample with the acid the pump has pushed out so
+        far, including during a slow dispense.
+        """
+        pump_port.update()
+        return sample.measure()
+
+    meter = orion_star.OrionStarA215(serial_port_loc="sim-meter", clock=clock)
+    meter.serial_port = SimulatedMeterPort(clock, measure,
+                                           stabilize_time=stabilize_time)
+    return pump, meter
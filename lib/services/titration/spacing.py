@@ -0,0 +1,317 @@
+import logging
+
+import numpy as np
+
+from lib.services.titration import gran
+from lib.services.titration.protocol import TitrationProtocol
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Step spacing of the second titration #####
+
+A StepPolicy chooses the target pH of each step of the second titration
+(TitrationRoutine.auto_titration), from the titration so far and the
+routine's protocol. FixedStepPolicy steps down by the protocol's pH step,
+which is what the routine has always done.
+
+AdaptiveStepPolicy places the steps where they tell the most about the
+equivalence volume, Veq = -intercept / slope of the Gran fit, per step
+spent. The noise of a step's Gran function comes from the pH reading
+noise, which grows with [H+]:
+
+    sd(y) = ln(10) * y * ph_noise,    with y = (m + V) * [H+],
+
+and from the volume noise, through the slope. The fit is ordinary least
+squares (see gran_polynomial_fit), so its covariance is the sandwich
+(X'X)^-1 X' diag(sd^2) X (X'X)^-1, and the variance of Veq follows by the
+delta method.
+
+Steps close to the cutoff pin down Veq, while steps near the end are
+noisy; yet the run has to reach the second target, and that last step is
+part of the fit. So for each candidate target, from the current fit, the
+policy predicts the variance of Veq at the end of the run, if the rest is
+done in as few steps as the bounds allow, and picks the candidate with the
+smallest variance times the number of steps in the run: the largest
+reduction of the variance per step. Steps are between min_step and
+max_step pH, and doses between min_dose and max_dose, on a grid of
+PH_RESOLUTION.
+
+Until there are two steps under the cutoff, the fit is completed with the
+ideal Gran slope, i.e. the acid concentration. Above the cutoff, the
+policy takes the protocol's pH step.
+
+    routine = TitrationRoutine(pump, ph_meter, 100.0, 35.0, 0.1,
+                               step_policy=AdaptiveStepPolicy())
+"""
+
+LN10 = np.log(10)
+PH_RESOLUTION = 0.01
+
+
+class StepPolicy:
+    """
+    This class defines how the second titration chooses its targets;
+    specific policies should use this class as the parent.
+    """
+    def next_target(self, titration: gran.ModifiedGranTitration,
+                      protocol: TitrationProtocol) -> float:
+        """Chooses the target pH of the next step.
+
+        Args:
+            titration (ModifiedGranTitration): the titration so far.
+            protocol (TitrationProtocol): protocol of the routine.
+
+        Returns:
+            float: target pH of the next step.
+        """
+        raise NotImplementedError("Use derived step policy class!")
+
+    def lookahead_target(self, ph_target: float,
+                           protocol: TitrationProtocol) -> float:
+        """Gives the target of the step after one aiming at ph_target,
+        before it's known where that step lands. Used to plan refills, so
+        policies should err towards the lower, i.e. larger dose, target.
+
+        Args:
+            ph_target (float): target pH of the current step.
+            protocol (TitrationProtocol): protocol of the routine.
+
+        Returns:
+            float: target pH of the following step.
+        """
+        raise NotImplementedError("Use derived step policy class!")
+
+
+class FixedStepPolicy(StepPolicy):
+    """Steps down by the protocol's pH step.
+    """
+    def next_target(self, titration: gran.ModifiedGranTitration,
+                      protocol: TitrationProtocol) -> float:
+        """Aims one pH step below the last reading.
+
+        Args:
+            titration (ModifiedGranTitration): the titration so far.
+            protocol (TitrationProtocol): protocol of the routine.
+
+        Returns:
+            float: target pH of the next step.
+        """
+        return titration.get_last_ph() - protocol.ph_step
+
+    def lookahead_target(self, ph_target: float,
+                           protocol: TitrationProtocol) -> float:
+        """Aims one pH step below the current target.
+
+        Args:
+            ph_target (float): target pH of the current step.
+            protocol (TitrationProtocol): protocol of the routine.
+
+        Returns:
+            float: target pH of the following step.
+        """
+        return ph_target - protocol.ph_step
+
+
+class AdaptiveStepPolicy(StepPolicy):
+    """Places each step to reduce the variance of Veq the most per step,
+    see above.
+
+    Args:
+        ph_noise (float): standard deviation of a pH reading. Defaults to
+            0.002.
+        volume_noise (float): standard deviation (in liters) of a recorded
+            volume. Defaults to 5e-8, about a pump step.
+        min_step (float): smallest pH step. Defaults to 0.05.
+        max_step (float): largest pH step. Defaults to 0.4.
+        min_dose (float): smallest dose (in liters). Defaults to 10 uL.
+        max_dose (float): largest dose (in liters). Defaults to 400 uL.
+
+    Returns:
+        None.
+
+    Raises:
+        ValueError: if a range is empty.
+    """
+    def __init__(self, ph_noise: float = 0.002, volume_noise: float = 5e-8,
+                    min_step: float = 0.05, max_step: float = 0.4,
+                    min_dose: float = 10e-6, max_dose: float = 400e-6
+                    ) -> None:
+        if not 0 < min_step <= max_step:
+            raise ValueError(f"Invalid step range {min_step}-{max_step}.")
+        if not 0 <= min_dose <= max_dose:
+            raise ValueError(f"Invalid dose range {min_dose}-{max_dose}.")
+        self.ph_noise = ph_noise
+        self.volume_noise = volume_noise
+        self.min_step = min_step
+        self.max_step = max_step
+        self.min_dose = min_dose
+        self.max_dose = max_dose
+
+    def next_target(self, titration: gran.ModifiedGranTitration,
+                      protocol: TitrationProtocol) -> float:
+        """Picks the candidate target leaving the smallest Veq variance per
+        step at the end of the run.
+
+        Args:
+            titration (ModifiedGranTitration): the titration so far.
+            protocol (TitrationProtocol): protocol of the routine.
+
+        Returns:
+            float: target pH of the next step.
+        """
+        last_ph = titration.get_last_ph()
+        if last_ph > protocol.gran_ph_cutoff:
+            return last_ph - protocol.ph_step
+
+        # Going below the second target only needs to get there
+        end = protocol.second_ph_target - PH_RESOLUTION
+        targets = np.arange(last_ph - self.min_step, end, -PH_RESOLUTION)
+        targets = np.append(targets[targets > end], end)
+        doses = np.array([titration.calc_required_acid_vol(t)
+                          for t in targets])
+        new_volumes = titration.get_last_volume() + doses
+        new_ygran = titration.calc_ygran(targets, new_volumes)
+
+        volumes, ygran = titration.get_gran_data(protocol.gran_ph_cutoff)
+        intercept, slope = self.fit(titration, volumes, ygran)
+
+        best, best_score, best_variance = 0, np.inf, np.inf
+        for i in self.reachable(targets, doses, last_ph, 0.0):
+            steps = self.complete(targets, doses, i)
+            variance = self.veq_variance(
+                np.append(volumes, new_volumes[steps]),
+                np.append(ygran, new_ygran[steps]), intercept, slope
+            )
+            score = variance * (titration.ph_array.size + len(steps))
+            if score < best_score:
+                best, best_score, best_variance = i, score, variance
+
+        logger.debug("Adaptive step: target %.3f, dose %.3g L, Veq sd %.3g L",
+                     targets[best], doses[best], np.sqrt(best_variance))
+        return float(targets[best])
+
+    def reachable(self, targets: np.ndarray, doses: np.ndarray,
+                    ph: float, dose: float) -> np.ndarray:
+        """Finds the targets one step can go to from a pH, within the step
+        and dose bounds. If no dose is within the bounds, the targets with
+        the dose closest to them are taken.
+
+        Args:
+            targets (np.ndarray): candidate targets, in decreasing order.
+            doses (np.ndarray): dose to each target from the last reading.
+            ph (float): pH the step starts from.
+            dose (float): dose to that pH from the last reading.
+
+        Returns:
+            np.ndarray: indices of the reachable targets.
+        """
+        steps = ph - targets
+        candidates = np.flatnonzero(
+            (steps >= self.min_step - 1e-9) & (steps <= self.max_step + 1e-9)
+        )
+        if candidates.size == 0:
+            # Less than a minimum step is left: the end
+            return np.array([targets.size - 1])
+
+        step_doses = doses[candidates] - dose
+        violation = (np.maximum(self.min_dose - step_doses, 0)
+                     + np.maximum(step_doses - self.max_dose, 0))
+        return candidates[violation == violation.min()]
+
+    def complete(self, targets: np.ndarray, doses: np.ndarray,
+                   first: int) -> list:
+        """Plans the rest of the run after a first step, in as few steps as
+        the bounds allow.
+
+        Args:
+            targets (np.ndarray): candidate targets, in decreasing order; the
+                last one ends the run.
+            doses (np.ndarray): dose to each target from the last reading.
+            first (int): index of the first step's target.
+
+        Returns:
+            list: indices of the targets of every step, first included.
+        """
+        steps = [first]
+        while steps[-1] < targets.size - 1:
+            reachable = self.reachable(targets, doses, targets[steps[-1]],
+                                       doses[steps[-1]])
+            steps.append(int(max(reachable.max(), steps[-1] + 1)))
+        return steps
+
+    def lookahead_target(self, ph_target: float,
+                           protocol: TitrationProtocol) -> float:
+        """Aims the largest step below the current target, since the step
+        chosen isn't known yet.
+
+        Args:
+            ph_target (float): target pH of the current step.
+            protocol (TitrationProtocol): protocol of the routine.
+
+        Returns:
+            float: target pH of the following step.
+        """
+        return ph_target - self.max_step
+
+    def fit(self, titration: gran.ModifiedGranTitration,
+              volumes: np.ndarray, ygran: np.ndarray) -> tuple:
+        """Fits the Gran steps so far, completing the fit with the ideal
+        slope while there are fewer than two.
+
+        Args:
+            titration (ModifiedGranTitration): the titration so far.
+            volumes (np.ndarray): total volume (in liters) of each Gran step.
+            ygran (np.ndarray): Gran function of each Gran step.
+
+        Returns:
+            tuple containing:
+             - float: intercept of the Gran function.
+             - float: slope of the Gran function.
+        """
+        slope = titration.acid_conc_M
+        if volumes.size >= 2:
+            fitted_slope, intercept = np.polyfit(volumes, ygran, 1)
+            if fitted_slope > 0:
+                return float(intercept), float(fitted_slope)
+        if volumes.size:
+            return float(ygran[-1] - slope * volumes[-1]), slope
+
+        # No Gran step yet: extrapolate from the last reading
+        last_volume = titration.get_last_volume()
+        last_ygran = titration.calc_ygran(titration.get_last_ph(),
+                                          last_volume)
+        return float(last_ygran - slope * last_volume), slope
+
+    def veq_variance(self, volumes: np.ndarray, ygran: np.ndarray,
+                       intercept: float, slope: float) -> float:
+        """Predicts the variance of Veq fitted from some steps, see above.
+
+        Args:
+            volumes (np.ndarray): total volume (in liters) of each step.
+            ygran (np.ndarray): Gran function of each step, measured or
+                predicted; the pH noise is scaled by it.
+            intercept (float): intercept of the current fit.
+            slope (float): slope of the current fit.
+
+        Returns:
+            float: variance (in liters^2) of Veq, inf if the steps can't
+                determine it.
+        """
+        if volumes.size < 2:
+            return np.inf
+
+        X = np.column_stack((np.ones(volumes.size), volumes))
+        noise = ((LN10 * self.ph_noise * ygran)**2
+                 + (slope * self.volume_noise)**2)
+        try:
+            inverse = np.linalg.inv(X.T @ X)
+        except np.linalg.LinAlgError:
+            return np.inf
+        covariance = inverse @ (X.T * noise) @ X @ inverse
+
+        grad = np.array([-1 / slope, intercept / slope**2])
+        return float(grad @ covariance @ grad)
+
+
+FIXED_STEPS = FixedStepPolicy()
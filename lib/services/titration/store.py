@@ -0,0 +1,669 @@
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from lib.services.titration import gran, results, timing
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Result store #####
+
+Every finished titration is indexed in one SQLite database, so runs can be
+found by time, sample, station or total alkalinity without opening result
+files. The database is in WAL mode, so the UI and several stations can
+write to it while it's being read.
+
+runs: one row per titration, indexed on started_at, sample_id, station and
+    total_alk_umol_kg. Times are unix timestamps, and protocol holds the
+    run's TitrationProtocol (see protocol.py) as JSON, if it was given.
+steps: one row per titration holding the volume, emf and pH of every step
+    (including the initial reading) as raw little-endian float64 arrays.
+reprocessed: one row per run and reprocessing pass (see reprocess.py),
+    with the recomputed TA and its difference to the stored TA.
+timings: one row per run and span (see timing.py) with the time spent in
+    it; the span "wall" holds the run's wall time and "other" the time
+    outside any span.
+
+Runs are buffered and inserted batch_size at a time in one transaction;
+call flush() (or close()) to write them right away. A run with a
+non-finite TA, gamma or rsq is refused before it is buffered, and a batch
+that fails to write is rolled back and dropped (each of its runs logged),
+so one bad run doesn't block every later write. Queries return numpy
+arrays built straight from the cursor or the stored bytes.
+
+Existing csv result files can be imported, and any run exported back to
+the csv layout of results.py:
+
+    python -m lib.services.titration.store import results.sqlite3 *.csv
+    python -m lib.services.titration.store export results.sqlite3 42 out.csv
+"""
+
+DEFAULT_STORE_FILENAME = "results.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    sample_id TEXT,
+    station TEXT,
+    sample_mass_g REAL NOT NULL,
+    salinity REAL NOT NULL,
+    acid_conc_M REAL NOT NULL,
+    temp_C REAL NOT NULL,
+    total_alk_umol_kg REAL NOT NULL,
+    gamma REAL,
+    rsq REAL,
+    n_steps INTEGER NOT NULL,
+    filepath TEXT,
+    protocol TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at);
+CREATE INDEX IF NOT EXISTS runs_sample_id ON runs (sample_id);
+CREATE INDEX IF NOT EXISTS runs_station ON runs (station);
+CREATE INDEX IF NOT EXISTS runs_total_alk ON runs (total_alk_umol_kg);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER PRIMARY KEY REFERENCES runs (id),
+    volume_L BLOB NOT NULL,
+    emf_mV BLOB NOT NULL,
+    pH BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reprocessed (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    engine TEXT NOT NULL,
+    processed_at REAL NOT NULL,
+    total_alk_umol_kg REAL,
+    gamma REAL,
+    rsq REAL,
+    diff_umol_kg REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS reprocessed_run_id ON reprocessed (run_id);
+CREATE TABLE IF NOT EXISTS timings (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    span TEXT NOT NULL,
+    total_s REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (run_id, span)
+);
+"""
+
+# Columns returned by query_runs, with their numpy types
+RUN_DTYPE = np.dtype([
+    ("id", "i8"), ("started_at", "f8"), ("finished_at", "f8"),
+    ("sample_mass_g", "f8"), ("salinity", "f8"), ("acid_conc_M", "f8"),
+    ("temp_C", "f8"), ("total_alk_umol_kg", "f8"), ("n_steps", "i8"),
+])
+
+# Columns added to runs after its first version, with their types, so
+# older databases are upgraded when opened
+ADDED_RUN_COLUMNS = {"protocol": "TEXT"}
+
+# Stored arrays are always little-endian float64
+ARRAY_DTYPE = np.dtype("<f8")
+
+
+class ResultStore:
+    """SQLite database of titration results, see the notes above. Safe to
+    share between threads.
+
+    Args:
+        path (str): location of the database file; created if missing.
+        batch_size (int): number of buffered runs that triggers a write.
+            Defaults to 1, i.e. every run is written as it's added; use a
+            larger value for bulk imports.
+
+    Returns:
+        None.
+    """
+    def __init__(self, path: str, batch_size: int = 1) -> None:
+        self.path = path
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+        columns = {row[1] for row in
+                   self._conn.execute("PRAGMA table_info(runs)")}
+        with self._conn:
+            for column, column_type in ADDED_RUN_COLUMNS.items():
+                if column not in columns:
+                    self._conn.execute(
+                        f"ALTER TABLE runs ADD COLUMN {column} {column_type}"
+                    )
+
+    def add_run(self, titration: gran.ModifiedGranTitration,
+                  total_alkalinity: float, gamma: Optional[float] = None,
+                  rsq: Optional[float] = None,
+                  sample_id: Optional[str] = None,
+                  station: Optional[str] = None,
+                  started_at: Optional[float] = None,
+                  finished_at: Optional[float] = None,
+                  filepath: Optional[str] = None,
+                  timings: Optional[dict] = None,
+                  protocol: Optional[dict] = None) -> None:
+        """Buffers a finished titration for insertion.
+
+        Args:
+            titration (ModifiedGranTitration): gran titration object.
+            total_alkalinity (float): estimated total alkalinity value.
+            gamma (float): optional, quality of fit metric.
+            rsq (float): optional, R-squared of the fit.
+            sample_id (str): optional, identifier of the sample.
+            station (str): optional, name of the station that ran it.
+            started_at (float): optional, unix time the run started.
+                Defaults to finished_at.
+            finished_at (float): optional, unix time the run finished.
+                Defaults to now.
+            filepath (str): optional, location of the run's csv file.
+            timings (dict): optional, time spent in each phase of the run,
+                see PhaseTimer.summary.
+            protocol (dict): optional, the run's TitrationProtocol, see
+                TitrationProtocol.to_dict.
+
+        Returns:
+            None.
+
+        Raises:
+            ValueError: if the TA, gamma or rsq isn't finite.
+        """
+        for name, value in (("total alkalinity", total_alkalinity),
+                            ("gamma", gamma), ("rsq", rsq)):
+            if value is not None and not math.isfinite(value):
+                raise ValueError(f"Invalid {name} {value}.")
+
+        if finished_at is None:
+            finished_at = time.time()
+        if started_at is None:
+            started_at = finished_at
+
+        run = (started_at, finished_at, sample_id, station,
+               titration.sample_mass_kg * 1000, titration.salinity,
+               titration.acid_conc_M, titration.temp_C, total_alkalinity,
+               gamma, rsq, titration.ph_array.size - 1, filepath,
+               None if protocol is None else json.dumps(protocol))
+        steps = tuple(
+            np.ascontiguousarray(array, dtype=ARRAY_DTYPE).tobytes()
+            for array in (titration.volume_array, titration.emf_array,
+                          titration.ph_array)
+        )
+
+        timing_rows = []
+        if timings:
+            timing_rows = [("wall", timings["wall_s"], 1),
+                           ("other", timings["other_s"], 1)]
+            timing_rows += [(name, span["total_s"], span["count"])
+                            for name, span in timings["spans"].items()]
+
+        with self._lock:
+            self._pending.append((run, steps, timing_rows))
+            if len(self._pending) >= self.batch_size:
+                self._write_pending()
+
+    def flush(self) -> None:
+        """Writes every buffered run in one transaction.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            self._write_pending()
+
+    def _write_pending(self) -> None:
+        """Writes the buffered runs; the lock must be held. If the write
+        fails, the batch is rolled back and dropped, and the error raised.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, []
+        try:
+            self._insert(pending)
+        except sqlite3.Error as e:
+            for run, _, _ in pending:
+                logger.error(f"Dropped run started at {run[0]} (sample "
+                             f"{run[2]}, station {run[3]}): {e}")
+            raise
+        logger.info(f"Stored {len(pending)} runs in {self.path}")
+
+    def _insert(self, pending: List[tuple]) -> None:
+        """Inserts buffered runs in one transaction, rolled back if any
+        insert fails.
+
+        Args:
+            pending (list): (run, steps, timing_rows) tuples, see add_run.
+
+        Returns:
+            None.
+        """
+        with self._conn:
+            for run, steps, timing_rows in pending:
+                cursor = self._conn.execute(
+                    "INSERT INTO runs (started_at, finished_at, sample_id, "
+                    "station, sample_mass_g, salinity, acid_conc_M, temp_C, "
+                    "total_alk_umol_kg, gamma, rsq, n_steps, filepath, "
+                    "protocol) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", run
+                )
+                self._conn.execute(
+                    "INSERT INTO steps (run_id, volume_L, emf_mV, pH) "
+                    "VALUES (?, ?, ?, ?)", (cursor.lastrowid,) + steps
+                )
+                self._conn.executemany(
+                    "INSERT INTO timings (run_id, span, total_s, count) "
+                    "VALUES (?, ?, ?, ?)",
+                    ((cursor.lastrowid,) + row for row in timing_rows)
+                )
+
+    def query_runs(self, start: Optional[float] = None,
+                      end: Optional[float] = None,
+                      sample_id: Optional[str] = None,
+                      station: Optional[str] = None,
+                      min_alk: Optional[float] = None,
+                      max_alk: Optional[float] = None) -> np.ndarray:
+        """Finds runs matching every given filter, oldest first.
+
+        Args:
+            start (float): optional, earliest unix start time.
+            end (float): optional, latest unix start time.
+            sample_id (str): optional, exact sample identifier.
+            station (str): optional, exact station name.
+            min_alk (float): optional, lowest total alkalinity.
+            max_alk (float): optional, highest total alkalinity.
+
+        Returns:
+            np.ndarray: structured array with the fields of RUN_DTYPE.
+        """
+        filters = [("started_at >= ?", start), ("started_at <= ?", end),
+                   ("sample_id = ?", sample_id), ("station = ?", station),
+                   ("total_alk_umol_kg >= ?", min_alk),
+                   ("total_alk_umol_kg <= ?", max_alk)]
+        clauses = [clause for clause, value in filters if value is not None]
+        params = [value for _, value in filters if value is not None]
+
+        query = f"SELECT {', '.join(RUN_DTYPE.names)} FROM runs"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY started_at"
+
+        with self._lock:
+            self._write_pending()
+            cursor = self._conn.execute(query, params)
+            return np.fromiter(cursor, dtype=RUN_DTYPE)
+
+    def get_steps(self, run_id: int) -> Tuple[np.ndarray, np.ndarray,
+                                               np.ndarray]:
+        """Reads the step data of a run.
+
+        Args:
+            run_id (int): id of the run.
+
+        Returns:
+            tuple containing:
+             - np.ndarray: total volume (in liters) added at each step.
+             - np.ndarray: emf (in mV) at each step.
+             - np.ndarray: pH at each step.
+        """
+        with self._lock:
+            self._write_pending()
+            row = self._conn.execute(
+                "SELECT volume_L, emf_mV, pH FROM steps WHERE run_id = ?",
+                (run_id,)
+            ).fetchone()
+
+        if row is None:
+            raise KeyError(f"No run with id {run_id}.")
+        return tuple(np.frombuffer(blob, dtype=ARRAY_DTYPE) for blob in row)
+
+    def iter_steps(self, run_ids: List[int]) -> Iterator[
+            Tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+        """Reads the step data of many runs with one query.
+
+        Args:
+            run_ids (list): ids of the runs.
+
+        Yields:
+            tuple: run id, then volume, emf and pH arrays as in get_steps.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            self._write_pending()
+            self._fill_wanted(run_ids)
+            rows = self._conn.execute(
+                "SELECT run_id, volume_L, emf_mV, pH FROM steps "
+                "JOIN wanted ON steps.run_id = wanted.id ORDER BY run_id"
+            ).fetchall()
+            self._conn.commit()
+
+        for run_id, *blobs in rows:
+            yield (run_id,) + tuple(np.frombuffer(blob, dtype=ARRAY_DTYPE)
+                                    for blob in blobs)
+
+    def get_protocols(self, run_ids: List[int]) -> Dict[int, dict]:
+        """Reads the stored protocol of many runs.
+
+        Args:
+            run_ids (list): ids of the runs.
+
+        Returns:
+            dict: run id -> protocol, see TitrationProtocol.to_dict; runs
+                stored without a protocol are left out.
+        """
+        with self._lock:
+            self._write_pending()
+            self._fill_wanted(run_ids)
+            rows = self._conn.execute(
+                "SELECT runs.id, protocol FROM runs JOIN wanted "
+                "ON runs.id = wanted.id WHERE protocol IS NOT NULL"
+            ).fetchall()
+            self._conn.commit()
+        return {run_id: json.loads(protocol) for run_id, protocol in rows}
+
+    def _fill_wanted(self, run_ids: List[int]) -> None:
+        """Fills the temporary table of run ids that queries join on to
+        select many runs; the lock must be held.
+
+        Args:
+            run_ids (list): ids of the runs.
+
+        Returns:
+            None.
+        """
+        self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted "
+                           "(id INTEGER PRIMARY KEY)")
+        self._conn.execute("DELETE FROM wanted")
+        self._conn.executemany("INSERT INTO wanted VALUES (?)",
+                               ((int(run_id),) for run_id in run_ids))
+
+    def add_reprocessed(self, engine: str, rows: List[tuple]) -> None:
+        """Writes the outcome of a reprocessing pass in one transaction.
+
+        Args:
+            engine (str): name of the fit engine used.
+            rows (list): one (run_id, total_alk_umol_kg, gamma, rsq,
+                diff_umol_kg, error) tuple per run.
+
+        Returns:
+            None.
+        """
+        processed_at = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO reprocessed (run_id, engine, processed_at, "
+                    "total_alk_umol_kg, gamma, rsq, diff_umol_kg, error) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((row[0], engine, processed_at) + tuple(row[1:])
+                     for row in rows)
+                )
+
+    def get_run(self, run_id: int) -> dict:
+        """Reads every column of a run, without its steps.
+
+        Args:
+            run_id (int): id of the run.
+
+        Returns:
+            dict: column name -> value.
+        """
+        with self._lock:
+            self._write_pending()
+            cursor = self._conn.execute("SELECT * FROM runs WHERE id = ?",
+                                        (run_id,))
+            row = cursor.fetchone()
+
+        if row is None:
+            raise KeyError(f"No run with id {run_id}.")
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def get_timings(self, run_id: int) -> dict:
+        """Reads the phase timings of a run.
+
+        Args:
+            run_id (int): id of the run.
+
+        Returns:
+            dict: span name -> (total seconds, count), including "wall"
+                and "other"; empty if no timings were stored.
+        """
+        with self._lock:
+            self._write_pending()
+            rows = self._conn.execute(
+                "SELECT span, total_s, count FROM timings WHERE run_id = ?",
+                (run_id,)
+            ).fetchall()
+        return {span: (total_s, count) for span, total_s, count in rows}
+
+    def export_timings(self, filepath: str, **filters) -> int:
+        """Writes the phase timings of many runs to a csv file, one row per
+        run with one column per span, e.g. to compare samples/hour before
+        and after a change.
+
+        Args:
+            filepath (str): location of the file to write.
+            **filters: passed to query_runs to select runs.
+
+        Returns:
+            int: number of runs written; runs without timings are skipped.
+        """
+        spans = ["wall", "other"] + timing.SPANS
+        run_ids = self.query_runs(**filters)["id"].tolist()
+
+        with self._lock:
+            self._fill_wanted(run_ids)
+            rows = self._conn.execute(
+                "SELECT runs.id, started_at, sample_id, station, n_steps, "
+                "span, total_s FROM runs JOIN wanted ON runs.id = wanted.id "
+                "JOIN timings ON timings.run_id = runs.id "
+                "ORDER BY started_at, runs.id"
+            ).fetchall()
+            self._conn.commit()
+        runs = {}
+        for run_id, *run, span, total_s in rows:
+            runs.setdefault(run_id, (run, {}))[1][span] = total_s
+
+        with open(filepath, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["run_id", "started_at", "sample_id", "station",
+                             "n_steps"] + [f"{span}_s" for span in spans])
+            for run_id, (run, totals) in runs.items():
+                writer.writerow([run_id] + run
+                                + [totals.get(span, 0.0) for span in spans])
+        return len(runs)
+
+    def load_titration(self, run_id: int) -> gran.ModifiedGranTitration:
+        """Rebuilds the titration of a stored run.
+
+        Args:
+            run_id (int): id of the run.
+
+        Returns:
+            ModifiedGranTitration: titration holding every step of the run.
+        """
+        run = self.get_run(run_id)
+        volumes, emfs, phs = self.get_steps(run_id)
+
+        return gran.ModifiedGranTitration.from_arrays(
+            run["sample_mass_g"], run["salinity"], run["acid_conc_M"],
+            run["temp_C"], phs, emfs, volumes, cumulative=True
+        )
+
+    def export_csv(self, run_id: int, filepath: str) -> None:
+        """Writes a stored run to a csv file in the usual layout.
+
+        Args:
+            run_id (int): id of the run.
+            filepath (str): location of the file to write.
+
+        Returns:
+            None.
+        """
+        run = self.get_run(run_id)
+        results.write_csv(filepath, self.load_titration(run_id),
+                          run["total_alk_umol_kg"])
+
+    def import_csv(self, filepaths: List[str]) -> int:
+        """Adds existing csv result files to the store. Files that can't
+        be read are logged and skipped.
+
+        Args:
+            filepaths (list): locations of the csv files.
+
+        Returns:
+            int: number of runs imported.
+        """
+        count = 0
+        for filepath in filepaths:
+            try:
+                titration, total_alkalinity = read_csv(filepath)
+            except (OSError, ValueError, IndexError) as e:
+                logger.error(f"Skipping {filepath}: {e}")
+                continue
+
+            started_at, sample_id = parse_filename(filepath)
+            try:
+                self.add_run(titration, total_alkalinity,
+                             sample_id=sample_id, started_at=started_at,
+                             finished_at=started_at,
+                             filepath=os.path.abspath(filepath))
+            except ValueError as e:
+                logger.error(f"Skipping {filepath}: {e}")
+                continue
+            count += 1
+
+        self.flush()
+        return count
+
+    def close(self) -> None:
+        """Writes any buffered runs and closes the database.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            try:
+                self._write_pending()
+            finally:
+                self._conn.close()
+
+
+def read_csv(filepath: str) -> Tuple[gran.ModifiedGranTitration, float]:
+    """Reads a csv result file written by results.write_csv.
+
+    Args:
+        filepath (str): location of the csv file.
+
+    Returns:
+        tuple containing:
+         - ModifiedGranTitration: titration holding every step.
+         - float: total alkalinity recorded in the file.
+    """
+    with open(filepath, newline="") as f:
+        rows = list(csv.reader(f))
+
+    if rows[0] != results.CSV_HEADER:
+        raise ValueError("not a titration result file")
+
+    first = [float(x) for x in rows[1]]
+    steps = np.array([first[:3]] + [[float(x) for x in row]
+                                     for row in rows[2:] if row],
+                     dtype=ARRAY_DTYPE)
+
+    titration = gran.ModifiedGranTitration.from_arrays(
+        first[3], first[5], first[6], first[4], steps[:, 2], steps[:, 1],
+        steps[:, 0], cumulative=True
+    )
+    return titration, first[7]
+
+
+def parse_filename(filepath: str) -> Tuple[float, Optional[str]]:
+    """Recovers the start time and sample id from a result filename, e.g.
+    2024_05_01-09_30_40_AM_CRM-205.csv. Falls back to the file's
+    modification time for other names.
+
+    Args:
+        filepath (str): location of the result file.
+
+    Returns:
+        tuple containing:
+         - float: unix start time of the run.
+         - str: sample id, or None.
+    """
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    stamp, _, sample_id = name[:22], name[22:23], name[23:]
+    try:
+        started_at = datetime.strptime(stamp, "%Y_%m_%d-%I_%M_%S_%p")
+    except ValueError:
+        return os.path.getmtime(filepath), None
+    return started_at.timestamp(), sample_id or None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAlk result store")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser(
+        "import", help="Add csv result files to a store."
+    )
+    import_parser.add_argument("store")
+    import_parser.add_argument("files", nargs="+")
+
+    export_parser = commands.add_parser(
+        "export", help="Write a stored run to a csv file."
+    )
+    export_parser.add_argument("store")
+    export_parser.add_argument("run_id", type=int)
+    export_parser.add_argument("file")
+
+    timings_parser = commands.add_parser(
+        "timings", help="Write the phase timings of stored runs to a csv file."
+    )
+    timings_parser.add_argument("store")
+    timings_parser.add_argument("file")
+    timings_parser.add_argument("--station", default=None)
+    timings_parser.add_argument("--sample-id", default=None)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    store = ResultStore(args.store, batch_size=500)
+    if args.command == "import":
+        count = store.import_csv(args.files)
+        print(f"Imported {count} of {len(args.files)} files.")
+    elif args.command == "timings":
+        count = store.export_timings(args.file, station=args.station,
+                                     sample_id=args.sample_id)
+        print(f"Exported timings of {count} runs.")
+    else:
+        store.export_csv(args.run_id, args.file)
+    store.close()
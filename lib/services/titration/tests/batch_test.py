@@ -0,0 +1,117 @@
+# Write unit tests for batch runs here
+# Tests MUST start with `test_` for pytest to find them
+
+from unittest.mock import Mock
+
+import pytest
+
+from lib.services.titration import batch, recovery
+
+PH_READINGS = [8.0, 3.75, 3.65, 3.55, 3.45, 3.35, 3.25, 3.15, 3.05, 2.95]
+
+MANIFEST = """sample_id,sample_mass_g,salinity,acid_conc_M
+A,100.0,35.0,0.1
+B,99.5,34.0,0.1
+C,101.2,33.0,0.1
+"""
+
+
+def measurements(readings: list) -> list:
+    """Helper to build mocked meter responses for the given pH readings.
+    """
+    return [{"pH": str(ph), "mV": str(round((7 - ph) * 59.16, 1)),
+             "temp": "25.0"} for ph in readings]
+
+def make_pump() -> Mock:
+    """Helper to build a mocked pump that is always ready.
+    """
+    pump = Mock()
+    pump.wash_cycles = 3
+    pump.get_syringe_position = Mock(return_value=48000)
+    pump.liters_to_steps = Mock(side_effect=lambda v: int(v / 5.1625e-8))
+    pump.check_module_ready = Mock(return_value=True)
+    return pump
+
+def test_load_manifest(tmp_path) -> None:
+    """Test that a manifest is read in file order.
+    """
+    filepath = tmp_path / "manifest.csv"
+    filepath.write_text(MANIFEST)
+    samples = batch.load_manifest(str(filepath))
+
+    assert [s.sample_id for s in samples] == ["A", "B", "C"]
+    assert samples[1].sample_mass == 99.5
+    assert samples[2].salinity == 33.0
+
+def test_load_manifest_missing_columns(tmp_path) -> None:
+    """Test that a manifest without the required columns is rejected.
+    """
+    filepath = tmp_path / "manifest.csv"
+    filepath.write_text("sample_id,sample_mass_g\nA,100.0\n")
+    with pytest.raises(ValueError):
+        batch.load_manifest(str(filepath))
+
+def test_queue_runs_all_samples(tmp_path) -> None:
+    """Test that every sample is run and written, that the syringe is only
+    filled at the start of the first sample and prepped between samples,
+    and that throughput is reported.
+    """
+    pump = make_pump()
+    meter = Mock()
+    meter.get_measurement = Mock(side_effect=measurements(PH_READINGS) * 3)
+
+    sample_queue = batch.SampleQueue(pump, meter, results_dir=str(tmp_path))
+    sample_queue.extend([batch.Sample(x, 100.0, 35.0, 0.1) for x in "ABC"])
+    list(sample_queue.run())
+
+    records = sample_queue.get_records()
+    assert [r["status"] for r in records] == ["done"] * 3
+    assert all(r["total_alkalinity"] > 0 for r in records)
+    assert len(list(tmp_path.glob("*.csv"))) == 3
+
+    # 1 initial fill + 1 refill during each sample, after its large first
+    # dose + 2 preps of (3 wash fills + 1 refill)
+    assert pump.fill.call_count == 1 + 3 + 2 * 4
+    assert pump.empty.call_count == 2 * 3
+
+    throughput = sample_queue.get_throughput()
+    assert throughput["completed"] == 3
+    assert throughput["failed"] == 0
+    assert throughput["samples_per_hour"] > 0
+
+def test_queue_survives_failed_sample(tmp_path) -> None:
+    """Test that a sample failing mid-run is recorded as failed, without a
+    checkpoint left to resume it, and the rest of the batch still runs.
+    """
+    pump = make_pump()
+    meter = Mock()
+    meter.get_measurement = Mock(side_effect=(
+        measurements(PH_READINGS[:3]) + [ValueError("bad response")]
+        + measurements(PH_READINGS)
+    ))
+
+    sample_queue = batch.SampleQueue(pump, meter, results_dir=str(tmp_path))
+    sample_queue.extend([batch.Sample(x, 100.0, 35.0, 0.1) for x in "AB"])
+    list(sample_queue.run())
+
+    records = sample_queue.get_records()
+    assert [r["status"] for r in records] == ["failed", "done"]
+    assert "bad response" in records[0]["error"]
+    assert sample_queue.get_throughput()["failed"] == 1
+    assert recovery.find_interrupted_runs(str(tmp_path)) == []
+
+def test_queue_stop_leaves_remaining_samples(tmp_path) -> None:
+    """Test that stopping the batch ends the current sample and leaves the
+    remaining samples pending.
+    """
+    meter = Mock()
+    meter.get_measurement = Mock(side_effect=measurements(PH_READINGS))
+
+    sample_queue = batch.SampleQueue(make_pump(), meter,
+                                     results_dir=str(tmp_path))
+    sample_queue.extend([batch.Sample(x, 100.0, 35.0, 0.1) for x in "ABC"])
+    sample_queue.routine_kwargs["on_step"] = lambda t: sample_queue.stop()
+    list(sample_queue.run())
+
+    assert [r["status"] for r in sample_queue.get_records()] == ["stopped"]
+    assert [s.sample_id for s in sample_queue.pending] == ["B", "C"]
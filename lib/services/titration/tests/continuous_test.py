@@ -0,0 +1,172 @@
+# Write unit tests for continuous-dosing titrations here
+# Tests MUST start with `test_` for pytest to find them
+
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from lib.services.pump import simulator
+from lib.services.titration import continuous, routine, simulation
+from lib.utils import clocks
+
+TOTAL_ALKALINITY = 2200.0
+
+
+def run_simulated(routine_class: type, stabilize_time: float,
+                    **kwargs) -> tuple:
+    """Helper to run a titration on simulated devices in virtual time.
+    """
+    clock = clocks.VirtualClock()
+    sample = simulation.SimulatedSample(TOTAL_ALKALINITY, 35.0)
+    pump, meter = simulation.simulated_devices(clock, sample,
+                                               stabilize_time=stabilize_time)
+    titration_routine = routine_class(
+        pump, meter, sample.sample_mass, sample.salinity, sample.acid_conc,
+        clock=clock, **kwargs
+    )
+    clock.run(titration_routine.run())
+    return titration_routine, pump, clock
+
+def test_continuous_run() -> None:
+    """Test that a continuous run reads the meter throughout one slow
+    dispense, ends past the second target with the pump back at full
+    speed, and recovers the alkalinity from the emf.
+    """
+    titration_routine, pump, clock = run_simulated(
+        continuous.ContinuousTitrationRoutine, 1.0, dispense_time=120.0,
+        analysis=routine.GranAnalysis.EMF
+    )
+    times, volumes, emfs, phs = np.array(titration_routine.readings).T
+
+    assert len(titration_routine.readings) > 50
+    assert np.all(np.diff(times) > 0)
+    assert np.all(np.diff(volumes) >= 0)
+    assert np.all(np.diff(phs) <= 0)
+    assert times[-1] - times[0] == pytest.approx(120.0, abs=5.0)
+    np.testing.assert_allclose(
+        volumes, titration_routine.titration.volume_array[-volumes.size:]
+    )
+
+    assert phs[-1] <= titration_routine.protocol.second_ph_target
+    assert pump.serial_port.steps_per_second == simulator.MAX_SPEED
+    assert titration_routine.result[0] == pytest.approx(TOTAL_ALKALINITY,
+                                                        abs=2)
+
+def test_faster_than_stepwise() -> None:
+    """Test that with the meter answering within a second, a continuous
+    run takes less than half as long as a stepwise one waiting for stable
+    readings.
+    """
+    _, _, stepwise_clock = run_simulated(routine.TitrationRoutine, 20.0)
+    _, _, continuous_clock = run_simulated(
+        continuous.ContinuousTitrationRoutine, 1.0, dispense_time=60.0
+    )
+    assert continuous_clock.monotonic() < stepwise_clock.monotonic() / 2
+
+def test_reading_volume_interpolated() -> None:
+    """Test that a reading's volume is where the plunger was when the
+    reading was taken, reading_lag before the meter answered.
+    """
+    titration_routine, _, _ = run_simulated(
+        continuous.ContinuousTitrationRoutine, 1.0, dispense_time=120.0
+    )
+    lagging, _, _ = run_simulated(
+        continuous.ContinuousTitrationRoutine, 1.0, dispense_time=120.0,
+        reading_lag=0.5
+    )
+    volumes = np.array(titration_routine.readings)[:, 1]
+    lagging_volumes = np.array(lagging.readings)[:, 1]
+
+    # Half a second earlier, at the plunger speed, while it moves
+    flow = volumes[-1] - volumes[0]
+    moving = slice(1, volumes.size // 2)
+    np.testing.assert_allclose(volumes[moving] - lagging_volumes[moving],
+                               flow / 120.0 * 0.5, rtol=0.1)
+
+def test_reading_time_used() -> None:
+    """Test that a reading stamped with the time it came in is placed at
+    that time rather than when the meter call returned.
+    """
+    clock = clocks.VirtualClock()
+    sample = simulation.SimulatedSample(TOTAL_ALKALINITY, 35.0)
+    pump, meter = simulation.simulated_devices(clock, sample,
+                                               stabilize_time=1.0)
+    get_measurement = meter.get_measurement
+
+    def stamped_measurement() -> dict:
+        """Helper stamping every reading half a second before it's
+        returned.
+        """
+        return dict(get_measurement(), time=clock.time() - 0.5)
+
+    meter.get_measurement = stamped_measurement
+    stamped = continuous.ContinuousTitrationRoutine(
+        pump, meter, sample.sample_mass, sample.salinity, sample.acid_conc,
+        clock=clock, dispense_time=120.0
+    )
+    clock.run(stamped.run())
+    lagging, _, _ = run_simulated(
+        continuous.ContinuousTitrationRoutine, 1.0, dispense_time=120.0,
+        reading_lag=0.5
+    )
+
+    np.testing.assert_allclose(np.array(stamped.readings),
+                               np.array(lagging.readings))
+
+def test_invalid_dispense_time() -> None:
+    """Test that the dispense has to take some time.
+    """
+    with pytest.raises(ValueError):
+        continuous.ContinuousTitrationRoutine(None, None, 100.0, 35.0, 0.1,
+                                              dispense_time=0.0)
+
+def test_streaming_meter() -> None:
+    """Test that with the meter streaming, readings come in at the export
+    interval, without waiting for GETMEAS.
+    """
+    clock = clocks.VirtualClock()
+    sample = simulation.SimulatedSample(TOTAL_ALKALINITY, 35.0)
+    pump, meter = simulation.simulated_devices(clock, sample)
+    meter.start_streaming(interval=0.5)
+    titration_routine = continuous.ContinuousTitrationRoutine(
+        pump, meter, sample.sample_mass, sample.salinity, sample.acid_conc,
+        clock=clock, dispense_time=60.0, analysis=routine.GranAnalysis.EMF
+    )
+    clock.run(titration_routine.run())
+    meter.stop_streaming()
+
+    times = np.array(titration_routine.readings)[:, 0]
+    assert np.diff(times).max() < 1.0
+    assert titration_routine.result[0] == pytest.approx(TOTAL_ALKALINITY,
+                                                        abs=2)
+    assert meter.serial_port.in_waiting == 0
+
+@pytest.mark.parametrize("interrupt", ["close", "meter_error"])
+def test_speed_restored_when_interrupted(interrupt: str) -> None:
+    """Test that a run cut short during the dispense, by closing it or by
+    a meter error, sets the plunger back to its speed before the dispense.
+    """
+    clock = clocks.VirtualClock()
+    sample = simulation.SimulatedSample(TOTAL_ALKALINITY, 35.0)
+    pump, meter = simulation.simulated_devices(clock, sample,
+                                               stabilize_time=1.0)
+    pump.set_plunger_speed(5000)
+    titration_routine = continuous.ContinuousTitrationRoutine(
+        pump, meter, sample.sample_mass, sample.salinity, sample.acid_conc,
+        clock=clock, dispense_time=120.0
+    )
+
+    steps = titration_routine.run()
+    while len(titration_routine.readings) < 5:
+        clock.sleep(next(steps))
+    assert not pump.check_module_ready()
+    if interrupt == "close":
+        steps.close()
+    else:
+        meter.get_measurement = Mock(side_effect=IndexError)
+        with pytest.raises(IndexError):
+            clock.run(steps)
+
+    assert pump.serial_port.steps_per_second == 5000
+    assert pump.plunger_speed == 5000
@@ -0,0 +1,144 @@
+# Write unit tests for the emf-based Gran analysis here
+# Tests MUST start with `test_` for pytest to find them
+
+import numpy as np
+import pytest
+
+from lib.services.titration import emf, forward, gran, routine, simulation
+from lib.utils import clocks
+
+SAMPLE_MASS = 100.0
+ACID_CONC = 0.1
+TOTAL_ALKALINITY = 2200.0
+
+
+def true_phs(targets: np.ndarray) -> tuple:
+    """Helper giving the volumes dosing a 2200 umol/kg sample to roughly
+    the targets, after an initial reading, and the true pH after each.
+    """
+    initial = gran.ModifiedGranTitration(SAMPLE_MASS, 35.0, ACID_CONC, 25.0,
+                                         7.75, 0.0)
+    volumes = np.array([0.0] + [initial.calc_required_acid_vol(ph)
+                                for ph in targets])
+    constants = forward.equilibrium_constants(35.0, 25.0)
+    phs = forward.forward_ph(volumes, TOTAL_ALKALINITY * 1e-6,
+                             sample_mass=SAMPLE_MASS, acid_conc=ACID_CONC,
+                             **constants)
+    return volumes, phs
+
+def titration_from(volumes: np.ndarray, phs: np.ndarray,
+                     emfs: np.ndarray) -> gran.ModifiedGranTitration:
+    """Helper to build a titration from readings.
+    """
+    return gran.ModifiedGranTitration.from_arrays(
+        SAMPLE_MASS, 35.0, ACID_CONC, 25.0, phs, emfs, volumes,
+        cumulative=True
+    )
+
+def test_electrode_recovered() -> None:
+    """Test that E0 and a non-Nernstian slope are recovered from exact
+    readings, and the alkalinity with them.
+    """
+    volumes, phs = true_phs(np.arange(3.8, 2.89, -0.1))
+    titration = titration_from(volumes, phs, 395.0 - 57.5 * phs)
+
+    e0, slope = emf.estimate_electrode(titration)
+    assert e0 == pytest.approx(395.0, abs=1e-3)
+    assert slope == pytest.approx(57.5, abs=1e-4)
+
+    total_alkalinity, gamma, rsq = emf.emf_gran_fit(titration)
+    assert total_alkalinity == pytest.approx(TOTAL_ALKALINITY, abs=0.01)
+    assert gamma == pytest.approx(1.0, abs=1e-6)
+    assert rsq == pytest.approx(1.0)
+
+def test_modified_gran_function_is_linear() -> None:
+    """Test that the modified Gran function of the true [H+] is the acid
+    in excess of the alkalinity.
+    """
+    volumes, phs = true_phs(np.arange(3.8, 2.89, -0.1))
+    titration = titration_from(volumes, phs, phs)
+    ygran = emf.calc_modified_ygran(titration, 10**-phs, volumes)
+    np.testing.assert_allclose(
+        ygran, ACID_CONC * volumes - SAMPLE_MASS / 1000 * TOTAL_ALKALINITY
+        * 1e-6, rtol=0, atol=1e-12
+    )
+
+def test_independent_of_meter_calibration() -> None:
+    """Test that a meter calibration error moves the pH-based fit but not
+    the emf-based one.
+    """
+    volumes, phs = true_phs(np.arange(3.7, 2.89, -0.1))
+    emfs = 400.0 - 59.16 * phs
+    calibrated = titration_from(volumes, phs, emfs)
+    miscalibrated = titration_from(volumes, 7 + (phs - 7) * 0.98 + 0.02,
+                                   emfs)
+
+    assert (abs(miscalibrated.gran_polynomial_fit()[0]
+                - calibrated.gran_polynomial_fit()[0]) > 5)
+    assert emf.emf_gran_fit(miscalibrated)[0] == pytest.approx(
+        emf.emf_gran_fit(calibrated)[0], abs=1e-6
+    )
+
+def test_emf_resolution_tightens_fit() -> None:
+    """Test that with readings rounded like the A215's (0.01 pH, 0.1 mV),
+    the emf fit has no bias and a smaller spread than the pH fit, and
+    with the slope fixed does so from fewer steps.
+    """
+    rng = np.random.default_rng(0)
+    nernst = emf.NERNST_MV_PER_K * 298.15
+    errors = {"ph": [], "emf": [], "emf_few": []}
+    for design, targets in (("full", np.arange(3.8, 2.89, -0.1)),
+                            ("few", np.array([3.8, 3.6, 3.3, 3.0]))):
+        volumes, phs = true_phs(targets)
+        for _ in range(50):
+            noisy = phs + rng.normal(0.0, 0.0005, phs.size)
+            titration = titration_from(volumes, np.round(noisy, 2),
+                                       np.round(395.0 - nernst * noisy, 1))
+            if design == "full":
+                errors["ph"].append(titration.gran_polynomial_fit()[0])
+                errors["emf"].append(emf.emf_gran_fit(titration)[0])
+            else:
+                errors["emf_few"].append(
+                    emf.emf_gran_fit(titration, slope=nernst)[0]
+                )
+
+    errors = {k: np.array(v) - TOTAL_ALKALINITY for k, v in errors.items()}
+    assert abs(errors["ph"].mean()) > 5
+    assert abs(errors["emf"].mean()) < 1
+    assert abs(errors["emf_few"].mean()) < 1
+    assert errors["emf"].std() < errors["ph"].std()
+    assert errors["emf_few"].std() < errors["ph"].std() / 2
+
+def test_too_few_steps() -> None:
+    """Test that the fit needs three steps in the Gran region, or two with
+    the slope given.
+    """
+    volumes, phs = true_phs(np.array([3.9, 3.7, 3.5]))
+    titration = titration_from(volumes, phs, 400.0 - 59.16 * phs)
+    with pytest.raises(ValueError):
+        emf.emf_gran_fit(titration)
+    assert emf.emf_gran_fit(titration, slope=59.16)[0] == pytest.approx(
+        TOTAL_ALKALINITY, abs=0.1
+    )
+
+def test_routine_emf_analysis() -> None:
+    """Test that a simulated routine can finish with the emf analysis, and
+    that it is closer to the true alkalinity than the pH analysis.
+    """
+    results = {}
+    for analysis in routine.GranAnalysis:
+        clock = clocks.VirtualClock()
+        sample = simulation.SimulatedSample(TOTAL_ALKALINITY, 35.0)
+        pump, meter = simulation.simulated_devices(clock, sample)
+        titration_routine = routine.TitrationRoutine(
+            pump, meter, sample.sample_mass, sample.salinity,
+            sample.acid_conc, clock=clock, analysis=analysis
+        )
+        clock.run(titration_routine.run())
+        results[analysis] = titration_routine.result[0]
+
+    assert (abs(results[routine.GranAnalysis.EMF] - TOTAL_ALKALINITY)
+            < abs(results[routine.GranAnalysis.PH] - TOTAL_ALKALINITY))
+    assert results[routine.GranAnalysis.EMF] == pytest.approx(
+        TOTAL_ALKALINITY, abs=2
+    )
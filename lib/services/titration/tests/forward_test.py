@@ -0,0 +1,111 @@
+# Write unit tests for the forward titration model here
+# Tests MUST start with `test_` for pytest to find them
+
+import numpy as np
+import pytest
+
+from lib.services.titration import forward, gran
+
+
+def bisect_ph(volume: float, total_alkalinity: float, constants: dict,
+                sample_mass: float = 100.0, acid_conc: float = 0.1) -> float:
+    """Helper solving the charge balance of one point by bisection on the
+    pH, as a reference.
+    """
+    low, high = 0.0, 14.0
+    for _ in range(60):
+        mid = (low + high) / 2
+        if forward.charge_balance(10**-mid, volume, total_alkalinity,
+                                  sample_mass=sample_mass,
+                                  acid_conc=acid_conc, **constants) > 0:
+            high = mid
+        else:
+            low = mid
+    return (low + high) / 2
+
+
+def test_matches_bisection() -> None:
+    """Test that every point agrees with a bisection of the charge balance,
+    on both sides of the equivalence point.
+    """
+    constants = forward.equilibrium_constants(35.0, 25.0)
+    volumes = np.linspace(0.0, 0.004, 41)
+    phs = forward.forward_ph(volumes, 2300e-6, sample_mass=100.0,
+                             acid_conc=0.1, **constants)
+
+    assert phs.shape == volumes.shape
+    expected = [bisect_ph(v, 2300e-6, constants) for v in volumes]
+    np.testing.assert_allclose(phs, expected, atol=1e-9)
+
+
+def test_solves_charge_balance() -> None:
+    """Test that the predicted pH zeroes the charge balance.
+    """
+    constants = forward.equilibrium_constants(33.0, 20.0)
+    volumes = np.linspace(0.0, 0.003, 31)
+    phs = forward.forward_ph(volumes, 2100e-6, sample_mass=100.0,
+                             acid_conc=0.1, **constants)
+
+    residual = forward.charge_balance(10**-phs, volumes, 2100e-6,
+                                      sample_mass=100.0, acid_conc=0.1,
+                                      **constants)
+    # Relative to the alkalinity of the sample, about 2e-4 moles
+    assert np.all(np.abs(residual) < 1e-15)
+
+
+def test_samples_by_volumes() -> None:
+    """Test that sample parameters broadcast against shared volumes and
+    against one row of volumes per sample.
+    """
+    salinity = np.array([30.0, 35.0, 38.0])
+    alkalinity = np.array([2000e-6, 2200e-6, 2400e-6])
+    constants = forward.equilibrium_constants(salinity, 25.0)
+    volumes = np.linspace(0.0, 0.003, 7)
+
+    shared = forward.forward_ph(volumes, alkalinity, sample_mass=100.0,
+                                acid_conc=0.1, **constants)
+    assert shared.shape == (3, 7)
+
+    per_sample = forward.forward_ph(np.tile(volumes, (3, 1)), alkalinity,
+                                    sample_mass=100.0, acid_conc=0.1,
+                                    **constants)
+    np.testing.assert_array_equal(per_sample, shared)
+
+    single = forward.equilibrium_constants(35.0, 25.0)
+    alone = forward.forward_ph(volumes, 2200e-6, sample_mass=100.0,
+                               acid_conc=0.1, **single)
+    np.testing.assert_allclose(shared[1], alone, atol=1e-12)
+
+
+def test_ph_falls_with_acid() -> None:
+    """Test that the pH only falls as acid is added, starting from a
+    seawater pH.
+    """
+    constants = forward.equilibrium_constants(35.0, 25.0)
+    phs = forward.forward_ph(np.linspace(0.0, 0.004, 400), 2300e-6,
+                             sample_mass=100.0, acid_conc=0.1, **constants)
+
+    assert 7.5 < phs[0] < 8.5
+    assert np.all(np.diff(phs) < 0)
+
+
+def test_matches_gran_constants() -> None:
+    """Test that the constants are those ModifiedGranTitration uses.
+    """
+    constants = forward.equilibrium_constants([30.0, 35.0], 25.0)
+    titration = gran.ModifiedGranTitration(100.0, 35.0, 0.1, 25.0, 8.0, 0.0)
+
+    assert constants["k1"][1] == pytest.approx(titration.K1)
+    assert constants["kw"][1] == pytest.approx(titration.KW)
+    assert constants["bt"][1] == pytest.approx(titration.BT)
+    assert constants["dic"][0] < constants["dic"][1]
+
+
+def test_raises_when_not_converged() -> None:
+    """Test that points left unconverged are an error rather than a
+    silently wrong pH.
+    """
+    constants = forward.equilibrium_constants(35.0, 25.0)
+    with pytest.raises(ValueError):
+        forward.forward_ph([0.0, 0.0025], 2300e-6, sample_mass=100.0,
+                           acid_conc=0.1, max_iter=1, **constants)
@@ -0,0 +1,113 @@
+# Write unit tests for the protocol optimizer here
+# Tests MUST start with `test_` for pytest to find them
+
+import numpy as np
+import pytest
+
+from lib.services.titration import gran, optimizer, protocol
+
+
+def array_titration(salinity: np.ndarray) -> gran.ModifiedGranTitration:
+    """Helper to build a titration with one salinity per sample, at 25 C.
+    """
+    return gran.ModifiedGranTitration(100.0, salinity, 0.1,
+                                      np.full(salinity.size, 25.0), 8.0, 0.0)
+
+def test_required_doses_match_routine() -> None:
+    """Test that the doses of every sample are those the routine would
+    calculate for it.
+    """
+    salinity = np.array([30.0, 35.0, 38.0])
+    ph_from = np.array([8.0, 4.5, 3.6])
+    ph_to = np.array([3.79, 3.6, 3.5])
+    doses = optimizer.required_doses(array_titration(salinity), ph_from,
+                                     ph_to)
+
+    for i in range(3):
+        titration = gran.ModifiedGranTitration(100.0, salinity[i], 0.1, 25.0,
+                                               ph_from[i], 0.0)
+        assert doses[i] == pytest.approx(
+            titration.calc_required_acid_vol(ph_to[i]), rel=1e-12
+        )
+
+def test_gran_fits_match_routine() -> None:
+    """Test that the alkalinity of every sample is that of
+    gran_polynomial_fit, with readings padded by NaN.
+    """
+    phs = np.array([[8.0, 3.7, 3.6, 3.5, 3.4, np.nan],
+                    [7.9, 3.9, 3.75, 3.6, 3.45, 3.3]])
+    volumes = np.array([[0.0, 0.0021, 0.00215, 0.0022, 0.00226, np.nan],
+                        [0.0, 0.0020, 0.0021, 0.00218, 0.00224, 0.0023]])
+    fits = optimizer.gran_fits(array_titration(np.array([35.0, 33.0])),
+                               phs, volumes, 3.8)
+
+    for i in range(2):
+        rows = ~np.isnan(phs[i])
+        titration = gran.ModifiedGranTitration.from_arrays(
+            100.0, 35.0, 0.1, 25.0, phs[i][rows], phs[i][rows],
+            volumes[i][rows], cumulative=True
+        )
+        assert fits[i] == pytest.approx(titration.gran_polynomial_fit(3.8)[0],
+                                        rel=1e-9)
+
+def test_simulate_is_repeatable() -> None:
+    """Test that a seed gives the same samples and errors, and that a
+    finer step takes more steps.
+    """
+    conditions = optimizer.Conditions()
+    first = optimizer.simulate(protocol.DEFAULT_PROTOCOL, conditions, 200, 3)
+    again = optimizer.simulate(protocol.DEFAULT_PROTOCOL, conditions, 200, 3)
+    np.testing.assert_array_equal(first["ta_error"], again["ta_error"])
+
+    summary = optimizer.summarize(first)
+    assert summary["failure_rate"] == 0
+    assert summary["ta_sd"] < 10
+
+    fine = optimizer.simulate(protocol.TitrationProtocol(ph_step=0.05),
+                              conditions, 200, 3)
+    assert fine["steps"].mean() > first["steps"].mean()
+    np.testing.assert_array_equal(fine["run_time_s"],
+                                  fine["steps"] * conditions.step_time)
+
+def test_runaway_titrations_fail() -> None:
+    """Test that titrations cut off at max_steps count as failed rather
+    than giving an estimate.
+    """
+    conditions = optimizer.Conditions(max_steps=3)
+    simulated = optimizer.simulate(protocol.DEFAULT_PROTOCOL, conditions, 50)
+    assert np.all(np.isnan(simulated["ta_error"]))
+    assert optimizer.summarize(simulated)["failure_rate"] == 1
+
+def test_optimize_beats_default() -> None:
+    """Test that the protocol found, with candidates evaluated in a
+    process pool, is at least as fast as the default one while meeting the
+    target on the search samples.
+    """
+    conditions = optimizer.Conditions()
+    default = optimizer.summarize(optimizer.simulate(
+        protocol.DEFAULT_PROTOCOL, conditions, 300, 0
+    ))
+    target = default["ta_sd"] * 1.2
+
+    best, optimization = optimizer.optimize(
+        target, conditions, n_samples=300, candidates=8, rounds=2,
+        workers=2
+    )
+    assert isinstance(best, protocol.TitrationProtocol)
+    assert optimization["search"]["ta_sd"] <= target
+    assert (optimization["search"]["mean_run_time_s"]
+            <= default["mean_run_time_s"])
+    assert optimization["candidates_evaluated"] == 16
+    assert "ta_sd" in optimization["validation"]
+
+def test_main_writes_loadable_profile(tmp_path) -> None:
+    """Test that the command line writes a profile the routine's owners
+    can load.
+    """
+    filepath = tmp_path / "optimized.json"
+    optimizer.main(["--output", str(filepath), "--target-sd", "20",
+                    "--samples", "100", "--candidates", "4", "--rounds", "1",
+                    "--workers", "1"])
+
+    loaded = protocol.load_protocol(str(filepath))
+    assert isinstance(loaded, protocol.TitrationProtocol)
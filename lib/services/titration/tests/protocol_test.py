@@ -0,0 +1,83 @@
+# Write unit tests for titration protocol profiles here
+# Tests MUST start with `test_` for pytest to find them
+
+import json
+
+import numpy as np
+import pytest
+
+from lib.services.titration import protocol, routine, simulation
+from lib.utils import clocks
+
+
+def run_with_protocol(titration_protocol: protocol.TitrationProtocol
+                        ) -> routine.TitrationRoutine:
+    """Helper to run a noiseless simulated titration with a protocol.
+    """
+    clock = clocks.VirtualClock()
+    sample = simulation.SimulatedSample(2200.0, 35.0)
+    pump, meter = simulation.simulated_devices(clock, sample)
+    titration_routine = routine.TitrationRoutine(
+        pump, meter, sample.sample_mass, sample.salinity, sample.acid_conc,
+        clock=clock, titration_protocol=titration_protocol
+    )
+    clock.run(titration_routine.run())
+    return titration_routine
+
+def test_profile_round_trip(tmp_path) -> None:
+    """Test that a saved profile loads back as the same protocol, with its
+    optimization section ignored.
+    """
+    filepath = tmp_path / "profiles" / "fast.json"
+    fast = protocol.TitrationProtocol(4.0, 3.1, 0.2, 3.7)
+    protocol.save_protocol(str(filepath), fast, {"target_ta_sd": 3.0})
+
+    assert protocol.load_protocol(str(filepath)) == fast
+    assert json.loads(filepath.read_text())["optimization"] == {
+        "target_ta_sd": 3.0
+    }
+
+def test_invalid_protocols_rejected(tmp_path) -> None:
+    """Test that protocols that can't make a titration, unknown parameters
+    and files without a protocol are errors.
+    """
+    with pytest.raises(ValueError):
+        protocol.TitrationProtocol(first_ph_target=3.0, second_ph_target=3.5)
+    with pytest.raises(ValueError):
+        protocol.TitrationProtocol(ph_step=0.0)
+    with pytest.raises(ValueError):
+        protocol.TitrationProtocol(gran_ph_cutoff=2.9)
+    with pytest.raises(ValueError):
+        protocol.TitrationProtocol.from_dict({"ph_stepp": 0.2})
+
+    filepath = tmp_path / "empty.json"
+    filepath.write_text("{}")
+    with pytest.raises(ValueError):
+        protocol.load_protocol(str(filepath))
+
+def test_missing_parameters_take_defaults() -> None:
+    """Test that a partial protocol section keeps the default of every
+    parameter it leaves out.
+    """
+    loaded = protocol.TitrationProtocol.from_dict({"ph_step": 0.2})
+    assert loaded.ph_step == 0.2
+    assert loaded.first_ph_target == protocol.FIRST_TITRATION_PH_TARGET
+    assert loaded.gran_ph_cutoff == protocol.DEFAULT_PROTOCOL.gran_ph_cutoff
+
+def test_routine_follows_protocol() -> None:
+    """Test that the routine's targets and step come from its protocol: a
+    coarser step and a higher stop take fewer steps.
+    """
+    default = run_with_protocol(protocol.DEFAULT_PROTOCOL)
+    coarse = run_with_protocol(protocol.TitrationProtocol(
+        first_ph_target=3.8, second_ph_target=3.3, ph_step=0.2,
+        gran_ph_cutoff=3.8
+    ))
+
+    phs = coarse.titration.ph_array
+    assert phs[-1] <= 3.3 < phs[-2]
+    assert coarse.titration.ph_array.size < default.titration.ph_array.size
+
+    # Doses after the first aim 0.2 pH below the last reading
+    assert np.all(np.abs(np.diff(phs[1:]) + 0.2) < 0.05)
+    assert coarse.result[0] == pytest.approx(2200.0, rel=0.02)
@@ -0,0 +1,256 @@
+# Write unit tests for checkpoints and resuming here
+# Tests MUST start with `test_` for pytest to find them
+
+import os
+from unittest.mock import Mock
+
+import numpy as np
+
+from lib.services.titration import gran, recovery, results, routine
+
+PH_READINGS = [8.0, 3.75, 3.65, 3.55, 3.45, 3.35, 3.25, 3.15, 3.05, 2.95]
+
+
+def measurement(ph: float) -> dict:
+    """Helper to build a mocked meter response for the given pH.
+    """
+    return {"pH": str(ph), "mV": str(round((7 - ph) * 59.16, 1)),
+            "temp": "25.0"}
+
+def make_pump() -> Mock:
+    """Helper to build a mocked pump that keeps track of its syringe
+    position, like the real pump does across a crash of the program.
+    """
+    liters_per_step = 0.002478 / 48000
+
+    pump = Mock()
+    pump.position = 0
+    pump.dispensed_steps = 0
+    pump.liters_to_steps = Mock(side_effect=lambda v: int(v / liters_per_step))
+    pump.get_syringe_position = Mock(side_effect=lambda: pump.position)
+
+    def fill() -> None:
+        pump.position = 48000
+
+    def dispense(volume: float) -> None:
+        pump.position -= pump.liters_to_steps(volume)
+        pump.dispensed_steps += pump.liters_to_steps(volume)
+
+    pump.fill = Mock(side_effect=fill)
+    pump.dispense = Mock(side_effect=dispense)
+    return pump
+
+def crash_after(pump: Mock, readings: list, filepath: str) -> None:
+    """Helper to run a routine whose meter fails once the given readings
+    are used up, leaving its checkpoint and journal behind.
+    """
+    meter = Mock()
+    meter.get_measurement = Mock(side_effect=(
+        [measurement(ph) for ph in readings] + [RuntimeError("power loss")] * 2
+    ))
+    titration_routine = routine.TitrationRoutine(
+        pump, meter, 100.0, 35.0, 0.1,
+        journal=results.StepJournal(filepath),
+        checkpoint=recovery.Checkpoint(filepath)
+    )
+    try:
+        list(titration_routine.run())
+    except RuntimeError:
+        pass
+
+def resume(pump: Mock, readings: list,
+             checkpoint_path: str) -> routine.TitrationRoutine:
+    """Helper to resume a run from its checkpoint with fresh readings.
+    """
+    state = recovery.load_checkpoint(checkpoint_path)
+    meter = Mock()
+    meter.get_measurement = Mock(side_effect=[measurement(ph)
+                                              for ph in readings])
+    titration_routine = routine.TitrationRoutine.resume(
+        pump, meter, state,
+        journal=results.StepJournal(state["filepath"]),
+        checkpoint=recovery.Checkpoint(state["filepath"])
+    )
+    list(titration_routine.run())
+    return titration_routine
+
+def test_checkpoint_round_trip(tmp_path) -> None:
+    """Test that a saved checkpoint is found and rebuilds the titration.
+    """
+    titration = gran.ModifiedGranTitration(100.0, 35.0, 0.1, 25.0, 8.0, -50.0)
+    titration.add_step_data(3.75, 191.7, 0.0021)
+
+    checkpoint = recovery.Checkpoint(str(tmp_path / "run.csv"))
+    checkpoint.save(titration, "AUTO", 5000, 0.0001)
+
+    assert recovery.find_interrupted_runs(str(tmp_path)) == [checkpoint.path]
+    state = recovery.load_checkpoint(checkpoint.path)
+    assert state["phase"] == "AUTO"
+    assert state["syringe_steps"] == 5000
+    assert state["pending_dose"] == 0.0001
+
+    loaded = recovery.titration_from_state(state)
+    assert np.array_equal(loaded.volume_array, titration.volume_array)
+    assert np.array_equal(loaded.ph_array, titration.ph_array)
+    assert loaded.K1 == titration.K1
+
+    checkpoint.clear()
+    assert recovery.find_interrupted_runs(str(tmp_path)) == []
+
+def test_resume_measures_pending_dose_without_redosing(tmp_path) -> None:
+    """Test that a run interrupted between a dose and its measurement is
+    resumed by measuring that dose, and ends like an uninterrupted run.
+    """
+    filepath = str(tmp_path / "run.csv")
+    pump = make_pump()
+    crash_after(pump, PH_READINGS[:4], filepath)
+
+    state = recovery.load_checkpoint(filepath + ".checkpoint")
+    assert state["pending_dose"] is not None
+    assert len(state["phs"]) == 4
+    dispensed = pump.dispense.call_count
+    position = pump.position
+
+    titration_routine = resume(pump, PH_READINGS[4:],
+                               filepath + ".checkpoint")
+
+    # The pump is only read, never re-initialized, and the first thing
+    # done is measuring rather than dosing
+    assert not pump.initialize_pump.called
+    assert titration_routine.titration.ph_array.size == len(PH_READINGS)
+    assert pump.dispense.call_count - dispensed == len(PH_READINGS) - 5
+    assert titration_routine.phase == routine.TitrationPhases.FINISHED
+    assert titration_routine.result[0] > 0
+    assert not os.path.exists(filepath + ".checkpoint")
+
+    # The resumed run keeps the start time of the interrupted one
+    assert state["started_at"] is not None
+    assert titration_routine.started_at == state["started_at"]
+
+    # The syringe was tracked from the position read back from the pump
+    assert titration_routine.available_steps == pump.position
+    assert pump.position < position
+
+def crash_in_dispense(pump: Mock, readings: list, filepath: str,
+                        moved: bool) -> None:
+    """Helper to run a routine that dies inside the dispense following the
+    given readings, after the plunger moved or before it did.
+    """
+    dispense = pump.dispense.side_effect
+
+    def failing_dispense(volume: float) -> None:
+        if meter.get_measurement.call_count == len(readings):
+            if moved:
+                dispense(volume)
+            raise RuntimeError("power loss")
+        dispense(volume)
+
+    meter = Mock()
+    meter.get_measurement = Mock(side_effect=[measurement(ph)
+                                              for ph in readings])
+    pump.dispense = Mock(side_effect=failing_dispense)
+    titration_routine = routine.TitrationRoutine(
+        pump, meter, 100.0, 35.0, 0.1,
+        journal=results.StepJournal(filepath),
+        checkpoint=recovery.Checkpoint(filepath)
+    )
+    try:
+        list(titration_routine.run())
+    except RuntimeError:
+        pass
+    pump.dispense = Mock(side_effect=dispense)
+
+def test_resume_after_crash_in_dispense(tmp_path) -> None:
+    """Test that a run dying between the dispense and the next checkpoint
+    measures the dose if the plunger moved, and doses again if it didn't,
+    so the acid never goes in twice.
+    """
+    for moved in (True, False):
+        filepath = str(tmp_path / f"run-{moved}.csv")
+        pump = make_pump()
+        crash_in_dispense(pump, PH_READINGS[:4], filepath, moved)
+
+        state = recovery.load_checkpoint(filepath + ".checkpoint")
+        assert len(state["phs"]) == 4
+        assert state["pending_dose"] is not None
+        dose_steps = pump.liters_to_steps(state["pending_dose"])
+        assert (state["syringe_steps"] - pump.position
+                == (dose_steps if moved else 0))
+
+        titration_routine = resume(pump, PH_READINGS[4:],
+                                   filepath + ".checkpoint")
+
+        titration = titration_routine.titration
+        assert titration.ph_array.size == len(PH_READINGS)
+        assert titration_routine.phase == routine.TitrationPhases.FINISHED
+        # Every measured step had its dose dispensed exactly once
+        assert pump.dispensed_steps == sum(pump.liters_to_steps(v)
+                                for v in np.diff(titration.volume_array))
+        if moved:
+            assert titration.volume_array[4] == (state["volumes"][-1]
+                                                 + state["pending_dose"])
+            assert pump.dispense.call_count == len(PH_READINGS) - 5
+        else:
+            assert pump.dispense.call_count == len(PH_READINGS) - 4
+
+def test_resume_after_crash_after_early_refill(tmp_path) -> None:
+    """Test that a run dying while its dose equilibrates, after the
+    syringe was refilled for the next dose, measures that dose on resume
+    instead of taking the refilled plunger for an undispensed dose.
+    """
+    filepath = str(tmp_path / "run.csv")
+    pump = make_pump()
+    crash_after(pump, PH_READINGS[:1], filepath)
+
+    state = recovery.load_checkpoint(filepath + ".checkpoint")
+    assert state["dose_dispensed"]
+    assert pump.fill.call_count == 2
+    assert pump.position == 48000
+
+    titration_routine = resume(pump, PH_READINGS[1:],
+                               filepath + ".checkpoint")
+
+    titration = titration_routine.titration
+    assert titration.ph_array.size == len(PH_READINGS)
+    assert titration.volume_array[1] == state["pending_dose"]
+    assert pump.dispensed_steps == sum(pump.liters_to_steps(v)
+                            for v in np.diff(titration.volume_array))
+
+def test_resume_after_measured_step(tmp_path) -> None:
+    """Test that a run interrupted right after a step was recorded picks
+    up with the next dose, and that the journal holds every step.
+    """
+    filepath = str(tmp_path / "run.csv")
+    pump = make_pump()
+
+    # Undo the dose of step 4, as if the program died right after
+    # recording step 3
+    checkpoint = recovery.Checkpoint(filepath)
+    crash_after(pump, PH_READINGS[:4], filepath)
+    state = recovery.load_checkpoint(checkpoint.path)
+    pump.position += pump.liters_to_steps(state["pending_dose"])
+    titration = recovery.titration_from_state(state)
+    checkpoint.save(titration, state["phase"], pump.position, None)
+
+    titration_routine = resume(pump, PH_READINGS[4:], checkpoint.path)
+
+    assert titration_routine.titration.ph_array.size == len(PH_READINGS)
+    journal = results.load_journal(filepath + ".partial")
+    assert np.allclose(journal.ph_array, titration_routine.titration.ph_array)
+
+def test_checkpoint_removed_when_stopped(tmp_path) -> None:
+    """Test that stopping a run on purpose leaves nothing to resume.
+    """
+    filepath = str(tmp_path / "run.csv")
+    meter = Mock()
+    meter.get_measurement = Mock(side_effect=[measurement(ph)
+                                              for ph in PH_READINGS])
+    titration_routine = routine.TitrationRoutine(
+        make_pump(), meter, 100.0, 35.0, 0.1,
+        checkpoint=recovery.Checkpoint(filepath)
+    )
+    titration_routine.on_step = lambda t: titration_routine.stop()
+    list(titration_routine.run())
+
+    assert titration_routine.stopped
+    assert recovery.find_interrupted_runs(str(tmp_path)) == []
@@ -0,0 +1,137 @@
+# Write unit tests for batch reprocessing here
+# Tests MUST start with `test_` for pytest to find them
+
+import csv
+import json
+
+import numpy as np
+
+from lib.services.titration import gran, reprocess, store
+
+PH_READINGS = [8.0, 3.75, 3.65, 3.55, 3.45, 3.35, 3.25, 3.15, 3.05, 2.95]
+
+
+def make_titration(sample_mass: float = 100.0) -> gran.ModifiedGranTitration:
+    """Helper to build a titration with a few steps in the Gran region.
+    """
+    titration = gran.ModifiedGranTitration(sample_mass, 35.0, 0.1, 25.0, 8.0,
+                                           -50.0)
+    for i, ph in enumerate(PH_READINGS[1:]):
+        titration.add_step_data(ph, (7 - ph) * 59.16, 0.0001 * (i + 1))
+    return titration
+
+def make_store(tmp_path, n_runs: int) -> store.ResultStore:
+    """Helper to build a store whose TAs come from the Gran fit.
+    """
+    result_store = store.ResultStore(str(tmp_path / "results.sqlite3"),
+                                     batch_size=n_runs)
+    for i in range(n_runs):
+        titration = make_titration(90.0 + i)
+        total_alkalinity, gamma, rsq = titration.gran_polynomial_fit()
+        result_store.add_run(titration, total_alkalinity, gamma, rsq,
+                             sample_id=f"S{i % 2}")
+    result_store.flush()
+    return result_store
+
+def test_reprocess_matches_stored_results(tmp_path) -> None:
+    """Test that every run is refitted across chunks and that unchanged
+    runs reproduce their stored TA.
+    """
+    result_store = make_store(tmp_path, 20)
+
+    rows = reprocess.reprocess(result_store, workers=2, chunk_size=3)
+
+    assert sorted(row[0] for row in rows) == list(range(1, 21))
+    assert all(row[5] is None for row in rows)
+    assert np.allclose([row[4] for row in rows], 0.0)
+
+    stored = result_store._conn.execute(
+        "SELECT COUNT(*), MAX(ABS(diff_umol_kg)) FROM reprocessed "
+        "WHERE engine = 'gran'"
+    ).fetchone()
+    assert stored[0] == 20
+    assert stored[1] < 1e-6
+    result_store.close()
+
+def test_reprocess_filters_runs(tmp_path) -> None:
+    """Test that query filters select the runs to reprocess.
+    """
+    result_store = make_store(tmp_path, 6)
+
+    rows = reprocess.reprocess(result_store, workers=1, sample_id="S1")
+
+    assert sorted(row[0] for row in rows) == [2, 4, 6]
+    result_store.close()
+
+def test_stored_cutoff_used(tmp_path) -> None:
+    """Test that a run is refitted with the Gran cutoff of its stored
+    protocol rather than the default one.
+    """
+    result_store = store.ResultStore(str(tmp_path / "results.sqlite3"))
+    titration = make_titration()
+    total_alkalinity, gamma, rsq = titration.gran_polynomial_fit(3.5)
+    assert total_alkalinity != titration.gran_polynomial_fit()[0]
+    result_store.add_run(titration, total_alkalinity, gamma, rsq,
+                         protocol={"gran_ph_cutoff": 3.5})
+
+    rows = reprocess.reprocess(result_store, workers=1)
+
+    assert rows[0][5] is None
+    assert abs(rows[0][4]) < 1e-6
+    result_store.close()
+
+def test_failed_fit_is_recorded(tmp_path) -> None:
+    """Test that a run that can't be fitted is recorded with its error
+    instead of stopping the pass, and that it shows up in the report.
+    """
+    result_store = make_store(tmp_path, 2)
+    titration = gran.ModifiedGranTitration(100.0, 35.0, 0.1, 25.0, 8.0, -50.0)
+    titration.add_step_data(5.0, 118.3, 0.0001)
+    result_store.add_run(titration, 2000.0)
+
+    rows = reprocess.reprocess(result_store, workers=2)
+
+    failed = [row for row in rows if row[5] is not None]
+    assert [row[0] for row in failed] == [3]
+    assert failed[0][1] is None and failed[0][4] is None
+
+    report_path = str(tmp_path / "report.csv")
+    reprocess.write_report(report_path, result_store, rows)
+    with open(report_path) as f:
+        report = list(csv.reader(f))
+    assert report[0] == reprocess.REPORT_HEADER
+    assert len(report) == 4
+    assert report[3][6] == failed[0][5]
+    result_store.close()
+
+def test_fit_dump_records_every_run(tmp_path) -> None:
+    """Test that every worker appends its fits to the shared dump file,
+    tagged with the run id.
+    """
+    result_store = make_store(tmp_path, 5)
+    dump_path = str(tmp_path / "fits.jsonl")
+
+    reprocess.reprocess(result_store, workers=2, chunk_size=2,
+                        fit_dump=dump_path)
+
+    with open(dump_path) as f:
+        records = [json.loads(line) for line in f]
+    assert sorted(record["run_id"] for record in records) == [1, 2, 3, 4, 5]
+    assert all(record["kind"] == "gran_fit" for record in records)
+    assert all(len(record["residuals"]) == len(record["volumes"])
+               for record in records)
+    result_store.close()
+
+def test_emf_engine(tmp_path) -> None:
+    """Test that the emf engine refits every run under its own name.
+    """
+    result_store = make_store(tmp_path, 4)
+
+    rows = reprocess.reprocess(result_store, "gran_emf", workers=1)
+
+    assert all(row[5] is None for row in rows)
+    stored = result_store._conn.execute(
+        "SELECT COUNT(*) FROM reprocessed WHERE engine = 'gran_emf'"
+    ).fetchone()
+    assert stored[0] == 4
+    result_store.close()
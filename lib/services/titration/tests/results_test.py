@@ -0,0 +1,134 @@
+# Write unit tests for result files here
+# Tests MUST start with `test_` for pytest to find them
+
+import csv
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from lib.services.titration import gran, results, routine
+
+PH_READINGS = [8.0, 3.75, 3.65, 3.55, 3.45, 3.35, 3.25, 3.15, 3.05, 2.95]
+
+
+def make_titration(steps: int = len(PH_READINGS) - 1
+                      ) -> gran.ModifiedGranTitration:
+    """Helper to build a titration with the given number of steps.
+    """
+    titration = gran.ModifiedGranTitration(100.0, 35.0, 0.1, 25.0, 8.0, -50.0)
+    for i, ph in enumerate(PH_READINGS[1:steps + 1]):
+        titration.add_step_data(ph, (7 - ph) * 59.16, 0.0001 * (i + 1))
+    return titration
+
+def read_rows(filepath) -> list:
+    """Helper to read a csv file into a list of rows.
+    """
+    with open(filepath, newline="") as f:
+        return list(csv.reader(f))
+
+def test_journal_finalizes_to_csv_layout(tmp_path) -> None:
+    """Test that a finalized journal is identical to a file written in one
+    go at the end, and that the journal itself is removed.
+    """
+    titration = make_titration()
+    expected_path = tmp_path / "expected.csv"
+    results.write_csv(str(expected_path), titration, 2250.1234)
+
+    journal = results.StepJournal(str(tmp_path / "run.csv"))
+    journal.open(make_titration(steps=0))
+    for vol, emf, ph in zip(titration.volume_array[1:],
+                            titration.emf_array[1:], titration.ph_array[1:]):
+        journal.append(float(vol), float(emf), float(ph))
+
+    assert journal.finalize(titration, 2250.1234) == str(tmp_path / "run.csv")
+    assert read_rows(tmp_path / "run.csv") == read_rows(expected_path)
+    assert not (tmp_path / "run.csv.partial").exists()
+    assert not (tmp_path / "run.csv.tmp").exists()
+
+def test_journal_keeps_steps_of_interrupted_run(tmp_path) -> None:
+    """Test that a journal left by a run that never finished holds every
+    step and can be loaded back, ignoring a torn last row.
+    """
+    titration = make_titration()
+    journal = results.StepJournal(str(tmp_path / "run.csv"))
+    journal.open(make_titration(steps=0))
+    for vol, emf, ph in zip(titration.volume_array[1:],
+                            titration.emf_array[1:], titration.ph_array[1:]):
+        journal.append(float(vol), float(emf), float(ph))
+
+    # Simulate a crash in the middle of writing a row
+    with open(journal.journal_path, "a") as f:
+        f.write("0.0012,23")
+    journal.close()
+
+    rows = read_rows(journal.journal_path)
+    assert rows[1][-1] == ""
+    assert not (tmp_path / "run.csv").exists()
+
+    loaded = results.load_journal(journal.journal_path)
+    assert loaded.ph_array.size == len(PH_READINGS)
+    assert np.allclose(loaded.volume_array, titration.volume_array)
+    assert np.allclose(loaded.emf_array, titration.emf_array)
+    assert loaded.salinity == titration.salinity
+    assert loaded.temp_C == pytest.approx(titration.temp_C)
+
+def test_journal_syncs_are_batched(tmp_path, monkeypatch) -> None:
+    """Test that steps appended within the sync interval share one fsync.
+    """
+    fsync = Mock()
+    monkeypatch.setattr(results.os, "fsync", fsync)
+
+    journal = results.StepJournal(str(tmp_path / "run.csv"),
+                                  sync_interval=60)
+    journal.open(make_titration(steps=0))
+    assert fsync.call_count == 1
+
+    for i in range(10):
+        journal.append(0.0001 * i, 100.0, 3.5)
+    assert fsync.call_count == 1
+
+    journal.close()
+    assert fsync.call_count == 2
+
+def test_routine_journals_steps_when_stopped(tmp_path) -> None:
+    """Test that a routine stopped midway leaves its measured steps in
+    the journal.
+    """
+    pump = Mock()
+    pump.get_syringe_position = Mock(return_value=48000)
+    pump.liters_to_steps = Mock(side_effect=lambda v: int(v / 5.1625e-8))
+    meter = Mock()
+    meter.get_measurement = Mock(side_effect=[
+        {"pH": str(ph), "mV": str(round((7 - ph) * 59.16, 1)), "temp": "25.0"}
+        for ph in PH_READINGS
+    ])
+
+    journal = results.StepJournal(str(tmp_path / "run.csv"))
+    titration_routine = routine.TitrationRoutine(
+        pump, meter, 100.0, 35.0, 0.1, journal=journal
+    )
+    titration_routine.on_step = lambda t: (t.ph_array.size >= 4
+                                            and titration_routine.stop())
+    list(titration_routine.run())
+
+    assert titration_routine.stopped
+    loaded = results.load_journal(journal.journal_path)
+    assert np.allclose(loaded.ph_array, titration_routine.titration.ph_array)
+
+def test_journal_reopened_with_existing_steps(tmp_path) -> None:
+    """Test that opening a journal for a titration that already has steps
+    (as when a run is resumed) writes those steps first.
+    """
+    titration = make_titration()
+    journal = results.StepJournal(str(tmp_path / "run.csv"))
+    journal.open(make_titration(steps=4))
+    journal.close()
+    journal.open(make_titration(steps=4))
+    for vol, emf, ph in zip(titration.volume_array[5:],
+                            titration.emf_array[5:], titration.ph_array[5:]):
+        journal.append(float(vol), float(emf), float(ph))
+    journal.close()
+
+    loaded = results.load_journal(journal.journal_path)
+    assert np.allclose(loaded.ph_array, titration.ph_array)
@@ -0,0 +1,185 @@
+# Write unit tests for the titration routine here
+# Tests MUST start with `test_` for pytest to find them
+
+from unittest.mock import Mock
+
+from lib.services.titration import routine
+
+# The routine is driven here by simply iterating over its generator, which
+# skips every wait; the pump and meter are mocked as in the driver tests.
+
+PH_READINGS = [8.0, 4.5, 3.75, 3.65, 3.55, 3.45, 3.35, 3.25, 3.15, 3.05, 2.95]
+
+
+def make_meter(readings: list) -> Mock:
+    """Helper to build a mocked meter returning the given pH readings.
+    """
+    meter = Mock()
+    meter.get_measurement = Mock(side_effect=[
+        {"pH": str(ph), "mV": str(round((7 - ph) * 59.16, 1)), "temp": "25.0"}
+        for ph in readings
+    ])
+    return meter
+
+def make_pump(capacity: int = 48000) -> Mock:
+    """Helper to build a mocked pump that keeps track of its syringe
+    position, with a 2.478 mL syringe filled to the given position.
+    """
+    liters_per_step = 0.002478 / 48000
+
+    pump = Mock()
+    pump.position = 0
+    pump.liters_to_steps = Mock(side_effect=lambda v: int(v / liters_per_step))
+    pump.get_syringe_position = Mock(side_effect=lambda: pump.position)
+
+    def fill() -> None:
+        pump.position = capacity
+
+    def dispense(volume: float) -> None:
+        assert pump.position >= pump.liters_to_steps(volume)
+        pump.position -= pump.liters_to_steps(volume)
+
+    pump.fill = Mock(side_effect=fill)
+    pump.dispense = Mock(side_effect=dispense)
+    return pump
+
+def test_routine_runs_to_completion() -> None:
+    """Test that the routine takes every step down to the final pH target
+    and computes a result.
+    """
+    pump = make_pump()
+    on_step = Mock()
+    titration_routine = routine.TitrationRoutine(
+        pump, make_meter(PH_READINGS), 100.0, 35.0, 0.1, on_step=on_step
+    )
+
+    delays = list(titration_routine.run())
+
+    assert all(delay >= 0 for delay in delays)
+    assert titration_routine.phase == routine.TitrationPhases.FINISHED
+    assert titration_routine.titration.ph_array.size == len(PH_READINGS)
+    assert pump.dispense.call_count == len(PH_READINGS) - 1
+    assert on_step.call_count == len(PH_READINGS) - 1
+
+    total_alkalinity, gamma, rsq = titration_routine.result
+    assert total_alkalinity > 0
+
+def test_routine_times_each_phase() -> None:
+    """Test that the routine charges every dose, wait and reading to its
+    phase timer.
+    """
+    titration_routine = routine.TitrationRoutine(
+        make_pump(), make_meter(PH_READINGS), 100.0, 35.0, 0.1
+    )
+    list(titration_routine.run())
+
+    spans = titration_routine.timer.summary()["spans"]
+    assert spans["measure"]["count"] == len(PH_READINGS)
+    assert spans["dose"]["count"] == len(PH_READINGS) - 1
+    assert spans["equilibrate"]["count"] >= 1
+    assert spans["fill"]["count"] >= 1
+    assert spans["compute"]["count"] >= 1
+
+def test_routine_refills_during_equilibration() -> None:
+    """Test that the syringe is refilled while the electrode equilibrates
+    when the next dose won't fit, so no step has to wait on a refill.
+    """
+    pump = make_pump(capacity=30000)
+    statuses = []
+    titration_routine = routine.TitrationRoutine(
+        pump, make_meter(PH_READINGS), 50.0, 35.0, 0.1,
+        on_status=statuses.append
+    )
+    list(titration_routine.run())
+
+    assert titration_routine.phase == routine.TitrationPhases.FINISHED
+    assert titration_routine.refill_count > 1
+    assert titration_routine.stalled_refill_count == 0
+    assert pump.fill.call_count == titration_routine.refill_count
+
+    # Each refill is started after a dose, before the measurement
+    for i, status in enumerate(statuses):
+        if status == "Refilling syringe...":
+            assert statuses[i - 1] == "Dosing..."
+            assert statuses[i + 1] == "Waiting for pH measurement..."
+
+def test_routine_refills_before_dose_that_does_not_fit() -> None:
+    """Test that a dose bigger than the syringe contents is preceded by
+    a refill even when it wasn't foreseen.
+    """
+    pump = make_pump()
+    titration_routine = routine.TitrationRoutine(
+        pump, make_meter(PH_READINGS), 100.0, 35.0, 0.1, prefilled=True
+    )
+    pump.position = 100
+    list(titration_routine.run())
+
+    assert titration_routine.stalled_refill_count == 1
+    assert titration_routine.phase == routine.TitrationPhases.FINISHED
+
+def test_syringe_position_read_only_after_fills() -> None:
+    """Test that the syringe contents are tracked locally rather than
+    queried before every dose.
+    """
+    pump = make_pump()
+    titration_routine = routine.TitrationRoutine(
+        pump, make_meter(PH_READINGS), 100.0, 35.0, 0.1
+    )
+    list(titration_routine.run())
+
+    assert (pump.get_syringe_position.call_count
+            == titration_routine.refill_count)
+    assert titration_routine.available_steps == pump.position
+
+def test_routine_stops_before_next_step() -> None:
+    """Test that a stop request ends the routine at the next step boundary
+    without any further doses.
+    """
+    pump = make_pump()
+    titration_routine = routine.TitrationRoutine(
+        pump, make_meter(PH_READINGS), 100.0, 35.0, 0.1
+    )
+    titration_routine.on_step = lambda titration: titration_routine.stop()
+
+    list(titration_routine.run())
+
+    # The first step is reported once the second dose is in, and that dose
+    # is still measured so it isn't lost
+    assert titration_routine.stopped
+    assert titration_routine.result is None
+    assert pump.dispense.call_count == 2
+    assert titration_routine.titration.ph_array.size == 3
+
+def test_measurement_retried_once() -> None:
+    """Test that a garbled meter response is retried before giving up.
+    """
+    meter = Mock()
+    meter.get_measurement = Mock(side_effect=[
+        IndexError(), {"pH": "8.0", "mV": "-50.0", "temp": "25.0"}
+    ])
+    titration_routine = routine.TitrationRoutine(
+        make_pump(), meter, 100.0, 35.0, 0.1
+    )
+    assert titration_routine.get_phmeter_measurements() == (8.0, -50.0, 25.0)
+
+def test_prefilled_routine_skips_fill_and_deferred_analysis() -> None:
+    """Test that a prefilled routine doesn't fill at the start, and that
+    deferring the analysis leaves the result to the caller.
+    """
+    pump = make_pump()
+    pump.position = 48000
+    titration_routine = routine.TitrationRoutine(
+        pump, make_meter(PH_READINGS), 100.0, 35.0, 0.1,
+        prefilled=True, defer_analysis=True
+    )
+    list(titration_routine.run())
+
+    # Any fills come from refills after the first dose
+    calls = [name for name, _, _ in pump.mock_calls
+             if name in ("fill", "dispense")]
+    assert calls[0] == "dispense"
+    assert pump.get_syringe_position.call_count == pump.fill.call_count + 1
+    assert titration_routine.stalled_refill_count == 0
+    assert titration_routine.result is None
+    titration_routine.finish_titration()
+    assert titration_routine.result is not None
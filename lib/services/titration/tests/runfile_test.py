@@ -0,0 +1,121 @@
+# Write unit tests for binary run files here
+# Tests MUST start with `test_` for pytest to find them
+
+import errno
+
+import numpy as np
+import pytest
+
+from lib.services.titration import gran, results, runfile
+
+PH_READINGS = [8.0, 3.75, 3.65, 3.55, 3.45, 3.35, 3.25, 3.15, 3.05, 2.95]
+
+
+def make_titration() -> gran.ModifiedGranTitration:
+    """Helper to build a titration with a few steps.
+    """
+    titration = gran.ModifiedGranTitration(100.0, 35.0, 0.1, 25.0, 8.0, -50.0)
+    for i, ph in enumerate(PH_READINGS[1:]):
+        titration.add_step_data(ph, (7 - ph) * 59.16, 0.0001 * (i + 1))
+    return titration
+
+def test_round_trip_with_zero_copy_views(tmp_path) -> None:
+    """Test that columns and metadata come back exactly, as read-only
+    views of the mapped file.
+    """
+    titration = make_titration()
+    times = np.arange(len(PH_READINGS)) * 6.0
+    filepath = str(tmp_path / "run.oalk")
+    runfile.write_titration(filepath, titration, 2250.1, times=times,
+                            sample_id="CRM-205")
+
+    run = runfile.RunFile(filepath)
+    assert np.array_equal(run.volume, titration.volume_array)
+    assert np.array_equal(run.emf, titration.emf_array)
+    assert np.array_equal(run.ph, titration.ph_array)
+    assert np.array_equal(run.time, times)
+    assert np.all(run.temp == 25.0)
+    assert run.metadata["sample_id"] == "CRM-205"
+    assert run.metadata["total_alk_umol_kg"] == 2250.1
+
+    assert not run.ph.flags.owndata
+    assert not run.ph.flags.writeable
+    assert run.ph.ctypes.data % 8 == 0
+
+    rebuilt = run.to_titration()
+    assert rebuilt.gran_polynomial_fit()[0] == pytest.approx(
+        titration.gran_polynomial_fit()[0]
+    )
+
+def test_rejects_other_files(tmp_path) -> None:
+    """Test that files which aren't run files, or are truncated, are
+    refused and skipped in bulk loads.
+    """
+    other = tmp_path / "other.oalk"
+    other.write_bytes(b"total_volume_added_L,emf_mV,pH\n")
+
+    good = str(tmp_path / "good.oalk")
+    runfile.write_titration(good, make_titration(), 2250.1)
+    truncated = tmp_path / "truncated.oalk"
+    truncated.write_bytes(open(good, "rb").read()[:-8])
+
+    with pytest.raises(ValueError):
+        runfile.RunFile(str(other))
+    with pytest.raises(ValueError):
+        runfile.RunFile(str(truncated))
+
+    runs = runfile.load_runs([str(other), good, str(truncated)])
+    assert [run.filepath for run in runs] == [good]
+
+def test_mapped_on_first_use(tmp_path) -> None:
+    """Test that opening a run only reads its header, and that its file is
+    mapped once the columns are used.
+    """
+    filepath = str(tmp_path / "run.oalk")
+    runfile.write_titration(filepath, make_titration(), 2250.1)
+
+    run = runfile.RunFile(filepath)
+    assert run._map is None
+    assert run.metadata["n_steps"] == len(PH_READINGS) - 1
+    assert np.array_equal(run.ph, PH_READINGS)
+    assert run._map is not None
+
+def test_fd_limit_raised(tmp_path, monkeypatch) -> None:
+    """Test that running out of file descriptors fails bulk loads instead
+    of skipping the files as unreadable.
+    """
+    filepath = str(tmp_path / "run.oalk")
+    runfile.write_titration(filepath, make_titration(), 2250.1)
+
+    def no_fds(*args, **kwargs):
+        """Helper failing like open() with no file descriptors left.
+        """
+        raise OSError(errno.EMFILE, "Too many open files")
+
+    monkeypatch.setattr(runfile, "open", no_fds, raising=False)
+    with pytest.raises(OSError):
+        runfile.load_runs([filepath])
+    with pytest.raises(OSError):
+        runfile.load_summary([filepath])
+
+def test_convert_csv_and_summary(tmp_path) -> None:
+    """Test that legacy csv files are converted with their timestamp and
+    sample id, and that the headers of many files load into one array.
+    """
+    titration = make_titration()
+    filepaths = []
+    for i in range(5):
+        csv_path = tmp_path / f"2024_05_0{i + 1}-09_30_40_AM_S{i}.csv"
+        results.write_csv(str(csv_path), titration, 2200.0 + i)
+        filepaths.append(runfile.convert_csv(str(csv_path), str(tmp_path)))
+
+    run = runfile.RunFile(filepaths[2])
+    assert run.metadata["sample_id"] == "S2"
+    assert np.allclose(run.ph, titration.ph_array)
+    assert np.all(np.isnan(run.time))
+
+    summary = runfile.load_summary(filepaths)
+    assert np.array_equal(summary["total_alk_umol_kg"],
+                          [2200.0, 2201.0, 2202.0, 2203.0, 2204.0])
+    assert np.all(summary["n_steps"] == len(PH_READINGS) - 1)
+    assert np.all(np.diff(summary["started_at"]) > 0)
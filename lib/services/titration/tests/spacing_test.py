@@ -0,0 +1,107 @@
+# Write unit tests for step spacing policies here
+# Tests MUST start with `test_` for pytest to find them
+
+import numpy as np
+import pytest
+
+from lib.services.titration import gran, protocol, routine, simulation, spacing
+from lib.utils import clocks
+
+
+def mid_titration(phs: list) -> gran.ModifiedGranTitration:
+    """Helper to build a titration of 2200 umol/kg alkalinity whose steps
+    landed on the given pHs.
+    """
+    initial = gran.ModifiedGranTitration(100.0, 35.0, 0.1, 25.0, 7.75, 0.0)
+    phs = np.array([7.75] + phs)
+    volumes = np.array([0.0] + [initial.calc_required_acid_vol(ph)
+                                for ph in phs[1:]])
+    return gran.ModifiedGranTitration.from_arrays(100.0, 35.0, 0.1, 25.0,
+                                                  phs, phs, volumes,
+                                                  cumulative=True)
+
+def run_with_policy(policy: spacing.StepPolicy, seed: int
+                      ) -> routine.TitrationRoutine:
+    """Helper to run a simulated titration with a noisy pH meter.
+    """
+    clock = clocks.VirtualClock()
+    sample = simulation.SimulatedSample(2200.0, 35.0, ph_noise=0.002,
+                                        seed=seed)
+    pump, meter = simulation.simulated_devices(clock, sample)
+    titration_routine = routine.TitrationRoutine(
+        pump, meter, sample.sample_mass, sample.salinity, sample.acid_conc,
+        clock=clock, step_policy=policy
+    )
+    clock.run(titration_routine.run())
+    return titration_routine
+
+def test_fixed_steps_follow_protocol() -> None:
+    """Test that the default policy steps down by the protocol's pH step.
+    """
+    titration = mid_titration([3.8, 3.7])
+    coarse = protocol.TitrationProtocol(ph_step=0.2)
+    assert spacing.FIXED_STEPS.next_target(titration, coarse) == \
+        pytest.approx(3.5)
+    assert spacing.FIXED_STEPS.lookahead_target(3.5, coarse) == \
+        pytest.approx(3.3)
+
+    with pytest.raises(NotImplementedError):
+        spacing.StepPolicy().next_target(titration, coarse)
+    with pytest.raises(ValueError):
+        spacing.AdaptiveStepPolicy(min_step=0.5, max_step=0.2)
+
+def test_adaptive_targets_within_bounds() -> None:
+    """Test that adaptive steps stay within the step and dose bounds, and
+    that the protocol's step is taken above the Gran cutoff.
+    """
+    policy = spacing.AdaptiveStepPolicy(min_step=0.05, max_step=0.3,
+                                        min_dose=20e-6, max_dose=200e-6)
+    default = protocol.DEFAULT_PROTOCOL
+    assert policy.next_target(mid_titration([4.2]), default) == \
+        pytest.approx(4.1)
+
+    for phs in ([3.8], [3.8, 3.75], [3.8, 3.7, 3.4], [3.8, 3.4, 3.1]):
+        titration = mid_titration(phs)
+        target = policy.next_target(titration, default)
+        assert 0.05 - 1e-9 <= phs[-1] - target <= 0.3 + 1e-9
+        assert target >= default.second_ph_target - spacing.PH_RESOLUTION
+        assert 20e-6 <= titration.calc_required_acid_vol(target) <= 200e-6
+
+def test_veq_variance() -> None:
+    """Test that the predicted variance of Veq is undefined from one step,
+    shrinks with repeated steps and grows with the pH noise.
+    """
+    policy = spacing.AdaptiveStepPolicy()
+    titration = mid_titration([3.8, 3.6, 3.4, 3.2])
+    volumes, ygran = titration.get_gran_data()
+    intercept, slope = policy.fit(titration, volumes, ygran)
+    assert -intercept / slope == pytest.approx(
+        titration.gran_polynomial_fit()[0] * 100e-3 / 0.1 / 1e6, rel=1e-9
+    )
+
+    assert policy.veq_variance(volumes[:1], ygran[:1], intercept,
+                               slope) == np.inf
+    variance = policy.veq_variance(volumes, ygran, intercept, slope)
+    assert policy.veq_variance(np.tile(volumes, 2), np.tile(ygran, 2),
+                               intercept, slope) == pytest.approx(variance / 2)
+
+    noisy = spacing.AdaptiveStepPolicy(ph_noise=0.01)
+    assert noisy.veq_variance(volumes, ygran, intercept, slope) > variance
+
+def test_adaptive_fewer_steps_same_precision() -> None:
+    """Test that on a noisy meter, adaptive spacing reaches the second
+    target in fewer steps without a larger spread of alkalinity.
+    """
+    fixed = [run_with_policy(spacing.FIXED_STEPS, seed) for seed in range(8)]
+    adaptive = [run_with_policy(spacing.AdaptiveStepPolicy(), seed)
+                for seed in range(8)]
+
+    for runs in (fixed, adaptive):
+        for titration_routine in runs:
+            assert titration_routine.titration.get_last_ph() <= 3.0
+    steps = [np.mean([r.titration.ph_array.size for r in runs])
+             for runs in (fixed, adaptive)]
+    spread = [np.std([r.result[0] for r in runs]) for runs in (fixed, adaptive)]
+
+    assert steps[1] < steps[0] - 2
+    assert spread[1] <= spread[0] * 1.1
@@ -0,0 +1,245 @@
+# Write unit tests for the result store here
+# Tests MUST start with `test_` for pytest to find them
+
+import csv
+import sqlite3
+import threading
+
+import numpy as np
+import pytest
+
+from lib.services.titration import gran, results, store, timing
+
+PH_READINGS = [8.0, 3.75, 3.65, 3.55, 3.45, 3.35, 3.25, 3.15, 3.05, 2.95]
+
+
+def make_titration(salinity: float = 35.0) -> gran.ModifiedGranTitration:
+    """Helper to build a titration with a few steps.
+    """
+    titration = gran.ModifiedGranTitration(100.0, salinity, 0.1, 25.0, 8.0,
+                                           -50.0)
+    for i, ph in enumerate(PH_READINGS[1:]):
+        titration.add_step_data(ph, (7 - ph) * 59.16, 0.0001 * (i + 1))
+    return titration
+
+def test_runs_are_queried_by_index(tmp_path) -> None:
+    """Test that runs can be found by time, sample, station and TA.
+    """
+    result_store = store.ResultStore(str(tmp_path / "results.sqlite3"))
+    for i in range(10):
+        result_store.add_run(make_titration(), 2000.0 + 10 * i,
+                             sample_id=f"S{i % 3}",
+                             station=f"station-{i % 2}",
+                             started_at=1000.0 + i)
+
+    runs = result_store.query_runs()
+    assert runs.size == 10
+    assert runs["n_steps"][0] == len(PH_READINGS) - 1
+    assert np.all(np.diff(runs["started_at"]) > 0)
+
+    assert result_store.query_runs(sample_id="S1").size == 3
+    assert result_store.query_runs(station="station-0").size == 5
+    assert result_store.query_runs(start=1005.0).size == 5
+    assert np.array_equal(
+        result_store.query_runs(min_alk=2020.0, max_alk=2040.0)
+        ["total_alk_umol_kg"], [2020.0, 2030.0, 2040.0]
+    )
+    result_store.close()
+
+def test_zero_times_kept(tmp_path) -> None:
+    """Test that a start or finish time of 0 is stored as given rather
+    than replaced by a default.
+    """
+    result_store = store.ResultStore(str(tmp_path / "results.sqlite3"))
+    result_store.add_run(make_titration(), 2250.0, started_at=0.0,
+                         finished_at=0.0)
+    result_store.flush()
+
+    runs = result_store.query_runs()
+    assert runs["started_at"][0] == 0.0
+    assert runs["finished_at"][0] == 0.0
+
+def test_protocols_round_trip(tmp_path) -> None:
+    """Test that a run's protocol is stored with it, and that runs without
+    one are left out.
+    """
+    params = {"first_ph_target": 3.9, "second_ph_target": 3.0,
+              "ph_step": 0.1, "gran_ph_cutoff": 3.5}
+    result_store = store.ResultStore(str(tmp_path / "results.sqlite3"))
+    result_store.add_run(make_titration(), 2250.0, protocol=params)
+    result_store.add_run(make_titration(), 2260.0)
+
+    assert result_store.get_protocols([1, 2]) == {1: params}
+    assert result_store.get_protocols([2]) == {}
+    result_store.close()
+
+def test_old_database_upgraded(tmp_path) -> None:
+    """Test that a database created before the protocol column existed
+    gets it when opened, keeping its runs.
+    """
+    path = str(tmp_path / "results.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript(store.SCHEMA.replace(",\n    protocol TEXT", ""))
+    conn.execute(
+        "INSERT INTO runs (started_at, finished_at, sample_mass_g, "
+        "salinity, acid_conc_M, temp_C, total_alk_umol_kg, n_steps) "
+        "VALUES (0, 0, 100, 35, 0.1, 25, 2250, 9)"
+    )
+    conn.commit()
+    conn.close()
+
+    result_store = store.ResultStore(path)
+    result_store.add_run(make_titration(), 2260.0,
+                         protocol={"gran_ph_cutoff": 3.5})
+
+    assert result_store.query_runs().size == 2
+    assert result_store.get_protocols([1, 2]) == {2: {"gran_ph_cutoff": 3.5}}
+    result_store.close()
+
+def test_non_finite_results_refused(tmp_path) -> None:
+    """Test that a run with a non-finite TA, gamma or rsq is refused
+    before it is buffered.
+    """
+    result_store = store.ResultStore(str(tmp_path / "results.sqlite3"),
+                                     batch_size=2)
+    for kwargs in ({"total_alkalinity": float("nan")},
+                   {"total_alkalinity": 2250.0, "gamma": float("inf")},
+                   {"total_alkalinity": 2250.0, "rsq": float("nan")}):
+        with pytest.raises(ValueError):
+            result_store.add_run(make_titration(), **kwargs)
+    assert result_store._pending == []
+    result_store.close()
+
+def test_failed_batch_dropped(tmp_path) -> None:
+    """Test that a batch that fails to write is rolled back and dropped,
+    so later writes and queries work.
+    """
+    result_store = store.ResultStore(str(tmp_path / "results.sqlite3"),
+                                     batch_size=2)
+    result_store.add_run(make_titration(), 2250.0)
+    # A run that only fails at insert time, e.g. on a full disk
+    result_store._pending.append(((None,) * 14, (b"",) * 3, []))
+
+    with pytest.raises(sqlite3.IntegrityError):
+        result_store.flush()
+    assert result_store.query_runs().size == 0
+
+    result_store.add_run(make_titration(), 2260.0)
+    assert result_store.query_runs()["total_alk_umol_kg"].tolist() == [2260.0]
+    result_store.close()
+
+def test_steps_round_trip(tmp_path) -> None:
+    """Test that step arrays come back exactly as stored.
+    """
+    titration = make_titration()
+    result_store = store.ResultStore(str(tmp_path / "results.sqlite3"))
+    result_store.add_run(titration, 2250.0, gamma=0.01, rsq=0.999)
+    run_id = int(result_store.query_runs()["id"][0])
+
+    volumes, emfs, phs = result_store.get_steps(run_id)
+    assert np.array_equal(volumes, titration.volume_array)
+    assert np.array_equal(emfs, titration.emf_array)
+    assert np.array_equal(phs, titration.ph_array)
+
+    run = result_store.get_run(run_id)
+    assert run["gamma"] == 0.01
+    assert run["sample_id"] is None
+
+    with pytest.raises(KeyError):
+        result_store.get_steps(run_id + 1)
+    result_store.close()
+
+def test_inserts_are_batched(tmp_path) -> None:
+    """Test that buffered runs are only written once the batch is full or
+    the store is flushed, and that queries see buffered runs.
+    """
+    path = str(tmp_path / "results.sqlite3")
+    result_store = store.ResultStore(path, batch_size=4)
+    reader = store.ResultStore(path)
+
+    for _ in range(3):
+        result_store.add_run(make_titration(), 2250.0)
+    assert reader.query_runs().size == 0
+
+    result_store.add_run(make_titration(), 2250.0)
+    assert reader.query_runs().size == 4
+
+    result_store.add_run(make_titration(), 2250.0)
+    assert result_store.query_runs().size == 5
+    result_store.close()
+    reader.close()
+
+def test_concurrent_writers(tmp_path) -> None:
+    """Test that several threads can add runs to one store at once.
+    """
+    result_store = store.ResultStore(str(tmp_path / "results.sqlite3"))
+
+    def add_runs(station: str) -> None:
+        for _ in range(5):
+            result_store.add_run(make_titration(), 2250.0, station=station)
+
+    threads = [threading.Thread(target=add_runs, args=(f"station-{i}",))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert result_store.query_runs().size == 20
+    result_store.close()
+
+def test_csv_import_and_export(tmp_path) -> None:
+    """Test that csv result files are imported with their timestamp and
+    sample id, and exported back in the same layout.
+    """
+    titration = make_titration()
+    original = tmp_path / "2024_05_01-09_30_40_AM_CRM-205.csv"
+    results.write_csv(str(original), titration, 2250.123)
+    (tmp_path / "notes.csv").write_text("not,a,result\n")
+
+    result_store = store.ResultStore(str(tmp_path / "results.sqlite3"))
+    count = result_store.import_csv([str(original),
+                                     str(tmp_path / "notes.csv")])
+    assert count == 1
+
+    run = result_store.query_runs(sample_id="CRM-205")
+    assert run.size == 1
+    assert run["total_alk_umol_kg"][0] == 2250.123
+
+    exported = tmp_path / "exported.csv"
+    result_store.export_csv(int(run["id"][0]), str(exported))
+    with open(original, newline="") as f1, open(exported, newline="") as f2:
+        assert list(csv.reader(f1)) == list(csv.reader(f2))
+    result_store.close()
+
+def test_timings_round_trip_and_export(tmp_path) -> None:
+    """Test that phase timings are stored with a run and exported one row
+    per run, skipping runs without timings.
+    """
+    timer = timing.PhaseTimer(clock=iter([0.0, 0.0, 30.0, 100.0]).__next__)
+    timer.add("connect", 5.0)
+    with timer.span("dose"):
+        pass
+
+    result_store = store.ResultStore(str(tmp_path / "results.sqlite3"))
+    result_store.add_run(make_titration(), 2250.0, sample_id="A",
+                         started_at=1.0, timings=timer.summary())
+    result_store.add_run(make_titration(), 2260.0, sample_id="B",
+                         started_at=2.0)
+    run_id = int(result_store.query_runs(sample_id="A")["id"][0])
+
+    timings = result_store.get_timings(run_id)
+    assert timings["wall"] == (105.0, 1)
+    assert timings["other"] == (70.0, 1)
+    assert timings["dose"] == (30.0, 1)
+    assert timings["connect"] == (5.0, 1)
+
+    exported = tmp_path / "timings.csv"
+    assert result_store.export_timings(str(exported)) == 1
+    with open(exported, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0]["sample_id"] == "A"
+    assert float(rows[0]["dose_s"]) == 30.0
+    assert float(rows[0]["fill_s"]) == 0.0
+    assert result_store.export_timings(str(exported), sample_id="B") == 0
+    result_store.close()
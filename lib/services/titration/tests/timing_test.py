@@ -0,0 +1,80 @@
+# Write unit tests for phase timing here
+# Tests MUST start with `test_` for pytest to find them
+
+from lib.services.titration import timing
+
+
+class FakeClock:
+    """Helper clock that only moves when told to.
+    """
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_nested_spans_are_exclusive() -> None:
+    """Test that time in an inner span is taken out of the outer one, so
+    the spans and other add up to the wall time.
+    """
+    clock = FakeClock()
+    timer = timing.PhaseTimer(clock=clock)
+    timer.start()
+
+    clock.now = 1.0
+    with timer.span("dose"):
+        clock.now = 3.0
+        with timer.span("plot"):
+            clock.now = 4.5
+        clock.now = 10.0
+    with timer.span("equilibrate"):
+        clock.now = 16.0
+    with timer.span("dose"):
+        clock.now = 18.0
+
+    summary = timer.summary()
+    spans = summary["spans"]
+    assert spans["dose"] == {"total_s": 9.5, "count": 2}
+    assert spans["plot"] == {"total_s": 1.5, "count": 1}
+    assert spans["equilibrate"] == {"total_s": 6.0, "count": 1}
+    assert summary["wall_s"] == 18.0
+    assert summary["other_s"] == 1.0
+
+def test_connect_time_adds_to_wall_time() -> None:
+    """Test that connect time, spent before the run starts, counts towards
+    the wall time but not towards other.
+    """
+    clock = FakeClock()
+    timer = timing.PhaseTimer(clock=clock)
+    timer.add("connect", 2.0)
+    timer.start()
+    clock.now = 8.0
+
+    summary = timer.summary()
+    assert summary["wall_s"] == 10.0
+    assert summary["other_s"] == 8.0
+
+def test_format_summary() -> None:
+    """Test that the breakdown lists the largest spans first and skips
+    negligible ones.
+    """
+    summary = {"wall_s": 600.0, "other_s": 0.0,
+               "spans": {"dose": {"total_s": 150.0, "count": 10},
+                         "equilibrate": {"total_s": 450.0, "count": 10},
+                         "plot": {"total_s": 0.001, "count": 10}}}
+    assert timing.format_summary(summary) == "10.0 min: equilibrate 75%, dose 25%"
+    assert timing.format_summary(None) == ""
+
+def test_connect_time_charged_to_next_run() -> None:
+    """Test that the recorded connect time goes to the next run's timer
+    only.
+    """
+    connect_time = timing.ConnectTime()
+    connect_time.record(3.0)
+
+    first = connect_time.new_timer(station="station-1")
+    assert first.station == "station-1"
+    assert first.summary()["spans"]["connect"]["total_s"] == 3.0
+    second = connect_time.new_timer()
+    assert second.summary()["spans"]["connect"]["total_s"] == 0.0
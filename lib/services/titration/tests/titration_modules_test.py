@@ -4,6 +4,7 @@
 import csv
 
 import numpy as np
+import pytest
 
 from lib.services.titration import gran
 
@@ -90,6 +91,48 @@ def test_adding_step_data() -> None:
         assert titration.get_last_emf() == emf
         assert titration.get_last_volume() == last_total_volume + step_volume
 
+def test_from_arrays_matches_step_by_step() -> None:
+    """Test that building a titration from whole arrays gives the same
+    steps as adding them one by one.
+    """
+    step_volumes = np.array([0.0] + rawdata['step_volumes'][1:])
+    built = gran.ModifiedGranTitration.from_arrays(
+                rawdata['sample_mass_g'], rawdata['salinity'], 0.1,
+                rawdata['temp_C'], rawdata['ph'], rawdata['emf_mV'],
+                step_volumes
+    )
+    assert np.array_equal(built.ph_array, titration.ph_array)
+    assert np.array_equal(built.emf_array, titration.emf_array)
+    assert np.allclose(built.volume_array, titration.volume_array)
+    assert built.K1 == titration.K1
+
+def test_from_arrays_shares_cumulative_storage() -> None:
+    """Test that float64 arrays are used without a copy and that bad
+    arrays are rejected.
+    """
+    phs = np.array([8.0, 3.7, 3.6])
+    emfs = np.array([-50.0, 195.0, 201.0])
+    volumes = np.array([0.0, 0.001, 0.0011])
+    built = gran.ModifiedGranTitration.from_arrays(100.0, 35.0, 0.1, 25.0,
+                                                   phs, emfs, volumes,
+                                                   cumulative=True)
+    assert built.ph_array is phs
+    assert built.volume_array is volumes
+
+    bad_inputs = [
+        (phs[:2], emfs, volumes, True),
+        (phs, np.array([-50.0, np.nan, 201.0]), volumes, True),
+        (phs, emfs, volumes[::-1], True),
+        (phs, emfs, np.array([0.0, 0.001, -0.0001]), False),
+        (phs, emfs, np.array([0.001, 0.0001, 0.0001]), False),
+        (phs, emfs, volumes[1:], False),
+    ]
+    for bad_phs, bad_emfs, bad_volumes, cumulative in bad_inputs:
+        with pytest.raises(ValueError):
+            gran.ModifiedGranTitration.from_arrays(100.0, 35.0, 0.1, 25.0,
+                                                   bad_phs, bad_emfs,
+                                                   bad_volumes, cumulative)
+
 def test_ionic_strength_calculation() -> None:
     """Test that the ionic strength calculation works as expected.
     """
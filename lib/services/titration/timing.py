@@ -0,0 +1,216 @@
+import contextlib
+import logging
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from lib.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Where the time of a titration goes #####
+
+Each run carries a PhaseTimer that adds up the time spent in a handful of
+named spans:
+
+connect      opening and initializing the devices (charged to the first
+             run after connecting)
+fill         filling the syringe, including waiting on the pump
+dose         dispensing acid and waiting for it to go in
+equilibrate  waiting for the electrode to settle
+measure      reading the pH meter
+compute      dose estimates and the final fit
+plot         updating the display
+write        journal, checkpoint and result files
+
+Spans may be nested, e.g. a step is reported (plot) while its dose goes in;
+the inner span's time is taken out of the outer one, so every second is
+charged to exactly one span and the totals add up to the run's wall time,
+less whatever happened outside any span ("other").
+
+Because the routine is a generator, a span that contains a yield also
+covers the wait handed to the scheduler, which is the point: a dose span
+includes dose_wait.
+
+Every span is also observed in the openalk_phase_seconds histogram (see
+lib/utils/metrics.py), less the time of the spans nested in it.
+
+The summary stored with each result looks like:
+
+{"wall_s": 1204.2, "other_s": 3.1,
+ "spans": {"dose": {"total_s": 690.5, "count": 131}, ...}}
+"""
+
+SPANS = ["connect", "fill", "dose", "equilibrate", "measure", "compute",
+         "plot", "write"]
+
+
+class PhaseTimer:
+    """Adds up the time spent in each span of one run, see the notes
+    above.
+
+    Args:
+        clock (Callable): function returning the current time in seconds.
+            Defaults to time.monotonic.
+        station (str): station label of the span metrics.
+
+    Returns:
+        None.
+    """
+    def __init__(self, clock: Callable[[], float] = time.monotonic,
+                    station: str = metrics.DEFAULT_STATION) -> None:
+        self.clock = clock
+        self.station = station
+        self.totals: Dict[str, float] = {name: 0.0 for name in SPANS}
+        self.counts: Dict[str, int] = {name: 0 for name in SPANS}
+        self.started = None
+
+        # Time spent so far in each open span, innermost last, and when the
+        # innermost one last resumed
+        self._open: List[float] = []
+        self._resumed_at = None
+
+    def start(self) -> None:
+        """Marks the start of the run, if not already started.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if self.started is None:
+            self.started = self.clock()
+
+    def add(self, name: str, seconds: float) -> None:
+        """Charges time measured elsewhere to a span.
+
+        Args:
+            name (str): span name, see SPANS.
+            seconds (float): time to add.
+
+        Returns:
+            None.
+        """
+        self.totals[name] += seconds
+        self.counts[name] += 1
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Charges the time spent in the with block to a span.
+
+        Args:
+            name (str): span name, see SPANS.
+
+        Yields:
+            None.
+
+        Returns:
+            None.
+        """
+        now = self.clock()
+        self.start()
+        if self._open:
+            self._open[-1] += now - self._resumed_at
+        self._open.append(0.0)
+        self._resumed_at = now
+        try:
+            yield
+        finally:
+            now = self.clock()
+            spent = self._open.pop() + now - self._resumed_at
+            self.totals[name] += spent
+            self.counts[name] += 1
+            self._resumed_at = now
+            metrics.PHASE_SECONDS.observe(spent, station=self.station,
+                                          phase=name)
+
+    def summary(self) -> dict:
+        """Returns the totals of the run so far; the wall time runs until
+        this is called, so owners call it once the result is written.
+
+        Args:
+            None.
+
+        Returns:
+            dict: see the example above.
+        """
+        if self.started is None:
+            wall = 0.0
+        else:
+            wall = self.clock() - self.started
+        # Connect time is spent before the run starts
+        in_run = sum(total for name, total in self.totals.items()
+                     if name != "connect")
+        return {
+            "wall_s": wall + self.totals["connect"],
+            "other_s": max(0.0, wall - in_run),
+            "spans": {name: {"total_s": self.totals[name],
+                             "count": self.counts[name]}
+                      for name in SPANS},
+        }
+
+
+class ConnectTime:
+    """Holds the time spent connecting the devices until the timer of the
+    next run takes it.
+
+    Args:
+        None.
+
+    Returns:
+        None.
+    """
+    def __init__(self) -> None:
+        self.pending_s = 0.0
+
+    def record(self, seconds: float) -> None:
+        """Records the time a connection took.
+
+        Args:
+            seconds (float): time (in seconds) spent connecting.
+
+        Returns:
+            None.
+        """
+        self.pending_s = seconds
+
+    def new_timer(self, station: str = metrics.DEFAULT_STATION
+                    ) -> PhaseTimer:
+        """Creates the phase timer of the next run, charging it with the
+        time spent connecting since the last run.
+
+        Args:
+            station (str): station label of the span metrics.
+
+        Returns:
+            PhaseTimer: the new timer.
+        """
+        timer = PhaseTimer(station=station)
+        if self.pending_s:
+            timer.add("connect", self.pending_s)
+            self.pending_s = 0.0
+        return timer
+
+
+def format_summary(summary: Optional[dict]) -> str:
+    """Lays out a timing summary on one line, largest spans first, e.g.
+    "20.1 min: dose 57%, equilibrate 22%, fill 12%, ...".
+
+    Args:
+        summary (dict): output of PhaseTimer.summary, or None.
+
+    Returns:
+        str: the breakdown, or an empty string without a summary.
+    """
+    if not summary or summary["wall_s"] <= 0:
+        return ""
+
+    wall = summary["wall_s"]
+    parts = [(span["total_s"], name)
+             for name, span in summary["spans"].items()]
+    parts.append((summary["other_s"], "other"))
+    shares = [f"{name} {100 * total / wall:.0f}%"
+              for total, name in sorted(parts, reverse=True)
+              if total / wall >= 0.005]
+    return f"{wall / 60:.1f} min: " + ", ".join(shares)
@@ -0,0 +1,131 @@
+import heapq
+import logging
+import time
+from typing import Generator
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Clocks #####
+
+The drivers and the titration routine read the time and wait through a
+Clock instead of calling the time module, so the same code can run in real
+time against the devices or in virtual time against the simulators (see
+lib/services/titration/simulation.py).
+
+RealClock is the time module. VirtualClock is a discrete-event clock: its
+time only moves when something waits on it, and then jumps straight to the
+end of the wait, so a 20 minute titration is replayed in well under a
+second, and every run of the same inputs gives the same result.
+
+Both can drive routines written as generators yielding wait times (see
+routine.py); run() interleaves any number of them, resuming each at its
+own deadline:
+
+    clock = VirtualClock()
+    clock.run(routine.run())
+
+A VirtualClock is not thread safe; everything that uses it should run on
+the thread that drives it.
+"""
+
+
+class Clock:
+    """Interface of a clock; see RealClock and VirtualClock.
+    """
+    def monotonic(self) -> float:
+        """Returns the time (in seconds) of a clock that never goes back,
+        e.g. to measure durations.
+        """
+        raise NotImplementedError("Use derived clock implementation class!")
+
+    def time(self) -> float:
+        """Returns the wall time (in seconds since the epoch), e.g. to
+        timestamp results.
+        """
+        raise NotImplementedError("Use derived clock implementation class!")
+
+    def sleep(self, seconds: float) -> None:
+        """Waits for the given time (in seconds).
+        """
+        raise NotImplementedError("Use derived clock implementation class!")
+
+    def run(self, *routines: Generator[float, None, None]) -> None:
+        """Drives generators that yield the time (in seconds) to wait
+        before resuming them, until they all finish. Generators due at the
+        same time are resumed in the order given.
+
+        Args:
+            *routines (Generator): the generators, e.g. TitrationRoutine.run().
+
+        Returns:
+            None.
+        """
+        now = self.monotonic()
+        heap = [(now, i, steps) for i, steps in enumerate(routines)]
+        while heap:
+            deadline, i, steps = heapq.heappop(heap)
+            wait = deadline - self.monotonic()
+            if wait > 0:
+                self.sleep(wait)
+            try:
+                delay = next(steps)
+            except StopIteration:
+                continue
+            heapq.heappush(heap, (self.monotonic() + delay, i, steps))
+
+
+class RealClock(Clock):
+    """The time module.
+    """
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """Discrete-event clock, see above.
+
+    Args:
+        start (float): wall time (in seconds since the epoch) at which the
+            clock starts. Defaults to a fixed date so results are
+            reproducible.
+
+    Returns:
+        None.
+    """
+    def __init__(self, start: float = 1700000000.0) -> None:
+        self.start = start
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.start + self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.advance(seconds)
+
+    def advance(self, seconds: float) -> None:
+        """Moves the clock forward, e.g. by the time a simulated device
+        takes to answer.
+
+        Args:
+            seconds (float): time to move forward; negative values are
+                ignored.
+
+        Returns:
+            None.
+        """
+        if seconds > 0:
+            self.now += seconds
+
+
+# Clock used unless another is given
+REAL_CLOCK = RealClock()
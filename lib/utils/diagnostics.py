@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Diagnostics #####
+
+Helpers for diagnostics that cost nothing unless someone is looking at
+them.
+
+Log calls should pass their values as %-style arguments rather than
+formatting an f-string, so the message is only built if the record is
+actually emitted. Values that are expensive to produce (e.g. a summary of
+an array) can be wrapped in Lazy, which only calls its function when the
+message is formatted:
+
+    logger.debug("ygran: %s", Lazy(lambda: np.array2string(ygran)))
+
+Fit internals can also be written to a side file as JSON lines for offline
+analysis. This is off unless enable_fit_dump() is called; while it is off,
+dump_fit returns straight away. Each record is appended with a single
+write, so several processes can share one file; set_dump_context adds
+fields (e.g. the run id) to every following record of the process.
+"""
+
+
+class Lazy:
+    """Defers building a log argument until the message is formatted.
+    The function is called at most once, however many handlers format the
+    record.
+
+    Args:
+        func (Callable): function taking no arguments and returning the
+            value to log.
+
+    Returns:
+        None.
+    """
+    __slots__ = ("func", "_text")
+
+    def __init__(self, func: Callable) -> None:
+        self.func = func
+        self._text = None
+
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = str(self.func())
+        return self._text
+
+
+class FitDump:
+    """Appends structured records to a JSON lines file.
+
+    Args:
+        filepath (str): location of the file; records are appended.
+
+    Returns:
+        None.
+    """
+    def __init__(self, filepath: str) -> None:
+        self.filepath = filepath
+        self.context = {}
+        self._fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                           0o644)
+
+    def write(self, kind: str, fields: dict) -> None:
+        """Writes one record; numpy values are converted to lists or
+        floats.
+
+        Args:
+            kind (str): what the record describes, e.g. gran_fit.
+            fields (dict): JSON-serializable values, or numpy arrays.
+
+        Returns:
+            None.
+        """
+        record = dict(self.context, kind=kind, time=time.time())
+        for name, value in fields.items():
+            if isinstance(value, (np.ndarray, np.generic)):
+                value = value.tolist()
+            record[name] = value
+
+        os.write(self._fd, (json.dumps(record) + "\n").encode("utf-8"))
+
+    def close(self) -> None:
+        """Closes the file.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        os.close(self._fd)
+
+
+# The active dump, if enabled
+_fit_dump: Optional[FitDump] = None
+
+
+def enable_fit_dump(filepath: str) -> None:
+    """Starts writing fit internals to the given file.
+
+    Args:
+        filepath (str): location of the JSON lines file.
+
+    Returns:
+        None.
+    """
+    global _fit_dump
+    disable_fit_dump()
+    _fit_dump = FitDump(filepath)
+    logger.info("Writing fit diagnostics to %s", filepath)
+
+
+def disable_fit_dump() -> None:
+    """Stops writing fit internals, closing the file if one is open.
+
+    Args:
+        None.
+
+    Returns:
+        None.
+    """
+    global _fit_dump
+    if _fit_dump is not None:
+        _fit_dump.close()
+        _fit_dump = None
+
+
+def fit_dump_enabled() -> bool:
+    """Checks whether fit internals are being written.
+
+    Args:
+        None.
+
+    Returns:
+        bool: whether a dump file is open.
+    """
+    return _fit_dump is not None
+
+
+def set_dump_context(**fields) -> None:
+    """Sets fields added to every following record, if the dump is enabled.
+
+    Args:
+        **fields: JSON-serializable values, e.g. run_id.
+
+    Returns:
+        None.
+    """
+    if _fit_dump is not None:
+        _fit_dump.context = fields
+
+
+def dump_fit(kind: str, **fields) -> None:
+    """Writes fit internals to the dump file, if enabled.
+
+    Args:
+        kind (str): what the record describes, e.g. gran_fit.
+        **fields: values to record; numpy arrays are written as lists.
+
+    Returns:
+        None.
+    """
+    if _fit_dump is not None:
+        _fit_dump.write(kind, fields)
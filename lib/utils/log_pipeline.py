@@ -0,0 +1,306 @@
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Non-blocking logging #####
+
+Log records are put on a bounded queue by a QueueHandler attached to the
+root logger and written to disk by a QueueListener on its own thread, so
+code timing doses and meter reads never waits on a file write.
+
+If the writer falls behind and the queue fills up, new records are dropped
+rather than blocking the caller. Dropped records are counted, and once the
+queue has room again a warning with the number dropped is logged in their
+place.
+
+The log file is rotated when it reaches max_bytes or when rotate_interval
+seconds have passed, whichever comes first; rotated files are gzipped by
+the writer thread (run.log.1.gz, run.log.2.gz, ...) and only the newest
+backup_count are kept.
+
+A logger can also get a file of its own with add_logger_file, e.g. one per
+station. That file is written by the same listener, through a handler that
+only passes the logger's records, so it doesn't bring file writes back to
+the caller's thread either:
+
+    handler = log_pipeline.add_logger_file("lib.station.a", "a.log")
+    ...
+    log_pipeline.remove_logger_file("lib.station.a", handler)
+"""
+
+# Default bound of the record queue; at typical rates this is minutes of
+# logging, so drops only happen if the disk stalls
+DEFAULT_QUEUE_SIZE = 10000
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_ROTATE_INTERVAL = 24 * 60 * 60
+DEFAULT_BACKUP_COUNT = 14
+
+LOG_FORMAT = "[%(levelname)s|%(filename)s|L%(lineno)s] %(asctime)s: %(message)s"
+LOG_DATEFMT = "%Y-%m-%dT%H:%M:%S%z"
+
+# Listener started by setup_logging, which writes the files added with
+# add_logger_file too
+_listener = None
+_listener_lock = threading.Lock()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when its
+    queue is full, and reports how many were dropped.
+
+    Args:
+        record_queue (queue.Queue): bounded queue shared with the listener.
+
+    Returns:
+        None.
+    """
+    def __init__(self, record_queue: queue.Queue) -> None:
+        super().__init__(record_queue)
+        self.dropped = 0
+        self._unreported = 0
+        self._drop_lock = threading.Lock()
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Puts a record on the queue without waiting, reporting earlier
+        drops first once there is room.
+
+        Args:
+            record (logging.LogRecord): prepared log record.
+
+        Returns:
+            None.
+        """
+        with self._drop_lock:
+            try:
+                if self._unreported:
+                    self.queue.put_nowait(self._drop_record(record))
+                    self._unreported = 0
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                self._unreported += 1
+
+    def _drop_record(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Builds the warning reporting records dropped since the last one.
+
+        Args:
+            record (logging.LogRecord): the record about to be queued, used
+                for its time.
+
+        Returns:
+            logging.LogRecord: the warning record.
+        """
+        warning = logging.LogRecord(
+            logger.name, logging.WARNING, __file__, 0,
+            f"Log queue full, dropped {self._unreported} records "
+            f"({self.dropped} in total)", None, None
+        )
+        warning.created = record.created
+        return warning
+
+
+class LogListener(logging.handlers.QueueListener):
+    """Queue listener that waits for room to queue its stop sentinel, so
+    stopping it with a full queue writes out every queued record.
+    """
+    def enqueue_sentinel(self) -> None:
+        """Queues the sentinel that stops the writer thread.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        self.queue.put(self._sentinel)
+
+    def stop(self) -> None:
+        """Writes out the queued records and stops the writer thread; files
+        added with add_logger_file are written directly from then on.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        super().stop()
+        global _listener
+        with _listener_lock:
+            if _listener is self:
+                _listener = None
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """File handler rotating on size or age, whichever comes first, and
+    gzipping rotated files.
+
+    Args:
+        filename (str): location of the log file.
+        max_bytes (int): size at which the file is rotated, or 0 for no
+            size limit.
+        rotate_interval (float): age (in seconds) at which the file is
+            rotated, or 0 for no age limit.
+        backup_count (int): number of rotated files to keep.
+
+    Returns:
+        None.
+    """
+    def __init__(self, filename: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                    rotate_interval: float = DEFAULT_ROTATE_INTERVAL,
+                    backup_count: int = DEFAULT_BACKUP_COUNT) -> None:
+        super().__init__(filename, maxBytes=max_bytes,
+                         backupCount=backup_count, encoding="utf-8")
+        self.rotate_interval = rotate_interval
+        self.rollover_at = self._next_rollover()
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._compress
+
+    def _next_rollover(self) -> Optional[float]:
+        """Returns the time of the next age-based rotation, or None.
+
+        Args:
+            None.
+
+        Returns:
+            float: unix time, or None if rotate_interval is 0.
+        """
+        if not self.rotate_interval:
+            return None
+        return time.time() + self.rotate_interval
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        """Checks whether the file has grown or aged past its limit.
+
+        Args:
+            record (logging.LogRecord): record about to be written.
+
+        Returns:
+            bool: whether to rotate before writing the record.
+        """
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        """Rotates the file and restarts the age limit.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        super().doRollover()
+        self.rollover_at = self._next_rollover()
+
+    @staticmethod
+    def _compress(source: str, dest: str) -> None:
+        """Gzips a rotated log file.
+
+        Args:
+            source (str): the file being rotated out.
+            dest (str): name of the compressed file.
+
+        Returns:
+            None.
+        """
+        with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+
+def setup_logging(filepath: str, level: int = logging.INFO,
+                    queue_size: int = DEFAULT_QUEUE_SIZE,
+                    max_bytes: int = DEFAULT_MAX_BYTES,
+                    rotate_interval: float = DEFAULT_ROTATE_INTERVAL,
+                    backup_count: int = DEFAULT_BACKUP_COUNT
+                    ) -> LogListener:
+    """Routes all logging through a bounded queue to a rotating file
+    written from a background thread.
+
+    Args:
+        filepath (str): location of the log file.
+        level (int): level of the root logger. Defaults to INFO.
+        queue_size (int): maximum number of records waiting to be written.
+        max_bytes (int): size at which the file is rotated.
+        rotate_interval (float): age (in seconds) at which the file is
+            rotated.
+        backup_count (int): number of rotated files to keep.
+
+    Returns:
+        LogListener: the started listener; stop it before exiting to
+            write out any queued records.
+    """
+    file_handler = CompressingRotatingFileHandler(filepath, max_bytes,
+                                                  rotate_interval,
+                                                  backup_count)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+
+    record_queue = queue.Queue(maxsize=queue_size)
+    listener = LogListener(record_queue, file_handler,
+                           respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(DroppingQueueHandler(record_queue))
+
+    global _listener
+    with _listener_lock:
+        _listener = listener
+    listener.start()
+    return listener
+
+
+def add_logger_file(name: str, filepath: str) -> logging.Handler:
+    """Writes the records of a logger (and its children) to a file of its
+    own as well, from the listener's thread. Without a listener (e.g. in
+    tests), the file is written by the logger directly.
+
+    Args:
+        name (str): name of the logger.
+        filepath (str): location of the file; overwritten if it exists.
+
+    Returns:
+        logging.Handler: the file's handler, for remove_logger_file.
+    """
+    handler = logging.FileHandler(filepath, mode="w")
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+    handler.addFilter(logging.Filter(name))
+
+    with _listener_lock:
+        if _listener is None:
+            logging.getLogger(name).addHandler(handler)
+        else:
+            # The writer thread reads the handlers once per record, so
+            # swapping the tuple is enough
+            _listener.handlers = _listener.handlers + (handler,)
+    return handler
+
+
+def remove_logger_file(name: str, handler: logging.Handler) -> None:
+    """Stops writing a file added with add_logger_file and closes it.
+
+    Args:
+        name (str): name of the logger.
+        handler (logging.Handler): handler returned by add_logger_file.
+
+    Returns:
+        None.
+    """
+    with _listener_lock:
+        logging.getLogger(name).removeHandler(handler)
+        if _listener is not None:
+            _listener.handlers = tuple(h for h in _listener.handlers
+                                       if h is not handler)
+    handler.close()
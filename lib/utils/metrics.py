@@ -0,0 +1,493 @@
+import bisect
+import http.server
+import logging
+import math
+import threading
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Live metrics #####
+
+Counters, gauges and histograms of what the titrators are doing, served in
+the Prometheus text format so a local scraper (Prometheus, or just curl)
+can follow throughput and device latency of unattended stations:
+
+    python run.py --metrics-port 9105
+    curl http://127.0.0.1:9105/metrics
+
+Updates are made on the hot path (every serial transaction, every span of
+the phase timer) so they are kept cheap: a dict lookup and an addition
+under a lock of the metric's own, never I/O or formatting. The text is only
+built when the endpoint is scraped, on the server's own thread, and locks
+are only held while copying the values out, so a scrape never holds up a
+step for longer than that copy.
+
+Metrics are always collected, whether or not the endpoint is served; they
+live in the module-level REGISTRY:
+
+openalk_samples_completed_total      finished titrations, per station
+openalk_steps_per_sample             steps of each finished titration
+openalk_phase_seconds                length of each dose, equilibrate,
+                                     measure... span (see timing.py)
+openalk_refills_total                syringe refills, per station
+openalk_stalled_refills_total        refills the titration had to wait for
+openalk_serial_seconds               serial transaction time (write and
+                                     read), per device, port and command
+openalk_serial_timeouts_total        responses that ended without their
+                                     terminator
+openalk_system_state                 1 for the current state of each station
+"""
+
+# Station label of the single-station UI and of routines run without one
+DEFAULT_STATION = "main"
+
+# Histogram bucket upper bounds
+PHASE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+                 300.0)
+SERIAL_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                  1.0, 2.5)
+STEP_BUCKETS = (10, 20, 30, 40, 50, 75, 100, 150, 200)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Lays out label pairs as {name="value",...}, escaping the values.
+
+    Args:
+        names (Sequence): label names.
+        values (Sequence): label values, in the same order.
+
+    Returns:
+        str: the label block, or an empty string without labels.
+    """
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = (value.replace("\\", "\\\\").replace("\n", "\\n")
+                 .replace('"', '\\"'))
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    """Formats a sample value, writing whole numbers without a decimal
+    point, and NaN and infinities the way the text format spells them.
+
+    Args:
+        value (float): the value.
+
+    Returns:
+        str: the formatted value.
+    """
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base class of a metric with a fixed set of label names; every
+    combination of label values has its own value.
+
+    Args:
+        name (str): metric name, e.g. openalk_refills_total.
+        help (str): one-line description.
+        labels (Sequence): label names.
+        registry (Registry): registry to add the metric to. Defaults to
+            the module-level REGISTRY.
+
+    Returns:
+        None.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                    registry: Optional["Registry"] = None) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """Turns label keyword arguments into the key of a value.
+
+        Args:
+            labels (dict): label name -> value, for every label name.
+
+        Returns:
+            tuple: label values, in the order of the label names.
+        """
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> List[str]:
+        """Formats the current values, one line per sample.
+
+        Args:
+            None.
+
+        Returns:
+            list: sample lines.
+        """
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} "
+                f"{_format_value(value)}"
+                for key, value in sorted(values)]
+
+    def render(self) -> str:
+        """Formats the metric with its HELP and TYPE lines.
+
+        Args:
+            None.
+
+        Returns:
+            str: the metric in the text exposition format.
+        """
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    """A value that only goes up, e.g. the number of finished samples.
+    """
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """Adds to the counter.
+
+        Args:
+            amount (float): amount to add. Defaults to 1.
+            **labels: label values, one per label name.
+
+        Returns:
+            None.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down.
+    """
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        """Sets the gauge.
+
+        Args:
+            value (float): new value.
+            **labels: label values, one per label name.
+
+        Returns:
+            None.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class StateGauge(Metric):
+    """Reports which state each tracked object is in, as one sample per
+    possible state with value 1 for the current one. States are read when
+    scraped, so the owners don't need to report every change.
+
+    Args:
+        name (str): metric name.
+        help (str): one-line description.
+        label (str): name of the label identifying the tracked object.
+        registry (Registry): see Metric.
+
+    Returns:
+        None.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, label: str,
+                    registry: Optional["Registry"] = None) -> None:
+        super().__init__(name, help, (label, "state"), registry)
+
+    def track(self, key: str, getter: Callable[[], Enum]) -> None:
+        """Starts reporting the state of an object.
+
+        Args:
+            key (str): value of the identifying label, e.g. station name.
+            getter (Callable): function returning the current state.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            self._values[key] = getter
+
+    def untrack(self, key: str) -> None:
+        """Stops reporting the state of an object.
+
+        Args:
+            key (str): value of the identifying label.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            self._values.pop(key, None)
+
+    def samples(self) -> List[str]:
+        """Formats one sample per state of every tracked object.
+
+        Args:
+            None.
+
+        Returns:
+            list: sample lines.
+        """
+        with self._lock:
+            getters = sorted(self._values.items())
+        lines = []
+        for key, getter in getters:
+            current = getter()
+            for state in type(current):
+                labels = _format_labels(self.labels, (key, state.name))
+                lines.append(f"{self.name}{labels} {int(state == current)}")
+        return lines
+
+
+class Histogram(Metric):
+    """Counts observations into buckets, e.g. the time of each serial
+    transaction.
+
+    Args:
+        name (str): metric name.
+        help (str): one-line description.
+        labels (Sequence): label names.
+        buckets (Sequence): increasing bucket upper bounds; the +Inf
+            bucket is added.
+        registry (Registry): see Metric.
+
+    Returns:
+        None.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                    buckets: Sequence[float] = PHASE_BUCKETS,
+                    registry: Optional["Registry"] = None) -> None:
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        """Adds an observation.
+
+        Args:
+            value (float): the observed value.
+            **labels: label values, one per label name.
+
+        Returns:
+            None.
+        """
+        key = self._key(labels)
+        # Buckets are inclusive of their upper bound
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, then the +Inf bucket, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self) -> List[str]:
+        """Formats the cumulative bucket counts, sum and count of every
+        combination of labels.
+
+        Args:
+            None.
+
+        Returns:
+            list: sample lines.
+        """
+        with self._lock:
+            values = [(key, list(counts))
+                      for key, counts in self._values.items()]
+
+        names = self.labels + ("le",)
+        lines = []
+        for key, counts in sorted(values):
+            cumulative = 0
+            bounds = [_format_value(b) for b in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _format_labels(names, key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """A set of metrics rendered together.
+
+    Args:
+        None.
+
+    Returns:
+        None.
+    """
+    def __init__(self) -> None:
+        self._metrics: List[Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> None:
+        """Adds a metric.
+
+        Args:
+            metric (Metric): the metric; its name must be unique.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Formats every metric in the text exposition format.
+
+        Args:
+            None.
+
+        Returns:
+            str: the metrics, ending with a newline.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+SAMPLES_COMPLETED = Counter(
+    "openalk_samples_completed_total", "Titrations finished with a result.",
+    ["station"]
+)
+STEPS_PER_SAMPLE = Histogram(
+    "openalk_steps_per_sample", "Steps taken by each finished titration.",
+    ["station"], STEP_BUCKETS
+)
+PHASE_SECONDS = Histogram(
+    "openalk_phase_seconds",
+    "Length of each span of a titration, excluding nested spans.",
+    ["station", "phase"], PHASE_BUCKETS
+)
+REFILLS = Counter(
+    "openalk_refills_total", "Syringe refills started.", ["station"]
+)
+STALLED_REFILLS = Counter(
+    "openalk_stalled_refills_total",
+    "Refills started because the next dose didn't fit, holding up the step.",
+    ["station"]
+)
+SERIAL_SECONDS = Histogram(
+    "openalk_serial_seconds",
+    "Time of each serial transaction, from write to end of response.",
+    ["device", "port", "kind"], SERIAL_BUCKETS
+)
+SERIAL_TIMEOUTS = Counter(
+    "openalk_serial_timeouts_total",
+    "Serial responses that ended without their terminator.",
+    ["device", "port"]
+)
+SYSTEM_STATE = StateGauge(
+    "openalk_system_state", "Current state of each station.", "station"
+)
+
+
+def observe_serial(device: str, port: str, kind: str, seconds: float,
+                     timed_out: bool) -> None:
+    """Counts one serial transaction.
+
+    Args:
+        device (str): name of the device class.
+        port (str): serial port of the device.
+        kind (str): command kind, see serial_recorder.
+        seconds (float): time from the write to the end of the response.
+        timed_out (bool): whether the response ended without its
+            terminator.
+
+    Returns:
+        None.
+    """
+    SERIAL_SECONDS.observe(seconds, device=device, port=port, kind=kind)
+    if timed_out:
+        SERIAL_TIMEOUTS.inc(device=device, port=port)
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the registry of the server at /metrics.
+    """
+    def do_GET(self) -> None:
+        """Answers a scrape.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        """Sends request logs to the module logger instead of stderr.
+
+        Args:
+            format (str): %-style message.
+            *args: message arguments.
+
+        Returns:
+            None.
+        """
+        logger.debug("%s " + format, self.address_string(), *args)
+
+
+def start_server(port: int, host: str = "127.0.0.1",
+                   registry: Optional[Registry] = None
+                   ) -> http.server.ThreadingHTTPServer:
+    """Serves the metrics from a background thread.
+
+    Args:
+        port (int): port to listen on; 0 picks a free one.
+        host (str): address to listen on. Defaults to localhost only.
+        registry (Registry): metrics to serve. Defaults to REGISTRY.
+
+    Returns:
+        ThreadingHTTPServer: the running server; call shutdown() and
+            server_close() to stop it.
+    """
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry or REGISTRY
+    thread = threading.Thread(target=server.serve_forever, name="metrics",
+                              daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
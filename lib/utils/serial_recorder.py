@@ -0,0 +1,298 @@
+import argparse
+import json
+import logging
+import queue
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Serial transaction recording #####
+
+When enabled, every request-response exchange with a device (see
+VersaPumpV6._send_pump_command and OrionStarA215._send_meter_command) is
+written to a JSON lines file, one object per transaction:
+
+{"t": 5123.004512, "device": "VersaPumpV6", "port": "/dev/ttyUSB0",
+ "kind": "DnR", "command": "/1D1234R\\r", "response": "/0`\\x03\\r\\n\\xff",
+ "write_s": 0.000081, "read_s": 0.01843, "timed_out": false,
+ "status": {"host_ready": true, "module_ready": true, "msg": ""},
+ "error": null}
+
+t is the device clock's monotonic() (see clocks.py) when the command was
+written, normally time.monotonic(); write_s and read_s are
+the time spent in the serial write and in reading the response. kind groups
+commands for analysis (numeric arguments replaced by n). timed_out is set
+when the response ended without its terminator. status is the parsed
+response, or null if parsing failed, in which case error holds the reason.
+
+Recording is off by default; devices then only pay for a few clock reads
+per transaction. Records are handed to a background thread through a
+bounded queue and dropped (and counted) if the writer falls behind, so
+recording never slows down device I/O.
+
+Latency percentiles per device and command kind:
+
+    python -m lib.utils.serial_recorder serial.jsonl
+"""
+
+DEFAULT_QUEUE_SIZE = 10000
+
+# Most records written in one go by the writer thread
+WRITE_BATCH_SIZE = 256
+
+PERCENTILES = [50, 90, 99]
+
+
+class TransactionRecorder:
+    """Writes transaction records to a JSON lines file from a background
+    thread.
+
+    Args:
+        filepath (str): location of the file; records are appended.
+        queue_size (int): maximum number of records waiting to be written.
+
+    Returns:
+        None.
+    """
+    def __init__(self, filepath: str,
+                    queue_size: int = DEFAULT_QUEUE_SIZE) -> None:
+        self.filepath = filepath
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = open(filepath, "a")
+        self._thread = threading.Thread(target=self._write_loop,
+                                        name="serial-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, record: dict) -> None:
+        """Queues a record without waiting; it is dropped if the queue is
+        full.
+
+        Args:
+            record (dict): JSON-serializable transaction record.
+
+        Returns:
+            None.
+        """
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self) -> None:
+        """Writes queued records in batches until the stop sentinel.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is None
+            lines = [json.dumps(record) for record in batch if record is not None]
+            if lines:
+                self._file.write("\n".join(lines) + "\n")
+                self._file.flush()
+            if stop:
+                return
+
+    def close(self) -> None:
+        """Writes out every queued record and closes the file.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        if self.dropped:
+            logger.warning(f"Dropped {self.dropped} serial transaction "
+                           f"records")
+
+
+# The active recorder, if enabled
+_recorder: Optional[TransactionRecorder] = None
+
+
+def enable_recording(filepath: str,
+                       queue_size: int = DEFAULT_QUEUE_SIZE) -> None:
+    """Starts recording every serial transaction to the given file.
+
+    Args:
+        filepath (str): location of the JSON lines file.
+        queue_size (int): maximum number of records waiting to be written.
+
+    Returns:
+        None.
+    """
+    global _recorder
+    disable_recording()
+    _recorder = TransactionRecorder(filepath, queue_size)
+    logger.info(f"Recording serial transactions to {filepath}")
+
+
+def disable_recording() -> None:
+    """Stops recording, writing out any queued records.
+
+    Args:
+        None.
+
+    Returns:
+        None.
+    """
+    global _recorder
+    if _recorder is not None:
+        recorder, _recorder = _recorder, None
+        recorder.close()
+
+
+def recording_enabled() -> bool:
+    """Checks whether serial transactions are being recorded.
+
+    Args:
+        None.
+
+    Returns:
+        bool: whether a recorder is active.
+    """
+    return _recorder is not None
+
+
+def record_transaction(device: str, port: str, kind: str, command: bytes,
+                         response: bytes, started: float, written: float,
+                         finished: float, timed_out: bool,
+                         status: Optional[dict],
+                         error: Optional[str] = None) -> None:
+    """Records one transaction, if recording is enabled.
+
+    Args:
+        device (str): name of the device class.
+        port (str): serial port of the device.
+        kind (str): command kind, used to group commands for analysis.
+        command (bytes): bytes written.
+        response (bytes): bytes read.
+        started (float): monotonic time before the write.
+        written (float): monotonic time after the write.
+        finished (float): monotonic time after the read.
+        timed_out (bool): whether the read ended without its terminator.
+        status (dict): parsed response, or None if parsing failed.
+        error (str): why parsing failed, if it did.
+
+    Returns:
+        None.
+    """
+    recorder = _recorder
+    if recorder is None:
+        return
+
+    recorder.record({
+        "t": started, "device": device, "port": port, "kind": kind,
+        "command": command.decode("ascii", "backslashreplace"),
+        "response": response.decode("ascii", "backslashreplace"),
+        "write_s": written - started, "read_s": finished - written,
+        "timed_out": timed_out, "status": status, "error": error,
+    })
+
+
+def load_transactions(filepath: str) -> List[dict]:
+    """Reads a recording; a partly written last line is ignored.
+
+    Args:
+        filepath (str): location of the JSON lines file.
+
+    Returns:
+        list: the transaction records, in file order.
+    """
+    records = []
+    with open(filepath) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping incomplete line in {filepath}")
+    return records
+
+
+def summarize(records: List[dict]) -> Dict[tuple, dict]:
+    """Computes latency statistics per device and command kind.
+
+    Args:
+        records (list): transaction records, see load_transactions.
+
+    Returns:
+        dict: (device, kind) -> {"count", "timeouts", "errors", and
+            "write_ms"/"read_ms"/"total_ms", each a dict of percentile
+            (see PERCENTILES, plus "max") -> milliseconds}.
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault((record["device"], record["kind"]), []).append(record)
+
+    summary = {}
+    for key, group in sorted(groups.items()):
+        write_ms = np.array([r["write_s"] for r in group]) * 1000
+        read_ms = np.array([r["read_s"] for r in group]) * 1000
+        stats = {
+            "count": len(group),
+            "timeouts": sum(bool(r["timed_out"]) for r in group),
+            "errors": sum(r["error"] is not None for r in group),
+        }
+        for name, values in [("write_ms", write_ms), ("read_ms", read_ms),
+                             ("total_ms", write_ms + read_ms)]:
+            stats[name] = dict(zip(PERCENTILES,
+                                   np.percentile(values, PERCENTILES)))
+            stats[name]["max"] = float(values.max())
+        summary[key] = stats
+    return summary
+
+
+def format_summary(summary: Dict[tuple, dict]) -> str:
+    """Lays out a summary as a text table.
+
+    Args:
+        summary (dict): output of summarize.
+
+    Returns:
+        str: one line per device and command kind.
+    """
+    columns = [f"p{p}" for p in PERCENTILES] + ["max"]
+    lines = [f"{'device':<16}{'kind':<10}{'count':>7}{'t/o':>5}{'err':>5}"
+             + "".join(f"{'total ' + c:>12}" for c in columns)
+             + f"{'read p50':>12}{'write p50':>12}"]
+    for (device, kind), stats in summary.items():
+        total = stats["total_ms"]
+        lines.append(
+            f"{device:<16}{kind:<10}{stats['count']:>7}{stats['timeouts']:>5}"
+            f"{stats['errors']:>5}"
+            + "".join(f"{total[key]:>12.2f}" for key in PERCENTILES + ["max"])
+            + f"{stats['read_ms'][50]:>12.2f}{stats['write_ms'][50]:>12.2f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serial latency percentiles (ms) per command kind"
+    )
+    parser.add_argument("files", nargs="+", help="JSON lines recordings")
+    args = parser.parse_args()
+
+    records = []
+    for filepath in args.files:
+        records.extend(load_transactions(filepath))
+    print(format_summary(summarize(records)))
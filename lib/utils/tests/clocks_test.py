@@ -0,0 +1,41 @@
+# Write unit tests for clocks here
+# Tests MUST start with `test_` for pytest to find them
+
+import time
+
+from lib.utils import clocks
+
+
+def test_virtual_clock_only_moves_when_waited_on() -> None:
+    """Test that virtual time jumps by the waits and nothing else.
+    """
+    clock = clocks.VirtualClock(start=1000.0)
+    assert clock.monotonic() == 0.0
+
+    started = time.perf_counter()
+    clock.sleep(600.0)
+    clock.advance(-5.0)
+    assert time.perf_counter() - started < 0.1
+    assert clock.monotonic() == 600.0
+    assert clock.time() == 1600.0
+
+def test_run_interleaves_routines_by_deadline() -> None:
+    """Test that run resumes each generator at its own deadline, in the
+    order of the deadlines.
+    """
+    clock = clocks.VirtualClock()
+    events = []
+
+    def routine(name: str, delays: list):
+        """Helper generator recording when it is resumed.
+        """
+        for delay in delays:
+            events.append((clock.monotonic(), name))
+            yield delay
+        events.append((clock.monotonic(), name))
+
+    clock.run(routine("a", [5, 5]), routine("b", [3, 1, 10]))
+
+    assert events == [(0, "a"), (0, "b"), (3, "b"), (4, "b"), (5, "a"),
+                      (10, "a"), (14, "b")]
+    assert clock.monotonic() == 14
@@ -0,0 +1,51 @@
+# Write unit tests for diagnostics here
+# Tests MUST start with `test_` for pytest to find them
+
+import json
+import logging
+from unittest.mock import Mock
+
+import numpy as np
+
+from lib.utils import diagnostics
+
+
+def test_lazy_only_formats_emitted_records(caplog) -> None:
+    """Test that a Lazy argument is only evaluated when the record is
+    emitted.
+    """
+    log = logging.getLogger("lib.test.diagnostics")
+    func = Mock(return_value="expensive")
+
+    with caplog.at_level(logging.INFO, logger=log.name):
+        log.debug("value: %s", diagnostics.Lazy(func))
+        func.assert_not_called()
+
+        log.info("value: %s", diagnostics.Lazy(func))
+    func.assert_called_once()
+    assert caplog.records[-1].getMessage() == "value: expensive"
+
+def test_fit_dump_is_opt_in(tmp_path) -> None:
+    """Test that nothing is written until the dump is enabled, and that
+    records carry arrays as lists plus the current context.
+    """
+    filepath = str(tmp_path / "fits.jsonl")
+    diagnostics.dump_fit("gran_fit", slope=1.0)
+    assert not diagnostics.fit_dump_enabled()
+
+    diagnostics.enable_fit_dump(filepath)
+    try:
+        diagnostics.set_dump_context(run_id=7)
+        diagnostics.dump_fit("gran_fit", volumes=np.array([0.1, 0.2]),
+                             rsq=np.float64(0.99))
+    finally:
+        diagnostics.disable_fit_dump()
+    diagnostics.dump_fit("gran_fit", slope=2.0)
+
+    with open(filepath) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 1
+    assert records[0]["kind"] == "gran_fit"
+    assert records[0]["run_id"] == 7
+    assert records[0]["volumes"] == [0.1, 0.2]
+    assert records[0]["rsq"] == 0.99
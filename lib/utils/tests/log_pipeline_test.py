@@ -0,0 +1,120 @@
+# Write unit tests for the logging pipeline here
+# Tests MUST start with `test_` for pytest to find them
+
+import gzip
+import logging
+import os
+import queue
+
+from lib.utils import log_pipeline
+
+
+def make_record(msg: str) -> logging.LogRecord:
+    """Helper to build an info record.
+    """
+    return logging.LogRecord("test", logging.INFO, __file__, 1, msg, None,
+                             None)
+
+def test_full_queue_drops_and_reports() -> None:
+    """Test that records are dropped without blocking when the queue is
+    full, and that the drops are reported once there is room.
+    """
+    record_queue = queue.Queue(maxsize=2)
+    handler = log_pipeline.DroppingQueueHandler(record_queue)
+    for i in range(5):
+        handler.handle(make_record(f"record {i}"))
+
+    assert handler.dropped == 3
+    assert record_queue.qsize() == 2
+
+    record_queue.get_nowait()
+    record_queue.get_nowait()
+    handler.handle(make_record("after"))
+
+    warning = record_queue.get_nowait()
+    assert warning.levelno == logging.WARNING
+    assert "dropped 3 records" in warning.getMessage()
+    assert record_queue.get_nowait().getMessage() == "after"
+
+def test_rotation_compresses_old_files(tmp_path) -> None:
+    """Test that the file rotates on size and age and that rotated files
+    are gzipped, keeping only backup_count of them.
+    """
+    filepath = str(tmp_path / "run.log")
+    handler = log_pipeline.CompressingRotatingFileHandler(
+        filepath, max_bytes=200, rotate_interval=0, backup_count=2
+    )
+    for i in range(40):
+        handler.emit(make_record(f"record number {i:04d}"))
+
+    assert os.path.exists(filepath + ".1.gz")
+    assert os.path.exists(filepath + ".2.gz")
+    assert not os.path.exists(filepath + ".3.gz")
+    with gzip.open(filepath + ".1.gz", "rt") as f:
+        assert "record number" in f.read()
+
+    handler.rotate_interval = 60
+    handler.rollover_at = 0
+    handler.emit(make_record("aged out"))
+    assert handler.rollover_at > 0
+    with open(filepath) as f:
+        assert f.read() == "aged out\n"
+    handler.close()
+
+def test_setup_logging_writes_from_listener(tmp_path) -> None:
+    """Test that records logged anywhere end up in the file once the
+    listener is stopped.
+    """
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+
+    filepath = str(tmp_path / "run.log")
+    listener = log_pipeline.setup_logging(filepath, queue_size=100)
+    try:
+        for i in range(50):
+            logging.getLogger("lib.test").info(f"step {i}")
+    finally:
+        listener.stop()
+        for handler in root.handlers:
+            if handler not in handlers:
+                root.removeHandler(handler)
+        root.setLevel(level)
+        for handler in listener.handlers:
+            handler.close()
+
+    with open(filepath) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 50
+    assert lines[-1].endswith("step 49")
+
+def test_logger_file_written_from_listener(tmp_path) -> None:
+    """Test that a logger's own file gets only its records, written by the
+    listener rather than by the logger.
+    """
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+
+    listener = log_pipeline.setup_logging(str(tmp_path / "run.log"),
+                                          queue_size=100)
+    try:
+        filepath = str(tmp_path / "station.log")
+        handler = log_pipeline.add_logger_file("lib.station.a", filepath)
+        assert handler in listener.handlers
+        assert handler not in logging.getLogger("lib.station.a").handlers
+
+        logging.getLogger("lib.station.a").info("dosing")
+        logging.getLogger("lib.station.b").info("other station")
+    finally:
+        listener.stop()
+        for h in root.handlers:
+            if h not in handlers:
+                root.removeHandler(h)
+        root.setLevel(level)
+        log_pipeline.remove_logger_file("lib.station.a", handler)
+        for h in listener.handlers:
+            h.close()
+
+    with open(filepath) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 1
+    assert lines[0].endswith("dosing")
@@ -0,0 +1,119 @@
+# Write unit tests for live metrics here
+# Tests MUST start with `test_` for pytest to find them
+
+import urllib.error
+import urllib.request
+from enum import Enum, auto
+from unittest.mock import Mock
+
+import pytest
+
+from lib.services.pump import norgren
+from lib.utils import metrics
+
+
+class Lights(Enum):
+    """Helper states for the state gauge.
+    """
+    OFF = auto()
+    ON = auto()
+
+
+def test_counter_and_histogram_text() -> None:
+    """Test that counters and histograms render in the Prometheus text
+    format, with cumulative buckets and escaped labels.
+    """
+    registry = metrics.Registry()
+    counter = metrics.Counter("test_total", "A counter.", ["station"],
+                              registry=registry)
+    histogram = metrics.Histogram("test_seconds", "A histogram.", ["phase"],
+                                  buckets=(0.5, 1.0), registry=registry)
+
+    counter.inc(station='a"1')
+    counter.inc(2, station='a"1')
+    for value in [0.2, 0.5, 0.7, 3.0]:
+        histogram.observe(value, phase="dose")
+
+    assert registry.render() == (
+        '# HELP test_total A counter.\n'
+        '# TYPE test_total counter\n'
+        'test_total{station="a\\"1"} 3\n'
+        '# HELP test_seconds A histogram.\n'
+        '# TYPE test_seconds histogram\n'
+        'test_seconds_bucket{phase="dose",le="0.5"} 2\n'
+        'test_seconds_bucket{phase="dose",le="1"} 3\n'
+        'test_seconds_bucket{phase="dose",le="+Inf"} 4\n'
+        'test_seconds_sum{phase="dose"} 4.4\n'
+        'test_seconds_count{phase="dose"} 4\n'
+    )
+    with pytest.raises(ValueError):
+        metrics.Counter("test_total", "Again.", registry=registry)
+
+def test_non_finite_values() -> None:
+    """Test that NaN and infinite samples render as the text format spells
+    them instead of breaking the scrape.
+    """
+    registry = metrics.Registry()
+    histogram = metrics.Histogram("test_seconds", "A histogram.", ["phase"],
+                                  buckets=(1.0,), registry=registry)
+    histogram.observe(float("nan"), phase="dose")
+    histogram.observe(float("inf"), phase="fill")
+    histogram.observe(float("-inf"), phase="plot")
+
+    text = registry.render()
+    assert 'test_seconds_sum{phase="dose"} NaN\n' in text
+    assert 'test_seconds_sum{phase="fill"} +Inf\n' in text
+    assert 'test_seconds_sum{phase="plot"} -Inf\n' in text
+
+def test_state_gauge_reads_state_when_scraped() -> None:
+    """Test that tracked states are read at render time.
+    """
+    registry = metrics.Registry()
+    gauge = metrics.StateGauge("test_state", "States.", "station",
+                               registry=registry)
+    state = {"current": Lights.OFF}
+    gauge.track("s1", lambda: state["current"])
+    state["current"] = Lights.ON
+
+    lines = registry.render().splitlines()
+    assert 'test_state{station="s1",state="OFF"} 0' in lines
+    assert 'test_state{station="s1",state="ON"} 1' in lines
+
+    gauge.untrack("s1")
+    assert "s1" not in registry.render()
+
+def test_server_serves_metrics() -> None:
+    """Test that the endpoint serves the registry and nothing else.
+    """
+    registry = metrics.Registry()
+    metrics.Counter("test_total", "A counter.", registry=registry).inc()
+    server = metrics.start_server(0, registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_port}"
+        with urllib.request.urlopen(url + "/metrics") as res:
+            assert res.headers["Content-Type"].startswith("text/plain")
+            assert res.read().decode() == registry.render()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + "/other")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_serial_transactions_are_counted() -> None:
+    """Test that every pump transaction is observed, timeouts included,
+    without recording being enabled.
+    """
+    pump = norgren.VersaPumpV6()
+    pump.serial_port_loc = "/dev/test-metrics"
+    pump.serial_port = Mock()
+    pump.serial_port.read_until = Mock(side_effect=[b"/0`\x03\r\n\xff",
+                                                    b"/0`"])
+
+    pump._send_pump_command("D1937R")
+    pump._send_pump_command("D12R")
+
+    lines = metrics.REGISTRY.render().splitlines()
+    assert ('openalk_serial_seconds_count{device="VersaPumpV6",'
+            'port="/dev/test-metrics",kind="DnR"} 2') in lines
+    assert ('openalk_serial_timeouts_total{device="VersaPumpV6",'
+            'port="/dev/test-metrics"} 1') in lines
@@ -0,0 +1,107 @@
+# Write unit tests for serial transaction recording here
+# Tests MUST start with `test_` for pytest to find them
+
+from unittest.mock import Mock
+
+import pytest
+
+from lib.services.ph import orion_star
+from lib.services.pump import norgren
+from lib.utils import serial_recorder
+
+METER_RES = (b'GETMEAS         \r\n\r\n\rA215 pH,X51250,3.04,ABCDE,12/07/23 '
+             b'09:30:40,---,CH-1,pH,4.61,pH,111.2, mV,25.0,C,89.1,%,M100,'
+             b'#1\n\r\r>')
+
+
+def make_pump(*responses: bytes) -> norgren.VersaPumpV6:
+    """Helper to build a pump answering with the given responses.
+    """
+    pump = norgren.VersaPumpV6()
+    pump.serial_port = Mock()
+    pump.serial_port.read_until = Mock(side_effect=list(responses))
+    return pump
+
+def test_transactions_are_recorded(tmp_path) -> None:
+    """Test that pump and meter transactions are written with their
+    timing, status and errors once recording is enabled.
+    """
+    filepath = str(tmp_path / "serial.jsonl")
+    pump = make_pump(b"/0`\x03\r\n\xff", b"/0`\x03\r\n\xff",
+                     b"/0`48000\x03\r\n\xff", b"/0`1",
+                     b"garbage\x03\r\n\xff")
+    meter = orion_star.OrionStarA215()
+    meter.serial_port = Mock()
+    meter.serial_port.read_until = Mock(return_value=METER_RES)
+
+    pump._send_pump_command("D1937R")
+    serial_recorder.enable_recording(filepath)
+    try:
+        pump._send_pump_command("D1937R")
+        assert pump.get_syringe_position() == 48000
+        meter.get_measurement()
+        pump.get_valve_state()
+        with pytest.raises(ValueError):
+            pump.get_valve_state()
+    finally:
+        serial_recorder.disable_recording()
+
+    records = serial_recorder.load_transactions(filepath)
+    assert [r["kind"] for r in records] == ["DnR", "?", "GETMEAS", "?8", "?8"]
+    assert records[0]["command"] == "/1D1937R\r"
+    assert records[0]["status"]["module_ready"] is True
+    assert records[2]["device"] == "OrionStarA215"
+    assert records[2]["status"]["pH"] == "4.61"
+    assert [r["timed_out"] for r in records] == [False, False, False, True,
+                                                 False]
+    assert records[4]["status"] is None
+    assert records[4]["error"].startswith("ValueError")
+    assert all(r["write_s"] >= 0 and r["read_s"] >= 0 for r in records)
+    assert records[0]["t"] < records[1]["t"]
+
+def test_config_commands_are_recorded(tmp_path) -> None:
+    """Test that meter configuration commands are recorded, including the
+    ones the meter refuses.
+    """
+    filepath = str(tmp_path / "serial.jsonl")
+    meter = orion_star.OrionStarA215()
+    meter.serial_port = Mock()
+    meter.serial_port.read_until = Mock(side_effect=[
+        b"SETEXPORT TIMED 1\r\n\r>", b"SETEXPORT OFF\r\nERROR\r\n\r>"
+    ])
+
+    serial_recorder.enable_recording(filepath)
+    try:
+        meter.start_streaming()
+        with pytest.raises(ValueError):
+            meter.stop_streaming()
+    finally:
+        serial_recorder.disable_recording()
+
+    records = serial_recorder.load_transactions(filepath)
+    assert [r["kind"] for r in records] == ["SETEXPORT", "SETEXPORT"]
+    assert records[0]["status"] == {"msg": "SETEXPORT TIMED 1"}
+    assert records[1]["status"] is None
+    assert records[1]["error"].startswith("ValueError")
+
+def test_summary_percentiles() -> None:
+    """Test that latencies are grouped by device and command kind.
+    """
+    records = [
+        {"device": "VersaPumpV6", "kind": "DnR", "write_s": 0.001,
+         "read_s": 0.001 * i, "timed_out": i == 99, "error": None}
+        for i in range(100)
+    ] + [
+        {"device": "OrionStarA215", "kind": "GETMEAS", "write_s": 0.0,
+         "read_s": 1.5, "timed_out": False, "error": "IndexError: x"}
+    ]
+
+    summary = serial_recorder.summarize(records)
+
+    pump = summary[("VersaPumpV6", "DnR")]
+    assert pump["count"] == 100
+    assert pump["timeouts"] == 1
+    assert pump["read_ms"][50] == pytest.approx(49.5)
+    assert pump["total_ms"]["max"] == pytest.approx(100.0)
+    assert summary[("OrionStarA215", "GETMEAS")]["errors"] == 1
+    assert "GETMEAS" in serial_recorder.format_summary(summary)
@@ -1,11 +1,12 @@
 # Standard libraries
-import csv
 import logging
 import platform
+import sqlite3
+import time
 import tkinter as tk
-from datetime import datetime
-from enum import Enum, auto
-from typing import Tuple, Callable
+import tkinter.filedialog
+from enum import Enum
+from typing import Callable, Generator, Optional, Tuple
 
 # Third-party libraries
 import numpy as np
@@ -15,13 +16,15 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 # Local libraries
 from lib.services.ph import orion_star
 from lib.services.pump import norgren
-from lib.services.titration import gran
+from lib.services.station import discovery
+from lib.services.station.states import SystemStates
+from lib.services.titration import (batch, gran, protocol, recovery,
+                                    results, routine, store, timing)
+from lib.utils import metrics, regression
+from lib.view.live_plot import LivePlot
 
 logger = logging.getLogger(__name__)
 
-FIRST_TITRATION_PH_TARGET = 3.8
-SECOND_TITRATION_PH_TARGET = 3.0
-
 
 class PlatformStrings(Enum):
     """Enum values to be used when checking platform.system(), in case
@@ -32,37 +35,47 @@ class PlatformStrings(Enum):
     MACOS = "Darwin"
 
 
-class SystemStates(Enum):
-    """Enum values to be used with the self._system_state attribute.
-    """
-    DISCONNECTED = auto()
-    READY = auto()
-    RUNNING = auto()
-    STOPPING = auto()
-
-
 class App(tk.Tk):
     """Main Tkinter interface class.
 
     Args:
-        None.
+        titration_protocol (TitrationProtocol): targets, step and Gran
+            cutoff of every titration run from the UI. Defaults to the
+            standard protocol.
 
     Returns:
         None.
     """
-    def __init__(self) -> None:
+    def __init__(self, titration_protocol: protocol.TitrationProtocol = (
+                    protocol.DEFAULT_PROTOCOL)) -> None:
         super().__init__()
 
+        # Not self.protocol, which would hide Tk's protocol method
+        self.titration_protocol = titration_protocol
+
         self.pump = norgren.VersaPumpV6()
 
         self.ph_meter = orion_star.OrionStarA215()
 
         self._sleep_var = tk.IntVar(self)
-        self._stop_titration = False
+        self.routine = None
+
+        # Time (in seconds) spent connecting, charged to the next run
+        self.connect_time = timing.ConnectTime()
+
+        # Every finished run is also indexed in the result store, next to
+        # the csv files
+        self.store = store.ResultStore(store.DEFAULT_STORE_FILENAME)
+
+        # Samples waiting for the next batch run, and the running batch
+        self.queued_samples = []
+        self.sample_queue = None
 
         self.build_UI()
 
         self._system_state = SystemStates.DISCONNECTED
+        metrics.SYSTEM_STATE.track(metrics.DEFAULT_STATION,
+                                   lambda: self._system_state)
 
     def build_UI(self) -> None:
         """Draws the main UI window before starting.
@@ -117,6 +130,10 @@ class App(tk.Tk):
             padx=10, pady=10, relief=tk.RIDGE, borderwidth=3,
             text="Serial Ports"
         )
+        self.queue_frame = tk.LabelFrame(self,
+            padx=10, pady=10, relief=tk.RIDGE, borderwidth=3,
+            text="Sample Queue"
+        )
 
         # Input field definition and titles
         self.initial_mass_label = tk.Label(self.inputs_frame,
@@ -139,11 +156,18 @@ class App(tk.Tk):
         )
         self.acid_conc_input = tk.Entry(self.inputs_frame, width=10)
 
+        self.sample_id_label = tk.Label(self.inputs_frame,
+            text="Insert sample ID (queue only): ", padx=10, pady=10
+        )
+        self.sample_id_input = tk.Entry(self.inputs_frame, width=10)
+
         self.total_alk_label = tk.Label(self.outputs_frame,
             text="Total Alkalinity (umol/kg): ", padx=20
         )
         self.total_alk_output = tk.Label(self.outputs_frame,
             text="N/A", padx=20)
+        self.timing_output = tk.Label(self.outputs_frame,
+            text="", padx=20, wraplength=250, justify=tk.LEFT)
 
         self.status_label = tk.Label(self.status_frame,
             text="Disconnected", fg="red", pady=10
@@ -159,6 +183,10 @@ class App(tk.Tk):
         )
         self.pump_port_input = tk.Entry(self.serial_ports_frame, width=15)
 
+        self.queue_listbox = tk.Listbox(self.queue_frame, width=40, height=6)
+        self.throughput_label = tk.Label(self.queue_frame,
+            text="Samples/hour: N/A", padx=10
+        )
 
         # Button definitions
         self.start_button = tk.Button(self.main_controls_frame, width=5,
@@ -185,6 +213,18 @@ class App(tk.Tk):
         self.connect_devices_button = tk.Button(self.serial_ports_frame,
             text="Connect Devices", padx=20, command=self.connect_devices
         )
+        self.auto_detect_button = tk.Button(self.serial_ports_frame,
+            text="Auto-Detect", padx=20, command=self.auto_detect_devices
+        )
+        self.add_sample_button = tk.Button(self.queue_frame, width=10,
+            text="Add Sample", padx=10, command=self.add_sample_to_queue
+        )
+        self.load_manifest_button = tk.Button(self.queue_frame, width=10,
+            text="Load Manifest", padx=10, command=self.load_manifest
+        )
+        self.run_queue_button = tk.Button(self.queue_frame, width=10,
+            text="Run Queue", bg="green", padx=10, command=self.start_queue
+        )
 
         # Grid arrangement of input fields, buttons
         self.initial_mass_label.grid(row=0, column=0, sticky="NSEW")
@@ -200,12 +240,16 @@ class App(tk.Tk):
         self.acid_conc_label.grid(row=2, column=0, sticky="NSEW")
         self.acid_conc_input.grid(row=3, column=0)
 
+        self.sample_id_label.grid(row=4, column=0, sticky="NSEW")
+        self.sample_id_input.grid(row=5, column=0)
+
         self.status_frame.grid_rowconfigure(0, weight=1)
         self.status_frame.grid_columnconfigure(0, weight=1)
         self.status_label.grid(row=0, column=0, sticky="NSEW")
 
         self.total_alk_label.grid(row=2, column=5, sticky="NSEW")
         self.total_alk_output.grid(row=3, column=5)
+        self.timing_output.grid(row=4, column=5, sticky="W")
 
         self.main_controls_frame.grid_columnconfigure(0, weight=1)
         self.start_button.grid(row=0, column=0, pady=5)
@@ -223,6 +267,13 @@ class App(tk.Tk):
         self.pump_port_label.grid(row=2, column=0, sticky="NSEW")
         self.pump_port_input.grid(row=3, column=0, pady=5)
         self.connect_devices_button.grid(row=4, column=0, pady=5)
+        self.auto_detect_button.grid(row=5, column=0, pady=5)
+
+        self.queue_listbox.grid(row=0, column=0, rowspan=3, padx=5)
+        self.add_sample_button.grid(row=0, column=1, pady=5)
+        self.load_manifest_button.grid(row=1, column=1, pady=5)
+        self.run_queue_button.grid(row=2, column=1, pady=5)
+        self.throughput_label.grid(row=3, column=0, columnspan=2, sticky="W")
 
         self.inputs_frame.grid(row=0, column=0, columnspan=2, padx=10, pady=0)
         self.main_controls_frame.grid(row=1, column=0, padx=10)
@@ -231,16 +282,27 @@ class App(tk.Tk):
         self.status_frame.grid(row=0, column=3, padx=10, pady=0, sticky="EW")
         self.outputs_frame.grid(row=1, column=3, padx=10, pady=0)
         self.serial_ports_frame.grid(row=2, column=0, padx=10, pady=0)
+        self.queue_frame.grid(row=2, column=2, padx=10, pady=0)
 
-        # Embed matplotlib object
-        self.fig, self.ax = plt.subplots(figsize=(4, 3),
-                                          constrained_layout=True)
-        self.ax.set_xlabel("Volume Added (L)")
-        self.ax.set_ylabel("Emf (mV)")
+        # Embed matplotlib object, with the titration curve on the left and
+        # the Gran function with its running fit on the right
+        self.fig, (self.ax, self.gran_ax) = plt.subplots(1, 2, figsize=(8, 3),
+                                                constrained_layout=True)
         self.canvas = FigureCanvasTkAgg(self.fig, self.display_frame)
         self.canvas.get_tk_widget().grid(
             row=0, column=0, rowspan=1, columnspan=1, sticky="NSEW"
         )
+
+        self.emf_plot = LivePlot(self.ax, self.canvas,
+                                   xlabel="Volume Added (L)", ylabel="Emf (mV)")
+        self.emf_plot.add_scatter("emf", color="blue")
+
+        self.gran_plot = LivePlot(self.gran_ax, self.canvas,
+                                    xlabel="Volume Added (L)",
+                                    ylabel="Gran Function")
+        self.gran_plot.add_scatter("gran", color="blue")
+        self.gran_plot.add_line("fit", color="red")
+
         self.canvas.draw()
 
     def check_serial_port_inputs(self) -> Tuple[bool, str, str]:
@@ -317,26 +379,29 @@ class App(tk.Tk):
             except AttributeError:
                 pass
         
-        pump_serial = self.pump.open_serial_port(port=pump_port_loc)
-        if not pump_serial:
-            tk.messagebox.showerror(
-                "Error", "Pump serial connection failed."
-            )
-            self._system_state = SystemStates.DISCONNECTED
-            self.status_label.configure(text="Disconnected", fg="red")
-            return False
+        # Initializing the pump zeroes the syringe, so it is skipped when
+        # an interrupted run is going to be resumed
+        resume_path = self.check_interrupted_runs()
+
+        # Pump and meter are opened at the same time, so the connection
+        # takes as long as the slowest device rather than the sum of both
+        connect_started = time.monotonic()
+        connected = discovery.connect_devices(
+            pumps={pump_port_loc: self.pump},
+            ph_meters={phmeter_port_loc: self.ph_meter},
+            initialize_pumps=resume_path is None
+        )
+        self.connect_time.record(time.monotonic() - connect_started)
 
-        pump_init = self.pump.initialize_pump()
-        if not pump_init['host_ready']:
+        if not connected[pump_port_loc]:
             tk.messagebox.showerror(
-                "Error", "Pump initialization failed."
+                "Error", "Pump connection failed."
             )
             self._system_state = SystemStates.DISCONNECTED
             self.status_label.configure(text="Disconnected", fg="red")
             return False
 
-        ph_meter_serial = self.ph_meter.open_serial_port(port=phmeter_port_loc)
-        if not ph_meter_serial:
+        if not connected[phmeter_port_loc]:
             tk.messagebox.showerror(
                 "Error", "pH meter serial connection failed."
             )
@@ -349,8 +414,85 @@ class App(tk.Tk):
         tk.messagebox.showinfo(
             "Success", "Device connection successful."
         )
+
+        if resume_path:
+            self.resume_titration(resume_path)
         return True
 
+    def check_interrupted_runs(self) -> Optional[str]:
+        """Offers to resume each titration that was interrupted (e.g. by a
+        crash or power loss) until one is accepted. Checkpoints that are
+        declined are removed; their steps stay in the .partial journal.
+
+        Args:
+            None.
+
+        Returns:
+            str: location of the checkpoint to resume, or None.
+        """
+        for path in recovery.find_interrupted_runs("."):
+            try:
+                state = recovery.load_checkpoint(path)
+            except (OSError, ValueError) as e:
+                logger.error(f"Reading checkpoint {path} failed: {e}")
+                continue
+
+            steps = len(state["phs"]) - 1
+            if tk.messagebox.askyesno(
+                "Interrupted titration",
+                f"A titration was interrupted after {steps} steps "
+                f"({state['filepath']}).\nResume it?"
+            ):
+                return path
+            recovery.Checkpoint(state["filepath"]).clear()
+        return None
+
+    def auto_detect_devices(self) -> bool:
+        """Probes every serial port for the pump and pH meter, fills in the
+        port fields, and connects to the devices found.
+
+        Args:
+            None.
+
+        Returns:
+            bool: True if both devices were found and connected.
+        """
+        # Serial ports on Windows are exclusive, so the current connections
+        # must be closed before they can be probed
+        if platform.system() == PlatformStrings.WINDOWS.value:
+            try:
+                self.pump.serial_port.close()
+                self.ph_meter.serial_port.close()
+            except AttributeError:
+                pass
+
+        self.status_label.configure(text="Searching for devices...")
+        self.update_idletasks()
+
+        found = discovery.discover_devices()
+        pump_ports = [port for port, device_type in found.items()
+                      if device_type == discovery.DeviceTypes.PUMP]
+        phmeter_ports = [port for port, device_type in found.items()
+                         if device_type == discovery.DeviceTypes.PH_METER]
+
+        if not pump_ports or not phmeter_ports:
+            tk.messagebox.showerror(
+                "Error", f"Found {len(pump_ports)} pump(s) and "
+                         f"{len(phmeter_ports)} pH meter(s)."
+            )
+            self.status_label.configure(text="Disconnected", fg="red")
+            return False
+
+        # The port fields take the bare device name on linux
+        for entry, port in ((self.pump_port_input, pump_ports[0]),
+                            (self.phmeter_port_input, phmeter_ports[0])):
+            if platform.system() == PlatformStrings.LINUX.value:
+                port = port.replace("/dev/", "", 1)
+            entry.delete(0, tk.END)
+            entry.insert(0, port)
+
+        return self.connect_devices()
+
     def check_pump_ready(self) -> bool:
         """Checks if the pump module initializes properly. Called on startup.
 
@@ -398,6 +540,7 @@ class App(tk.Tk):
         self.initial_mass_input.configure(state=tk.DISABLED)
         self.salinity_input.configure(state=tk.DISABLED)
         self.acid_conc_input.configure(state=tk.DISABLED)
+        self.sample_id_input.configure(state=tk.DISABLED)
 
     def enable_inputs(self) -> None:
         """Helper function to re-enable all UI inputs at once after
@@ -412,6 +555,7 @@ class App(tk.Tk):
         self.initial_mass_input.configure(state=tk.NORMAL)
         self.salinity_input.configure(state=tk.NORMAL)
         self.acid_conc_input.configure(state=tk.NORMAL)
+        self.sample_id_input.configure(state=tk.NORMAL)
 
     def clear_display(self) -> None:
         """Clears the display data from the last run.
@@ -422,10 +566,8 @@ class App(tk.Tk):
         Returns:
             None.
         """
-        self.ax.clear()
-        self.ax.set_xlabel("Volume Added (L)")
-        self.ax.set_ylabel("Emf (mV)")
-        self.canvas.draw()
+        self.emf_plot.clear()
+        self.gran_plot.clear()
 
     def reset_interface(self) -> None:
         """Resets all the interface elements at the end of a run.
@@ -503,6 +645,10 @@ class App(tk.Tk):
         self.empty_button.configure(state=tk.DISABLED)
         self.wash_button.configure(state=tk.DISABLED)
         self.connect_devices_button.configure(state=tk.DISABLED)
+        self.auto_detect_button.configure(state=tk.DISABLED)
+        self.add_sample_button.configure(state=tk.DISABLED)
+        self.load_manifest_button.configure(state=tk.DISABLED)
+        self.run_queue_button.configure(state=tk.DISABLED)
 
     def enable_manual_controls(self) -> None:
         """Helper function to re-enable all manual controls at the end of a run.
@@ -518,6 +664,10 @@ class App(tk.Tk):
         self.empty_button.configure(state=tk.NORMAL)
         self.wash_button.configure(state=tk.NORMAL)
         self.connect_devices_button.configure(state=tk.NORMAL)
+        self.auto_detect_button.configure(state=tk.NORMAL)
+        self.add_sample_button.configure(state=tk.NORMAL)
+        self.load_manifest_button.configure(state=tk.NORMAL)
+        self.run_queue_button.configure(state=tk.NORMAL)
 
     def clear_inputs(self) -> None:
         """Helper function to clear UI inputs before the next run.
@@ -531,6 +681,7 @@ class App(tk.Tk):
         self.initial_mass_input.delete(0, tk.END)
         self.salinity_input.delete(0, tk.END)
         self.acid_conc_input.delete(0, tk.END)
+        self.sample_id_input.delete(0, tk.END)
 
         self.temperature_input.configure(state=tk.NORMAL)
         self.temperature_input.delete(0, tk.END)
@@ -546,6 +697,7 @@ class App(tk.Tk):
             None.
         """
         self.total_alk_output.configure(text="N/A")
+        self.timing_output.configure(text="")
 
     def handle_manual_fill_command(self) -> None:
         """Calls the pump's fill command and gives a status update.
@@ -640,31 +792,6 @@ class App(tk.Tk):
         """
         self.total_alk_output.configure(text=str(round(value, 3)))
 
-    def get_phmeter_measurements(self) -> Tuple[float, float, float]:
-        """Polls the pH meter for the current measurements of pH, emf,
-        and temperature.
-
-        Args:
-            None.
-
-        Returns:
-            tuple containing:
-             - float: pH value from the meter casted to float.
-             - float: emf value from the meter casted to float.
-             - float: temperature value from the meter casted to float.
-        """
-        try:
-            meas = self.ph_meter.get_measurement()
-        except IndexError as e:
-            logger.info("pH measurement failed, trying again...")
-            meas = self.ph_meter.get_measurement()
-
-        ph_meas = meas["pH"]
-        emf_meas = meas["mV"]
-        temp_meas = meas["temp"]
-
-        return float(ph_meas), float(emf_meas), float(temp_meas)
-
     def start_titration(self) -> None:
         """Starts the main titration routine after gathering the
         necessary data.
@@ -694,66 +821,106 @@ class App(tk.Tk):
             self.enable_manual_controls()
             return
 
-        self.status_label.configure(text="Waiting for pH measurement...")
-        # For some unknown reason, unless there's a small sleep here
-        # tk will go immediately to the ph measurement without updating the UI
-        self.tksleep(1)
+        # Steps are journaled as they're measured, so a crash or stop
+        # midway keeps the data collected so far, and the checkpoint lets
+        # the run be resumed
+        filepath = results.default_filename() + ".csv"
+
+        self.routine = routine.TitrationRoutine(
+            self.pump, self.ph_meter, sample_mass, salinity, acid_conc,
+            on_status=self.update_status, on_start=self.show_initial_conditions,
+            on_step=self.handle_step_data,
+            journal=results.StepJournal(filepath),
+            checkpoint=recovery.Checkpoint(filepath),
+            timer=self.connect_time.new_timer(), titration_protocol=self.titration_protocol
+        )
 
-        ph_init, emf_init, temp_init = self.get_phmeter_measurements()
+        self._system_state = SystemStates.RUNNING
 
-        self.status_label.configure(text="Titration in progress")
+        self.run_routine(self.routine.run(), self.handle_routine_done)
 
-        self.temperature_input.configure(state=tk.NORMAL)
-        self.temperature_input.insert(0, temp_init)
-        self.temperature_input.configure(state=tk.DISABLED)
+    def resume_titration(self, checkpoint_path: str) -> None:
+        """Continues an interrupted titration from its checkpoint.
+
+        Args:
+            checkpoint_path (str): location of the checkpoint.
+
+        Returns:
+            None.
+        """
+        state = recovery.load_checkpoint(checkpoint_path)
 
-        titration = gran.ModifiedGranTitration(
-            sample_mass, salinity, acid_conc, temp_init, ph_init, emf_init
+        self.disable_inputs()
+        self.disable_manual_controls()
+        self.clear_display()
+        self.clear_outputs()
+
+        self.routine = routine.TitrationRoutine.resume(
+            self.pump, self.ph_meter, state,
+            on_status=self.update_status, on_start=self.show_initial_conditions,
+            on_step=self.handle_step_data,
+            journal=results.StepJournal(state["filepath"]),
+            checkpoint=recovery.Checkpoint(state["filepath"]),
+            timer=self.connect_time.new_timer(), titration_protocol=self.titration_protocol
         )
 
         self._system_state = SystemStates.RUNNING
 
-        logger.info("Filling syringe...")
-        self.pump.fill()
-        self.tksleep(15)
-
-        self.initial_titration(titration)
+        self.run_routine(self.routine.run(), self.handle_routine_done)
 
-    def initial_titration(self, titration: gran.ModifiedGranTitration) -> None:
-        """Runs the initial titration procedure from the starting pH to
-        the first target pH where data will be collected.
+    def run_routine(self, steps: Generator[float, None, None],
+                       on_done: Callable[[], None]) -> None:
+        """Advances a titration routine (or sample queue) to its next wait,
+        then schedules itself to resume it once the wait is over.
 
         Args:
-            titration (ModifiedGranTitration): gran titration object.
+            steps (Generator): generator returned by TitrationRoutine.run
+                or SampleQueue.run.
+            on_done (Callable): called once the generator is exhausted.
 
         Returns:
             None.
         """
-        if self._stop_titration:
-            self.handle_stop_command(self.initial_titration)
+        try:
+            delay = next(steps)
+        except StopIteration:
+            on_done()
             return
 
-        last_ph = titration.get_last_ph()
+        # Hand control back to the mainloop while waiting, so the UI stays
+        # responsive between steps
+        self.after(int(delay * 1000), self.run_routine, steps, on_done)
 
-        # Check if last pH reading is below target, if so move to next step
-        if last_ph <= FIRST_TITRATION_PH_TARGET:
-            self.after_cancel(self.initial_titration)
-            logger.info("Reached pH target. Moving to second titration step...")
-            self.auto_titration(titration)
-            return
+    def handle_routine_done(self) -> None:
+        """Handles the end of a single titration, whether it finished or
+        was stopped.
 
-        # Shoot for slightly below target to make sure target is reached
-        stepwise_ph_target = FIRST_TITRATION_PH_TARGET - 0.01
+        Args:
+            None.
 
-        self.run_titration_step(titration, stepwise_ph_target)
+        Returns:
+            None.
+        """
+        if self.routine.stopped:
+            self.handle_stop_command()
+        else:
+            self.finish_titration(self.routine.titration)
 
-        # Schedule next titration step, setting time=0 makes it run
-        # immediately whenever the mainloop is not busy
-        self.after(0, self.initial_titration, titration)
+    def update_status(self, status: str) -> None:
+        """Displays a status update coming from the titration routine.
 
-    def auto_titration(self, titration: gran.ModifiedGranTitration) -> None:
-        """Runs the second titration, in smaller steps, to collect data
-        for the total alkalinity estimate.
+        Args:
+            status (str): short description of the current stage.
+
+        Returns:
+            None.
+        """
+        self.status_label.configure(text=status)
+
+    def show_initial_conditions(self,
+                                   titration: gran.ModifiedGranTitration) -> None:
+        """Displays the sample temperature once the initial measurement
+        has been taken.
 
         Args:
             titration (ModifiedGranTitration): gran titration object.
@@ -761,122 +928,239 @@ class App(tk.Tk):
         Returns:
             None.
         """
-        if self._stop_titration:
-            self.handle_stop_command(self.auto_titration)
-            return
+        self.temperature_input.configure(state=tk.NORMAL)
+        self.temperature_input.insert(0, titration.temp_C)
+        self.temperature_input.configure(state=tk.DISABLED)
+
+    def handle_step_data(self, titration: gran.ModifiedGranTitration) -> None:
+        """Plots the data of each titration step as it comes in.
+
+        Args:
+            titration (ModifiedGranTitration): gran titration object.
+
+        Returns:
+            None.
+        """
+        self.plot(titration.volume_array, titration.emf_array)
+        self.plot_gran(titration)
+
+    def finish_titration(self, titration: gran.ModifiedGranTitration) -> None:
+        """Displays the results, writes data, and cleans up after the
+        titration is finished.
+
+        Args:
+            titration (ModifiedGranTitration): gran titration object.
+
+        Returns:
+            None.
+        """
+        total_alkalinity, gamma, rsq = self.routine.result
+
+        self.update_ta_output(total_alkalinity)
+
+        timings = self.write_data(titration, total_alkalinity)
+        self.timing_output.configure(text=timing.format_summary(timings))
+
+        self.reset_interface()
+
+        tk.messagebox.showinfo(
+            "Info", "Titration finished."
+        )
+        self._system_state = SystemStates.READY
+        self.status_label.configure(text="Ready", fg="green")
+
+    def handle_stop_command(self) -> None:
+        """Cleans up once the routine has stopped after a stop request.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        self.reset_interface()
+        self._system_state = SystemStates.READY
+        self.status_label.configure(text="Ready", fg="green")
+
+        msg = "Titration cancelled."
+        if self.routine and self.routine.titration is not None:
+            msg += f"\nPartial data kept in {self.routine.journal.journal_path}"
+        tk.messagebox.showinfo("Info", msg)
+
+    def add_sample_to_queue(self) -> None:
+        """Adds a sample to the queue from the current input values.
 
-        last_ph = titration.get_last_ph()
+        Args:
+            None.
 
-        # Check if last pH reading is below target, if so stop the routine
-        # and run calculations
-        if last_ph <= SECOND_TITRATION_PH_TARGET:
-            self.status_label.configure(text="Finished", fg="green")
-            logger.info("Titration finished.")
-            logger.info(f"Final pH: {last_ph}")
-            self.finish_titration(titration)
+        Returns:
+            None.
+        """
+        inputs_valid, sample_mass, salinity, acid_conc = self.check_inputs()
+        if not inputs_valid:
             return
 
-        # Collect data moving downward in steps of 0.1 pH
-        stepwise_ph_target = last_ph - 0.1
+        sample_id = self.sample_id_input.get().strip()
+        if not sample_id:
+            tk.messagebox.showerror(
+                "Error", "Please provide a sample ID."
+            )
+            return
+
+        self.enqueue_samples(
+            [batch.Sample(sample_id, sample_mass, salinity, acid_conc)]
+        )
+        self.clear_inputs()
+
+    def load_manifest(self) -> None:
+        """Adds every sample of a csv manifest to the queue.
+
+        Args:
+            None.
 
-        self.run_titration_step(titration, stepwise_ph_target)
+        Returns:
+            None.
+        """
+        filepath = tk.filedialog.askopenfilename(
+            title="Select sample manifest",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*")]
+        )
+        if not filepath:
+            return
 
-        # Schedule next titration step, setting time=0 makes it run
-        # immediately whenever the mainloop is not busy
-        self.after(0, self.auto_titration, titration)
+        try:
+            samples = batch.load_manifest(filepath)
+        except (OSError, ValueError, KeyError) as e:
+            tk.messagebox.showerror(
+                "Error", f"Could not load manifest: {e}"
+            )
+            return
+
+        self.enqueue_samples(samples)
 
-    def run_titration_step(self, titration: gran.ModifiedGranTitration,
-                                  ph_target: float) -> None:
-        """Handles the addition of acid and gathers measurements at
-        each individual titration step.
+    def enqueue_samples(self, samples: list) -> None:
+        """Adds samples to the list waiting for the next batch run.
 
         Args:
-            titration (ModifiedGranTitration): gran titration object.
-            ph_target (float): desired pH at the end of the step.
+            samples (list): Sample objects to add, in order.
 
         Returns:
             None.
         """
-        # Get the volume of acid required to dose at the next step, in liters
-        required_acid_vol_liters = titration.calc_required_acid_vol(ph_target)
+        for sample in samples:
+            self.queued_samples.append(sample)
+            self.queue_listbox.insert(
+                tk.END, f"{sample.sample_id}: {sample.sample_mass} g, "
+                        f"S={sample.salinity}, {sample.acid_conc} M"
+            )
 
-        required_acid_vol_ul = round(required_acid_vol_liters * 1e6, 2)
+    def start_queue(self) -> None:
+        """Runs every queued sample back-to-back.
 
-        if not self.pump.check_volume_available(required_acid_vol_liters):
-            logger.info("Volume low, re-filling...")
-            self.pump.fill()
-            self.tksleep(15)
+        Args:
+            None.
 
-        # Dispense required volume of acid
-        logger.info(f"Dispensing: {required_acid_vol_ul} uL")
-        self.pump.dispense(required_acid_vol_liters)
-        self.status_label.configure(text="Dosing...")
+        Returns:
+            None.
+        """
+        if self._system_state == SystemStates.DISCONNECTED:
+            tk.messagebox.showerror(
+                "Error", "Please connect devices before starting."
+            )
+            return
 
-        # Wait 5 seconds to dispense acid
-        self.tksleep(5)
+        if not self._system_state == SystemStates.READY:
+            return
 
-        self.status_label.configure(text="Waiting for pH measurement...")
-        self.tksleep(1)
+        if not self.queued_samples:
+            tk.messagebox.showerror(
+                "Error", "Please add samples to the queue before starting."
+            )
+            return
 
-        # Take pH, emf measurements -- this call is blocking
-        pH, emf, _ = self.get_phmeter_measurements()
-        logger.info(f"pH: {pH}, emf: {emf}")
+        self.disable_inputs()
+        self.disable_manual_controls()
 
-        self.status_label.configure(text="Titration in progress")
+        self.sample_queue = batch.SampleQueue(
+            self.pump, self.ph_meter, store=self.store,
+            on_sample_start=self.handle_sample_start,
+            on_sample_done=self.handle_sample_done,
+            on_status=self.update_status,
+            on_start=self.show_initial_conditions,
+            on_step=self.handle_step_data, titration_protocol=self.titration_protocol
+        )
+        self.sample_queue.extend(self.queued_samples)
+        self.queued_samples = []
 
-        # Add last measurements to titration
-        titration.add_step_data(pH, emf, required_acid_vol_liters)
+        self._system_state = SystemStates.RUNNING
 
-        # Plot current step
-        self.plot(titration.volume_array, titration.emf_array)
+        self.run_routine(self.sample_queue.run(), self.finish_queue)
 
-    def finish_titration(self, titration: gran.ModifiedGranTitration) -> None:
-        """Handles the calculations, writes data, and cleans up after the
-        titration is finished.
+    def handle_sample_start(self, sample: batch.Sample,
+                               titration_routine: routine.TitrationRoutine) -> None:
+        """Resets the display for the next sample of the batch.
 
         Args:
-            titration (ModifiedGranTitration): gran titration object.
+            sample (Sample): the sample being started.
+            titration_routine (TitrationRoutine): the sample's routine.
 
         Returns:
             None.
         """
-        self.after_cancel(self.auto_titration)
+        self.routine = titration_routine
+        self.queue_listbox.delete(0)
 
-        total_alkalinity, gamma, rsq = titration.gran_polynomial_fit()
-        logger.info(f"TA: {total_alkalinity}, Gamma: {gamma}, Rsq: {rsq}")
+        self.clear_display()
+        self.clear_outputs()
+        self.temperature_input.configure(state=tk.NORMAL)
+        self.temperature_input.delete(0, tk.END)
+        self.temperature_input.configure(state=tk.DISABLED)
 
-        self.update_ta_output(total_alkalinity)
+        logger.info(f"Starting sample {sample.sample_id}")
 
-        self.write_data(titration, total_alkalinity)
+    def handle_sample_done(self, record: dict) -> None:
+        """Displays the outcome of a sample and the batch throughput.
 
-        self.reset_interface()
+        Args:
+            record (dict): the sample's record, see SampleQueue.get_records.
 
-        tk.messagebox.showinfo(
-            "Info", "Titration finished."
+        Returns:
+            None.
+        """
+        if record["total_alkalinity"] is not None:
+            self.update_ta_output(record["total_alkalinity"])
+
+        throughput = self.sample_queue.get_throughput()
+        self.throughput_label.configure(
+            text=f"Samples/hour: {throughput['samples_per_hour']:.2f} "
+                 f"({throughput['completed']} done, "
+                 f"{throughput['failed']} failed)"
         )
-        self._system_state = SystemStates.READY
-        self.status_label.configure(text="Ready", fg="green")
 
-    def handle_stop_command(self, func: Callable) -> None:
-        """Handles the stop command when requested in the middle of a run.
+    def finish_queue(self) -> None:
+        """Cleans up once the batch has finished or was stopped.
 
         Args:
-            func (Callable): the titration function to cancel. Should be either
-                self.initial_titration or self.auto_titration.
+            None.
 
         Returns:
             None.
         """
-        self.after_cancel(func)
-        logger.info("Titration cancelled.")
-        self._stop_titration = False
+        throughput = self.sample_queue.get_throughput()
+
+        # Samples left over after a stop stay queued (and listed) for the
+        # next run
+        self.queued_samples = list(self.sample_queue.pending)
+        self.sample_queue = None
 
         self.reset_interface()
         self._system_state = SystemStates.READY
         self.status_label.configure(text="Ready", fg="green")
 
         tk.messagebox.showinfo(
-            "Info", "Titration cancelled."
+            "Info", f"Batch finished: {throughput['completed']} completed, "
+                    f"{throughput['failed']} failed, "
+                    f"{throughput['samples_per_hour']:.2f} samples/hour."
         )
 
     def plot(self, x: np.ndarray, y: np.ndarray) -> None:
@@ -890,40 +1174,67 @@ class App(tk.Tk):
             None.
         """
         if len(x) >= 3:
-            self.ax.scatter(x[2:], y[2:], color="blue")
-            self.ax.autoscale()
-            self.canvas.draw()
+            self.emf_plot.update("emf", x[2:], y[2:])
 
-    def write_data(self, titration: gran.ModifiedGranTitration,
-                      total_alkalinity: float) -> None:
-        """Dumps the titration data to a csv file on the host.
+    def plot_gran(self, titration: gran.ModifiedGranTitration) -> None:
+        """Displays the Gran function of the steps collected so far, along
+        with a running linear fit once there are enough points for one.
 
         Args:
             titration (ModifiedGranTitration): gran titration object.
-            total_alkalinity (float): estimated total alkalinity value.
 
         Returns:
             None.
         """
-        filename = datetime.now().strftime("%Y_%m_%d-%I_%M_%S_%p")
+        volumes, ygran = titration.get_gran_data(
+            self.titration_protocol.gran_ph_cutoff
+        )
+        if volumes.size == 0:
+            return
+
+        self.gran_plot.update("gran", volumes, ygran)
 
-        header = ["total_volume_added_L", "emf_mV", "pH", "sample_mass_g",
-                  "temp_C", "salinity", "acid_conc_M", "total_alk_umol_kg"]
+        if volumes.size < 2:
+            return
+
+        slope, intercept, _, _, _ = regression.linear_regression(volumes, ygran)
 
-        with open(filename + ".csv", "w") as f:
-            writer = csv.writer(f, delimiter=",")
-            writer.writerow(header)
+        # Extend the fit line down to the x-intercept (Veq)
+        veq = -1 * intercept / slope
+        x_fit = np.array([veq, volumes.max()])
+        self.gran_plot.update("fit", x_fit, slope * x_fit + intercept)
 
-            firstrow = [titration.volume_array[0], titration.emf_array[0],
-                titration.ph_array[0], titration.sample_mass_kg * 1000,
-                titration.temp_K - 273.15, titration.salinity,
-                titration.acid_conc_M, round(total_alkalinity, 3)]
-            writer.writerow(firstrow)
+    def write_data(self, titration: gran.ModifiedGranTitration,
+                      total_alkalinity: float) -> dict:
+        """Dumps the titration data to a csv file on the host.
 
-            for vol,emf,ph in zip(titration.volume_array[1:],
-                    titration.emf_array[1:], titration.ph_array[1:]):
-                rowarray = [vol, emf, ph]
-                writer.writerow(rowarray)
+        Args:
+            titration (ModifiedGranTitration): gran titration object.
+            total_alkalinity (float): estimated total alkalinity value.
+
+        Returns:
+            dict: time spent in each phase of the run, see
+                PhaseTimer.summary.
+        """
+        with self.routine.timer.span("write"):
+            filepath = self.routine.journal.finalize(titration,
+                                                     total_alkalinity)
+
+        timings = self.routine.timer.summary()
+        logger.info(f"Timing: {timing.format_summary(timings)}")
+
+        _, gamma, rsq = self.routine.result
+        try:
+            self.store.add_run(
+                titration, total_alkalinity, gamma=gamma, rsq=rsq,
+                sample_id=self.sample_id_input.get().strip() or None,
+                started_at=self.routine.started_at, filepath=filepath,
+                timings=timings,
+                protocol=self.titration_protocol.to_dict()
+            )
+        except (ValueError, sqlite3.Error) as e:
+            logger.error(f"Storing titration result failed with error: {e}")
+        return timings
 
     def stop_titration(self) -> None:
         """Gives the signal to stop the titration process in the middle
@@ -938,8 +1249,10 @@ class App(tk.Tk):
         if not self._system_state == SystemStates.RUNNING:
             return
 
-        self._stop_titration = True
-        logger.info("Stopping titration before next step...")
+        if self.sample_queue:
+            self.sample_queue.stop()
+        else:
+            self.routine.stop()
         self._system_state = SystemStates.STOPPING
         self.status_label.configure(text="Stopping...", fg="red")
 
@@ -970,6 +1283,7 @@ class App(tk.Tk):
 
         mb = tk.messagebox.askyesnocancel("Warning", msg)
         if mb:
+            self.store.close()
             self.quit()
         else:
             return
@@ -0,0 +1,229 @@
+import logging
+from typing import Dict, Tuple
+
+import numpy as np
+from matplotlib.artist import Artist
+from matplotlib.axes import Axes
+from matplotlib.backend_bases import FigureCanvasBase
+
+logger = logging.getLogger(__name__)
+
+
+class LivePlot:
+    """Plot panel for data that arrives one titration step at a time.
+
+    Every series owns a single artist for the lifetime of a run, which is
+    updated in place rather than re-created at each step. Redraws are
+    restricted to the panel's own region of the canvas using blitting, and
+    the axis limits only change when new points fall outside of the current
+    view; that is the only case where a full canvas redraw is needed.
+
+    Several panels can share one canvas; each one re-caches its background
+    whenever the canvas is fully redrawn (e.g. on resize or when another
+    panel rescales).
+
+    Args:
+        ax (Axes): matplotlib axes the panel draws into.
+        canvas (FigureCanvasBase): canvas holding the figure of the axes.
+        xlabel (str): label for the x-axis.
+        ylabel (str): label for the y-axis.
+        margin (float): fraction of the data span added on each side of the
+            view when the limits have to grow. Defaults to 0.1.
+
+    Returns:
+        None.
+    """
+    def __init__(self, ax: Axes, canvas: FigureCanvasBase, xlabel: str,
+                    ylabel: str, margin: float = 0.1) -> None:
+        self.ax = ax
+        self.canvas = canvas
+        self.margin = margin
+
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel(ylabel)
+
+        # Limits are managed here, matplotlib's autoscaling would otherwise
+        # rescale (and force a full redraw) on every update
+        self.ax.set_autoscale_on(False)
+        self._default_xlim = self.ax.get_xlim()
+        self._default_ylim = self.ax.get_ylim()
+
+        self._artists: Dict[str, Artist] = {}
+        self._data: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+        self._background = None
+        self._needs_full_draw = True
+
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def add_scatter(self, name: str, **kwargs) -> None:
+        """Adds a scatter series to the panel.
+
+        Args:
+            name (str): identifier used when updating the series.
+            **kwargs: styling passed through to Axes.scatter.
+
+        Returns:
+            None.
+        """
+        artist = self.ax.scatter([], [], animated=True, **kwargs)
+        self._artists[name] = artist
+        self._data[name] = (np.empty(0), np.empty(0))
+
+    def add_line(self, name: str, **kwargs) -> None:
+        """Adds a line series to the panel.
+
+        Args:
+            name (str): identifier used when updating the series.
+            **kwargs: styling passed through to Axes.plot.
+
+        Returns:
+            None.
+        """
+        (artist,) = self.ax.plot([], [], animated=True, **kwargs)
+        self._artists[name] = artist
+        self._data[name] = (np.empty(0), np.empty(0))
+
+    def update(self, name: str, x: np.ndarray, y: np.ndarray) -> None:
+        """Replaces the data of a series and redraws the panel.
+
+        Args:
+            name (str): identifier of the series to update.
+            x (np.ndarray): x-coordinates of the series.
+            y (np.ndarray): y-coordinates of the series.
+
+        Returns:
+            None.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        artist = self._artists[name]
+        if hasattr(artist, "set_offsets"):
+            artist.set_offsets(np.column_stack((x, y)))
+        else:
+            artist.set_data(x, y)
+        self._data[name] = (x, y)
+
+        if self._expand_limits(x, y):
+            self._needs_full_draw = True
+
+        self.draw()
+
+    def clear(self) -> None:
+        """Empties every series and restores the initial axis limits.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        for name, artist in self._artists.items():
+            if hasattr(artist, "set_offsets"):
+                artist.set_offsets(np.empty((0, 2)))
+            else:
+                artist.set_data([], [])
+            self._data[name] = (np.empty(0), np.empty(0))
+
+        self.ax.set_xlim(self._default_xlim)
+        self.ax.set_ylim(self._default_ylim)
+        self._needs_full_draw = True
+        self.draw()
+
+    def draw(self) -> None:
+        """Redraws the panel, blitting only the region of its axes unless
+        the limits changed since the last draw.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if self._needs_full_draw or self._background is None:
+            # The draw event re-caches the background and blits the artists
+            self.canvas.draw()
+            return
+
+        self.canvas.restore_region(self._background)
+        self._draw_artists()
+        self.canvas.blit(self.ax.bbox)
+
+    def _on_draw(self, event) -> None:
+        """Caches the static background of the axes after any full redraw
+        of the canvas, then puts the (animated) series back on top.
+
+        Args:
+            event (DrawEvent): matplotlib draw event.
+
+        Returns:
+            None.
+        """
+        self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self._needs_full_draw = False
+        self._draw_artists()
+        self.canvas.blit(self.ax.bbox)
+
+    def _draw_artists(self) -> None:
+        """Renders every series of the panel onto the canvas.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        for artist in self._artists.values():
+            self.ax.draw_artist(artist)
+
+    def _expand_limits(self, x: np.ndarray, y: np.ndarray) -> bool:
+        """Grows the axis limits if any of the given points are out of view.
+
+        Args:
+            x (np.ndarray): x-coordinates of the new data.
+            y (np.ndarray): y-coordinates of the new data.
+
+        Returns:
+            bool: True if the limits were changed, False otherwise.
+        """
+        finite = np.isfinite(x) & np.isfinite(y)
+        if not finite.any():
+            return False
+
+        x = x[finite]
+        y = y[finite]
+
+        changed = False
+        xlim = self.ax.get_xlim()
+        if x.min() < xlim[0] or x.max() > xlim[1]:
+            self.ax.set_xlim(self._padded_limits("x"))
+            changed = True
+
+        ylim = self.ax.get_ylim()
+        if y.min() < ylim[0] or y.max() > ylim[1]:
+            self.ax.set_ylim(self._padded_limits("y"))
+            changed = True
+
+        return changed
+
+    def _padded_limits(self, axis: str) -> Tuple[float, float]:
+        """Computes new limits spanning all data on the panel plus a margin.
+
+        Args:
+            axis (str): "x" or "y".
+
+        Returns:
+            tuple: new (lower, upper) limits of the axis.
+        """
+        idx = 0 if axis == "x" else 1
+        values = np.concatenate([d[idx] for d in self._data.values()])
+        values = values[np.isfinite(values)]
+
+        low = values.min()
+        high = values.max()
+
+        span = high - low
+        if span == 0:
+            span = abs(high) if high != 0 else 1.0
+        return low - (self.margin * span), high + (self.margin * span)
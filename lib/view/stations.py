@@ -0,0 +1,408 @@
+# Standard libraries
+import logging
+import math
+import queue
+import threading
+import tkinter as tk
+import tkinter.messagebox
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+# Third-party libraries
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+# Local libraries
+from lib.services.station.manager import Station, StationManager
+from lib.services.station.states import SystemStates
+from lib.services.titration import gran, timing
+from lib.view.live_plot import LivePlot
+
+logger = logging.getLogger(__name__)
+
+# Interval (in milliseconds) at which station events are moved onto the
+# tk thread
+EVENT_POLL_INTERVAL_MS = 100
+
+
+class StationTile(tk.LabelFrame):
+    """Compact control and display panel for a single station.
+
+    Args:
+        parent (tk.Misc): parent widget.
+        station (Station): the station shown on the tile.
+        post (Callable): thread-safe function taking a callable, used to
+            run UI updates coming from scheduler threads on the tk thread.
+        on_start (Callable): called with the tile when Start is pressed.
+        on_stop (Callable): called with the tile when Stop is pressed.
+
+    Returns:
+        None.
+    """
+    def __init__(self, parent: tk.Misc, station: Station,
+                    post: Callable[[Callable], None],
+                    on_start: Callable, on_stop: Callable) -> None:
+        super().__init__(parent, padx=10, pady=10, relief=tk.RIDGE,
+                         borderwidth=3, text=station.name)
+        self.station = station
+        self.post = post
+
+        self.mass_input = self._add_input("Sample mass (g): ", 0)
+        self.salinity_input = self._add_input("Salinity (S): ", 1)
+        self.acid_conc_input = self._add_input("Acid conc. (M): ", 2)
+
+        self.start_button = tk.Button(self, width=5, text="Start", bg="green",
+                                        command=lambda: on_start(self))
+        self.stop_button = tk.Button(self, width=5, text="Stop",
+                                       command=lambda: on_stop(self))
+        self.start_button.grid(row=3, column=0, pady=5)
+        self.stop_button.grid(row=3, column=1, pady=5)
+
+        self.status_label = tk.Label(self, text="Disconnected", fg="red")
+        self.status_label.grid(row=4, column=0, columnspan=2, sticky="NSEW")
+        if station.state == SystemStates.READY:
+            self.set_status("Ready", "green")
+
+        self.total_alk_output = tk.Label(self, text="TA (umol/kg): N/A")
+        self.total_alk_output.grid(row=5, column=0, columnspan=2,
+                                   sticky="NSEW")
+        self.timing_output = tk.Label(self, text="", wraplength=250,
+                                      font="Arial 9")
+        self.timing_output.grid(row=6, column=0, columnspan=2, sticky="NSEW")
+
+        self.fig = Figure(figsize=(3, 2), constrained_layout=True)
+        self.canvas = FigureCanvasTkAgg(self.fig, self)
+        self.canvas.get_tk_widget().grid(row=7, column=0, columnspan=2)
+        self.emf_plot = LivePlot(self.fig.add_subplot(), self.canvas,
+                                   xlabel="Volume Added (L)",
+                                   ylabel="Emf (mV)")
+        self.emf_plot.add_scatter("emf", color="blue", s=8)
+        self.canvas.draw()
+
+        self.station.subscribe(
+            lambda result: self.post(lambda: self.show_result(result))
+        )
+
+    def _add_input(self, text: str, row: int) -> tk.Entry:
+        """Helper to add a labelled entry field on the given row.
+
+        Args:
+            text (str): label text.
+            row (int): grid row.
+
+        Returns:
+            tk.Entry: the entry widget.
+        """
+        tk.Label(self, text=text).grid(row=row, column=0, sticky="W")
+        entry = tk.Entry(self, width=8)
+        entry.grid(row=row, column=1)
+        return entry
+
+    def get_inputs(self) -> List[float]:
+        """Reads the sample inputs of the tile.
+
+        Args:
+            None.
+
+        Returns:
+            list: sample mass, salinity, and acid concentration.
+
+        Raises:
+            ValueError: if any input is not a number.
+        """
+        return [float(self.mass_input.get()), float(self.salinity_input.get()),
+                float(self.acid_conc_input.get())]
+
+    def set_status(self, text: str, color: str = "black") -> None:
+        """Updates the status line of the tile.
+
+        Args:
+            text (str): status text.
+            color (str): text color. Defaults to black.
+
+        Returns:
+            None.
+        """
+        self.status_label.configure(text=text, fg=color)
+
+    def show_step(self, titration: gran.ModifiedGranTitration) -> None:
+        """Plots the steps collected so far.
+
+        Args:
+            titration (ModifiedGranTitration): gran titration object.
+
+        Returns:
+            None.
+        """
+        x = titration.volume_array
+        y = titration.emf_array
+        if len(x) >= 3:
+            self.emf_plot.update("emf", x[2:], y[2:])
+
+    def show_result(self, result: dict) -> None:
+        """Displays the outcome of a titration.
+
+        Args:
+            result (dict): result published by the station.
+
+        Returns:
+            None.
+        """
+        self.start_button.configure(state=tk.NORMAL)
+
+        if result["error"]:
+            self.set_status(f"Error: {result['error']}", "red")
+            return
+        if result["stopped"]:
+            self.set_status("Cancelled", "red")
+            return
+
+        ta = round(result["total_alkalinity"], 3)
+        self.total_alk_output.configure(text=f"TA (umol/kg): {ta}")
+        self.timing_output.configure(
+            text=timing.format_summary(result["timings"])
+        )
+        self.set_status("Finished", "green")
+
+
+class StationsApp(tk.Tk):
+    """Tkinter interface for running several stations from one process,
+    showing one tile per station.
+
+    Args:
+        manager (StationManager): manager holding the stations.
+        ports (dict): station name -> (pump port, meter port) for the
+            Connect All button.
+
+    Returns:
+        None.
+    """
+    def __init__(self, manager: StationManager, ports: dict) -> None:
+        super().__init__()
+
+        self.manager = manager
+        self.ports = ports
+
+        # Station callbacks arrive on scheduler threads; tk is not thread
+        # safe so they are queued here and run from the mainloop
+        self._events = queue.Queue()
+
+        self.tiles = {}
+        self.build_UI()
+
+        self.protocol("WM_DELETE_WINDOW", self.quit_program)
+        self.after(EVENT_POLL_INTERVAL_MS, self.process_events)
+
+    def build_UI(self) -> None:
+        """Draws one tile per station in a roughly square grid.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        self.title("OpenAlk")
+        self.option_add("*font", "Arial 11")
+
+        controls = tk.Frame(self)
+        controls.grid(row=0, column=0, sticky="W", padx=10, pady=5)
+        self.connect_button = tk.Button(controls, text="Connect All", padx=20,
+                                        command=self.connect_all)
+        self.connect_button.grid(row=0, column=0, padx=5)
+        tk.Button(controls, text="Stop All", padx=20,
+                  command=self.manager.stop_all).grid(row=0, column=1, padx=5)
+
+        tiles_frame = tk.Frame(self)
+        tiles_frame.grid(row=1, column=0)
+
+        stations = list(self.manager.stations.values())
+        columns = max(1, math.ceil(math.sqrt(len(stations))))
+        for i, station in enumerate(stations):
+            tile = StationTile(tiles_frame, station, self.post,
+                               on_start=self.start_station,
+                               on_stop=self.stop_station)
+            tile.grid(row=i // columns, column=i % columns, padx=5, pady=5)
+            self.tiles[station.name] = tile
+
+    def post(self, func: Callable) -> None:
+        """Queues a callable to be run on the tk thread. Safe to call from
+        any thread.
+
+        Args:
+            func (Callable): function taking no arguments.
+
+        Returns:
+            None.
+        """
+        self._events.put(func)
+
+    def process_events(self) -> None:
+        """Runs every queued UI update, then reschedules itself.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        while True:
+            try:
+                func = self._events.get_nowait()
+            except queue.Empty:
+                break
+            func()
+        self.after(EVENT_POLL_INTERVAL_MS, self.process_events)
+
+    def connect_all(self) -> None:
+        """Connects every station's devices on a worker thread, so the UI
+        stays responsive while the ports are opened.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        # Stations with an interrupted run that is going to be resumed must
+        # not have their pump initialized, which would zero the syringe
+        resume_paths = {}
+        for name, station in self.manager.stations.items():
+            path = station.find_interrupted_run()
+            if path is None:
+                continue
+            if tk.messagebox.askyesno(
+                "Interrupted titration",
+                f"A titration on {name} was interrupted.\nResume it?"
+            ):
+                resume_paths[name] = path
+            station.discard_interrupted_runs(keep=resume_paths.get(name))
+
+        def connect(name: str) -> bool:
+            pump_port, meter_port = self.ports[name]
+            return self.manager.stations[name].connect(
+                pump_port, meter_port,
+                initialize_pump=name not in resume_paths
+            )
+
+        def connect_stations() -> None:
+            # Opening the ports and initializing the pumps blocks, so it
+            # runs off the tk thread and hands the outcome back with post
+            names = list(self.tiles)
+            with ThreadPoolExecutor(max_workers=max(1, len(names))) as pool:
+                connected = list(pool.map(connect, names))
+            self.post(lambda: self.show_connected(names, connected,
+                                                  resume_paths))
+
+        self.connect_button.configure(state=tk.DISABLED)
+        for tile in self.tiles.values():
+            tile.set_status("Connecting...")
+        threading.Thread(target=connect_stations, daemon=True).start()
+
+    def show_connected(self, names: List[str], connected: List[bool],
+                         resume_paths: dict) -> None:
+        """Shows the outcome of connect_all on the tiles, and resumes the
+        interrupted runs whose stations connected.
+
+        Args:
+            names (list): station names, in the order they were connected.
+            connected (list): whether each station connected.
+            resume_paths (dict): station name -> checkpoint location of the
+                runs to resume.
+
+        Returns:
+            None.
+        """
+        self.connect_button.configure(state=tk.NORMAL)
+        for name, ok in zip(names, connected):
+            if not ok:
+                self.tiles[name].set_status("Connection failed", "red")
+            elif name in resume_paths:
+                self.resume_station(self.tiles[name], resume_paths[name])
+            else:
+                self.tiles[name].set_status("Ready", "green")
+
+    def resume_station(self, tile: StationTile, checkpoint_path: str) -> None:
+        """Continues an interrupted titration on the station of the given
+        tile.
+
+        Args:
+            tile (StationTile): the station's tile.
+            checkpoint_path (str): location of the checkpoint.
+
+        Returns:
+            None.
+        """
+        tile.start_button.configure(state=tk.DISABLED)
+        tile.emf_plot.clear()
+        tile.set_status("Resuming titration...")
+
+        self.manager.resume(
+            tile.station.name, checkpoint_path,
+            on_status=lambda status: self.post(lambda: tile.set_status(status)),
+            on_step=lambda titration: self.post(lambda: tile.show_step(titration))
+        )
+
+    def start_station(self, tile: StationTile) -> None:
+        """Starts a titration on the station of the given tile.
+
+        Args:
+            tile (StationTile): the tile whose Start button was pressed.
+
+        Returns:
+            None.
+        """
+        if not tile.station.state == SystemStates.READY:
+            tk.messagebox.showerror(
+                "Error", f"{tile.station.name} is not ready."
+            )
+            return
+
+        try:
+            sample_mass, salinity, acid_conc = tile.get_inputs()
+        except ValueError:
+            tk.messagebox.showerror(
+                "Error", "Please provide valid values for all sample inputs."
+            )
+            return
+
+        tile.start_button.configure(state=tk.DISABLED)
+        tile.emf_plot.clear()
+        tile.set_status("Titration in progress")
+
+        self.manager.start(
+            tile.station.name, sample_mass, salinity, acid_conc,
+            on_status=lambda status: self.post(lambda: tile.set_status(status)),
+            on_step=lambda titration: self.post(lambda: tile.show_step(titration))
+        )
+
+    def stop_station(self, tile: StationTile) -> None:
+        """Stops the titration running on the station of the given tile.
+
+        Args:
+            tile (StationTile): the tile whose Stop button was pressed.
+
+        Returns:
+            None.
+        """
+        self.manager.stop(tile.station.name)
+        if tile.station.state == SystemStates.STOPPING:
+            tile.set_status("Stopping...", "red")
+
+    def quit_program(self) -> None:
+        """Handles any close event and prompts for confirmation.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        msg = "Are you sure you want to quit?"
+        if any(s.state == SystemStates.RUNNING
+               for s in self.manager.stations.values()):
+            msg = "   ***Titration in progress***\nAre you sure you want to quit?"
+
+        if tk.messagebox.askyesnocancel("Warning", msg):
+            self.manager.shutdown()
+            self.quit()
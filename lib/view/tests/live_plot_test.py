@@ -0,0 +1,84 @@
+# Write unit tests for live plotting logic here
+# Tests MUST start with `test_` for pytest to find them
+
+from unittest.mock import Mock
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from lib.view.live_plot import LivePlot
+
+# These tests use the non-interactive Agg canvas, which supports the same
+# background caching and blitting calls as the Tk canvas used in the app.
+
+def make_plot() -> LivePlot:
+    """Helper to build a panel with one scatter and one line series.
+    """
+    fig = Figure(figsize=(4, 3))
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    plot = LivePlot(ax, canvas, xlabel="x", ylabel="y")
+    plot.add_scatter("points")
+    plot.add_line("fit")
+    canvas.draw()
+    return plot
+
+def test_single_artist_per_series() -> None:
+    """Test that repeated updates reuse the same artists instead of adding
+    new ones to the axes.
+    """
+    plot = make_plot()
+    for n in range(1, 20):
+        x = np.arange(n, dtype=float)
+        plot.update("points", x, x ** 2)
+        plot.update("fit", x, x ** 2)
+
+    assert len(plot.ax.collections) == 1
+    assert len(plot.ax.lines) == 1
+    assert plot.ax.collections[0].get_offsets().shape == (19, 2)
+
+def test_limits_expand_only_when_out_of_view() -> None:
+    """Test that the limits grow to cover new data, and are left alone
+    when new data is already in view.
+    """
+    plot = make_plot()
+    plot.update("points", np.array([0.0, 10.0]), np.array([0.0, 100.0]))
+
+    xlim = plot.ax.get_xlim()
+    ylim = plot.ax.get_ylim()
+    assert xlim[0] <= 0.0 and xlim[1] >= 10.0
+    assert ylim[0] <= 0.0 and ylim[1] >= 100.0
+
+    plot.update("points", np.array([0.0, 5.0, 10.0]),
+                np.array([0.0, 50.0, 100.0]))
+    assert plot.ax.get_xlim() == xlim
+    assert plot.ax.get_ylim() == ylim
+
+def test_in_view_update_blits_without_full_draw() -> None:
+    """Test that an update inside the current limits only blits the axes
+    region rather than redrawing the whole canvas.
+    """
+    plot = make_plot()
+    plot.update("points", np.array([0.0, 10.0]), np.array([0.0, 100.0]))
+
+    plot.canvas.draw = Mock()
+    plot.canvas.blit = Mock()
+    plot.update("points", np.array([1.0, 2.0]), np.array([10.0, 20.0]))
+
+    plot.canvas.draw.assert_not_called()
+    plot.canvas.blit.assert_called_once_with(plot.ax.bbox)
+
+def test_clear_resets_series_and_limits() -> None:
+    """Test that clearing the panel empties every series and restores the
+    original limits.
+    """
+    plot = make_plot()
+    default_xlim = plot.ax.get_xlim()
+    plot.update("points", np.array([0.0, 10.0]), np.array([0.0, 100.0]))
+    plot.update("fit", np.array([0.0, 10.0]), np.array([0.0, 100.0]))
+
+    plot.clear()
+    assert plot.ax.collections[0].get_offsets().shape[0] == 0
+    assert len(plot.ax.lines[0].get_xdata()) == 0
+    assert plot.ax.get_xlim() == default_xlim
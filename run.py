@@ -1,10 +1,15 @@
+import io
 import os
 import sys
 import logging
+import argparse
 import datetime
 from typing import Callable
 
-from lib.view import gui
+from lib.services.station import manager
+from lib.services.titration import protocol
+from lib.utils import log_pipeline, metrics, serial_recorder
+from lib.view import gui, stations
 
 class StreamLogger:
     """Helper class to redirect stdout and stderr to the same log file as
@@ -22,7 +27,7 @@ class StreamLogger:
     def __init__(self, logfunc: Callable, streamtype: str) -> None:
         self.logfunc = logfunc
         self.streamtype = streamtype
-        self._msg = ""
+        self._buffer = io.StringIO()
 
     def write(self, msg: str) -> None:
         """Takes the message coming from the stream and logs it without
@@ -35,11 +40,20 @@ class StreamLogger:
         Returns:
             None.
         """
-        self._msg = self._msg + msg
-        while "\n" in self._msg:
-            pos = self._msg.find("\n")
-            self.logfunc(f"({self.streamtype}) {self._msg[:pos]}")
-            self._msg = self._msg[pos+1:]
+        lines = msg.split("\n")
+        if len(lines) == 1:
+            self._buffer.write(msg)
+            return
+
+        self._buffer.write(lines[0])
+        self.logfunc(f"({self.streamtype}) {self._buffer.getvalue()}")
+        for line in lines[1:-1]:
+            self.logfunc(f"({self.streamtype}) {line}")
+
+        # Keep the unfinished last line for the next write
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._buffer.write(lines[-1])
 
     def flush(self) -> None:
         """Dummy flush method put here in case some extra flushing logic
@@ -54,19 +68,79 @@ class StreamLogger:
         pass
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAlk titrator control")
+    parser.add_argument(
+        "--stations", default=None,
+        help="JSON station configuration file; runs every station listed "
+             "from one window instead of the single-station interface."
+    )
+    parser.add_argument(
+        "--discover", action="store_true",
+        help="Find every pump/pH meter pair on the host and run them all "
+             "from one window, without a station configuration file."
+    )
+    parser.add_argument(
+        "--record-serial", default=None, metavar="FILE",
+        help="Record every serial transaction with its timing to a JSON "
+             "lines file; see lib/utils/serial_recorder.py."
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=None, metavar="PORT",
+        help="Serve live throughput and device latency metrics for "
+             "Prometheus at http://127.0.0.1:PORT/metrics; see "
+             "lib/utils/metrics.py."
+    )
+    parser.add_argument(
+        "--protocol", default=None, metavar="FILE",
+        help="JSON protocol profile (pH targets, pH step and Gran cutoff) "
+             "for every titration, e.g. one written by "
+             "lib.services.titration.optimizer; see "
+             "lib/services/titration/protocol.py."
+    )
+    args = parser.parse_args()
+
     log_filename = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
     log_filepath = os.path.join("logs", log_filename)
 
-    logging.basicConfig(
-        level=logging.INFO,
-        filename=log_filepath,
-        filemode="w",
-        format="[%(levelname)s|%(filename)s|L%(lineno)s] %(asctime)s: %(message)s",
-        datefmt="%Y-%m-%dT%H:%M:%S%z"
-    )
+    # Records are written to disk from a background thread so logging
+    # never holds up the titration
+    log_listener = log_pipeline.setup_logging(log_filepath)
+
+    if args.record_serial:
+        serial_recorder.enable_recording(args.record_serial)
+
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = metrics.start_server(args.metrics_port)
 
     sys.stdout = StreamLogger(logging.info, "STDOUT")
     sys.stderr = StreamLogger(logging.error, "STDERR")
 
-    root = gui.App()
-    root.mainloop()
+    titration_protocol = protocol.DEFAULT_PROTOCOL
+    if args.protocol:
+        titration_protocol = protocol.load_protocol(args.protocol)
+
+    if args.discover:
+        station_manager, ports = manager.build_manager_from_discovery(
+            titration_protocol=titration_protocol
+        )
+        root = stations.StationsApp(station_manager, ports)
+    elif args.stations:
+        config = manager.load_station_config(args.stations)
+        ports = {e["name"]: (e["pump_port"], e["meter_port"]) for e in config}
+        root = stations.StationsApp(
+            manager.build_manager(config, titration_protocol), ports
+        )
+    else:
+        root = gui.App(titration_protocol)
+
+    try:
+        root.mainloop()
+    finally:
+        sys.stdout = sys.__stdout__
+        sys.stderr = sys.__stderr__
+        serial_recorder.disable_recording()
+        if metrics_server:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+        log_listener.stop()